@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Admin HTTP Service (管理后台响应压缩与缓存)
+============================================================================
+
+管理后台 (/admin) 的 JSON 体积较大 (采访详情中的完整 LLM 输入、数据表浏览)，
+前端 SPA 也没有缓存头。AdminHttpMiddleware 只作用于 /admin 前缀：
+
+1. 压缩：按请求的 Accept-Encoding 协商 br (需安装 brotli) / gzip，
+   只压缩 >= COMPRESS_MIN_BYTES 的文本类响应；已带 Content-Encoding 的
+   (预压缩静态文件) 原样返回
+2. ETag / If-None-Match (GET /admin/api/*)：
+   - 配置类接口 (VERSIONED_PATHS) 由数据版本号生成 ETag：sys_config /
+     base_models / prompt_config 变更时经 'config' / 'models' / 'prompts'
+     缓存失效广播递增版本 (ETag 带 worker ID，各 worker 版本号独立)。
+     请求携带的 ETag 仍是当前版本时直接返回 304，不执行查询
+   - 其余接口按响应内容摘要生成 ETag，内容未变时返回 304 (省去传输)
+3. SPA 静态文件 (admin_static_response)：
+   - assets/ 下为带内容哈希的构建产物，Cache-Control: immutable 一年
+   - 其他 (index.html 等) no-cache，每次用 ETag 校验
+   - 存在 build-admin.sh 生成的 .br / .gz 时直接返回预压缩文件
+"""
+
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+from typing import Dict, Any, Optional
+
+from fastapi import Request
+from fastapi.responses import FileResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+from .coordination_service import register_invalidation, WORKER_ID
+
+try:
+    import brotli as _brotli  # 可选依赖，未安装时只协商 gzip
+except ImportError:
+    _brotli = None
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量与统计
+# ============================================================================
+
+ADMIN_PREFIX = "/admin"
+ADMIN_API_PREFIX = "/admin/api/"
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# 由数据版本号生成 ETag 的接口 -> 版本范围
+VERSIONED_PATHS = {
+    "/admin/api/config/sys": "config",
+    "/admin/api/config/models": "config",
+    "/admin/api/config/prompts": "config",
+}
+
+_COMPRESSIBLE_TYPES = (
+    "application/json", "text/", "application/javascript", "image/svg+xml",
+)
+
+_data_versions: Dict[str, int] = {"config": 0}
+
+_stats = {
+    'compressed': {'br': 0, 'gzip': 0},
+    'bytes_before': 0,
+    'bytes_after': 0,
+    'not_modified_versioned': 0,    # 未执行查询直接 304
+    'not_modified_hashed': 0,
+    'precompressed_assets': 0,
+}
+
+
+# ============================================================================
+# 数据版本
+# ============================================================================
+
+def bump_data_version(scope: str):
+    _data_versions[scope] = _data_versions.get(scope, 0) + 1
+
+
+def _version_etag(scope: str) -> str:
+    return f'W/"{scope}-{WORKER_ID}-{_data_versions.get(scope, 0)}"'
+
+
+for _name in ('config', 'models', 'prompts'):
+    register_invalidation(_name, lambda _: bump_data_version('config'))
+
+
+# ============================================================================
+# 协商工具
+# ============================================================================
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    """解析 Accept-Encoding；q=0 视为拒绝"""
+    accepted = set()
+    for item in (accept_encoding or "").lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """按 Accept-Encoding 选择动态压缩方式 (优先 br)"""
+    accepted = _accepted_encodings(accept_encoding)
+    if _brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # 弱比较：忽略 W/ 前缀
+    target = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == target:
+            return True
+    return False
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return _brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _is_compressible(content_type: str) -> bool:
+    return any(content_type.startswith(t) for t in _COMPRESSIBLE_TYPES)
+
+
+# ============================================================================
+# 中间件
+# ============================================================================
+
+class AdminHttpMiddleware:
+    """/admin 前缀下的压缩与条件请求 (ASGI 中间件，缓冲整个响应后处理)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(ADMIN_PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        is_get = scope["method"] == "GET"
+        is_api = scope["path"].startswith(ADMIN_API_PREFIX)
+        if_none_match = request_headers.get("if-none-match")
+
+        version_etag = None
+        if is_get and is_api and scope["path"] in VERSIONED_PATHS:
+            version_etag = _version_etag(VERSIONED_PATHS[scope["path"]])
+            if _etag_matches(if_none_match, version_etag):
+                _stats['not_modified_versioned'] += 1
+                await _send_not_modified(send, version_etag)
+                return
+
+        start_message: Dict[str, Any] = {}
+        body = bytearray()
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start_message.update(message)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body.extend(message.get("body", b""))
+            if message.get("more_body"):
+                return
+            await self._finish(
+                send, start_message, bytes(body), request_headers,
+                is_get=is_get, is_api=is_api, version_etag=version_etag
+            )
+
+        await self.app(scope, receive, capture)
+
+    async def _finish(self, send, start_message, body, request_headers, is_get, is_api, version_etag):
+        status = start_message["status"]
+        headers = MutableHeaders(raw=list(start_message.get("headers", [])))
+
+        if is_get and status == 200:
+            etag = headers.get("etag")
+            if is_api:
+                etag = version_etag or f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+                headers["etag"] = etag
+                headers["cache-control"] = REVALIDATE_CACHE
+            if etag and _etag_matches(request_headers.get("if-none-match"), etag):
+                _stats['not_modified_hashed'] += 1
+                await _send_not_modified(send, etag, headers.get("cache-control"))
+                return
+
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""))
+        if (
+            encoding
+            and status == 200
+            and len(body) >= COMPRESS_MIN_BYTES
+            and "content-encoding" not in headers
+            and _is_compressible(headers.get("content-type", ""))
+        ):
+            compressed = _compress(body, encoding)
+            _stats['compressed'][encoding] += 1
+            _stats['bytes_before'] += len(body)
+            _stats['bytes_after'] += len(compressed)
+            body = compressed
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+
+        await send({"type": "http.response.start", "status": status, "headers": headers.raw})
+        await send({"type": "http.response.body", "body": body})
+
+
+async def _send_not_modified(send, etag: str, cache_control: Optional[str] = REVALIDATE_CACHE):
+    headers = [(b"etag", etag.encode("latin-1"))]
+    if cache_control:
+        headers.append((b"cache-control", cache_control.encode("latin-1")))
+    await send({"type": "http.response.start", "status": 304, "headers": headers})
+    await send({"type": "http.response.body", "body": b""})
+
+
+# ============================================================================
+# SPA 静态文件
+# ============================================================================
+
+_PRECOMPRESSED_SUFFIX = {"br": ".br", "gzip": ".gz"}
+
+
+def admin_static_response(request: Request, static_root: str, path: str) -> FileResponse:
+    """
+    返回管理后台静态文件；不存在的路径回退到 index.html 交给前端路由
+
+    优先返回预压缩版本 (.br / .gz)，assets/ 下的文件按不可变资源缓存。
+    """
+    root = os.path.realpath(static_root)
+    full_path = os.path.realpath(os.path.join(root, path))
+    if not full_path.startswith(root + os.sep) or not os.path.isfile(full_path):
+        full_path = os.path.join(root, "index.html")
+
+    relative = os.path.relpath(full_path, root).replace(os.sep, "/")
+    cache_control = IMMUTABLE_CACHE if relative.startswith("assets/") else REVALIDATE_CACHE
+    media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    for encoding, suffix in _PRECOMPRESSED_SUFFIX.items():
+        variant = full_path + suffix
+        if encoding in accepted and os.path.isfile(variant):
+            _stats['precompressed_assets'] += 1
+            headers["Content-Encoding"] = encoding
+            return FileResponse(variant, media_type=media_type, headers=headers)
+
+    return FileResponse(full_path, media_type=media_type, headers=headers)
+
+
+def get_admin_http_stats() -> Dict[str, Any]:
+    stats = dict(_stats)
+    stats['compressed'] = dict(_stats['compressed'])
+    stats['brotli_available'] = _brotli is not None
+    stats['data_versions'] = dict(_data_versions)
+    before = stats['bytes_before']
+    stats['compression_ratio'] = round(stats['bytes_after'] / before, 4) if before else None
+    return stats
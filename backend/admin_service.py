@@ -9,7 +9,7 @@ from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from .database import get_db_connection
-from .interview_detail_service import get_user_interview_details
+import asyncio
 import logging
 
 router = APIRouter()
@@ -177,6 +177,7 @@ async def get_sys_configs():
 @router.put("/config/sys/{config_key}")
 async def update_sys_config(config_key: str, update: ConfigUpdate):
     """更新系统配置"""
+    from .coordination_service import invalidate_cache
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
@@ -191,6 +192,7 @@ async def update_sys_config(config_key: str, update: ConfigUpdate):
                     raise HTTPException(status_code=404, detail=f"配置项 {config_key} 不存在")
                 
                 conn.commit()
+                invalidate_cache('config')
                 return {"message": "更新成功", "config_key": config_key}
     except HTTPException:
         raise
@@ -237,6 +239,7 @@ async def get_models():
 @router.post("/config/models")
 async def create_model(model: ModelCreate):
     """新增模型"""
+    from .coordination_service import invalidate_cache
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
@@ -254,6 +257,7 @@ async def create_model(model: ModelCreate):
                 ))
                 model_id = cursor.fetchone()[0]
                 conn.commit()
+                invalidate_cache('models')
                 return {"message": "创建成功", "model_id": model_id}
     except Exception as e:
         logging.error(f"创建模型失败: {e}")
@@ -263,6 +267,7 @@ async def create_model(model: ModelCreate):
 @router.put("/config/models/{model_id}")
 async def update_model(model_id: int, model: ModelCreate):
     """更新模型"""
+    from .coordination_service import invalidate_cache
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
@@ -283,6 +288,7 @@ async def update_model(model_id: int, model: ModelCreate):
                     raise HTTPException(status_code=404, detail=f"模型 {model_id} 不存在")
                 
                 conn.commit()
+                invalidate_cache('models')
                 return {"message": "更新成功", "model_id": model_id}
     except HTTPException:
         raise
@@ -294,6 +300,7 @@ async def update_model(model_id: int, model: ModelCreate):
 @router.delete("/config/models/{model_id}")
 async def delete_model(model_id: int):
     """删除模型"""
+    from .coordination_service import invalidate_cache
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
@@ -303,6 +310,7 @@ async def delete_model(model_id: int):
                     raise HTTPException(status_code=404, detail=f"模型 {model_id} 不存在")
                 
                 conn.commit()
+                invalidate_cache('models')
                 return {"message": "删除成功", "model_id": model_id}
     except HTTPException:
         raise
@@ -344,6 +352,7 @@ async def get_prompts():
 @router.post("/config/prompts")
 async def create_prompt(prompt: PromptCreate):
     """新增提示词"""
+    from .coordination_service import invalidate_cache
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
@@ -363,6 +372,7 @@ async def create_prompt(prompt: PromptCreate):
                 
                 prompt_id = cursor.fetchone()[0]
                 conn.commit()
+                invalidate_cache('prompts')
                 return {"message": "创建成功", "prompt_id": prompt_id}
     except Exception as e:
         logging.error(f"创建提示词失败: {e}")
@@ -372,6 +382,7 @@ async def create_prompt(prompt: PromptCreate):
 @router.post("/config/prompts/{prompt_id}/toggle")
 async def toggle_prompt_active(prompt_id: int):
     """切换提示词激活状态"""
+    from .coordination_service import invalidate_cache
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
@@ -405,6 +416,7 @@ async def toggle_prompt_active(prompt_id: int):
                 """, (new_active, prompt_id))
                 
                 conn.commit()
+                invalidate_cache('prompts')
                 return {"message": "切换成功", "prompt_id": prompt_id, "is_active": new_active}
     except HTTPException:
         raise
@@ -515,7 +527,8 @@ async def get_user_interview_details_api(
         if end_time:
             end_dt = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
         
-        # 调用服务
+        # 调用服务 (采访详情仅管理后台使用，按需导入)
+        from .interview_detail_service import get_user_interview_details
         result = get_user_interview_details(
             user_id=user_id,
             data_types=data_type_list,
@@ -601,6 +614,8 @@ async def delete_user_interview_records(user_id: str):
     
     使用事务确保原子性
     """
+    from .telemetry_service import flush_telemetry
+    from .coordination_service import invalidate_cache
     try:
         from .database import get_db_connection
         
@@ -619,6 +634,9 @@ async def delete_user_interview_records(user_id: str):
             'narration_status': 0,
         }
         
+        # 先写完队列中尚未落库的用量记录，避免删除后又被写回
+        await asyncio.to_thread(flush_telemetry)
+        
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
                 # 按外键依赖顺序删除
@@ -633,23 +651,19 @@ async def delete_user_interview_records(user_id: str):
                 
                 # 2. 删除 asr_processed (通过 original_text_id 关联)
                 cursor.execute("""
-                    DELETE FROM asr_processed 
-                    WHERE original_text_id IN (
-                        SELECT interview_original_text_id 
-                        FROM interview_original_text 
-                        WHERE user_id = %s
-                    )
+                    DELETE FROM asr_processed a
+                    USING interview_original_text t
+                    WHERE a.original_text_id = t.interview_original_text_id
+                        AND t.user_id = %s
                 """, (user_id,))
                 deleted_counts['asr_processed'] = cursor.rowcount
                 
                 # 3. 删除 tts_processed (通过 link_original_text_id 关联)
                 cursor.execute("""
-                    DELETE FROM tts_processed 
-                    WHERE link_original_text_id IN (
-                        SELECT interview_original_text_id 
-                        FROM interview_original_text 
-                        WHERE user_id = %s
-                    )
+                    DELETE FROM tts_processed p
+                    USING interview_original_text t
+                    WHERE p.link_original_text_id = t.interview_original_text_id
+                        AND t.user_id = %s
                 """, (user_id,))
                 deleted_counts['tts_processed'] = cursor.rowcount
                 
@@ -719,6 +733,11 @@ async def delete_user_interview_records(user_id: str):
                 # 提交事务
                 conn.commit()
         
+        # 差分基准已删除，后续 LLM 记录从关键帧重新开始 (通知所有 worker)
+        invalidate_cache('llm_sessions', user_id)
+        # 卸载各 worker 中该用户的常驻讲述状态
+        invalidate_cache('narration', user_id)
+        
         total_deleted = sum(deleted_counts.values())
         
         logging.info(f"✅ 删除用户 {user_id[:8]}... 的所有记录成功: {deleted_counts}")
@@ -738,3 +757,153 @@ async def delete_user_interview_records(user_id: str):
         raise HTTPException(status_code=500, detail=f"删除失败: {str(e)}")
 
 
+# ============================================================================
+# 运行统计
+# ============================================================================
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    获取各子系统的运行统计（单一入口，按子系统分组）
+
+    telemetry: 用量记录异步写入 / coordination: 多 worker 协调 / speculation: Intv 推测执行
+    actors: 用户 Actor / llm_admission: LLM 准入控制 / stn_batching: Stn 自适应批次
+    dir_scheduler: Dir 变更调度 / intv_prewarm: Intv Session 预热 / logging: 日志采样
+    admin_http: 管理后台响应压缩 / user_cache: 用户信息缓存 / tts_http: HTTP 流式 TTS
+    audio: 音频缓存与转码
+    """
+    from .telemetry_service import get_telemetry_stats
+    from .coordination_service import get_coordination_stats
+    from .intv_speculation_service import get_speculation_stats
+    from .user_actor_service import get_actor_stats
+    from .llm_api_service import get_llm_admission_stats
+    from .stn_batching_service import get_stn_batching_stats
+    from .dir_scheduler_service import get_dir_scheduler_stats
+    from .intv_prewarm_service import get_prewarm_stats
+    from .logging_service import get_logging_stats
+    from .admin_http_service import get_admin_http_stats
+    from .user_service import get_user_cache_stats
+    from .tts_http_service import get_tts_http_stats
+    from .audio_service import get_audio_stats
+    return {"code": 0, "data": {
+        "telemetry": get_telemetry_stats(),
+        "coordination": get_coordination_stats(),
+        "speculation": get_speculation_stats(),
+        "actors": get_actor_stats(),
+        "llm_admission": get_llm_admission_stats(),
+        "stn_batching": get_stn_batching_stats(),
+        "dir_scheduler": get_dir_scheduler_stats(),
+        "intv_prewarm": get_prewarm_stats(),
+        "logging": get_logging_stats(),
+        "admin_http": get_admin_http_stats(),
+        "user_cache": get_user_cache_stats(),
+        "tts_http": get_tts_http_stats(),
+        "audio": get_audio_stats(),
+    }}
+
+
+# ============================================================================
+# 日志表分区 / 归档
+# ============================================================================
+
+@router.get("/partitions")
+async def get_partitions():
+    """查看各日志表的在线分区和归档文件"""
+    from .partition_service import PARTITIONED_TABLES, list_partitions, list_archives, is_partitioned
+    try:
+        result = {}
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                for table in PARTITIONED_TABLES:
+                    partitioned = is_partitioned(cursor, table)
+                    partitions = list_partitions(cursor, table) if partitioned else []
+                    result[table] = {
+                        "partitioned": partitioned,
+                        "partitions": [
+                            {**p, "month": p["month"].strftime("%Y-%m")} for p in partitions
+                        ],
+                        "archives": list_archives(table),
+                    }
+        return {"code": 0, "data": result}
+    except Exception as e:
+        logging.error(f"获取分区信息失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/partitions/{table}/{month}/restore")
+async def restore_archived_partition(table: str, month: str):
+    """把归档文件恢复为在线分区（month 格式: 2026-01 或 202601）"""
+    from .partition_service import parse_month, restore_partition
+    try:
+        result = await asyncio.to_thread(restore_partition, table, parse_month(month))
+        return {"code": 0, "message": "恢复成功", "data": result}
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"恢复分区失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/partitions/maintenance")
+async def trigger_partition_maintenance():
+    """立即执行一次分区维护（创建未来分区、归档过期分区）"""
+    from .partition_service import run_partition_maintenance
+    try:
+        summary = await asyncio.to_thread(run_partition_maintenance)
+        return {"code": 0, "data": summary}
+    except Exception as e:
+        logging.error(f"分区维护失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ============================================================================
+# 用量与成本汇总
+# ============================================================================
+
+@router.get("/usage/rollup")
+async def get_usage_rollup_data(
+    granularity: str = Query("day", description="聚合粒度: hour / day"),
+    start_time: Optional[datetime] = Query(None, description="开始时间"),
+    end_time: Optional[datetime] = Query(None, description="结束时间"),
+    user_id: Optional[str] = Query(None, description="只看某个用户"),
+    service: Optional[str] = Query(None, description="LLM / ASR / TTS"),
+    group_by: Optional[str] = Query(None, description="分组维度，逗号分隔: user_id,service,agent,model_id；传空字符串只按时间汇总")
+):
+    """查询按小时/天预聚合的用量与成本（含缓存命中率与缓存节省成本）"""
+    from .usage_rollup_service import get_usage_rollup
+    try:
+        dims = None if group_by is None else [c.strip() for c in group_by.split(",") if c.strip()]
+        rows = get_usage_rollup(granularity, start_time, end_time, user_id, service, dims)
+        return {
+            "code": 0,
+            "data": {
+                "rows": rows,
+                "total_cost": round(sum(r["cost"] for r in rows), 6),
+                "total_cache_saving": round(sum(r["cache_saving"] for r in rows), 6),
+            }
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"查询用量汇总失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/usage/rebuild")
+async def rebuild_usage_rollup(
+    start_time: datetime = Query(..., description="开始时间 (按天对齐)"),
+    end_time: datetime = Query(..., description="结束时间 (按天对齐)")
+):
+    """按原始记录重新计算指定时间范围内的用量汇总（历史回填 / 校正）"""
+    from .telemetry_service import flush_telemetry
+    from .usage_rollup_service import rebuild_rollups
+    try:
+        # 先写完队列，保证重算包含最新记录
+        await asyncio.to_thread(flush_telemetry)
+        result = await asyncio.to_thread(rebuild_rollups, start_time, end_time)
+        return {"code": 0, "message": "重算完成", "data": result}
+    except Exception as e:
+        logging.error(f"重算用量汇总失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+ASR Gateway (火山引擎流式 ASR 网关)
+============================================================================
+
+替代原 volc_service.asr_stream：
+
+1. AsrUpstreamPool: 预先建立少量到火山 ASR 的 WebSocket 连接 (TLS + 握手)，
+   客户端连上时直接取用；空闲连接靠 ping 保活，只在被关闭时淘汰，
+   且只在近期有识别请求时补充 (无流量时不反复重建)
+2. AsrSession: 单次识别会话
+   - PCM 音频帧不压缩，使用 volc_protocol 零拷贝编解码
+   - 客户端 -> 上游、上游 -> 客户端 均为有界队列：
+     音频队列满时暂停读取客户端 (背压)；中间结果队列满时丢弃旧的中间结果
+   - 只下发发生变化的分句 (文本或 definite 状态变化)
+3. asr_stream(client_ws): /ws/asr 端点适配，消息格式与原来一致
+   {"text", "is_final", "index"}
+"""
+
+import os
+import ssl
+import json
+import time
+import uuid
+import asyncio
+import logging
+import urllib.parse
+from collections import deque
+from typing import Dict, Any, Optional, AsyncGenerator, Tuple
+
+import websockets
+from websockets.protocol import State
+from fastapi import WebSocket
+
+from .logging_service import log_sampled
+from .volc_protocol import (
+    MSG_TYPE_FULL_CLIENT_REQUEST, MSG_TYPE_FULL_SERVER_RESPONSE,
+    MSG_TYPE_PARTIAL_SERVER_RESPONSE, MSG_TYPE_ERROR,
+    SERIALIZATION_JSON, COMPRESSION_GZIP, LAST_AUDIO_PACKET,
+    pack_asr_packet, pack_audio_packet, parse_asr_packet,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量
+# ============================================================================
+
+ASR_URL = "wss://openspeech.bytedance.com/api/v3/sauc/bigmodel_async"
+ASR_RESOURCE_ID = "volc.seedasr.sauc.duration"
+
+ASR_POOL_SIZE = 2               # 预热连接数
+ASR_POOL_PING_SEC = 20          # 空闲连接 ping 保活间隔 (websockets keepalive)
+ASR_POOL_WARM_WINDOW_SEC = 600  # 最近一次识别请求后多久内补充连接，之后不再重建已关闭的连接
+ASR_POOL_CHECK_SEC = 10         # 后台检查间隔
+AUDIO_QUEUE_MAX = 50            # 客户端 -> 上游音频帧队列上限 (约 5s 音频)
+RESULT_QUEUE_MAX = 32           # 上游 -> 客户端结果队列上限
+
+_ssl_context: Optional[ssl.SSLContext] = None
+
+
+def _get_ssl_context() -> ssl.SSLContext:
+    """与原实现一致：不校验证书"""
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+        _ssl_context.check_hostname = False
+        _ssl_context.verify_mode = ssl.CERT_NONE
+    return _ssl_context
+
+
+def _get_credentials() -> Tuple[Optional[str], Optional[str]]:
+    return os.getenv("VOLC_APPID"), os.getenv("VOLC_ACCESS_KEY")
+
+
+async def _open_upstream():
+    """建立一条到火山 ASR 的 WebSocket 连接 (不发送 init 包)"""
+    appid, ak = _get_credentials()
+    if not all([appid, ak]):
+        raise RuntimeError("缺少火山引擎配置 VOLC_APPID / VOLC_ACCESS_KEY")
+
+    url = ASR_URL + "?" + urllib.parse.urlencode({"appid": appid, "resource_id": ASR_RESOURCE_ID})
+    headers = {
+        "X-Api-Resource-Id": ASR_RESOURCE_ID,
+        "X-Api-App-Key": appid,
+        "X-Api-Access-Key": ak,
+        "X-Api-Connect-Id": str(uuid.uuid4()),
+    }
+    ws = await websockets.connect(
+        url, additional_headers=headers, ssl=_get_ssl_context(),
+        ping_interval=ASR_POOL_PING_SEC, ping_timeout=ASR_POOL_PING_SEC
+    )
+
+    try:
+        logid = ws.response.headers.get("X-Tt-Logid") if ws.response else None
+        if logid:
+            logging.debug(f"[ASR] 上游连接 logid={logid}")
+    except Exception:
+        pass
+    return ws
+
+
+def _build_init_packet() -> bytearray:
+    appid, ak = _get_credentials()
+    init_payload = {
+        "type": "application/json",
+        "app": {"appid": appid, "token": ak},
+        "user": {"uid": "user_1"},
+        "audio": {
+            "format": "pcm",
+            "rate": 16000,
+            "bits": 16,
+            "channel": 1,
+            "codec": "raw"
+        },
+        "request": {
+            "model_name": "bigmodel",
+            "reqid": str(uuid.uuid4()),
+            "result_type": "single",
+            "show_utterances": True,
+            "enable_intermediate_result": True,
+            "enable_itn": True,
+            "enable_punc": True
+        }
+    }
+    # init 包按官方示例 gzip，音频帧不压缩
+    return pack_asr_packet(
+        MSG_TYPE_FULL_CLIENT_REQUEST,
+        json.dumps(init_payload).encode('utf-8'),
+        SERIALIZATION_JSON,
+        COMPRESSION_GZIP
+    )
+
+
+# ============================================================================
+# 预热连接池
+# ============================================================================
+
+class AsrUpstreamPool:
+    """
+    预先建立的上游连接池，每条连接只用于一个识别会话
+
+    空闲连接由 websockets 定期 ping 保活，只淘汰已关闭的连接；
+    最近 warm_window 秒内没有识别请求时不再补充，避免无流量时周期性重建 TLS 连接。
+    """
+
+    def __init__(self, size: int = ASR_POOL_SIZE, warm_window: float = ASR_POOL_WARM_WINDOW_SEC):
+        self.size = size
+        self.warm_window = warm_window
+        self._idle: deque = deque()
+        self._fill_lock = asyncio.Lock()
+        self._maintain_task: Optional[asyncio.Task] = None
+        self._fill_tasks: set = set()
+        self._last_demand = 0.0
+        self.stats = {'hits': 0, 'misses': 0, 'discarded': 0, 'opened': 0}
+
+    async def start(self):
+        """启动后台补充任务 (启动时视为有流量，先预热一次)"""
+        appid, ak = _get_credentials()
+        if not all([appid, ak]):
+            logging.warning("⚠️ 未配置火山引擎 ASR 凭证，跳过连接预热")
+            return
+        if self._maintain_task is None:
+            self._last_demand = time.monotonic()
+            self._maintain_task = asyncio.create_task(self._maintain_loop())
+            logging.info(f"✅ ASR 连接池已启动 (预热 {self.size} 条)")
+
+    async def close(self):
+        if self._maintain_task:
+            self._maintain_task.cancel()
+            self._maintain_task = None
+        for task in list(self._fill_tasks):
+            task.cancel()
+        while self._idle:
+            await _close_quietly(self._idle.popleft())
+
+    async def acquire(self):
+        """取一条可用连接；池为空时现场建立"""
+        self._last_demand = time.monotonic()
+        while self._idle:
+            ws = self._idle.popleft()
+            if ws.state == State.OPEN:
+                self.stats['hits'] += 1
+                self._schedule_fill()
+                return ws
+            self.stats['discarded'] += 1
+            await _close_quietly(ws)
+
+        self.stats['misses'] += 1
+        self._schedule_fill()
+        return await _open_upstream()
+
+    def _schedule_fill(self):
+        if self._maintain_task is not None:
+            # 持有引用，避免任务在完成前被回收
+            task = asyncio.create_task(self._fill())
+            self._fill_tasks.add(task)
+            task.add_done_callback(self._fill_tasks.discard)
+
+    async def _fill(self):
+        async with self._fill_lock:
+            # 只淘汰已关闭的连接 (对端断开或 ping 超时)
+            for _ in range(len(self._idle)):
+                ws = self._idle.popleft()
+                if ws.state == State.OPEN:
+                    self._idle.append(ws)
+                else:
+                    self.stats['discarded'] += 1
+                    await _close_quietly(ws)
+
+            if time.monotonic() - self._last_demand > self.warm_window:
+                return
+            while len(self._idle) < self.size:
+                try:
+                    ws = await _open_upstream()
+                except Exception as e:
+                    logging.error(f"❌ ASR 预热连接失败: {e}")
+                    return
+                self.stats['opened'] += 1
+                self._idle.append(ws)
+
+    async def _maintain_loop(self):
+        while True:
+            await self._fill()
+            await asyncio.sleep(ASR_POOL_CHECK_SEC)
+
+
+async def _close_quietly(ws):
+    try:
+        await ws.close()
+    except Exception:
+        pass
+
+
+asr_upstream_pool = AsrUpstreamPool()
+
+
+# ============================================================================
+# 识别会话
+# ============================================================================
+
+class AsrSession:
+    """
+    单次流式识别
+
+    用法:
+        session = await AsrSession.open()
+        await session.send_audio(pcm)   # 队列满时等待 (背压)
+        await session.finish()          # 发送结束帧
+        async for result in session.results():
+            ...                         # {"text", "is_final", "index"}
+        await session.close()
+    """
+
+    def __init__(self, ws):
+        self._ws = ws
+        self._audio_queue: asyncio.Queue = asyncio.Queue(maxsize=AUDIO_QUEUE_MAX)
+        self._result_queue: asyncio.Queue = asyncio.Queue(maxsize=RESULT_QUEUE_MAX)
+        self._last_sent: Dict[int, Tuple[str, bool]] = {}
+        self._tasks = []
+        self._first_audio_at: Optional[float] = None
+        self.stats = {
+            'frames_sent': 0,
+            'bytes_sent': 0,
+            'results_sent': 0,
+            'results_suppressed': 0,
+            'partials_dropped': 0,
+            'first_result_ms': None,
+        }
+
+    @classmethod
+    async def open(cls) -> "AsrSession":
+        ws = await asr_upstream_pool.acquire()
+        session = cls(ws)
+        await ws.send(_build_init_packet())
+        session._tasks = [
+            asyncio.create_task(session._send_loop()),
+            asyncio.create_task(session._receive_loop()),
+        ]
+        return session
+
+    # ------------------------------------------------------------------
+    # 输入
+    # ------------------------------------------------------------------
+
+    async def send_audio(self, pcm: bytes):
+        if not pcm:
+            return
+        if self._first_audio_at is None:
+            self._first_audio_at = time.monotonic()
+        await self._audio_queue.put(pcm)
+
+    async def finish(self):
+        """音频结束，发送 last 包"""
+        await self._audio_queue.put(None)
+
+    async def _send_loop(self):
+        try:
+            while True:
+                pcm = await self._audio_queue.get()
+                if pcm is None:
+                    break
+                await self._ws.send(pack_audio_packet(pcm))
+                self.stats['frames_sent'] += 1
+                self.stats['bytes_sent'] += len(pcm)
+            # 未发送过音频也要发 last 包，否则上游不返回最终结果，results() 会一直等待
+            await self._ws.send(LAST_AUDIO_PACKET)
+        except Exception as e:
+            logging.error(f"[ASR] 上游发送失败: {e}")
+
+    # ------------------------------------------------------------------
+    # 输出
+    # ------------------------------------------------------------------
+
+    async def results(self) -> AsyncGenerator[Dict[str, Any], None]:
+        """逐条产出分句变化，识别结束后退出"""
+        while True:
+            item = await self._result_queue.get()
+            if item is None:
+                return
+            yield item
+
+    async def _emit(self, index: int, text: str, is_final: bool):
+        key = (text, is_final)
+        if self._last_sent.get(index) == key:
+            self.stats['results_suppressed'] += 1
+            return
+        self._last_sent[index] = key
+
+        if self.stats['first_result_ms'] is None and self._first_audio_at is not None:
+            self.stats['first_result_ms'] = int((time.monotonic() - self._first_audio_at) * 1000)
+
+        item = {"text": text, "is_final": is_final, "index": index}
+        if is_final:
+            logging.debug(f"[ASR] 最终结果 #{index}: {text[:50]}")
+        else:
+            log_sampled('asr_partial', logging.DEBUG, lambda: f"[ASR] 中间结果 #{index}: {text[:50]}")
+        if is_final:
+            await self._result_queue.put(item)
+        else:
+            try:
+                self._result_queue.put_nowait(item)
+            except asyncio.QueueFull:
+                # 中间结果会被后续结果覆盖，客户端跟不上时直接丢弃
+                self.stats['partials_dropped'] += 1
+                self._last_sent.pop(index, None)
+                return
+        self.stats['results_sent'] += 1
+
+    async def _handle_result(self, data: Dict[str, Any]):
+        result = data.get('result')
+        if not result:
+            return
+        utterances = result.get('utterances', []) if isinstance(result, dict) else []
+        if utterances:
+            for i, utterance in enumerate(utterances):
+                text = utterance.get('text', '')
+                if text:
+                    await self._emit(i, text, bool(utterance.get('definite', False)))
+        else:
+            # 兼容旧格式
+            text = result['text'] if isinstance(result, dict) else result[0]['text']
+            if text:
+                await self._emit(0, text, False)
+
+    async def _receive_loop(self):
+        try:
+            async for message in self._ws:
+                if isinstance(message, str):
+                    try:
+                        await self._handle_result(json.loads(message))
+                    except (ValueError, KeyError, IndexError, TypeError):
+                        pass
+                    continue
+
+                packet = parse_asr_packet(message)
+                if packet is None:
+                    continue
+
+                if packet.msg_type == MSG_TYPE_ERROR:
+                    error_text = packet.payload_bytes().decode('utf-8', errors='ignore')
+                    logging.error(f"[ASR] 上游错误 code={packet.error_code} msg={error_text}")
+                    continue
+
+                if packet.msg_type in (MSG_TYPE_FULL_SERVER_RESPONSE, MSG_TYPE_PARTIAL_SERVER_RESPONSE):
+                    try:
+                        await self._handle_result(json.loads(packet.payload_bytes()))
+                    except (ValueError, KeyError, IndexError, TypeError) as e:
+                        logging.debug(f"[ASR] 响应解析失败: {e}")
+        except Exception as e:
+            logging.error(f"[ASR] 上游接收失败: {e}")
+        finally:
+            await self._result_queue.put(None)
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await _close_quietly(self._ws)
+        logging.info(f"[ASR] 会话结束: {self.stats}")
+
+
+# ============================================================================
+# /ws/asr 适配
+# ============================================================================
+
+async def asr_stream(client_ws: WebSocket):
+    """
+    客户端音频 -> 火山 ASR -> 识别结果回传
+
+    客户端消息格式与原实现一致: {"text": "...", "is_final": bool, "index": int}
+    """
+    try:
+        session = await AsrSession.open()
+    except Exception as e:
+        logging.error(f"[ASR] 上游连接失败: {e}")
+        try:
+            await client_ws.send_json({"text": "(服务连接异常)"})
+        finally:
+            await client_ws.close()
+        return
+
+    async def pump_audio():
+        try:
+            async for message in client_ws.iter_bytes():
+                await session.send_audio(message)
+        except Exception as e:
+            logging.debug(f"[ASR] 客户端音频结束: {e}")
+        finally:
+            await session.finish()
+
+    async def pump_results():
+        async for item in session.results():
+            await client_ws.send_json(item)
+
+    audio_task = asyncio.create_task(pump_audio())
+    try:
+        await pump_results()
+    except Exception as e:
+        logging.debug(f"[ASR] 客户端发送结束: {e}")
+    finally:
+        audio_task.cancel()
+        await session.close()
@@ -4,55 +4,201 @@
 音频处理服务模块
 
 处理音频格式转换(PCM -> MP3)
+
+1. SpooledAudioBuffer：整段录音 / TTS PCM 的缓存。不超过 AUDIO_SPOOL_MAX_MEMORY
+   时在内存中，超过后整体转存到临时文件 (已删除的匿名文件，关闭即释放)，
+   单连接内存占用不随回答时长增长
+2. encode_pcm_to_mp3：PCM 分块写入 ffmpeg 标准输入，MP3 直接输出到临时文件，
+   不在内存中拼出完整的 PCM / MP3；返回的文件对象可直接交给 COS 流式上传
 """
 import os
-import logging
 import io
-# 延迟导入 pydub 以避免 Python 3.13 兼容性问题
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from typing import Dict, Any, BinaryIO, Iterator, Optional
 
 logging.basicConfig(level=logging.INFO)
 
-def convert_pcm_to_mp3(pcm_data: bytes, sample_rate: int = 16000) -> bytes:
+
+# ============================================================================
+# 常量与统计
+# ============================================================================
+
+AUDIO_SPOOL_MAX_MEMORY = int(os.getenv("AUDIO_SPOOL_MAX_MEMORY", 256 * 1024))  # 约 5s 24kHz PCM
+AUDIO_SPOOL_DIR = os.getenv("AUDIO_SPOOL_DIR") or None                           # 默认系统临时目录
+STREAM_CHUNK_BYTES = 64 * 1024
+
+_stats = {
+    'buffers_created': 0,
+    'buffers_rolled_to_disk': 0,
+    'bytes_spooled': 0,
+    'encode_ok': 0,
+    'encode_failed': 0,
+    'encode_ms_total': 0,
+}
+_stats_lock = threading.Lock()   # 计数在事件循环与工作线程中都会更新
+
+
+def _count(key: str, n: int = 1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+# ============================================================================
+# 音频缓存
+# ============================================================================
+
+class SpooledAudioBuffer:
     """
-    将 PCM 音频转换为 MP3
-    
+    只追加写入的音频缓存：先写内存，超过 max_memory 后转存临时文件
+
+    写入 (write / extend) 在事件循环中进行，读取 (reader / iter_chunks) 在写完后
+    由转码线程进行，两者不并发。用完需 close() (或用 with)，未关闭时由 GC 回收。
+    """
+
+    def __init__(self, max_memory: Optional[int] = None):
+        self._max_memory = AUDIO_SPOOL_MAX_MEMORY if max_memory is None else max_memory
+        self._file: BinaryIO = io.BytesIO()
+        self._size = 0
+        self._on_disk = False
+        _count('buffers_created')
+
+    def write(self, data) -> int:
+        """追加数据 (bytes / bytearray / memoryview)"""
+        size = len(data)
+        if not self._on_disk and self._size + size > self._max_memory:
+            self._roll_to_disk()
+        self._file.write(data)
+        self._size += size
+        _count('bytes_spooled', size)
+        return size
+
+    # 与原 bytearray 缓存的写法兼容
+    extend = write
+
+    def _roll_to_disk(self):
+        disk_file = tempfile.TemporaryFile(dir=AUDIO_SPOOL_DIR)
+        disk_file.write(self._file.getbuffer())
+        self._file.close()
+        self._file = disk_file
+        self._on_disk = True
+        _count('buffers_rolled_to_disk')
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def on_disk(self) -> bool:
+        return self._on_disk
+
+    def reader(self) -> BinaryIO:
+        """回到开头并返回底层文件对象，供一次性顺序读取"""
+        self._file.seek(0)
+        return self._file
+
+    def iter_chunks(self, chunk_size: int = STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+        source = self.reader()
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self) -> "SpooledAudioBuffer":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ============================================================================
+# 流式转码
+# ============================================================================
+
+def encode_pcm_to_mp3(source: BinaryIO, sample_rate: int = 16000, bitrate: str = "64k") -> BinaryIO:
+    """
+    流式 PCM (16bit 单声道) -> MP3 (在线程中执行)
+
     Args:
-        pcm_data: PCM 音频二进制数据
-        sample_rate: 采样率（默认 16000Hz）
-    
+        source: 可读的 PCM 文件对象 (SpooledAudioBuffer.reader()、UploadFile.file 等)，
+                从当前位置读到末尾
     Returns:
-        MP3 音频二进制数据
+        位于开头的 MP3 临时文件对象，调用方负责关闭
+    Raises:
+        RuntimeError: 未安装 ffmpeg 或转码失败
     """
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        _count('encode_failed')
+        logging.error("❌ 未找到 ffmpeg，请先安装: brew install ffmpeg")
+        raise RuntimeError("ffmpeg not found")
+
+    start_time = time.time()
+    output = tempfile.TemporaryFile(dir=AUDIO_SPOOL_DIR)
+    errors = tempfile.TemporaryFile(dir=AUDIO_SPOOL_DIR)
+    process = None
     try:
-        # 延迟导入以避免 Python 3.13 兼容性问题
-        from pydub import AudioSegment
-        
-        logging.info(f"🔄 开始转换音频: PCM -> MP3, 大小={len(pcm_data)} bytes")
-        
-        # 创建 AudioSegment 对象
-        # sample_width=2 (16bit), channels=1 (mono)
-        audio = AudioSegment(
-            data=pcm_data,
-            sample_width=2,
-            frame_rate=sample_rate,
-            channels=1
+        process = subprocess.Popen(
+            [ffmpeg, "-hide_banner", "-loglevel", "error",
+             "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+             "-f", "mp3", "-b:a", bitrate, "pipe:1"],
+            stdin=subprocess.PIPE, stdout=output, stderr=errors
         )
-        
-        # 导出为 MP3
-        mp3_io = io.BytesIO()
-        audio.export(mp3_io, format="mp3", bitrate="64k")
-        
-        mp3_data = mp3_io.getvalue()
-        logging.info(f"✅ 音频转换成功: MP3 大小={len(mp3_data)} bytes")
-        
-        return mp3_data
-        
-    except Exception as e:
-        logging.error(f"❌ 音频转换失败: {e}")
-        # 如果转换失败，记录详细日志并抛出
-        # 检查是否安装了 ffmpeg
-        import shutil
-        if not shutil.which("ffmpeg"):
-            logging.error("❌ 未找到 ffmpeg，请先安装: brew install ffmpeg")
-            
-        raise e
+        try:
+            while True:
+                chunk = source.read(STREAM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass  # ffmpeg 已退出，错误信息见返回码与 stderr
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+        returncode = process.wait()
+        if returncode != 0:
+            errors.seek(0)
+            message = errors.read(2000).decode("utf-8", "replace").strip()
+            raise RuntimeError(f"ffmpeg exited with {returncode}: {message}")
+    except BaseException:
+        # 读取 source 出错等情况下 ffmpeg 可能仍在运行，结束并回收进程
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+        _count('encode_failed')
+        output.close()
+        raise
+    finally:
+        errors.close()
+
+    _count('encode_ok')
+    _count('encode_ms_total', int((time.time() - start_time) * 1000))
+    output.seek(0)
+    return output
+
+
+def file_size(fileobj: BinaryIO) -> int:
+    """文件对象总大小 (不改变当前读取位置)"""
+    position = fileobj.tell()
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(position)
+    return size
+
+
+def get_audio_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    count = stats['encode_ok']
+    stats['avg_encode_ms'] = int(stats['encode_ms_total'] / count) if count else None
+    stats['spool_max_memory'] = AUDIO_SPOOL_MAX_MEMORY
+    return stats
@@ -3,13 +3,15 @@
 """
 对话缓存池服务模块
 
-处理对话内容的缓存、字数统计和阈值触发，并对接 Stn Agent（速记员）
+处理对话内容的缓存、字数统计和阈值判断
+
+本模块只做数据库读写 (可在线程中执行)；达到阈值时由调用方在事件循环中
+经 user_actor_service.post_agent_run(user_id, 'stn') 触发 Stn Agent（速记员）
 """
 import logging
 from .database import get_db_connection
 from .config_manager import get_config
 from datetime import datetime
-from .stn_service import run_stn_agent_async
 
 logging.basicConfig(level=logging.INFO)
 
@@ -85,11 +87,7 @@ def add_to_cachepool(session_id: str, user_id: str, speaker_type: int, text: str
                 threshold_reached = new_count >= threshold
                 
                 if threshold_reached:
-                    logging.info(f"🔔 缓存池已满 ({new_count}/{threshold})，触发 Stn Agent...")
-                    
-                    # 异步触发速记员 (stn_service 会负责把状态改为 1 处理中)
-                    run_stn_agent_async(user_id, session_id, combined_content, pool_id)
-
+                    logging.info(f"🔔 缓存池已满 ({new_count}/{threshold})，由调用方触发 Stn Agent")
                     return {
                         'current_word_count': new_count,
                         'threshold_reached': True,
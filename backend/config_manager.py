@@ -6,6 +6,7 @@
 
 from typing import Optional, Dict, Any
 from .database import get_db_connection
+from .coordination_service import register_invalidation
 import logging
 from functools import lru_cache
 
@@ -15,6 +16,7 @@ class ConfigManager:
     def __init__(self):
         self._config_cache = {}
         self._model_cache = {}
+        self._prompt_cache = {}
     
     def get_config(self, key: str, default: Any = None) -> Any:
         """
@@ -130,6 +132,10 @@ class ConfigManager:
         Returns:
             prompt_content 字符串，若不存在则返回 None
         """
+        # 先从缓存读取
+        if llm_type in self._prompt_cache:
+            return self._prompt_cache[llm_type]
+        
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute("""
@@ -145,12 +151,38 @@ class ConfigManager:
                     logging.warning(f"未找到 llm_type={llm_type} 的 active prompt")
                     return None
                 
+                # 缓存
+                self._prompt_cache[llm_type] = result[0]
+                
                 return result[0]
     
+    def preload(self):
+        """一次查询载入全部 sys_config 与各 LLM 的 active prompt (启动预热)"""
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT config_key, config_value, config_type
+                    FROM sys_config
+                """)
+                for key, value, config_type in cursor.fetchall():
+                    self._config_cache[key] = self._convert_value(value, config_type)
+                
+                cursor.execute("""
+                    SELECT DISTINCT ON (llm_type) llm_type, prompt_content
+                    FROM prompt_config
+                    WHERE is_active = TRUE
+                    ORDER BY llm_type, prompt_id DESC
+                """)
+                for llm_type, prompt_content in cursor.fetchall():
+                    self._prompt_cache[llm_type] = prompt_content
+        
+        logging.info(f"配置缓存预热完成: {len(self._config_cache)} 项配置, {len(self._prompt_cache)} 条提示词")
+    
     def clear_cache(self):
         """清空缓存"""
         self._config_cache.clear()
         self._model_cache.clear()
+        self._prompt_cache.clear()
         logging.info("配置缓存已清空")
     
     def _convert_value(self, value: str, config_type: str) -> Any:
@@ -211,6 +243,17 @@ def get_active_prompt(llm_type: int) -> Optional[str]:
     return config_manager.get_active_prompt(llm_type)
 
 
+def preload_config_cache():
+    """预热配置与提示词缓存"""
+    config_manager.preload()
+
+
 def clear_config_cache():
     """清空配置缓存"""
     config_manager.clear_cache()
+
+
+# 其他 worker 修改 sys_config / base_models 后广播失效
+register_invalidation('config', lambda _: clear_config_cache())
+register_invalidation('models', lambda _: clear_config_cache())
+register_invalidation('prompts', lambda _: clear_config_cache())
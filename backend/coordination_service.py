@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Coordination Service (多 worker 协调：用户级锁 + 缓存失效广播)
+============================================================================
+
+uvicorn 多 worker / 多机部署时，进程内的 asyncio.Lock 与内存缓存不再可靠：
+
+1. user_agent_lock(agent, user_id)
+   同一用户的 Stn / Dir 任务串行执行。进程内先排 asyncio.Lock (FIFO)，
+   再取 PostgreSQL advisory lock 保证跨进程互斥。
+   后端可插拔 (环境变量 COORDINATION_BACKEND):
+     - postgres (默认): pg_try_advisory_lock，所有锁由每个 worker 一条专用连接持有
+     - local: 仅进程内锁 (单 worker 开发环境)
+
+2. invalidate_cache(name, payload)
+   立即清空本进程缓存，并通过 NOTIFY 通知其他 worker。
+   各模块用 register_invalidation(name, handler) 注册自己的缓存清理函数。
+   监听线程断线重连后会清空全部缓存 (期间的通知可能丢失)。
+
+3. subscribe(channel, handler)
+   通用 LISTEN 订阅，回调在监听线程中执行。
+
+4. publish(channel, message, fallback) / subscribe_bus(channel, handler)
+   进程内消息总线：本进程订阅者同步收到，其他 worker 经 NOTIFY 收到 (如 Dir 新 hint)。
+   序列化后超过 NOTIFY_MAX_BYTES 或 NOTIFY 失败时改发 fallback (只含 ID 的失效消息)。
+
+连接预算见 database.get_pool_budget() (按 worker 数均分 DB_MAX_CONNECTIONS)。
+"""
+
+import os
+import json
+import uuid
+import time
+import select
+import asyncio
+import logging
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+from .database import DATABASE_URL, get_db_connection, get_pool_budget
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量
+# ============================================================================
+
+COORDINATION_BACKEND = os.getenv("COORDINATION_BACKEND", "postgres").lower()
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+# advisory lock 命名空间 (int4)，key 为 hashtext(user_id)
+LOCK_NAMESPACES = {
+    'stn': 0x53544E,
+    'dir': 0x444952,
+    'narration': 0x4E4152,        # 常驻状态所有权，见 acquire_user_ownership
+}
+LOCK_WAIT_TIMEOUT_SEC = 300       # 等待跨进程锁的上限 (Stn/Dir 单次调用远小于此)
+LOCK_POLL_MIN_SEC = 0.05
+LOCK_POLL_MAX_SEC = 1.0
+
+INVALIDATION_CHANNEL = "cache_invalidate"
+LISTEN_POLL_SEC = 5.0
+LISTEN_RECONNECT_SEC = 3.0
+NOTIFY_MAX_BYTES = 7999           # PostgreSQL NOTIFY 负载须小于 8000 字节 (UTF-8 编码后)
+
+_stats = {
+    'locks_acquired': 0,
+    'lock_waits': 0,
+    'lock_wait_ms_total': 0,
+    'lock_timeouts': 0,
+    'invalidations_sent': 0,
+    'invalidations_received': 0,
+    'listener_reconnects': 0,
+    'bus_published': 0,
+    'bus_fallbacks': 0,
+    'bus_received': 0,
+}
+_stats_lock = threading.Lock()   # 计数在事件循环与工作线程中都会更新
+
+
+def _count(key: str, n: int = 1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+# ============================================================================
+# 锁后端
+# ============================================================================
+
+class LocalLockBackend:
+    """仅进程内互斥 (进程内 asyncio.Lock 已保证)，不做跨进程协调"""
+
+    name = "local"
+
+    async def acquire(self, namespace: int, key: str, timeout: float) -> bool:
+        return True
+
+    async def release(self, namespace: int, key: str):
+        pass
+
+    def acquire_blocking(self, namespace: int, key: str, timeout: float) -> bool:
+        return True
+
+    def release_blocking(self, namespace: int, key: str):
+        pass
+
+    def close(self):
+        pass
+
+
+class PgAdvisoryLockBackend:
+    """
+    PostgreSQL session 级 advisory lock
+
+    每个 worker 一条专用 autocommit 连接持有本进程的全部锁，
+    不占用业务连接池；连接断开时服务端自动释放锁。
+    """
+
+    name = "postgres"
+
+    def __init__(self):
+        self._conn = None
+        self._conn_lock = threading.Lock()
+
+    def _execute(self, sql: str, params: Tuple) -> Any:
+        with self._conn_lock:
+            if self._conn is None or self._conn.closed:
+                self._conn = psycopg2.connect(DATABASE_URL)
+                self._conn.autocommit = True
+            try:
+                with self._conn.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    return cursor.fetchone()[0]
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # 连接已断开，持有的锁已被服务端释放；下次重建
+                logging.warning("⚠️ advisory lock 连接断开，已持有的锁失效")
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+                self._conn = None
+                raise
+
+    async def acquire(self, namespace: int, key: str, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        delay = LOCK_POLL_MIN_SEC
+        waited = False
+        while True:
+            acquired = await asyncio.to_thread(
+                self._execute, "SELECT pg_try_advisory_lock(%s, hashtext(%s))", (namespace, key)
+            )
+            if acquired:
+                return True
+            if not waited:
+                waited = True
+                _count('lock_waits')
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LOCK_POLL_MAX_SEC)
+
+    async def release(self, namespace: int, key: str):
+        await asyncio.to_thread(self.release_blocking, namespace, key)
+
+    def acquire_blocking(self, namespace: int, key: str, timeout: float) -> bool:
+        """同步版 acquire (在线程中调用)"""
+        deadline = time.monotonic() + timeout
+        delay = LOCK_POLL_MIN_SEC
+        waited = False
+        while True:
+            if self._execute("SELECT pg_try_advisory_lock(%s, hashtext(%s))", (namespace, key)):
+                return True
+            if not waited:
+                waited = True
+                _count('lock_waits')
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, LOCK_POLL_MAX_SEC)
+
+    def release_blocking(self, namespace: int, key: str):
+        try:
+            self._execute("SELECT pg_advisory_unlock(%s, hashtext(%s))", (namespace, key))
+        except Exception as e:
+            logging.error(f"❌ 释放 advisory lock 失败: {e}")
+
+    def close(self):
+        with self._conn_lock:
+            if self._conn is not None and not self._conn.closed:
+                self._conn.close()
+            self._conn = None
+
+
+def _create_lock_backend():
+    if COORDINATION_BACKEND == "local":
+        return LocalLockBackend()
+    return PgAdvisoryLockBackend()
+
+
+lock_backend = _create_lock_backend()
+
+# 进程内排队锁；没有协程持有/等待时自动回收
+_local_locks: "weakref.WeakValueDictionary[Tuple[str, str], asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _get_local_lock(agent: str, user_id: str) -> asyncio.Lock:
+    key = (agent, user_id)
+    lock = _local_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _local_locks[key] = lock
+    return lock
+
+
+@asynccontextmanager
+async def user_agent_lock(agent: str, user_id: str, timeout: float = LOCK_WAIT_TIMEOUT_SEC):
+    """
+    用户级 Agent 锁 (跨 worker)
+
+    用法:
+        async with user_agent_lock('stn', user_id):
+            ...
+
+    Raises:
+        asyncio.TimeoutError: 超时仍未取得跨进程锁
+    """
+    namespace = LOCK_NAMESPACES[agent]
+    async with _get_local_lock(agent, user_id):
+        start = time.monotonic()
+        if not await lock_backend.acquire(namespace, user_id, timeout):
+            _count('lock_timeouts')
+            raise asyncio.TimeoutError(f"等待 {agent} 用户锁超时: {user_id}")
+        _count('locks_acquired')
+        _count('lock_wait_ms_total', int((time.monotonic() - start) * 1000))
+        try:
+            yield
+        finally:
+            await lock_backend.release(namespace, user_id)
+
+
+def acquire_user_ownership(user_id: str, timeout: float) -> bool:
+    """
+    取得用户常驻状态的所有权 (跨 worker，在线程中调用)
+
+    与 user_agent_lock 不同，所有权跨越多次调用：常驻期间一直持有，
+    由 release_user_ownership 在最后一次落库后释放。同一进程重复获取会叠加计数，
+    须成对释放。锁连接断开时服务端自动释放 (等同进程崩溃)。
+
+    Returns:
+        timeout 秒内是否取得
+    """
+    start = time.monotonic()
+    if not lock_backend.acquire_blocking(LOCK_NAMESPACES['narration'], user_id, timeout):
+        _count('lock_timeouts')
+        return False
+    _count('locks_acquired')
+    _count('lock_wait_ms_total', int((time.monotonic() - start) * 1000))
+    return True
+
+
+def release_user_ownership(user_id: str):
+    """释放 acquire_user_ownership 取得的所有权 (在线程中调用)"""
+    lock_backend.release_blocking(LOCK_NAMESPACES['narration'], user_id)
+
+
+# ============================================================================
+# LISTEN / NOTIFY
+# ============================================================================
+
+_subscriptions: Dict[str, List[Callable[[str], None]]] = {}
+_invalidation_handlers: Dict[str, List[Callable[[str], None]]] = {}
+_listener: Optional["_NotifyListener"] = None
+
+
+def subscribe(channel: str, handler: Callable[[str], None]):
+    """订阅 NOTIFY 频道 (需在 start_coordination 之前注册)；handler(payload) 在监听线程中执行"""
+    _subscriptions.setdefault(channel, []).append(handler)
+
+
+def notify(channel: str, payload: str = "", cursor=None):
+    """
+    发送 NOTIFY
+
+    传入 cursor 时随该事务提交一起发出 (事务回滚则不发送)；否则使用独立连接立即发送。
+    """
+    if COORDINATION_BACKEND == "local":
+        return
+    if cursor is not None:
+        cursor.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+        return
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+        conn.commit()
+
+
+class _NotifyListener(threading.Thread):
+    """独立连接 LISTEN 全部订阅频道，断线自动重连"""
+
+    def __init__(self):
+        super().__init__(name="pg-notify-listener", daemon=True)
+        self._stop_event = threading.Event()
+        self._conn = None
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        first = True
+        while not self._stop_event.is_set():
+            try:
+                self._conn = psycopg2.connect(DATABASE_URL)
+                self._conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with self._conn.cursor() as cursor:
+                    for channel in _subscriptions:
+                        cursor.execute(f'LISTEN "{channel}"')
+                if not first:
+                    # 断线期间的通知可能丢失，保守地清空全部缓存
+                    _count('listener_reconnects')
+                    _run_invalidation_handlers(None, "")
+                first = False
+                logging.info(f"✅ NOTIFY 监听已启动: {list(_subscriptions)}")
+                self._loop()
+            except Exception as e:
+                if not self._stop_event.is_set():
+                    logging.error(f"❌ NOTIFY 监听异常，{LISTEN_RECONNECT_SEC}s 后重连: {e}")
+                    self._stop_event.wait(LISTEN_RECONNECT_SEC)
+            finally:
+                if self._conn is not None:
+                    try:
+                        self._conn.close()
+                    except Exception:
+                        pass
+                    self._conn = None
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            if select.select([self._conn], [], [], LISTEN_POLL_SEC) == ([], [], []):
+                continue
+            self._conn.poll()
+            while self._conn.notifies:
+                message = self._conn.notifies.pop(0)
+                for handler in _subscriptions.get(message.channel, []):
+                    try:
+                        handler(message.payload)
+                    except Exception as e:
+                        logging.error(f"❌ NOTIFY 回调失败 ({message.channel}): {e}")
+
+
+# ============================================================================
+# 缓存失效
+# ============================================================================
+
+def register_invalidation(name: str, handler: Callable[[str], None]):
+    """注册缓存清理函数，handler(payload)"""
+    _invalidation_handlers.setdefault(name, []).append(handler)
+
+
+def _run_invalidation_handlers(name: Optional[str], payload: str):
+    names = [name] if name else list(_invalidation_handlers)
+    for n in names:
+        for handler in _invalidation_handlers.get(n, []):
+            try:
+                handler(payload)
+            except Exception as e:
+                logging.error(f"❌ 缓存清理失败 ({n}): {e}")
+
+
+def _on_invalidation_message(raw: str):
+    try:
+        message = json.loads(raw)
+    except ValueError:
+        return
+    if message.get('w') == WORKER_ID:
+        return  # 本进程发出的通知，发送时已清理
+    _count('invalidations_received')
+    _run_invalidation_handlers(message.get('n'), message.get('p', ''))
+
+
+def invalidate_cache(name: str, payload: str = ""):
+    """
+    清空本进程缓存并广播给其他 worker
+
+    Args:
+        name: 缓存名 ('config' / 'models' / 'llm_sessions' ...)
+        payload: 附加信息 (如 user_id)，原样传给 handler
+    """
+    _run_invalidation_handlers(name, payload)
+    try:
+        notify(INVALIDATION_CHANNEL, json.dumps({'w': WORKER_ID, 'n': name, 'p': payload}))
+        _count('invalidations_sent')
+    except Exception as e:
+        logging.error(f"❌ 广播缓存失效失败 ({name}): {e}")
+
+
+subscribe(INVALIDATION_CHANNEL, _on_invalidation_message)
+
+
+# ============================================================================
+# 消息总线
+# ============================================================================
+
+_bus_handlers: Dict[str, List[Callable[[Dict[str, Any]], None]]] = {}
+
+
+def subscribe_bus(channel: str, handler: Callable[[Dict[str, Any]], None]):
+    """
+    订阅总线频道 (需在 start_coordination 之前注册)
+
+    handler(message): 本进程发布时在发布者线程中同步执行，其他 worker 发布时在监听线程中执行
+    """
+    if channel not in _bus_handlers:
+        _bus_handlers[channel] = []
+        subscribe(channel, lambda raw, c=channel: _on_bus_message(c, raw))
+    _bus_handlers[channel].append(handler)
+
+
+def _run_bus_handlers(channel: str, message: Dict[str, Any]):
+    for handler in _bus_handlers.get(channel, []):
+        try:
+            handler(message)
+        except Exception as e:
+            logging.error(f"❌ 总线回调失败 ({channel}): {e}")
+
+
+def _on_bus_message(channel: str, raw: str):
+    try:
+        envelope = json.loads(raw)
+    except ValueError:
+        return
+    if envelope.get('w') == WORKER_ID:
+        return  # 本进程发布时已同步分发
+    _count('bus_received')
+    _run_bus_handlers(channel, envelope.get('m') or {})
+
+
+def _bus_payload(message: Dict[str, Any]) -> str:
+    return json.dumps({'w': WORKER_ID, 'm': message}, ensure_ascii=False)
+
+
+def publish(channel: str, message: Dict[str, Any], fallback: Optional[Dict[str, Any]] = None):
+    """
+    发布消息：先分发给本进程订阅者，再 NOTIFY 其他 worker
+
+    Args:
+        fallback: 序列化后的信封超过 NOTIFY_MAX_BYTES 或 NOTIFY 失败时改发的精简消息
+                  (如去掉正文、只保留 ID，接收方回源读取)
+    """
+    _run_bus_handlers(channel, message)
+    payload = _bus_payload(message)
+    if fallback is not None and len(payload.encode('utf-8')) > NOTIFY_MAX_BYTES:
+        payload, fallback = _bus_payload(fallback), None
+        _count('bus_fallbacks')
+    try:
+        notify(channel, payload)
+        _count('bus_published')
+        return
+    except Exception as e:
+        if fallback is None:
+            logging.error(f"❌ 总线消息广播失败 ({channel}): {e}")
+            return
+        logging.warning(f"⚠️ 总线消息广播失败，改发精简消息 ({channel}): {e}")
+    try:
+        notify(channel, _bus_payload(fallback))
+        _count('bus_published')
+        _count('bus_fallbacks')
+    except Exception as e:
+        logging.error(f"❌ 总线消息广播失败 ({channel}): {e}")
+
+
+# ============================================================================
+# 生命周期
+# ============================================================================
+
+def start_coordination():
+    """启动 NOTIFY 监听线程 (lifespan 调用)"""
+    global _listener
+    if COORDINATION_BACKEND == "local" or _listener is not None:
+        return
+    _listener = _NotifyListener()
+    _listener.start()
+
+
+def stop_coordination():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener.join(timeout=LISTEN_POLL_SEC + 1)
+        _listener = None
+    lock_backend.close()
+
+
+def get_coordination_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['worker_id'] = WORKER_ID
+    stats['backend'] = lock_backend.name
+    stats['listener_alive'] = bool(_listener and _listener.is_alive())
+    stats['local_locks'] = len(_local_locks)
+    stats['pool_budget'] = get_pool_budget()
+    return stats
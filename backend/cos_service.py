@@ -7,6 +7,7 @@
 """
 import os
 import logging
+from typing import Union, BinaryIO
 from qcloud_cos import CosConfig
 from qcloud_cos import CosS3Client
 from .config_manager import get_config
@@ -28,12 +29,12 @@ def get_cos_client():
     client = CosS3Client(config)
     return client
 
-def upload_audio_to_cos(audio_data: bytes, filename: str) -> str:
+def upload_audio_to_cos(audio_data: Union[bytes, BinaryIO], filename: str) -> str:
     """
     上传音频文件到腾讯云 COS
     
     Args:
-        audio_data: 音频文件二进制数据
+        audio_data: 音频文件二进制数据，或位于开头的文件对象 (按流读取上传，不整体载入内存)
         filename: 文件名（如 'voice_20260126_001.mp3'）
     
     Returns:
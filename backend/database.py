@@ -6,7 +6,7 @@
 
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from psycopg2.pool import SimpleConnectionPool
+from psycopg2.pool import ThreadedConnectionPool
 import os
 from dotenv import load_dotenv
 from contextlib import contextmanager
@@ -18,20 +18,38 @@ load_dotenv()
 # 数据库连接字符串
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-# 连接池（提高性能）
+# 连接预算：数据库侧 max_connections 由所有 worker 共享 (uvicorn --workers 读取 WEB_CONCURRENCY)
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "12"))
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+RESERVED_CONNECTIONS_PER_WORKER = 2  # coordination_service: advisory lock 连接 + LISTEN 连接
+
+# 连接池（提高性能；同步路由运行在线程池中，telemetry 后台线程也会使用，需线程安全）
 connection_pool = None
 
+
+def get_pool_budget() -> dict:
+    """按 worker 数均分连接预算，扣除每个 worker 的专用连接后作为连接池上限"""
+    per_worker = DB_MAX_CONNECTIONS // WEB_CONCURRENCY
+    return {
+        'total': DB_MAX_CONNECTIONS,
+        'workers': WEB_CONCURRENCY,
+        'per_worker': per_worker,
+        'pool_max': max(2, per_worker - RESERVED_CONNECTIONS_PER_WORKER),
+    }
+
+
 def init_connection_pool():
     """初始化数据库连接池"""
     global connection_pool
     if connection_pool is None:
         try:
-            connection_pool = SimpleConnectionPool(
+            budget = get_pool_budget()
+            connection_pool = ThreadedConnectionPool(
                 minconn=1,
-                maxconn=10,
+                maxconn=budget['pool_max'],
                 dsn=DATABASE_URL
             )
-            logging.info("数据库连接池初始化成功")
+            logging.info(f"数据库连接池初始化成功 (maxconn={budget['pool_max']}, workers={budget['workers']})")
         except Exception as e:
             logging.error(f"数据库连接池初始化失败: {e}")
             raise
@@ -3,15 +3,25 @@
 """
 数据库日志记录模块
 提供 ASR 和 TTS 调用记录到数据库的功能
+
+记录只加入 telemetry_service 的写入队列，由后台线程批量落库，
+不在请求路径上产生数据库往返。
 """
 
 import logging
+from typing import Dict
 from .database import get_db_connection
+from .coordination_service import register_invalidation
+from .telemetry_service import record_usage
 
 logging.basicConfig(level=logging.INFO)
 
+# 模型名称 -> model_id 缓存 (base_models 基本不变，只缓存查到的结果)
+_model_id_cache: Dict[str, int] = {}
+
 
-def log_asr_call(user_id: str, original_text_id: int, model_id: int, duration_ms: int, cost: float):
+def log_asr_call(user_id: str, original_text_id: int, model_id: int, duration_ms: int, cost: float,
+                 audio_seconds: float = 0):
     """
     记录 ASR 调用到数据库
     
@@ -21,29 +31,28 @@ def log_asr_call(user_id: str, original_text_id: int, model_id: int, duration_ms
         model_id: 模型ID (base_models.model_id)
         duration_ms: 处理耗时(毫秒)
         cost: 成本
+        audio_seconds: 音频时长(秒)，计入用量汇总
+    
+    Returns:
+        是否成功加入写入队列
     """
-    try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO asr_processed 
-                    (original_text_id, model_id, duration, processed_cost)
-                    VALUES (%s, %s, %s, %s)
-                    RETURNING processed_id
-                """, (original_text_id, model_id, duration_ms, cost))
-                
-                processed_id = cursor.fetchone()[0]
-                conn.commit()
-                
-                logging.info(f"✅ ASR 调用已记录: processed_id={processed_id}, text_id={original_text_id}, duration={duration_ms}ms, cost=¥{cost}")
-                return processed_id
-    except Exception as e:
-        logging.error(f"❌ 记录 ASR 调用失败: {e}", exc_info=True)
-        return None
+    queued = record_usage('asr_processed', {
+        'user_id': user_id,
+        'original_text_id': original_text_id,
+        'audio_seconds': audio_seconds,
+        'model_id': model_id,
+        'duration_ms': duration_ms,
+        'cost': cost,
+    })
+    if queued:
+        logging.info(f"✅ ASR 调用已记录: text_id={original_text_id}, duration={duration_ms}ms, cost=¥{cost}")
+    else:
+        logging.warning(f"⚠️ ASR 调用记录被丢弃(队列已满): text_id={original_text_id}")
+    return queued
 
 
 def log_tts_call(user_id: str, link_original_text_id: int, link_original_voice_id: int, 
-                 model_id: int, duration_ms: int, cost: float):
+                 model_id: int, duration_ms: int, cost: float, char_count: int = 0):
     """
     记录 TTS 调用到数据库
     
@@ -54,30 +63,30 @@ def log_tts_call(user_id: str, link_original_text_id: int, link_original_voice_i
         model_id: 模型ID (base_models.model_id)
         duration_ms: 处理耗时(毫秒)
         cost: 成本
+        char_count: 合成字符数，计入用量汇总
+    
+    Returns:
+        是否成功加入写入队列
     """
-    try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO tts_processed 
-                    (link_original_text_id, link_original_voice_id, model_id, duration, processed_cost)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING processed_id
-                """, (link_original_text_id, link_original_voice_id, model_id, duration_ms, cost))
-                
-                processed_id = cursor.fetchone()[0]
-                conn.commit()
-                
-                logging.info(f"✅ TTS 调用已记录: processed_id={processed_id}, text_id={link_original_text_id}, voice_id={link_original_voice_id}, duration={duration_ms}ms, cost=¥{cost}")
-                return processed_id
-    except Exception as e:
-        logging.error(f"❌ 记录 TTS 调用失败: {e}", exc_info=True)
-        return None
+    queued = record_usage('tts_processed', {
+        'user_id': user_id,
+        'link_original_text_id': link_original_text_id,
+        'char_count': char_count,
+        'link_original_voice_id': link_original_voice_id,
+        'model_id': model_id,
+        'duration_ms': duration_ms,
+        'cost': cost,
+    })
+    if queued:
+        logging.info(f"✅ TTS 调用已记录: text_id={link_original_text_id}, voice_id={link_original_voice_id}, duration={duration_ms}ms, cost=¥{cost}")
+    else:
+        logging.warning(f"⚠️ TTS 调用记录被丢弃(队列已满): text_id={link_original_text_id}")
+    return queued
 
 
 def get_model_id_by_name(model_name: str):
     """
-    根据模型名称获取模型ID
+    根据模型名称获取模型ID (进程内缓存)
     
     Args:
         model_name: 模型名称
@@ -85,6 +94,9 @@ def get_model_id_by_name(model_name: str):
     Returns:
         model_id 或 None
     """
+    if model_name in _model_id_cache:
+        return _model_id_cache[model_name]
+    
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
@@ -95,7 +107,17 @@ def get_model_id_by_name(model_name: str):
                 """, (model_name, model_name))
                 
                 row = cursor.fetchone()
+                if row:
+                    _model_id_cache[model_name] = row[0]
                 return row[0] if row else None
     except Exception as e:
         logging.error(f"❌ 查询模型ID失败: {e}")
         return None
+
+
+def clear_model_id_cache():
+    """清空模型ID缓存 (base_models 变更后调用)"""
+    _model_id_cache.clear()
+
+
+register_invalidation('models', lambda _: clear_model_id_cache())
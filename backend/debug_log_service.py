@@ -9,6 +9,7 @@ import logging
 from typing import Dict, Any, Optional, List
 from datetime import datetime, timedelta
 from .database import get_db_connection
+from .llm_content_service import load_llm_io
 
 logging.basicConfig(level=logging.INFO)
 
@@ -203,7 +204,7 @@ def _aggregate_logs(user_id: str, start_time: datetime, end_time: datetime) -> L
                         "record_id": f"text_{text_id}"
                     })
                 
-                # 3. 获取 ASR 调用记录
+                # 3. 获取 ASR 调用记录 (调用记录晚于文本写入，created_time 条件用于分区裁剪)
                 cursor.execute("""
                     SELECT 
                         a.processed_id,
@@ -221,8 +222,9 @@ def _aggregate_logs(user_id: str, start_time: datetime, end_time: datetime) -> L
                             AND created_time >= %s 
                             AND created_time <= %s
                     )
+                        AND a.created_time >= %s
                     ORDER BY a.created_time ASC
-                """, (user_id, start_time, end_time))
+                """, (user_id, start_time, end_time, start_time))
                 
                 for row in cursor.fetchall():
                     processed_id, created_time, text_id, duration, cost, model_name = row
@@ -237,7 +239,7 @@ def _aggregate_logs(user_id: str, start_time: datetime, end_time: datetime) -> L
                         "record_id": f"asr_{processed_id}"
                     })
                 
-                # 4. 获取 TTS 调用记录
+                # 4. 获取 TTS 调用记录 (同上)
                 cursor.execute("""
                     SELECT 
                         t.processed_id,
@@ -255,8 +257,9 @@ def _aggregate_logs(user_id: str, start_time: datetime, end_time: datetime) -> L
                             AND created_time >= %s 
                             AND created_time <= %s
                     )
+                        AND t.created_time >= %s
                     ORDER BY t.created_time ASC
-                """, (user_id, start_time, end_time))
+                """, (user_id, start_time, end_time, start_time))
                 
                 for row in cursor.fetchall():
                     processed_id, created_time, text_id, duration, cost, model_name = row
@@ -293,10 +296,14 @@ def _aggregate_logs(user_id: str, start_time: datetime, end_time: datetime) -> L
                     ORDER BY created_time ASC
                 """, (user_id, start_time, end_time))
                 
-                for row in cursor.fetchall():
+                llm_rows = cursor.fetchall()
+                io_map = load_llm_io(conn, [row[0] for row in llm_rows])
+                
+                for row in llm_rows:
                     (processed_id, created_time, agent, model_name, 
                      llm_input, llm_output, total_tokens, prompt_tokens, 
                      completion_tokens, cached_tokens, duration, cost) = row
+                    llm_input, llm_output = io_map.get(processed_id, (llm_input, llm_output))
                     
                     logs.append({
                         "timestamp": created_time.isoformat(),
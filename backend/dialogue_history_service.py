@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Dialogue History Service (Intv 滚动对话历史)
+============================================================================
+
+intv_llm_previous_content 原先是不断拼接的 "U:... I:..." 长串 (截断到 5000 字)，
+Session 重建时还要从原文表重新查询最近 9 条。这里改为有界的滚动历史：
+
+- 最近轮次：环形缓冲，最多 intv_history_recent_turns 轮，保留原文
+- 较早轮次：滑出环形缓冲时压缩为一句摘要 (每侧截取开头) 并入摘要列表，
+  增量维护，不重新处理整段历史
+- 总量受 intv_history_token_budget 约束：超出时先把最早的轮次并入摘要，
+  摘要本身最多占预算的 1/4，超出丢弃最早的摘要
+- 存储为紧凑 JSON ({"v":1,"s":[摘要...],"t":[[用户,回复],...]})，
+  每轮改写的字段大小有上界；旧版纯文本内容读取时视为一条摘要
+
+Session 重建时直接渲染该结构作为 pc，无需再查询原文表。
+"""
+
+import json
+import logging
+from collections import deque
+from typing import List, Optional, Tuple
+
+from .config_manager import get_config
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量
+# ============================================================================
+
+HISTORY_FORMAT_VERSION = 1
+DEFAULT_TOKEN_BUDGET = 1200
+DEFAULT_RECENT_TURNS = 6
+SUMMARY_BUDGET_RATIO = 0.25      # 摘要最多占用的预算比例
+SUMMARY_SIDE_CHARS = 24          # 压缩时每侧保留的字数
+ELLIPSIS = "…"
+
+
+def _config_int(key: str, default: int) -> int:
+    try:
+        return max(1, int(float(get_config(key, default=default))))
+    except (TypeError, ValueError):
+        return default
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符按 1 个计，其余按 4 个字符 1 个计"""
+    if not text:
+        return 0
+    wide = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def _clip(text: str, max_tokens: int) -> str:
+    """按估算 token 数截取开头"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    used = 0.0
+    for i, ch in enumerate(text):
+        used += 1 if ord(ch) >= 0x2E80 else 0.25
+        if used > max_tokens:
+            return text[:i] + ELLIPSIS
+    return text
+
+
+def _compress_turn(user_text: str, ai_text: str) -> str:
+    """把一轮对话压缩为一句摘要"""
+    def side(text: str) -> str:
+        text = ' '.join((text or '').split())
+        return text if len(text) <= SUMMARY_SIDE_CHARS else text[:SUMMARY_SIDE_CHARS] + ELLIPSIS
+    return f"U:{side(user_text)} I:{side(ai_text)}"
+
+
+# ============================================================================
+# 滚动历史
+# ============================================================================
+
+class DialogueHistory:
+    """有 token 预算的滚动对话历史：摘要列表 + 最近轮次环形缓冲"""
+
+    def __init__(
+        self,
+        summary: Optional[List[str]] = None,
+        turns: Optional[List[Tuple[str, str]]] = None,
+        token_budget: Optional[int] = None,
+        recent_turns: Optional[int] = None
+    ):
+        self.token_budget = token_budget or _config_int('intv_history_token_budget', DEFAULT_TOKEN_BUDGET)
+        self.summary: deque = deque(summary or [])
+        self.turns: deque = deque()
+        self._recent_turns = recent_turns or _config_int('intv_history_recent_turns', DEFAULT_RECENT_TURNS)
+        for user_text, ai_text in turns or []:
+            self.turns.append((user_text, ai_text))
+        self._enforce_budget()
+
+    # ------------------------------------------------------------------
+    # 存取
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def load(cls, stored: Optional[str]) -> 'DialogueHistory':
+        """从 intv_llm_previous_content 解析；旧版纯文本视为一条摘要"""
+        if not stored:
+            return cls()
+        try:
+            data = json.loads(stored)
+            if isinstance(data, dict) and data.get('v') == HISTORY_FORMAT_VERSION:
+                return cls(
+                    summary=[s for s in data.get('s') or [] if isinstance(s, str)],
+                    turns=[(t[0], t[1]) for t in data.get('t') or [] if isinstance(t, list) and len(t) == 2]
+                )
+        except (ValueError, TypeError, IndexError):
+            pass
+        history = cls()
+        # 旧版拼接串保留的是最近内容，取结尾部分
+        legacy = stored[-int(history.token_budget * SUMMARY_BUDGET_RATIO):]
+        history.summary.append(legacy)
+        history._enforce_budget()
+        return history
+
+    def dump(self) -> str:
+        """序列化为紧凑 JSON，写回 intv_llm_previous_content"""
+        return json.dumps(
+            {'v': HISTORY_FORMAT_VERSION, 's': list(self.summary), 't': [list(t) for t in self.turns]},
+            ensure_ascii=False,
+            separators=(',', ':')
+        )
+
+    def is_empty(self) -> bool:
+        return not self.summary and not self.turns
+
+    # ------------------------------------------------------------------
+    # 更新与渲染
+    # ------------------------------------------------------------------
+
+    def append(self, user_text: str, ai_text: str):
+        """追加一轮对话；超出轮数或预算的最早轮次并入摘要"""
+        turn_budget = self.token_budget - self._summary_budget()
+        self.turns.append((
+            _clip(user_text or '', turn_budget // 2),
+            _clip(ai_text or '', turn_budget // 2)
+        ))
+        self._enforce_budget()
+
+    def render(self) -> str:
+        """渲染为 pc 文本：较早摘要在前，最近轮次原文在后"""
+        parts = list(self.summary)
+        parts.extend(f"U:{user_text} I:{ai_text}" for user_text, ai_text in self.turns)
+        return " ".join(parts)
+
+    def token_count(self) -> int:
+        return self._summary_tokens() + self._turn_tokens()
+
+    def _summary_budget(self) -> int:
+        return int(self.token_budget * SUMMARY_BUDGET_RATIO)
+
+    def _summary_tokens(self) -> int:
+        return sum(estimate_tokens(s) for s in self.summary)
+
+    def _turn_tokens(self) -> int:
+        return sum(estimate_tokens(u) + estimate_tokens(a) for u, a in self.turns)
+
+    def _enforce_budget(self):
+        while self.turns and (
+            len(self.turns) > self._recent_turns
+            or (len(self.turns) > 1 and self.token_count() > self.token_budget)
+        ):
+            self.summary.append(_compress_turn(*self.turns.popleft()))
+        summary_budget = self._summary_budget()
+        while self.summary and self._summary_tokens() > summary_budget:
+            self.summary.popleft()
+
+
+def append_dialogue_turn(stored: Optional[str], user_text: str, ai_text: str) -> str:
+    """在已存储的历史上追加一轮，返回新的存储表示"""
+    history = DialogueHistory.load(stored)
+    history.append(user_text, ai_text)
+    return history.dump()
+
+
+def render_dialogue_history(stored: Optional[str]) -> str:
+    """把已存储的历史渲染为 Session 重建时的 pc 文本"""
+    return DialogueHistory.load(stored).render()
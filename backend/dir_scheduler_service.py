@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Dir Scheduler Service (按故事板变更调度 Dir Agent)
+============================================================================
+
+Stn 每次完成后不再无条件触发 Dir：
+
+1. 对本次解析结果 (S/T/O/C/R) 打分：新阶段/话题/镜头、人物变更分值较高，
+   仅更新摘要等分值较低，无变更为 0 分
+2. 分数按用户累加 (连续多次 Stn 的变更合并)，达到 dir_trigger_min_score 时
+   投递 Dir 并清零；Dir 一次读取全部未处理的故事板，合并的变更一并处理
+3. 分数不足时延后；自第一笔未处理变更起超过 dir_max_defer_sec 仍未触发，
+   则到期强制运行一次，避免 hint 长时间过期
+"""
+
+import time
+import asyncio
+import logging
+from typing import Dict, Any, Optional
+
+from .config_manager import get_config
+from .user_actor_service import post_agent_run
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量与统计
+# ============================================================================
+
+# 实体类型 -> (新建分, 更新分)
+DELTA_WEIGHTS = {
+    'S': (4, 1),
+    'T': (3, 1),
+    'O': (2, 1),
+    'C': (2, 2),
+}
+RELATION_WEIGHT = 1
+
+DEFAULT_MIN_SCORE = 4
+DEFAULT_MAX_DEFER_SEC = 300
+
+_stats = {
+    'scored': 0,
+    'skipped_no_change': 0,
+    'deferred': 0,
+    'triggered': 0,
+    'triggered_by_timeout': 0,
+}
+
+
+class _PendingDelta:
+    """某用户尚未交给 Dir 的累计变更"""
+
+    def __init__(self):
+        self.score = 0
+        self.first_at = time.monotonic()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+_pending: Dict[str, _PendingDelta] = {}
+_timeout_tasks: set = set()
+
+
+def _config_number(key: str, default: float) -> float:
+    try:
+        return float(get_config(key, default=default))
+    except (TypeError, ValueError):
+        return default
+
+
+# ============================================================================
+# 打分
+# ============================================================================
+
+def score_storyboard_delta(parsed_data: Dict[str, Any]) -> int:
+    """按 Stn 解析结果计算故事板变更分"""
+    score = 0
+    for entity_type, (new_weight, update_weight) in DELTA_WEIGHTS.items():
+        for entity in parsed_data.get(entity_type) or []:
+            if not isinstance(entity, dict):
+                continue
+            score += new_weight if entity.get('pt', 'n') == 'n' else update_weight
+    score += RELATION_WEIGHT * len(parsed_data.get('R') or [])
+    return score
+
+
+# ============================================================================
+# 调度
+# ============================================================================
+
+async def schedule_dir_after_stn(user_id: str, parsed_data: Dict[str, Any]):
+    """Stn 完成后调用：累计变更分，决定立即运行、延后或跳过 Dir"""
+    score = score_storyboard_delta(parsed_data)
+    _stats['scored'] += 1
+
+    min_score = _config_number('dir_trigger_min_score', DEFAULT_MIN_SCORE)
+    max_defer = _config_number('dir_max_defer_sec', DEFAULT_MAX_DEFER_SEC)
+
+    pending = _pending.get(user_id)
+    if min_score <= 0:
+        # 关闭变更判断：每次 Stn 后都运行 Dir
+        if pending is None:
+            pending = _pending[user_id] = _PendingDelta()
+        pending.score += score
+        await _trigger(user_id)
+        return
+
+    if score <= 0 and pending is None:
+        _stats['skipped_no_change'] += 1
+        logging.info(f"🎬 Stn 无故事板变更，跳过 Dir (User: {user_id[:8]}...)")
+        return
+
+    if pending is None:
+        pending = _pending[user_id] = _PendingDelta()
+    pending.score += score
+
+    overdue = time.monotonic() - pending.first_at >= max_defer
+
+    if pending.score >= min_score or overdue:
+        await _trigger(user_id, timeout=overdue and pending.score < min_score)
+        return
+
+    _stats['deferred'] += 1
+    if pending.timer is None:
+        delay = max(0.0, max_defer - (time.monotonic() - pending.first_at))
+        pending.timer = asyncio.get_running_loop().call_later(delay, _on_timeout, user_id)
+    logging.info(f"🎬 Dir 延后: 累计变更分 {pending.score} < {min_score:g} (User: {user_id[:8]}...)")
+
+
+async def _trigger(user_id: str, timeout: bool = False):
+    pending = _pending.pop(user_id, None)
+    if pending is None:
+        return
+    if pending.timer is not None:
+        pending.timer.cancel()
+    _stats['triggered'] += 1
+    if timeout:
+        _stats['triggered_by_timeout'] += 1
+    logging.info(f"🎬 触发 Dir: 累计变更分 {pending.score}{' (延后到期)' if timeout else ''}")
+    await post_agent_run(user_id, 'dir')
+
+
+def _on_timeout(user_id: str):
+    pending = _pending.get(user_id)
+    if pending is None:
+        return
+    pending.timer = None
+    task = asyncio.ensure_future(_trigger(user_id, timeout=True))
+    _timeout_tasks.add(task)
+    task.add_done_callback(_timeout_tasks.discard)
+
+
+def get_dir_scheduler_stats() -> Dict[str, Any]:
+    stats = dict(_stats)
+    stats['pending_users'] = len(_pending)
+    stats['pending_score_total'] = sum(p.score for p in _pending.values())
+    return stats
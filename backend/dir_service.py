@@ -16,9 +16,8 @@ Dir Service (导演 Agent 服务) v3.3
 根据《服务端流程文档与数据库结构设计 v3.3》实现。
 """
 
-import asyncio
 import logging
-from typing import Dict, Any, Optional
+from typing import Any, Optional
 
 from .narration_service import (
     get_or_create_narration_status,
@@ -34,24 +33,11 @@ from .stn_database import (
     format_storyboards_for_llm,
 )
 from .config_manager import get_config, get_active_prompt
+from .coordination_service import user_agent_lock
 
 logging.basicConfig(level=logging.INFO)
 
 
-# ============================================================================
-# 用户级并发控制（FIFO 队列）
-# ============================================================================
-
-_user_locks: Dict[str, asyncio.Lock] = {}
-
-
-def _get_user_lock(user_id: str) -> asyncio.Lock:
-    """获取用户级别的锁"""
-    if user_id not in _user_locks:
-        _user_locks[user_id] = asyncio.Lock()
-    return _user_locks[user_id]
-
-
 # ============================================================================
 # v3.4: Dir System Prompt 现已从 prompt_config 表动态读取
 # ============================================================================
@@ -65,15 +51,14 @@ async def run_dir_agent(user_id: str) -> bool:
     """
     运行 Dir Agent
     
-    这是一个异步函数，由 Stn Agent 完成后触发。
-    使用用户级锁保证同一用户的任务按 FIFO 顺序执行。
+    Stn 产生足够的故事板变更后由 dir_scheduler_service 投递到用户 actor 的邮箱。
+    跨 worker 仍以用户级锁保证同一用户的任务互斥。
     
     Returns:
         bool: 是否成功
     """
-    lock = _get_user_lock(user_id)
-    
-    async with lock:
+    # 用户级锁：进程内 FIFO + 跨 worker advisory lock
+    async with user_agent_lock('dir', user_id):
         logging.info(f"🎬 Dir Agent 开始工作 (User: {user_id[:8]}...)")
         
         try:
@@ -9,6 +9,7 @@ import logging
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 from .database import get_db_connection
+from .llm_content_service import load_llm_io
 
 logging.basicConfig(level=logging.INFO)
 
@@ -116,7 +117,7 @@ def get_user_interview_details(
                 u.user_name
             FROM llm_processed p
             LEFT JOIN users u ON p.user_id = u.user_id
-            WHERE p.user_id = %s AND p.agent = 'Intv' AND p.input IS NOT NULL
+            WHERE p.user_id = %s AND p.agent = 'Intv' AND (p.input IS NOT NULL OR p.input_packed IS NOT NULL)
         """)
         params.append(user_id)
     
@@ -140,7 +141,7 @@ def get_user_interview_details(
                 u.user_name
             FROM llm_processed p
             LEFT JOIN users u ON p.user_id = u.user_id
-            WHERE p.user_id = %s AND p.agent = 'Stn' AND p.input IS NOT NULL
+            WHERE p.user_id = %s AND p.agent = 'Stn' AND (p.input IS NOT NULL OR p.input_packed IS NOT NULL)
         """)
         params.append(user_id)
     
@@ -164,7 +165,7 @@ def get_user_interview_details(
                 u.user_name
             FROM llm_processed p
             LEFT JOIN users u ON p.user_id = u.user_id
-            WHERE p.user_id = %s AND p.agent = 'Stn' AND p.output IS NOT NULL
+            WHERE p.user_id = %s AND p.agent = 'Stn' AND (p.output IS NOT NULL OR p.output_packed IS NOT NULL)
         """)
         params.append(user_id)
     
@@ -188,7 +189,7 @@ def get_user_interview_details(
                 u.user_name
             FROM llm_processed p
             LEFT JOIN users u ON p.user_id = u.user_id
-            WHERE p.user_id = %s AND p.agent = 'Dir' AND p.input IS NOT NULL
+            WHERE p.user_id = %s AND p.agent = 'Dir' AND (p.input IS NOT NULL OR p.input_packed IS NOT NULL)
         """)
         params.append(user_id)
     
@@ -212,7 +213,7 @@ def get_user_interview_details(
                 u.user_name
             FROM llm_processed p
             LEFT JOIN users u ON p.user_id = u.user_id
-            WHERE p.user_id = %s AND p.agent = 'Dir' AND p.output IS NOT NULL
+            WHERE p.user_id = %s AND p.agent = 'Dir' AND (p.output IS NOT NULL OR p.output_packed IS NOT NULL)
         """)
         params.append(user_id)
     
@@ -253,6 +254,9 @@ def get_user_interview_details(
             cursor.execute(paginated_query, params)
             rows = cursor.fetchall()
             
+            # 还原压缩存储的 LLM input/output
+            rows = _hydrate_llm_rows(rows, conn)
+            
             # 获取所有涉及的 Text ID
             text_ids = [int(row[1]) for row in rows if row[1] and str(row[1]).isdigit()]
             
@@ -282,6 +286,26 @@ def get_user_interview_details(
             }
 
 
+def _hydrate_llm_rows(rows: list, conn) -> list:
+    """用 load_llm_io 填充 LLM 记录的 content / llm_input / llm_output"""
+    llm_ids = [int(row[1]) for row in rows if row[12]]
+    if not llm_ids:
+        return rows
+    
+    io_map = load_llm_io(conn, llm_ids)
+    hydrated = []
+    for row in rows:
+        if row[12] and int(row[1]) in io_map:
+            llm_input, llm_output = io_map[int(row[1])]
+            row = list(row)
+            row[3] = llm_input if row[0].endswith("_input") else llm_output
+            row[10] = llm_input
+            row[11] = llm_output
+            row = tuple(row)
+        hydrated.append(row)
+    return hydrated
+
+
 def _format_record_optimized(row: tuple, user_id: str, audio_map: dict, conn) -> Dict[str, Any]:
     """优化后的格式化单条记录"""
     data_type = row[0]
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Interview Turn Service (单轮访谈：Intv 流式输出 + TTS 流式合成)
+============================================================================
+
+/ws/interview 与 /ws/voice 共用的单轮处理流程：
+
+1. process_user_input 流式产出 Intv 文本，转发给客户端
+2. 文本按句切分后送入 TTS 双向流，PCM 音频实时回传客户端
+3. 结束后在后台把整段 TTS PCM 转为 MP3 上传 COS，并记录 TTS 用量
+   (PCM 缓存在 SpooledAudioBuffer 中，超过阈值转存临时文件；转码与上传均按流进行)
+
+取消 (用户打断 / 断开): 调用方取消运行 run_interview_turn 的 Task 即可。
+LLM 流与 TTS 会话随之关闭 (CancelSession 并释放 TTS 连接锁)，部分回复由
+process_user_input 记录，跳过音频转存。
+"""
+
+import json
+import time
+import base64
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+from .intv_service import process_user_input
+from .audio_service import SpooledAudioBuffer
+from .logging_service import bind_log_context, log_sampled
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量
+# ============================================================================
+
+SENTENCE_DELIMITERS = "。！？；\n"   # 遇到这些字符即送 TTS
+SENTENCE_MAX_CHARS = 60              # 无标点时的最大缓冲长度
+TTS_SAMPLE_RATE = 24000              # synthesize_stream_v3 输出 PCM 采样率
+
+SendJson = Callable[[Dict[str, Any]], Awaitable[None]]
+SendAudio = Callable[[bytes], Awaitable[None]]
+
+# 后台保存任务的引用，防止被 GC 回收
+_background_tasks: set = set()
+
+
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+class SentenceBuffer:
+    """按句缓冲 LLM 文本增量，避免 TTS 断续 (/ws/interview、/ws/voice 与旧版 /ws/chat 共用)"""
+
+    def __init__(self):
+        self._text = ""
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """追加增量；出现分隔符或超过 SENTENCE_MAX_CHARS 时取出整段缓冲"""
+        self._text += chunk
+        if any(p in self._text for p in SENTENCE_DELIMITERS) or len(self._text) >= SENTENCE_MAX_CHARS:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        """取出剩余文本 (为空时返回 None)"""
+        text, self._text = self._text, ""
+        return text or None
+
+
+# ============================================================================
+# 单轮处理
+# ============================================================================
+
+async def run_interview_turn(
+    send_json: SendJson,
+    tts_client,
+    user_id: str,
+    user_text: str,
+    has_voice: bool,
+    send_audio: Optional[SendAudio] = None,
+    speculation=None,
+    result: Optional[Dict[str, Any]] = None,
+    audio_seconds: Optional[float] = None
+) -> Dict[str, Any]:
+    """
+    处理一轮用户输入
+
+    Args:
+        send_json: 发送 JSON 消息给客户端
+        tts_client: VolcTTSClient (全局连接)
+        send_audio: 发送 TTS PCM 分片；默认以 {"type": "audio", "data": base64} 发送
+        speculation: 命中的 Intv 推测执行，透传给 process_user_input
+        result: 可选，由调用方传入以便本轮被取消时仍能拿到已产生的 user_text_id
+        audio_seconds: 本轮语音的实际时长，透传给 process_user_input 用于 ASR 计费
+
+    发送给客户端的消息:
+        start / session_id / user_text_id / text / audio / error / text_finish
+
+    Returns:
+        {'user_text_id', 'ai_text_id', 'full_text', 'error'}
+    """
+    if send_audio is None:
+        async def send_audio(chunk: bytes):
+            await send_json({"type": "audio", "data": base64.b64encode(chunk).decode('utf-8')})
+
+    if result is None:
+        result = {}
+    result.update({'user_text_id': None, 'ai_text_id': None, 'full_text': "", 'error': None})
+
+    # 本轮 (含 TTS 子任务) 的日志带上用户与轮次 ID；调用方以独立任务运行本函数
+    bind_log_context(user_id=user_id, turn_id=uuid.uuid4().hex[:12])
+
+    # --- TTS 流 ---
+    text_queue: asyncio.Queue = asyncio.Queue()
+
+    async def text_iterator():
+        while True:
+            chunk = await text_queue.get()
+            if chunk is None:
+                break
+            yield chunk
+
+    full_audio_buffer = SpooledAudioBuffer()
+
+    async def tts_receiver_task():
+        tts_stream = tts_client.synthesize_stream_v3(text_iterator())
+        try:
+            async for audio_chunk in tts_stream:
+                if audio_chunk:
+                    full_audio_buffer.extend(audio_chunk)
+                    log_sampled('turn_audio_chunk', logging.DEBUG, lambda: f"[Turn] 发送音频分片: {len(audio_chunk)} bytes")
+                    await send_audio(audio_chunk)
+        except Exception as e:
+            logging.error(f"[Turn] TTS Receiver Error: {e}")
+        finally:
+            # 提前退出时发送 CancelSession 并释放 TTS 连接锁
+            await tts_stream.aclose()
+
+    tts_start_time = time.time()
+    tts_task = asyncio.create_task(tts_receiver_task())
+
+    # --- Intv 流 ---
+    intv_stream = process_user_input(
+        user_id, user_text, has_voice, speculation=speculation, audio_seconds=audio_seconds
+    )
+    sentences = SentenceBuffer()
+    completed = False
+    try:
+        async for event in intv_stream:
+            event_type = event.get("type")
+
+            if event_type == "start":
+                await send_json({"type": "start"})
+
+            elif event_type == "session_id":
+                await send_json({"type": "session_id", "session_id": event.get("session_id")})
+
+            elif event_type == "user_text_id":
+                result['user_text_id'] = event.get("text_id")
+                await send_json({"type": "user_text_id", "text_id": event.get("text_id")})
+
+            elif event_type == "text":
+                chunk = event.get("content", "")
+                result['full_text'] += chunk
+                await send_json({"type": "text", "content": chunk})
+
+                # 按句缓冲，避免 TTS 断续
+                sentence = sentences.feed(chunk) if chunk else None
+                if sentence:
+                    await text_queue.put(sentence)
+
+            elif event_type == "done":
+                result['ai_text_id'] = event.get("ai_text_id")
+                sentence = sentences.flush()
+                if sentence:
+                    await text_queue.put(sentence)
+
+            elif event_type == "error":
+                result['error'] = event.get("message")
+                await send_json({"type": "error", "message": event.get("message")})
+                return result
+        completed = True
+    finally:
+        # 被取消时 GeneratorExit 会让 process_user_input 记录部分回复
+        await intv_stream.aclose()
+        if completed:
+            await text_queue.put(None)
+        else:
+            # 出错或被取消：不再合成剩余音频
+            tts_task.cancel()
+            await asyncio.gather(tts_task, return_exceptions=True)
+            full_audio_buffer.close()
+
+    await tts_task
+    tts_duration_ms = int((time.time() - tts_start_time) * 1000)
+
+    await send_json({"type": "text_finish"})
+
+    # --- 后台保存 TTS 音频 ---
+    if full_audio_buffer and result['ai_text_id']:
+        spawn_background(asyncio.to_thread(
+            save_tts_audio, user_id, result['ai_text_id'], full_audio_buffer,
+            result['full_text'], tts_duration_ms
+        ))
+    else:
+        full_audio_buffer.close()
+
+    return result
+
+
+async def wait_for_interrupt(websocket) -> str:
+    """
+    一轮进行中监听客户端，收到 {"type": "interrupt"} 或连接断开时返回原因
+
+    供 /ws/interview 与 run_interview_turn 并发等待，先完成者决定是否取消本轮。
+    """
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return "disconnect"
+        text = message.get("text")
+        if not text:
+            continue
+        try:
+            data = json.loads(text)
+        except ValueError:
+            continue
+        if isinstance(data, dict) and data.get("type") == "interrupt":
+            return "interrupt"
+
+
+# ============================================================================
+# TTS 音频保存
+# ============================================================================
+
+def save_tts_audio(user_id: str, ai_text_id: int, pcm_buffer: SpooledAudioBuffer, text: str, duration_ms: int):
+    """
+    TTS PCM -> MP3 -> COS，写入 interview_original_voice 并记录 TTS 用量 (在线程中执行)
+
+    完成后关闭 pcm_buffer。
+    """
+    try:
+        from .audio_service import encode_pcm_to_mp3, file_size
+        from .cos_service import upload_audio_to_cos
+        from .interview_service import save_original_voice
+        from .db_logger import log_tts_call
+        from .usage_rollup_service import get_default_model_id, compute_tts_cost
+
+        logging.info(f"[Turn] PCM 转换 MP3 中... 大小: {len(pcm_buffer)} bytes (磁盘: {pcm_buffer.on_disk})")
+
+        # 采样率需与 TTS 配置一致 (24000), 16bit, 单声道
+        with encode_pcm_to_mp3(pcm_buffer.reader(), TTS_SAMPLE_RATE, bitrate="128k") as mp3_file:
+            mp3_size = file_size(mp3_file)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            audio_url = upload_audio_to_cos(mp3_file, f"tts/{user_id}/{timestamp}.mp3")
+        if not audio_url:
+            return
+
+        voice_id = save_original_voice(user_id, speaker_type=1, audio_url=audio_url, link_original_text_id=ai_text_id)
+        logging.info(f"[Turn] PCM 转档成功并保存: {audio_url} (MP3 大小: {mp3_size})")
+
+        # 记录 TTS 用量 (按合成字符数计费)
+        tts_model_id = get_default_model_id('TTS')
+        log_tts_call(
+            user_id, ai_text_id, voice_id, tts_model_id, duration_ms,
+            compute_tts_cost(tts_model_id, len(text)),
+            char_count=len(text)
+        )
+    except Exception as e:
+        logging.error(f"[Turn] Audio Save/Convert Error: {e}")
+    finally:
+        pcm_buffer.close()
+
+
+def save_user_voice(user_id: str, pcm_buffer: SpooledAudioBuffer, text_id: Optional[int]) -> Optional[int]:
+    """
+    用户录音 PCM (16kHz) -> MP3 -> COS，写入 interview_original_voice (在线程中执行)
+
+    完成后关闭 pcm_buffer。
+    """
+    try:
+        from .audio_service import encode_pcm_to_mp3
+        from .cos_service import upload_audio_to_cos
+        from .interview_service import save_original_voice
+
+        filename = f"voice_{user_id}_{int(time.time())}_{str(uuid.uuid4())[:8]}.mp3"
+        with encode_pcm_to_mp3(pcm_buffer.reader()) as mp3_file:
+            voice_url = upload_audio_to_cos(mp3_file, filename)
+        if not voice_url:
+            logging.error("❌ [Voice] COS 上传失败")
+            return None
+        return save_original_voice(user_id, 0, voice_url, link_original_text_id=text_id)
+    except Exception as e:
+        logging.error(f"❌ [Voice] 用户录音保存失败: {e}")
+        return None
+    finally:
+        pcm_buffer.close()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Intv Prewarm Service (采访页打开时预热 Intv Session)
+============================================================================
+
+空闲一段时间后的第一轮访谈要承担：Session 失效重建、前情提要查询、
+system prompt 读取，以及没有前缀缓存的冷 Ark 请求。采访页加载时会调用
+/api/get_latest_ai_message，这里借此在后台提前完成这些工作：
+
+1. 启动用户 actor：narration_status 常驻内存，最新 Hint 载入 hint 缓存
+2. 在 actor 轮次锁内读取本轮上下文 (load_intv_context)，system prompt 与
+   前情提要随之进入缓存；Session 仍有效时到此为止
+3. Session 无效时立即轮换 (reset)，并在开启 intv_prewarm_prime_ark 与
+   enable_llm_caching 时，用 system prompt + 前情提要创建 Ark 前缀缓存
+   (不生成回复)。创建期间不占用轮次锁；完成后若用户尚未开始说话，
+   把缓存的 response_id 记为本 Session 的 previous_response_id，
+   首轮直接续接热 Session
+
+同一用户同时只有一个预热在进行，重复调用直接返回。
+"""
+
+import time
+import uuid
+import asyncio
+import logging
+from datetime import timezone
+from typing import Dict, Any
+
+from .config_manager import get_config
+from .narration_service import get_or_create_narration_status, update_intv_session
+from .user_actor_service import get_actor
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量与统计
+# ============================================================================
+
+_stats = {
+    'requested': 0,
+    'skipped_inflight': 0,
+    'already_hot': 0,
+    'rotated': 0,
+    'primed': 0,
+    'prime_failed': 0,
+    'prime_discarded': 0,    # 前缀缓存完成前用户已开始说话
+    'errors': 0,
+    'duration_ms_total': 0,
+}
+
+_inflight: set = set()
+_tasks: set = set()
+
+
+def _prime_enabled() -> bool:
+    return str(get_config('intv_prewarm_prime_ark', default='false')).lower() == 'true'
+
+
+# ============================================================================
+# 预热
+# ============================================================================
+
+def schedule_intv_prewarm(user_id: str):
+    """在后台预热 (不阻塞调用方的请求)"""
+    if not user_id:
+        return
+    task = asyncio.ensure_future(prewarm_intv_session(user_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def prewarm_intv_session(user_id: str) -> Dict[str, Any]:
+    """
+    预热用户的 Intv Session
+
+    Returns:
+        {'status': 'hot' / 'rotated' / 'primed' / 'inflight' / 'error', ...}
+    """
+    from .intv_service import load_intv_context, build_intv_input_for_context  # 动态导入避免循环依赖
+
+    _stats['requested'] += 1
+    if user_id in _inflight:
+        _stats['skipped_inflight'] += 1
+        return {'status': 'inflight'}
+
+    _inflight.add(user_id)
+    start_time = time.time()
+    try:
+        actor = await get_actor(user_id)
+
+        async with actor.turn():
+            context = await asyncio.to_thread(load_intv_context, user_id)
+            if context['session_valid']:
+                _stats['already_hot'] += 1
+                return {'status': 'hot'}
+
+            update_intv_session(user_id, reset=True)
+            _stats['rotated'] += 1
+            logging.info(f"🔥 Intv Session 预热: 已轮换 ({context['reason']})")
+
+            if not _prime_enabled():
+                return {'status': 'rotated'}
+
+            # system prompt + 前情提要 (去掉末尾的当前用户消息)
+            prefix = build_intv_input_for_context(context, '')[:-1]
+            status = get_or_create_narration_status(user_id)
+            expire_at = status['intv_llm_session_expire_at']
+
+        from .llm_api_service import prime_intv_session
+        response_id = await prime_intv_session(
+            user_id=user_id,
+            input_messages=prefix,
+            expire_at=int(expire_at.replace(tzinfo=expire_at.tzinfo or timezone.utc).timestamp())
+        )
+        if not response_id:
+            _stats['prime_failed'] += 1
+            return {'status': 'rotated'}
+
+        async with actor.turn():
+            status = get_or_create_narration_status(user_id)
+            if status['intv_llm_session_id'] or status['intv_llm_session_previous_response_id']:
+                # 预热期间已经完成了一轮访谈，Session 已由该轮建立
+                _stats['prime_discarded'] += 1
+                return {'status': 'rotated'}
+            update_intv_session(
+                user_id=user_id,
+                session_id=str(uuid.uuid4()),
+                previous_response_id=response_id,
+                # 与正常轮次一致只计对话字数；前缀 (system prompt + 前情提要) 不计入
+                word_count_delta=0
+            )
+
+        _stats['primed'] += 1
+        return {'status': 'primed'}
+
+    except Exception as e:
+        _stats['errors'] += 1
+        logging.error(f"❌ Intv Session 预热失败: {e}")
+        return {'status': 'error', 'message': str(e)}
+
+    finally:
+        _inflight.discard(user_id)
+        _stats['duration_ms_total'] += int((time.time() - start_time) * 1000)
+
+
+def get_prewarm_stats() -> Dict[str, Any]:
+    stats = dict(_stats)
+    stats['inflight'] = len(_inflight)
+    finished = stats['requested'] - stats['skipped_inflight']
+    stats['avg_duration_ms'] = int(stats['duration_ms_total'] / finished) if finished else None
+    return stats
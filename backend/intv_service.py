@@ -35,8 +35,11 @@ from .narration_service import (
     get_intv_previous_content,
     check_hint_updated,
 )
-from .llm_api_service import call_intv_llm_stream
+from .dialogue_history_service import append_dialogue_turn, render_dialogue_history
+from .llm_api_service import call_intv_llm_stream, is_llm_caching_enabled
 from .config_manager import get_config, get_active_prompt
+from .user_actor_service import get_actor, post_agent_run
+from .stn_batching_service import decide_cachepool_threshold, note_stn_trigger
 
 logging.basicConfig(level=logging.INFO)
 
@@ -81,15 +84,8 @@ def save_interview_text(
 def _get_current_session_id(user_id: str) -> str:
     """获取当前 Intv 的 Session ID"""
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT intv_llm_session_id
-                    FROM narration_status
-                    WHERE user_id = %s
-                """, (user_id,))
-                result = cursor.fetchone()
-                return result[0] if result and result[0] else str(uuid.uuid4())
+        session_id = get_or_create_narration_status(user_id).get('intv_llm_session_id')
+        return session_id or str(uuid.uuid4())
     except Exception as e:
         logging.error(f"❌ 获取 Session ID 失败: {e}")
         return str(uuid.uuid4())
@@ -102,11 +98,19 @@ def _get_current_session_id(user_id: str) -> str:
 async def process_user_input(
     user_id: str,
     user_text: str,
-    has_voice: bool = False
+    has_voice: bool = False,
+    speculation=None,
+    audio_seconds: Optional[float] = None
 ) -> AsyncGenerator[Dict[str, Any], None]:
     """
     处理用户输入并流式返回 AI 响应
     
+    Args:
+        speculation: 已命中的 IntvSpeculation (intv_speculation_service)，
+            上下文未变化时直接复用其缓冲输出，不再重新调用 LLM
+        audio_seconds: 本轮语音的实际时长 (服务端收到音频时)，用于 ASR 计费；
+            为空时按文字数估算
+    
     Yields:
         dict:
             - {"type": "start"}
@@ -114,6 +118,25 @@ async def process_user_input(
             - {"type": "done", "full_text": "xxx"}
             - {"type": "error", "message": "xxx"}
     """
+    # 同一用户的轮次由其 actor 串行执行，轮次内的状态读写走内存
+    actor = await get_actor(user_id)
+    async with actor.turn():
+        turn = _process_turn(user_id, user_text, has_voice, speculation, audio_seconds)
+        try:
+            async for event in turn:
+                yield event
+        finally:
+            # 显式关闭，被打断时由 _process_turn 记录部分回复
+            await turn.aclose()
+
+
+async def _process_turn(
+    user_id: str,
+    user_text: str,
+    has_voice: bool,
+    speculation,
+    audio_seconds: Optional[float]
+) -> AsyncGenerator[Dict[str, Any], None]:
     logging.info(f"🎤 Intv 处理输入: user={user_id[:8]}..., text={user_text[:50]}...")
     
     try:
@@ -128,97 +151,108 @@ async def process_user_input(
         # Step 1.5: 如果是语音输入,记录 ASR 调用
         if has_voice and user_text_id:
             try:
-                from db_logger import log_asr_call
+                from .db_logger import log_asr_call
+                from .usage_rollup_service import get_default_model_id, compute_asr_cost
                 
-                # 获取 ASR 模型ID (火山 ASR, ID=2)
-                model_id = 2  # 根据之前查询的结果,火山 ASR 的 ID 是 2
+                model_id = get_default_model_id('ASR')
                 
-                # 估算耗时和成本 (这里使用估算值,实际应该在 ASR 调用时记录)
-                # 假设平均每秒音频需要 100ms 处理时间,按字数估算音频时长
-                estimated_audio_seconds = len(user_text) / 3  # 假设每秒说 3 个字
-                duration_ms = int(estimated_audio_seconds * 100)  # 估算处理耗时
-                cost = estimated_audio_seconds * 0.001  # 示例:每秒 0.001 元
+                # 双工会话传入实际音频时长；前端直连 /ws/asr 识别时拿不到，按语速估算 (每秒约 3 个字)
+                if not audio_seconds:
+                    audio_seconds = len(user_text) / 3
+                duration_ms = int(audio_seconds * 100)  # 估算处理耗时
+                cost = compute_asr_cost(model_id, audio_seconds)
                 
-                log_asr_call(user_id, user_text_id, model_id, duration_ms, cost)
+                log_asr_call(user_id, user_text_id, model_id, duration_ms, cost,
+                             audio_seconds=audio_seconds)
             except Exception as e:
                 logging.error(f"记录 ASR 调用失败: {e}")
         
         # Step 2: 更新缓存池
         append_cachepool(user_id, "U", user_text)
         
-        # Step 3: 检查是否触发 Stn
-        should_trigger, current_len = check_cachepool_threshold(user_id)
-        if should_trigger:
-            asyncio.create_task(_trigger_stn_agent(user_id))
+        # Step 3: 检查是否触发 Stn (已有待执行的 Stn 时由 actor 合并)
+        await _maybe_trigger_stn(user_id)
         
-        # Step 4: Session 处理
-        session_valid, reason = check_intv_session_valid(user_id)
-        status = get_or_create_narration_status(user_id)
+        # Step 4: Session 处理 + Step 5: 检查 Hintboard 更新
+        context = load_intv_context(user_id)
+        if speculation is not None:
+            await speculation.ready()
+        if speculation is not None and not speculation.context_matches(context):
+            speculation.discard("context_changed")
+            speculation = None
         
-        if session_valid:
-            # Session 有效：复用
-            prev_resp_id = status.get('intv_llm_session_previous_response_id')
-            prev_content = status.get('intv_llm_previous_content') or ''
+        if context['session_valid']:
             logging.info(f"🎤 Intv Session 有效，复用 prev_resp_id")
         else:
-            # Session 无效：新建
-            prev_resp_id = None
-            prev_content = get_intv_previous_content(user_id)
-            
-            # 重置 Session
+            # Session 无效：重置
             update_intv_session(user_id, reset=True)
-            logging.info(f"🎤 Intv Session 无效 ({reason})，新建 Session")
+            logging.info(f"🎤 Intv Session 无效 ({context['reason']})，新建 Session")
         
-        # Step 5: 检查 Hintboard 更新
-        hint_updated, new_hint_id, new_hint_content = check_hint_updated(user_id)
-        hint_content = new_hint_content if hint_updated else ''
+        if context['hint_updated']:
+            update_intv_session(user_id, hint_id=context['new_hint_id'])
+            logging.info(f"🎤 检测到 Hint 更新: {context['new_hint_id']}")
         
-        if hint_updated:
-            update_intv_session(user_id, hint_id=new_hint_id)
-            logging.info(f"🎤 检测到 Hint 更新: {new_hint_id}")
+        history = context['history']
         
         # Step 6: 构建 LLM 输入
-        is_new_session = not session_valid
-        llm_input = _build_intv_input(
-            is_new_session=is_new_session,
-            previous_content=prev_content,
-            current_input=user_text,
-            hint_content=hint_content
-        )
+        llm_input = build_intv_input_for_context(context, user_text)
         
         # Step 7: 调用 Intv LLM（流式）
         yield {"type": "start"}
         
         full_response = ""
         new_response_id = None
+        llm_error = None
         
-        # 序列化 llm_input 为字符串（用于记录）
-        import json
-        llm_input_str = json.dumps(llm_input, ensure_ascii=False)
-        
-        async for event in call_intv_llm_stream(
-            user_id=user_id,
-            input_messages=llm_input,
-            previous_response_id=prev_resp_id,
-            llm_input_str=llm_input_str,
-            related_original_text_id=user_text_id
-        ):
-            event_type = event.get("type")
-            
-            if event_type == "response_id":
-                new_response_id = event.get("response_id")
-            
-            elif event_type == "text":
-                content = event.get("content", "")
-                full_response += content
-                yield {"type": "text", "content": content}
-            
-            elif event_type == "error":
-                yield {"type": "error", "message": event.get("message")}
-                return
+        if speculation is not None:
+            # 推测执行命中：先回放已缓冲的输出，再接续仍在进行的流
+            speculation.adopt()
+            llm_stream = speculation.events()
+        else:
+            # 序列化 llm_input 为字符串（用于记录）
+            import json
+            llm_input_str = json.dumps(llm_input, ensure_ascii=False)
             
-            elif event_type == "done":
-                pass  # 继续处理
+            llm_stream = call_intv_llm_stream(
+                user_id=user_id,
+                input_messages=llm_input,
+                previous_response_id=context['prev_resp_id'],
+                llm_input_str=llm_input_str,
+                related_original_text_id=user_text_id
+            )
+        
+        try:
+            async for event in llm_stream:
+                event_type = event.get("type")
+                
+                if event_type == "response_id":
+                    new_response_id = event.get("response_id")
+                
+                elif event_type == "text":
+                    content = event.get("content", "")
+                    full_response += content
+                    yield {"type": "text", "content": content}
+                
+                elif event_type == "error":
+                    llm_error = event.get("message")
+                    break
+                
+                elif event_type == "done":
+                    pass  # 继续处理
+        except (GeneratorExit, asyncio.CancelledError):
+            # 用户打断 / 断开：停止 LLM 流，记录已输出的部分回复
+            await llm_stream.aclose()
+            if speculation is not None:
+                speculation.cancel()
+            _record_interrupted_turn(user_id, user_text, full_response, history)
+            raise
+        
+        if llm_error is not None:
+            yield {"type": "error", "message": llm_error}
+            return
+        
+        if speculation is not None:
+            speculation.record_usage(user_text_id)
         
         # Step 8: 存储 AI 回复
         ai_text_id = save_interview_text(user_id, speaker_type=1, text=full_response, has_voice=True)
@@ -226,18 +260,22 @@ async def process_user_input(
         # Step 9: 更新缓存池（AI 回复）
         append_cachepool(user_id, "I", full_response)
         
-        # 再次检查是否触发 Stn
-        should_trigger, current_len = check_cachepool_threshold(user_id)
-        if should_trigger:
-            asyncio.create_task(_trigger_stn_agent(user_id))
+        # 再次检查是否触发 Stn (防抖窗口内与上面的触发合并为一次)
+        await _maybe_trigger_stn(user_id)
         
         # Step 10: 更新 Intv Session 状态
+        # 本轮新建的 Session 在开启缓存时记下 session_id，后续轮次凭 previous_response_id 续接
+        new_session_id = None
+        if not context['session_valid'] and new_response_id and is_llm_caching_enabled():
+            new_session_id = str(uuid.uuid4())
+        
         word_count = len(user_text) + len(full_response)
         update_intv_session(
             user_id=user_id,
+            session_id=new_session_id,
             previous_response_id=new_response_id,
             word_count_delta=word_count,
-            previous_content=_format_dialogue_history(prev_content, user_text, full_response)
+            previous_content=append_dialogue_turn(history, user_text, full_response)
         )
         
         yield {"type": "done", "full_text": full_response, "ai_text_id": ai_text_id}
@@ -249,6 +287,82 @@ async def process_user_input(
         yield {"type": "error", "message": str(e)}
 
 
+INTERRUPTED_MARK = "[被打断]"
+
+
+def _record_interrupted_turn(user_id: str, user_text: str, partial_response: str, history: str):
+    """
+    记录被打断的一轮
+
+    - 已输出的部分回复照常存入原文表和缓存池
+    - 上游流已中止，Ark 侧的 response 不完整，不能作为 previous_response_id 续接：
+      重置 Intv Session，下一轮以 intv_llm_previous_content (含打断标记) 重建上下文
+    """
+    try:
+        if partial_response:
+            save_interview_text(user_id, speaker_type=1, text=partial_response, has_voice=True)
+            append_cachepool(user_id, "I", partial_response)
+        update_intv_session(
+            user_id=user_id,
+            reset=True,
+            previous_content=append_dialogue_turn(
+                history, user_text, f"{partial_response}{INTERRUPTED_MARK}"
+            )
+        )
+        logging.info(f"⏹️ Intv 本轮被打断，已记录部分回复: {len(partial_response)} 字符")
+    except Exception as e:
+        logging.error(f"❌ 记录被打断的回复失败: {e}")
+
+
+# ============================================================================
+# Intv 上下文 (只读)
+# ============================================================================
+
+def load_intv_context(user_id: str) -> Dict[str, Any]:
+    """
+    读取本轮 Intv 调用所需的 Session / Hint 状态，不做任何更新
+
+    推测执行在用户说完前调用它，真正提交时再由 process_user_input 落库。
+    
+    - history: intv_llm_previous_content 中存储的滚动历史 (本轮结束后在其上追加)
+    - prev_content: Session 重建时发送的 pc 文本，由滚动历史渲染；
+      历史为空 (旧数据) 时才回退到查询原文表
+    """
+    session_valid, reason = check_intv_session_valid(user_id)
+    status = get_or_create_narration_status(user_id)
+    history = status.get('intv_llm_previous_content') or ''
+    
+    if session_valid:
+        prev_resp_id = status.get('intv_llm_session_previous_response_id')
+        prev_content = ''
+    else:
+        prev_resp_id = None
+        prev_content = render_dialogue_history(history) or get_intv_previous_content(user_id)
+    
+    hint_updated, new_hint_id, new_hint_content = check_hint_updated(user_id)
+    
+    return {
+        'session_valid': session_valid,
+        'reason': reason,
+        'prev_resp_id': prev_resp_id,
+        'history': history,
+        'prev_content': prev_content,
+        'hint_updated': hint_updated,
+        'new_hint_id': new_hint_id,
+        'hint_content': new_hint_content if hint_updated else '',
+    }
+
+
+def build_intv_input_for_context(context: Dict[str, Any], user_text: str) -> list:
+    """根据 load_intv_context 的结果构建 LLM 输入"""
+    return _build_intv_input(
+        is_new_session=not context['session_valid'],
+        previous_content=context['prev_content'],
+        current_input=user_text,
+        hint_content=context['hint_content']
+    )
+
+
 # ============================================================================
 # 构建 LLM 输入
 # ============================================================================
@@ -292,36 +406,17 @@ def _build_intv_input(
         return [{"role": "user", "content": user_message}]
 
 
-def _format_dialogue_history(prev_content: str, user_text: str, ai_response: str) -> str:
-    """
-    格式化对话历史，用于存储到 intv_llm_previous_content
-    
-    保留最近几轮对话
-    """
-    new_round = f"U:{user_text} I:{ai_response}"
-    
-    if prev_content:
-        # 限制长度，保留最近 5000 字符
-        combined = f"{prev_content} {new_round}"
-        if len(combined) > 5000:
-            combined = combined[-5000:]
-        return combined
-    
-    return new_round
-
-
 # ============================================================================
 # 触发 Stn Agent
 # ============================================================================
 
-async def _trigger_stn_agent(user_id: str):
-    """异步触发 Stn Agent"""
-    try:
-        # 动态导入避免循环依赖
-        from .stn_service import run_stn_agent
-        await run_stn_agent(user_id)
-    except Exception as e:
-        logging.error(f"❌ 触发 Stn Agent 失败: {e}")
+async def _maybe_trigger_stn(user_id: str):
+    """缓存池达到自适应阈值时投递 Stn"""
+    decision = decide_cachepool_threshold()
+    should_trigger, current_len = check_cachepool_threshold(user_id, decision['threshold'])
+    if should_trigger:
+        note_stn_trigger(user_id, decision)
+        await post_agent_run(user_id, 'stn')
 
 
 # ============================================================================
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Intv Speculation Service (Intv 推测执行)
+============================================================================
+
+用户还在说话时，ASR 中间结果往往已经不再变化。双工会话 (/ws/voice) 在
+中间结果稳定 intv_speculation_stable_ms 毫秒后，提前用该文本调用 Intv LLM：
+
+- 只读取 Session / Hint 状态 (intv_service.load_intv_context)，不写任何表
+- LLM 输出缓冲在内存中，用量暂不记录 (defer_record)
+- 最终识别结果与推测文本一致 (忽略标点和空白) 且上下文未变化时命中：
+  process_user_input 落库后立即回放缓冲输出，再接续仍在进行的流
+- 否则取消推测，已产生的 token 计入浪费统计
+
+统计: get_speculation_stats() — 命中率、浪费 token、平均提前量
+"""
+
+import re
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, Any, Optional, List, AsyncGenerator
+
+from .config_manager import get_config
+from .intv_service import load_intv_context, build_intv_input_for_context
+from .llm_api_service import call_intv_llm_stream, record_intv_usage
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量与统计
+# ============================================================================
+
+DEFAULT_STABLE_MS = 600      # sys_config 未配置时的稳定窗口；配置为 0 关闭推测执行
+
+_CONTEXT_KEYS = ('session_valid', 'prev_resp_id', 'prev_content', 'hint_updated', 'new_hint_id')
+_NON_WORD = re.compile(r'[\W_]+')
+
+_stats = {
+    'started': 0,
+    'hits': 0,
+    'misses': 0,
+    'miss_reasons': {},
+    'wasted_tokens': 0,          # 已完成但被丢弃的调用 (usage 上报的 total_tokens)
+    'wasted_output_chars': 0,    # 中途取消的调用 (无 usage，按已输出字符数统计)
+    'lead_ms_total': 0,          # 命中时 LLM 提前启动的总时长
+}
+
+
+def get_speculation_stable_sec() -> float:
+    """推测执行的稳定窗口 (秒)，0 表示关闭"""
+    try:
+        return max(0.0, float(get_config('intv_speculation_stable_ms', default=DEFAULT_STABLE_MS)) / 1000)
+    except (TypeError, ValueError):
+        return DEFAULT_STABLE_MS / 1000
+
+
+def normalize_transcript(text: str) -> str:
+    """比较识别文本时忽略标点与空白 (ASR 最终结果常补全标点)"""
+    return _NON_WORD.sub('', text or '')
+
+
+def get_speculation_stats() -> Dict[str, Any]:
+    stats = dict(_stats)
+    stats['miss_reasons'] = dict(_stats['miss_reasons'])
+    settled = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / settled, 4) if settled else None
+    stats['avg_lead_ms'] = int(stats['lead_ms_total'] / stats['hits']) if stats['hits'] else None
+    return stats
+
+
+# ============================================================================
+# 推测执行
+# ============================================================================
+
+class IntvSpeculation:
+    """
+    一次推测执行
+
+    用法:
+        spec = IntvSpeculation(user_id, partial_text).start()
+        if spec.matches(final_text):
+            process_user_input(..., speculation=spec)   # 命中
+        else:
+            spec.discard("final_mismatch")
+    """
+
+    def __init__(self, user_id: str, text: str):
+        self.user_id = user_id
+        self.text = text
+        self.key = normalize_transcript(text)
+        self.context: Optional[Dict[str, Any]] = None
+        self.llm_input_str: Optional[str] = None
+        self._events: List[Dict[str, Any]] = []
+        self._changed = asyncio.Event()
+        self._context_ready = asyncio.Event()
+        self._finished = False
+        self._output = ""
+        self._usage_event: Optional[Dict[str, Any]] = None
+        self._started_at = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._settled = False
+
+    def start(self) -> "IntvSpeculation":
+        _stats['started'] += 1
+        self._task = asyncio.create_task(self._run())
+        logging.info(f"🔮 Intv 推测执行: user={self.user_id[:8]}..., text={self.text[:30]}")
+        return self
+
+    async def _run(self):
+        try:
+            self.context = await asyncio.to_thread(load_intv_context, self.user_id)
+            llm_input = build_intv_input_for_context(self.context, self.text)
+            self.llm_input_str = json.dumps(llm_input, ensure_ascii=False)
+            self._context_ready.set()
+
+            async for event in call_intv_llm_stream(
+                user_id=self.user_id,
+                input_messages=llm_input,
+                previous_response_id=self.context['prev_resp_id'],
+                llm_input_str=self.llm_input_str,
+                defer_record=True
+            ):
+                if event.get("type") == "text":
+                    self._output += event.get("content", "")
+                elif event.get("type") == "usage":
+                    self._usage_event = event
+                self._push(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"❌ Intv 推测执行失败: {e}")
+            self._push({"type": "error", "message": str(e)})
+        finally:
+            self._finished = True
+            self._context_ready.set()
+            self._changed.set()
+
+    def _push(self, event: Dict[str, Any]):
+        self._events.append(event)
+        self._changed.set()
+
+    # ------------------------------------------------------------------
+    # 命中判断
+    # ------------------------------------------------------------------
+
+    def matches(self, text: str) -> bool:
+        return not self._settled and normalize_transcript(text) == self.key
+
+    async def ready(self):
+        """等待推测读取完上下文"""
+        await self._context_ready.wait()
+
+    def context_matches(self, context: Dict[str, Any]) -> bool:
+        """推测启动后 Session / Hint 未变化 (尚未读到上下文时视为不一致)"""
+        if self.context is None:
+            return False
+        return all(self.context.get(k) == context.get(k) for k in _CONTEXT_KEYS)
+
+    # ------------------------------------------------------------------
+    # 命中 / 丢弃
+    # ------------------------------------------------------------------
+
+    def adopt(self):
+        """命中：由 process_user_input 接管输出"""
+        if self._settled:
+            return
+        self._settled = True
+        _stats['hits'] += 1
+        _stats['lead_ms_total'] += int((time.monotonic() - self._started_at) * 1000)
+
+    async def events(self) -> AsyncGenerator[Dict[str, Any], None]:
+        """回放已缓冲的事件，并继续产出后续事件直到 LLM 流结束"""
+        index = 0
+        while True:
+            while index < len(self._events):
+                yield self._events[index]
+                index += 1
+            if self._finished:
+                return
+            self._changed.clear()
+            await self._changed.wait()
+
+    def record_usage(self, related_original_text_id: Optional[int]):
+        """命中后补记 LLM 用量 (关联正式的 user_text_id)"""
+        if self._usage_event:
+            record_intv_usage(
+                self.user_id, self._usage_event, self.llm_input_str, self._output,
+                related_original_text_id=related_original_text_id
+            )
+
+    def discard(self, reason: str):
+        """未命中：取消 LLM 流并计入浪费统计"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+        if self._settled:
+            return
+        self._settled = True
+        _stats['misses'] += 1
+        _stats['miss_reasons'][reason] = _stats['miss_reasons'].get(reason, 0) + 1
+
+        if self._usage_event:
+            # 调用已完成并计费，照常记录 (不关联原文)
+            _stats['wasted_tokens'] += self._usage_event['usage'].get('total_tokens', 0) or 0
+            record_intv_usage(self.user_id, self._usage_event, self.llm_input_str, self._output)
+        else:
+            _stats['wasted_output_chars'] += len(self._output)
+        logging.info(f"🔮 Intv 推测未命中 ({reason}): {self.text[:30]}")
+
+    def cancel(self):
+        """连接断开等情况：无论是否命中都停止 LLM 流"""
+        self.discard("cancelled")
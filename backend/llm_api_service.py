@@ -10,18 +10,23 @@ LLM API Service (Responses API 统一封装)
 - Stream / Non-stream
 - JSON Output Mode
 - Token 消耗记录
+- 准入控制：全局并发上限 + 每模型令牌桶，Intv 严格优先于 Stn/Dir
 
 根据《服务端流程文档与数据库结构设计 v3.3》中的 LLM API 调用参数规范。
 """
 
 import os
 import time
+import asyncio
 import logging
+from collections import deque
+from contextlib import asynccontextmanager
 from typing import Optional, Dict, Any, Generator, List, AsyncGenerator
 from datetime import datetime, timezone
 from volcenginesdkarkruntime import AsyncArk
-from .database import get_db_connection
-from .config_manager import get_config
+from .database import get_pool_budget
+from .config_manager import get_config, get_model_config
+from .telemetry_service import record_usage
 
 logging.basicConfig(level=logging.INFO)
 
@@ -30,40 +35,240 @@ logging.basicConfig(level=logging.INFO)
 # 客户端初始化
 # ============================================================================
 
+_ark_client: Optional[AsyncArk] = None
+
+
 def _get_ark_client() -> AsyncArk:
-    """获取 Ark 异步客户端"""
-    api_key = os.getenv("ARK_API_KEY")
-    if not api_key:
-        raise ValueError("ARK_API_KEY 环境变量未配置")
-    
-    return AsyncArk(
-        base_url="https://ark.cn-beijing.volces.com/api/v3",
-        api_key=api_key
-    )
+    """获取 Ark 异步客户端 (进程内共享，复用底层 HTTP 连接)"""
+    global _ark_client
+    if _ark_client is None:
+        api_key = os.getenv("ARK_API_KEY")
+        if not api_key:
+            raise ValueError("ARK_API_KEY 环境变量未配置")
+        
+        _ark_client = AsyncArk(
+            base_url="https://ark.cn-beijing.volces.com/api/v3",
+            api_key=api_key
+        )
+    return _ark_client
 
 
 def _get_model_info(model_id: int) -> Dict[str, Any]:
-    """从 base_models 表获取模型信息"""
-    with get_db_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT model_id, model_name_cn, api_model_id, input_price, output_price, cache_discount
-                FROM base_models
-                WHERE model_id = %s
-            """, (model_id,))
-            row = cursor.fetchone()
-            
-            if not row:
-                raise ValueError(f"Model ID {model_id} 不存在")
-            
-            return {
-                'model_id': row[0],
-                'model_name_cn': row[1],
-                'api_model_id': row[2],
-                'input_price': float(row[3]) if row[3] else 0,
-                'output_price': float(row[4]) if row[4] else 0,
-                'cache_discount': float(row[5]) if row[5] else 0.5,
-            }
+    """获取模型信息 (base_models，经 config_manager 缓存)"""
+    model = get_model_config(model_id)
+    if not model:
+        raise ValueError(f"Model ID {model_id} 不存在")
+    return model
+
+
+def warm_llm_clients():
+    """启动预热：创建 Ark 客户端并载入三个 agent 的模型信息"""
+    _get_ark_client()
+    for key, default in (('intv_llm_model', 1), ('stn_llm_model', 2), ('dir_llm_model', 2)):
+        _get_model_info(int(get_config(key, default=default)))
+
+
+def is_llm_caching_enabled() -> bool:
+    """是否开启 Session Caching (enable_llm_caching)"""
+    return str(get_config('enable_llm_caching', default='false')).lower() == 'true'
+
+
+# ============================================================================
+# 准入控制 (优先级调度)
+# ============================================================================
+#
+# 所有 Ark 调用先取得名额再发请求：
+# - 全局并发上限 llm_max_inflight (每 worker)；Intv 流式调用占用名额直到输出结束
+# - 每个模型一个令牌桶，速率 llm_model_rpm (全部 worker 合计，按 worker 数均分)
+# - Intv 严格优先：有 Intv 排队时 Stn/Dir 不放行；Stn/Dir 最多使用
+#   (上限 - llm_intv_reserved_slots) 个名额，负载高时自动延后
+# 同一用户的 Stn/Dir 已由其 actor 串行调度，这里不再做合并。
+
+PRIORITY_INTERACTIVE = 0     # Intv
+PRIORITY_BACKGROUND = 1      # Stn / Dir
+
+_PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BACKGROUND: 'background'}
+
+
+class _TokenBucket:
+    """请求令牌桶；rate <= 0 表示不限速"""
+
+    def __init__(self):
+        self.rate = 0.0
+        self.capacity = 1.0
+        self.tokens: Optional[float] = None   # 首次配置时装满
+        self.updated = time.monotonic()
+
+    def configure(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity if self.tokens is None else min(self.tokens, capacity)
+
+    def take(self) -> float:
+        """取一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _LLMAdmission:
+    """进程内 LLM 准入调度器 (仅在事件循环线程中使用)"""
+
+    def __init__(self):
+        self._inflight = 0
+        self._waiters = {PRIORITY_INTERACTIVE: deque(), PRIORITY_BACKGROUND: deque()}
+        self._buckets: Dict[int, _TokenBucket] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._stats = {
+            name: {'admitted': 0, 'deferred': 0, 'wait_ms_total': 0, 'wait_ms_max': 0}
+            for name in _PRIORITY_NAMES.values()
+        }
+        self._rate_limited = 0
+
+    # ------------------------------------------------------------------
+    # 配置
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _limits() -> Dict[str, int]:
+        max_inflight = max(1, int(get_config('llm_max_inflight', default=16)))
+        reserved = min(max_inflight - 1, max(0, int(get_config('llm_intv_reserved_slots', default=4))))
+        return {'max_inflight': max_inflight, 'background_max': max_inflight - reserved}
+
+    def _bucket(self, model_id: int) -> _TokenBucket:
+        bucket = self._buckets.get(model_id)
+        if bucket is None:
+            bucket = self._buckets[model_id] = _TokenBucket()
+        rpm = float(get_config('llm_model_rpm', default=600)) / get_pool_budget()['workers']
+        rate = rpm / 60
+        # 允许约 5 秒的突发
+        bucket.configure(rate, max(1.0, rate * 5))
+        return bucket
+
+    # ------------------------------------------------------------------
+    # 调度
+    # ------------------------------------------------------------------
+
+    def _has_capacity(self, priority: int, limits: Dict[str, int]) -> bool:
+        if priority == PRIORITY_INTERACTIVE:
+            return self._inflight < limits['max_inflight']
+        return (
+            not self._waiters[PRIORITY_INTERACTIVE]
+            and self._inflight < limits['background_max']
+        )
+
+    def _try_admit(self, priority: int, model_id: int, limits: Dict[str, int]) -> Optional[float]:
+        """放行返回 None；受令牌桶限制返回需等待的秒数；无名额返回 -1"""
+        if not self._has_capacity(priority, limits):
+            return -1
+        delay = self._bucket(model_id).take()
+        if delay > 0:
+            return delay
+        self._inflight += 1
+        return None
+
+    def _dispatch(self):
+        """按优先级依次放行排队的请求 (同一优先级内 FIFO)"""
+        self._timer = None
+        limits = self._limits()
+        for priority in (PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND):
+            waiters = self._waiters[priority]
+            while waiters:
+                future, model_id = waiters[0]
+                if future.done():
+                    waiters.popleft()
+                    continue
+                result = self._try_admit(priority, model_id, limits)
+                if result is None:
+                    waiters.popleft()
+                    future.set_result(None)
+                    continue
+                if result > 0:
+                    self._schedule(result)
+                return  # 严格优先：高优先级队首未放行时低优先级也不放行
+
+    def _schedule(self, delay: float):
+        if self._timer is None:
+            self._rate_limited += 1
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _release(self):
+        self._inflight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int, model_id: int):
+        """
+        取得一次 LLM 调用名额
+
+        用法:
+            async with _admission.slot(PRIORITY_INTERACTIVE, model_id):
+                ...
+        """
+        name = _PRIORITY_NAMES[priority]
+        start = time.monotonic()
+        queued = (
+            self._waiters[PRIORITY_INTERACTIVE]
+            or (priority == PRIORITY_BACKGROUND and self._waiters[PRIORITY_BACKGROUND])
+            or self._try_admit(priority, model_id, self._limits()) is not None
+        )
+        if queued:
+            self._stats[name]['deferred'] += 1
+            future = asyncio.get_running_loop().create_future()
+            entry = (future, model_id)
+            self._waiters[priority].append(entry)
+            self._dispatch()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release()   # 已放行但调用方同时被取消
+                else:
+                    try:
+                        self._waiters[priority].remove(entry)
+                    except ValueError:
+                        pass
+                    self._dispatch()
+                raise
+
+        wait_ms = int((time.monotonic() - start) * 1000)
+        stats = self._stats[name]
+        stats['admitted'] += 1
+        stats['wait_ms_total'] += wait_ms
+        stats['wait_ms_max'] = max(stats['wait_ms_max'], wait_ms)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {name: dict(values) for name, values in self._stats.items()}
+        for priority, name in _PRIORITY_NAMES.items():
+            admitted = stats[name]['admitted']
+            stats[name]['queue_depth'] = len(self._waiters[priority])
+            stats[name]['avg_wait_ms'] = int(stats[name]['wait_ms_total'] / admitted) if admitted else None
+        stats['inflight'] = self._inflight
+        stats['limits'] = self._limits()
+        stats['rate_limited'] = self._rate_limited
+        stats['buckets'] = {
+            model_id: {'rate_per_sec': round(bucket.rate, 3), 'tokens': round(bucket.tokens or 0, 2)}
+            for model_id, bucket in self._buckets.items()
+        }
+        return stats
+
+
+_admission = _LLMAdmission()
+
+
+def get_llm_admission_stats() -> Dict[str, Any]:
+    """LLM 准入控制统计：各优先级排队深度、等待时间、在途数、令牌桶"""
+    return _admission.get_stats()
 
 
 # ============================================================================
@@ -77,7 +282,8 @@ async def call_intv_llm_stream(
     expire_at: Optional[int] = None,
     temperature: float = None,
     llm_input_str: Optional[str] = None,
-    related_original_text_id: Optional[int] = None
+    related_original_text_id: Optional[int] = None,
+    defer_record: bool = False
 ) -> AsyncGenerator[Dict[str, Any], None]:
     """
     Intv Agent LLM 调用（流式输出）- 异步版本
@@ -93,16 +299,19 @@ async def call_intv_llm_stream(
         previous_response_id: 上一轮的 response_id（延续 Session 时传入）
         expire_at: 缓存过期时间（Unix 时间戳）
         temperature: 温度参数，默认从配置获取
+        defer_record: 不在结束时记录用量，由调用方通过 record_intv_usage 补记
+            (推测执行时 related_original_text_id 尚未产生)
     
     Yields:
         dict:
             - {"type": "response_id", "response_id": "xxx"}
             - {"type": "text", "content": "xxx"}
-            - {"type": "usage", "usage": {...}}
+            - {"type": "usage", "usage": {...}, "model_id", "model_name_cn", "duration_ms"}
             - {"type": "done", "response_id": "xxx"}
             - {"type": "error", "message": "xxx"}
     """
     start_time = time.time()
+    stream = None
     
     try:
         # 获取模型信息
@@ -141,48 +350,56 @@ async def call_intv_llm_stream(
         
         logging.info(f"🎤 Intv LLM 调用: model={model_info['model_name_cn']}, caching={enable_caching}, prev_id={previous_response_id[:20] if previous_response_id else 'None'}...")
         
-        # 调用 API (Async)
-        stream = await client.responses.create(**params)
-        
         response_id = None
         usage_data = None
         full_output = ""  # 收集完整输出
         
-        async for event in stream:
-            # 1. 提取 Response 元数据 (ID / Usage)
-            resp_obj = getattr(event, 'response', None)
-            if resp_obj:
-                if hasattr(resp_obj, 'id') and not response_id:
-                    response_id = resp_obj.id
-                    yield {"type": "response_id", "response_id": response_id}
-                
-                # 提取 Usage
-                usage_obj = getattr(resp_obj, 'usage', None)
-                if usage_obj:
-                    cached_tokens = 0
-                    if hasattr(usage_obj, 'input_tokens_details'):
-                        details = usage_obj.input_tokens_details
-                        cached_tokens = getattr(details, 'cached_tokens', 0) or 0
-                    
-                    usage_data = {
-                        'total_tokens': getattr(usage_obj, 'total_tokens', 0),
-                        'prompt_tokens': getattr(usage_obj, 'input_tokens', 0),
-                        'completion_tokens': getattr(usage_obj, 'output_tokens', 0),
-                        'cached_tokens': cached_tokens,
-                    }
+        # 调用 API (Async)；名额占用到流结束
+        async with _admission.slot(PRIORITY_INTERACTIVE, model_id):
+            stream = await client.responses.create(**params)
             
-            # 2. 提取文本增量内容 (Delta)
-            delta = getattr(event, 'delta', None)
-            if delta:
-                full_output += delta  # 累积输出
-                yield {"type": "text", "content": delta}
+            async for event in stream:
+                # 1. 提取 Response 元数据 (ID / Usage)
+                resp_obj = getattr(event, 'response', None)
+                if resp_obj:
+                    if hasattr(resp_obj, 'id') and not response_id:
+                        response_id = resp_obj.id
+                        yield {"type": "response_id", "response_id": response_id}
+                    
+                    # 提取 Usage
+                    usage_obj = getattr(resp_obj, 'usage', None)
+                    if usage_obj:
+                        cached_tokens = 0
+                        if hasattr(usage_obj, 'input_tokens_details'):
+                            details = usage_obj.input_tokens_details
+                            cached_tokens = getattr(details, 'cached_tokens', 0) or 0
+                        
+                        usage_data = {
+                            'total_tokens': getattr(usage_obj, 'total_tokens', 0),
+                            'prompt_tokens': getattr(usage_obj, 'input_tokens', 0),
+                            'completion_tokens': getattr(usage_obj, 'output_tokens', 0),
+                            'cached_tokens': cached_tokens,
+                        }
+                
+                # 2. 提取文本增量内容 (Delta)
+                delta = getattr(event, 'delta', None)
+                if delta:
+                    full_output += delta  # 累积输出
+                    yield {"type": "text", "content": delta}
         
         # 计算耗时
         duration_ms = int((time.time() - start_time) * 1000)
         
         # 记录调用
         if usage_data:
-            yield {"type": "usage", "usage": usage_data}
+            yield {
+                "type": "usage",
+                "usage": usage_data,
+                "model_id": model_id,
+                "model_name_cn": model_info['model_name_cn'],
+                "duration_ms": duration_ms,
+            }
+        if usage_data and not defer_record:
             _record_llm_usage(
                 user_id=user_id,
                 agent="Intv",
@@ -197,11 +414,175 @@ async def call_intv_llm_stream(
         
         yield {"type": "done", "response_id": response_id}
         
+    except (GeneratorExit, asyncio.CancelledError):
+        # 调用方取消 (用户打断 / 断开)：关闭上游流，不再继续生成
+        if stream is not None:
+            try:
+                await stream.close()
+            except Exception as e:
+                logging.debug(f"关闭 Intv LLM 流失败: {e}")
+        logging.info(f"⏹️ Intv LLM 流已取消 ({int((time.time() - start_time) * 1000)}ms)")
+        raise
     except Exception as e:
         logging.error(f"❌ Intv LLM 调用失败: {e}")
         yield {"type": "error", "message": str(e)}
 
 
+# ============================================================================
+# Intv Session 预热 (前缀缓存)
+# ============================================================================
+
+async def prime_intv_session(
+    user_id: str,
+    input_messages: List[Dict[str, str]],
+    expire_at: int
+) -> Optional[str]:
+    """
+    用 system prompt + 前情提要创建 Intv 前缀缓存，不生成回复
+
+    返回的 response_id 作为下一轮的 previous_response_id，首轮即可续接缓存。
+    未开启 enable_llm_caching 或调用失败时返回 None。
+    """
+    if not is_llm_caching_enabled():
+        return None
+    
+    start_time = time.time()
+    
+    try:
+        model_id = int(get_config('intv_llm_model', default=1))
+        model_info = _get_model_info(model_id)
+        client = _get_ark_client()
+        
+        params = {
+            "model": model_info['api_model_id'],
+            "input": input_messages,
+            "store": True,
+            "expire_at": expire_at,
+            "thinking": {"type": "disabled"},
+            "extra_body": {"caching": {"type": "enabled", "prefix": True}},
+        }
+        
+        # 预热可被推迟：后台优先级，不与进行中的访谈争抢名额
+        async with _admission.slot(PRIORITY_BACKGROUND, model_id):
+            response = await client.responses.create(**params)
+        
+        response_id = getattr(response, 'id', None)
+        duration_ms = int((time.time() - start_time) * 1000)
+        
+        usage_obj = getattr(response, 'usage', None)
+        if usage_obj:
+            _record_llm_usage(
+                user_id=user_id,
+                agent="Intv",
+                model_id=model_id,
+                model_name_cn=model_info['model_name_cn'],
+                usage={
+                    'total_tokens': getattr(usage_obj, 'total_tokens', 0),
+                    'prompt_tokens': getattr(usage_obj, 'input_tokens', 0),
+                    'completion_tokens': getattr(usage_obj, 'output_tokens', 0),
+                    'cached_tokens': 0,
+                },
+                duration_ms=duration_ms
+            )
+        
+        logging.info(f"🔥 Intv 前缀缓存已创建: {duration_ms}ms")
+        return response_id
+        
+    except Exception as e:
+        logging.error(f"❌ Intv 前缀缓存创建失败: {e}")
+        return None
+
+
+# ============================================================================
+# 旧版接口 (/chat, /ws/chat)
+# ============================================================================
+#
+# 旧版小程序仍在使用，模型取环境变量 ARK_ENDPOINT_ID (不走 base_models)。
+# 与 Intv 共用 Ark 异步客户端与准入控制 (交互优先级)，不阻塞事件循环。
+
+def _legacy_endpoint() -> str:
+    endpoint_id = os.getenv("ARK_ENDPOINT_ID")
+    if not endpoint_id:
+        raise ValueError("ARK_ENDPOINT_ID 环境变量未配置")
+    return endpoint_id
+
+
+async def call_legacy_chat(messages: List[Dict[str, str]]) -> str:
+    """
+    Chat Completions 非流式调用 (/chat)
+
+    Returns:
+        回复文本；失败时返回 "AI Service Error: ..." (与 ai_service.get_doubao_chat_reply 一致)
+    """
+    try:
+        endpoint_id = _legacy_endpoint()
+        client = _get_ark_client()
+        async with _admission.slot(PRIORITY_INTERACTIVE, endpoint_id):
+            completion = await client.chat.completions.create(model=endpoint_id, messages=messages)
+        return completion.choices[0].message.content
+    except Exception as e:
+        logging.error(f"❌ 旧版 Chat 调用失败: {e}")
+        return f"AI Service Error: {str(e)}"
+
+
+async def call_legacy_response_stream(
+    input_text: str,
+    previous_response_id: Optional[str] = None,
+    temperature: float = 0.7,
+    enable_caching: bool = True
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Responses API 流式调用 (/ws/chat)，事件格式同 ai_service.get_doubao_response_stream
+
+    Yields:
+        {"type": "response_id" / "text" / "done" / "error", ...}
+    """
+    stream = None
+    try:
+        endpoint_id = _legacy_endpoint()
+        client = _get_ark_client()
+        
+        params = {
+            "model": endpoint_id,
+            "input": input_text,
+            "temperature": temperature,
+            "stream": True,
+            "store": True,
+            "expire_at": int(time.time()) + 3600,
+            "thinking": {"type": "disabled"},
+        }
+        if enable_caching:
+            params["extra_body"] = {"caching": {"type": "enabled"}}
+        if previous_response_id:
+            params["previous_response_id"] = previous_response_id
+        
+        response_id = None
+        async with _admission.slot(PRIORITY_INTERACTIVE, endpoint_id):
+            stream = await client.responses.create(**params)
+            async for event in stream:
+                resp_obj = getattr(event, 'response', None)
+                if resp_obj is not None and not response_id and getattr(resp_obj, 'id', None):
+                    response_id = resp_obj.id
+                    yield {"type": "response_id", "response_id": response_id}
+                
+                delta = getattr(event, 'delta', None)
+                if delta:
+                    yield {"type": "text", "content": delta}
+        
+        yield {"type": "done"}
+        
+    except (GeneratorExit, asyncio.CancelledError):
+        if stream is not None:
+            try:
+                await stream.close()
+            except Exception as e:
+                logging.debug(f"关闭旧版 Response 流失败: {e}")
+        raise
+    except Exception as e:
+        logging.error(f"❌ 旧版 Response API 调用失败: {e}")
+        yield {"type": "error", "message": f"Response API Error: {str(e)}"}
+
+
 # ============================================================================
 # Stn Agent LLM 调用 (非流式, JSON 模式, 无 Session)
 # ============================================================================
@@ -254,8 +635,9 @@ async def call_stn_llm(
         
         logging.info(f"📝 Stn LLM 调用: model={model_info['model_name_cn']}")
         
-        # 调用 API (Async)
-        response = await client.responses.create(**params)
+        # 调用 API (Async)；后台优先级，Intv 排队时延后
+        async with _admission.slot(PRIORITY_BACKGROUND, model_id):
+            response = await client.responses.create(**params)
         
         # 解析响应
         response_id = response.id if hasattr(response, 'id') else None
@@ -377,8 +759,9 @@ async def call_dir_llm(
         
         logging.info(f"🎬 Dir LLM 调用: model={model_info['model_name_cn']}, caching={enable_caching}")
         
-        # 调用 API (Async)
-        response = await client.responses.create(**params)
+        # 调用 API (Async)；后台优先级，Intv 排队时延后
+        async with _admission.slot(PRIORITY_BACKGROUND, model_id):
+            response = await client.responses.create(**params)
         
         # 解析响应
         response_id = response.id if hasattr(response, 'id') else None
@@ -444,6 +827,27 @@ async def call_dir_llm(
 # LLM 调用记录
 # ============================================================================
 
+def record_intv_usage(
+    user_id: str,
+    usage_event: Dict[str, Any],
+    llm_input: Optional[str] = None,
+    llm_output: Optional[str] = None,
+    related_original_text_id: Optional[int] = None
+):
+    """补记 defer_record=True 的 Intv 调用 (usage_event 为流中的 usage 事件)"""
+    _record_llm_usage(
+        user_id=user_id,
+        agent="Intv",
+        model_id=usage_event['model_id'],
+        model_name_cn=usage_event['model_name_cn'],
+        usage=usage_event['usage'],
+        duration_ms=usage_event['duration_ms'],
+        llm_input=llm_input,
+        llm_output=llm_output,
+        related_original_text_id=related_original_text_id
+    )
+
+
 def _record_llm_usage(
     user_id: str,
     agent: str,
@@ -455,31 +859,24 @@ def _record_llm_usage(
     llm_output: Optional[str] = None,
     related_original_text_id: Optional[int] = None
 ):
-    """记录 LLM 调用到 llm_processed 表"""
+    """
+    记录 LLM 调用到 llm_processed 表
+
+    只入队，不在请求路径上访问数据库。由 telemetry_service 后台批量写入，
+    input/output 在写入时经 llm_content_service 去重压缩。
+    """
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO llm_processed 
-                    (user_id, agent, model_id, model_name_cn, process_duration,
-                     total_tokens, prompt_tokens, completion_tokens, cached_tokens,
-                     input, output, related_original_text_id)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    user_id,
-                    agent,
-                    model_id,
-                    model_name_cn,
-                    duration_ms,
-                    usage.get('total_tokens', 0),
-                    usage.get('prompt_tokens', 0),
-                    usage.get('completion_tokens', 0),
-                    usage.get('cached_tokens', 0),
-                    llm_input,
-                    llm_output,
-                    related_original_text_id,
-                ))
-                conn.commit()
+        record_usage('llm_processed', {
+            'user_id': user_id,
+            'agent': agent,
+            'model_id': model_id,
+            'model_name_cn': model_name_cn,
+            'duration_ms': duration_ms,
+            'usage': dict(usage),
+            'llm_input': llm_input,
+            'llm_output': llm_output,
+            'related_original_text_id': related_original_text_id,
+        })
         
         logging.info(f"📊 记录 LLM 调用: {agent} - {usage.get('total_tokens', 0)} tokens")
         
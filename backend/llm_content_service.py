@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+LLM Content Store (LLM 调用输入/输出的去重压缩存储)
+============================================================================
+
+llm_processed 过去把每次调用的完整 input (system prompt + 故事板/前情提要)
+和 output 原样存成 TEXT，大部分内容在相邻调用间逐字重复。本模块负责：
+
+1. System Prompt 按 sha256 存入 llm_content_blob 表，只存一份
+2. 其余上下文 (context) 按「同一用户 + 同一 Agent」与上一次调用做差分，
+   每隔若干次写一个完整关键帧 (keyframe)，差分链不跨月 (便于按月分区归档)
+3. 超过阈值的数据做压缩 (优先 zstd，未安装时退回 zlib)
+
+写入: encode_llm_io() -> INSERT -> remember_llm_io() -> COMMIT -> remember_prompt_blobs()
+读取: load_llm_io(conn, ids) 透明还原为原始的 input/output 字符串
+
+表结构见 sql/create_llm_content_store.sql。
+"""
+
+import json
+import zlib
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Tuple, Iterable
+
+from .coordination_service import register_invalidation
+
+try:
+    import zstandard as _zstd  # 可选依赖，未安装时退回 zlib
+except ImportError:
+    _zstd = None
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量
+# ============================================================================
+
+IO_FORMAT_PLAIN = 0    # 旧格式：input/output 明文存于 TEXT 列
+IO_FORMAT_PACKED = 1   # 新格式：input_packed/output_packed + llm_content_blob
+
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+COMPRESS_MIN_BYTES = 512      # 小于该长度不压缩
+PROMPT_MIN_CHARS = 64         # 短于该长度的 system prompt 直接内联
+KEYFRAME_INTERVAL = 16        # 差分链最大长度，超过后写完整关键帧
+DELTA_MAX_RATIO = 0.6         # 差分大小超过全文的该比例时，直接写关键帧
+DELTA_BLOCK = 32              # 差分匹配的块大小（字符）
+MAX_TRACKED_SESSIONS = 4096   # 内存中最多跟踪的 (user, agent) 会话数
+
+
+# ============================================================================
+# 压缩编解码
+# ============================================================================
+
+_zstd_compressor = _zstd.ZstdCompressor(level=3) if _zstd else None
+_zstd_decompressor = _zstd.ZstdDecompressor() if _zstd else None
+
+
+def _pack(data: bytes) -> bytes:
+    """按长度决定是否压缩，首字节记录编码方式"""
+    if len(data) >= COMPRESS_MIN_BYTES:
+        if _zstd_compressor:
+            packed = bytes([CODEC_ZSTD]) + _zstd_compressor.compress(data)
+        else:
+            packed = bytes([CODEC_ZLIB]) + zlib.compress(data, 6)
+        if len(packed) < len(data):
+            return packed
+    return bytes([CODEC_RAW]) + data
+
+
+def _unpack(blob) -> bytes:
+    """还原 _pack 的结果（兼容 psycopg2 返回的 memoryview）"""
+    view = memoryview(blob)
+    codec = view[0]
+    body = view[1:]
+    if codec == CODEC_RAW:
+        return body.tobytes()
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(body)
+    if codec == CODEC_ZSTD:
+        if not _zstd_decompressor:
+            raise RuntimeError("数据使用 zstd 压缩，但未安装 zstandard")
+        return _zstd_decompressor.decompress(body.tobytes())
+    raise ValueError(f"未知的压缩编码: {codec}")
+
+
+def _pack_text(text: str) -> bytes:
+    return _pack(text.encode('utf-8'))
+
+
+def _unpack_text(blob) -> str:
+    return _unpack(blob).decode('utf-8')
+
+
+# ============================================================================
+# 文本差分 (copy/insert 指令)
+# ============================================================================
+
+def _match_len(a: str, i: int, b: str, j: int) -> int:
+    """a[i:] 与 b[j:] 的公共前缀长度"""
+    limit = min(len(a) - i, len(b) - j)
+    n = 0
+    while n + DELTA_BLOCK <= limit and a[i + n:i + n + DELTA_BLOCK] == b[j + n:j + n + DELTA_BLOCK]:
+        n += DELTA_BLOCK
+    while n < limit and a[i + n] == b[j + n]:
+        n += 1
+    return n
+
+
+def diff_ops(base: str, new: str) -> List[Any]:
+    """
+    计算 new 相对 base 的差分指令
+
+    指令列表中 [offset, length] 表示从 base 复制，字符串表示插入的字面量。
+    基于块索引的贪心匹配，O(len(new))，足以覆盖「前情提要滑动窗口」和
+    「故事板追加」这两种主要模式。
+    """
+    index: Dict[str, int] = {}
+    for off in range(0, len(base) - DELTA_BLOCK + 1, DELTA_BLOCK):
+        index.setdefault(base[off:off + DELTA_BLOCK], off)
+
+    ops: List[Any] = []
+    lit_start = 0
+    j = 0
+    end = len(new) - DELTA_BLOCK
+    while j <= end:
+        i = index.get(new[j:j + DELTA_BLOCK])
+        if i is None:
+            j += 1
+            continue
+        # 向后扩展（吃掉待输出字面量的尾部）
+        while j > lit_start and i > 0 and base[i - 1] == new[j - 1]:
+            i -= 1
+            j -= 1
+        length = _match_len(base, i, new, j)
+        if j > lit_start:
+            ops.append(new[lit_start:j])
+        ops.append([i, length])
+        j += length
+        lit_start = j
+    if lit_start < len(new):
+        ops.append(new[lit_start:])
+    return ops
+
+
+def apply_ops(base: str, ops: Iterable[Any]) -> str:
+    """按差分指令从 base 还原文本"""
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            offset, length = op
+            parts.append(base[offset:offset + length])
+    return "".join(parts)
+
+
+def _ops_cost(ops: List[Any]) -> int:
+    """差分指令的大致存储开销（字符数）"""
+    return sum(len(op) if isinstance(op, str) else 12 for op in ops)
+
+
+# ============================================================================
+# System Prompt 抽取
+# ============================================================================
+
+def _hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _split_input(llm_input: str) -> Tuple[bool, str, Dict[str, str]]:
+    """
+    将 input 拆成「上下文 + system prompt 引用」
+
+    Returns:
+        (是否为消息数组 JSON, context 字符串, {hash: prompt 原文})
+    """
+    try:
+        messages = json.loads(llm_input)
+    except (TypeError, ValueError):
+        return False, llm_input, {}
+
+    if not isinstance(messages, list):
+        return False, llm_input, {}
+
+    prompts: Dict[str, str] = {}
+    slim = []
+    for msg in messages:
+        content = msg.get('content') if isinstance(msg, dict) else None
+        if (isinstance(msg, dict) and msg.get('role') == 'system'
+                and isinstance(content, str) and len(content) >= PROMPT_MIN_CHARS):
+            blob_hash = _hash_text(content)
+            prompts[blob_hash] = content
+            slim.append({**msg, 'content': None, '$blob': blob_hash})
+        else:
+            slim.append(msg)
+    return True, json.dumps(slim, ensure_ascii=False), prompts
+
+
+def _join_input(is_messages: bool, context: str, blobs: Dict[str, str]) -> str:
+    """_split_input 的逆过程"""
+    if not is_messages:
+        return context
+
+    messages = json.loads(context)
+    for msg in messages:
+        if isinstance(msg, dict) and '$blob' in msg:
+            blob_hash = msg.pop('$blob')
+            msg['content'] = blobs.get(blob_hash, f"[prompt {blob_hash[:12]} 缺失]")
+    return json.dumps(messages, ensure_ascii=False)
+
+
+# ============================================================================
+# 写入侧：会话状态与编码
+# ============================================================================
+
+# (user_id, agent) -> {'id', 'context', 'depth', 'month'}
+_sessions: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+_known_blobs: set = set()
+_state_lock = threading.Lock()
+
+
+def _month_key(ts: Optional[datetime] = None) -> str:
+    return (ts or datetime.now()).strftime("%Y%m")
+
+
+def encode_llm_io(
+    user_id: str,
+    agent: str,
+    llm_input: Optional[str],
+    llm_output: Optional[str]
+) -> Dict[str, Any]:
+    """
+    将一次调用的 input/output 编码为 llm_processed 的新格式列
+
+    Returns:
+        {
+            'io_format': 1,
+            'input_base_id': 差分基准行 ID 或 None (关键帧),
+            'input_packed': bytes 或 None,
+            'output_packed': bytes 或 None,
+            'new_blobs': {hash: packed_bytes}  # 尚未写入 llm_content_blob 的 prompt
+            'context': 本次上下文（写入成功后交给 remember_llm_io）,
+            'depth': 本次在差分链中的深度,
+        }
+    """
+    encoded: Dict[str, Any] = {
+        'io_format': IO_FORMAT_PACKED,
+        'input_base_id': None,
+        'input_packed': None,
+        'output_packed': _pack_text(llm_output) if llm_output is not None else None,
+        'new_blobs': {},
+        'context': None,
+        'depth': 0,
+    }
+
+    if llm_input is None:
+        return encoded
+
+    is_messages, context, prompts = _split_input(llm_input)
+    envelope: Dict[str, Any] = {'m': 1 if is_messages else 0}
+
+    with _state_lock:
+        for blob_hash, text in prompts.items():
+            if blob_hash not in _known_blobs:
+                encoded['new_blobs'][blob_hash] = _pack_text(text)
+
+        prev = _sessions.get((user_id, agent))
+        use_delta = (
+            prev is not None
+            and prev['depth'] < KEYFRAME_INTERVAL
+            and prev['month'] == _month_key()
+        )
+
+    if use_delta:
+        ops = diff_ops(prev['context'], context)
+        if _ops_cost(ops) <= len(context) * DELTA_MAX_RATIO:
+            envelope['d'] = ops
+            encoded['input_base_id'] = prev['id']
+            encoded['depth'] = prev['depth'] + 1
+
+    if 'd' not in envelope:
+        envelope['c'] = context
+
+    encoded['input_packed'] = _pack_text(json.dumps(envelope, ensure_ascii=False))
+    encoded['context'] = context
+    return encoded
+
+
+def remember_llm_io(user_id: str, agent: str, row_id: int, encoded: Dict[str, Any]):
+    """
+    行写入后，记录其上下文作为下一次差分的基准 (同一事务内的后续行即可引用)
+
+    事务回滚时调用方需 forget_llm_sessions()；prompt blob 由 remember_prompt_blobs() 单独记录。
+    """
+    with _state_lock:
+        if encoded.get('context') is None:
+            return
+        key = (user_id, agent)
+        _sessions[key] = {
+            'id': row_id,
+            'context': encoded['context'],
+            'depth': encoded['depth'],
+            'month': _month_key(),
+        }
+        _sessions.move_to_end(key)
+        while len(_sessions) > MAX_TRACKED_SESSIONS:
+            _sessions.popitem(last=False)
+
+
+def remember_prompt_blobs(blob_hashes: Iterable[str]):
+    """事务提交成功后，标记这些 prompt 已写入 llm_content_blob (之后不再重复写入)"""
+    with _state_lock:
+        _known_blobs.update(blob_hashes)
+
+
+def forget_llm_sessions(user_id: Optional[str] = None):
+    """
+    丢弃差分基准（例如删除用户记录后），下一次写入将从关键帧开始
+
+    user_id 为 None 时清空全部。
+    """
+    with _state_lock:
+        if user_id is None:
+            _sessions.clear()
+            return
+        for key in [k for k in _sessions if k[0] == user_id]:
+            del _sessions[key]
+
+
+# 其他 worker 删除用户记录后广播 (payload 为 user_id，空串表示全部)
+register_invalidation('llm_sessions', lambda user_id: forget_llm_sessions(user_id or None))
+
+
+def save_prompt_blobs(cursor, new_blobs: Dict[str, bytes]):
+    """写入新的 system prompt（已存在则忽略）"""
+    for blob_hash, packed in new_blobs.items():
+        cursor.execute("""
+            INSERT INTO llm_content_blob (blob_hash, content)
+            VALUES (%s, %s)
+            ON CONFLICT (blob_hash) DO NOTHING
+        """, (blob_hash, packed))
+
+
+# ============================================================================
+# 读取侧：透明还原
+# ============================================================================
+
+def load_llm_io(conn, ids: Iterable[int]) -> Dict[int, Tuple[Optional[str], Optional[str]]]:
+    """
+    批量还原 llm_processed 记录的 input/output
+
+    兼容旧格式 (io_format=0) 的明文行。差分链上的基准行会被一并读出，
+    基准行缺失时 input 返回占位文本而不是抛错。
+
+    Returns:
+        {model_processed_id: (input, output)}
+    """
+    wanted = {int(i) for i in ids if i is not None}
+    if not wanted:
+        return {}
+
+    rows: Dict[int, Tuple] = {}
+    to_fetch = set(wanted)
+    with conn.cursor() as cursor:
+        # 逐层向上读取差分基准，层数受 KEYFRAME_INTERVAL 约束
+        for _ in range(KEYFRAME_INTERVAL + 2):
+            if not to_fetch:
+                break
+            cursor.execute("""
+                SELECT model_processed_id, io_format, input_base_id,
+                       input, output, input_packed, output_packed
+                FROM llm_processed
+                WHERE model_processed_id = ANY(%s)
+            """, (list(to_fetch),))
+            for row in cursor.fetchall():
+                rows[row[0]] = row[1:]
+            to_fetch = {
+                r[1] for r in rows.values()
+                if r[1] is not None and r[1] not in rows
+            } - set(rows)
+
+    contexts: Dict[int, Optional[Tuple[bool, str]]] = {}
+
+    def _context_of(row_id: int, depth: int = 0) -> Optional[Tuple[bool, str]]:
+        if row_id in contexts:
+            return contexts[row_id]
+        row = rows.get(row_id)
+        result = None
+        if row is not None and row[4] is not None and depth <= KEYFRAME_INTERVAL + 1:
+            envelope = json.loads(_unpack_text(row[4]))
+            is_messages = bool(envelope.get('m'))
+            if 'c' in envelope:
+                result = (is_messages, envelope['c'])
+            else:
+                base = _context_of(row[1], depth + 1)
+                if base is not None:
+                    result = (is_messages, apply_ops(base[1], envelope['d']))
+        contexts[row_id] = result
+        return result
+
+    decoded: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+    pending_blobs: Dict[int, Tuple[bool, str]] = {}
+    for row_id in wanted:
+        row = rows.get(row_id)
+        if row is None:
+            continue
+        io_format, _, plain_in, plain_out, input_packed, output_packed = row
+        if io_format != IO_FORMAT_PACKED:
+            decoded[row_id] = (plain_in, plain_out)
+            continue
+
+        output = _unpack_text(output_packed) if output_packed is not None else None
+        if input_packed is None:
+            decoded[row_id] = (None, output)
+            continue
+
+        ctx = _context_of(row_id)
+        if ctx is None:
+            decoded[row_id] = ("[上下文基准记录已删除或归档，无法还原]", output)
+            continue
+        pending_blobs[row_id] = ctx
+        decoded[row_id] = (None, output)
+
+    if pending_blobs:
+        hashes = set()
+        for is_messages, context in pending_blobs.values():
+            if is_messages:
+                hashes.update(m['$blob'] for m in json.loads(context)
+                              if isinstance(m, dict) and '$blob' in m)
+        blobs = _load_blobs(conn, hashes)
+        for row_id, (is_messages, context) in pending_blobs.items():
+            decoded[row_id] = (_join_input(is_messages, context, blobs), decoded[row_id][1])
+
+    return decoded
+
+
+def _load_blobs(conn, hashes: Iterable[str]) -> Dict[str, str]:
+    """按 hash 批量读取 system prompt"""
+    hashes = list(hashes)
+    if not hashes:
+        return {}
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT blob_hash, content FROM llm_content_blob
+            WHERE blob_hash = ANY(%s)
+        """, (hashes,))
+        return {row[0]: _unpack_text(row[1]) for row in cursor.fetchall()}
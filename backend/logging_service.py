@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Logging Service (异步结构化日志)
+============================================================================
+
+1. 非阻塞：根 logger 只挂一个 QueueHandler，记录入队即返回；
+   QueueListener 后台线程负责格式化与写 stderr，请求协程不再等待 I/O
+2. 结构化：默认每条记录输出一行 JSON (ts / level / module / msg / user_id / turn_id)，
+   LOG_FORMAT=text 时输出原来的文本格式，便于本地调试
+3. 关联 ID：bind_log_context(user_id=..., turn_id=...) 设置 contextvars，
+   同一轮访谈 (含其创建的子任务) 内的日志自动带上用户与轮次 ID
+4. 分级：LOG_LEVEL 环境变量为默认级别；sys_config.log_levels
+   ("volc_tts_client=DEBUG,asr_gateway=WARNING") 按模块覆盖，配置变更后重新生效
+5. 采样：音频分片、ASR 中间结果等高频事件用 log_sampled() 记录，
+   每 log_sample_every 条只输出 1 条 (附带累计条数)，未输出时不格式化消息
+
+各模块仍直接使用 logging.info(...) 等根 logger 调用；模块级别按记录的
+module (文件名) 过滤，同名 logger (如 uvicorn.access) 同时设置级别。
+"""
+
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Any, Callable, Optional, Union
+
+DEFAULT_SAMPLE_EVERY = 100
+TEXT_FORMAT = "%(asctime)s %(levelname)s [%(module)s] %(message)s"
+
+_user_id_var: contextvars.ContextVar = contextvars.ContextVar('log_user_id', default=None)
+_turn_id_var: contextvars.ContextVar = contextvars.ContextVar('log_turn_id', default=None)
+
+_listener: Optional[QueueListener] = None
+_module_levels: Dict[str, int] = {}
+_default_level = logging.INFO
+_sample_every = DEFAULT_SAMPLE_EVERY
+_sample_counts: Dict[str, int] = {}
+_config_subscribed = False
+
+_stats = {
+    'sampled_total': 0,
+    'sampled_emitted': 0,
+}
+
+
+# ============================================================================
+# 格式化与过滤
+# ============================================================================
+
+class _ContextFilter(logging.Filter):
+    """在调用方线程中附加关联 ID，并按模块级别过滤"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        level = _module_levels.get(record.module, _default_level)
+        if record.levelno < level:
+            return False
+        record.user_id = _user_id_var.get()
+        record.turn_id = _turn_id_var.get()
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    """入队前只合并消息参数，异常堆栈单独保存在 exc_text 中供 JSON 输出"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _plain_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+_plain_formatter = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'module': record.module,
+            'msg': record.getMessage(),
+        }
+        user_id = getattr(record, 'user_id', None)
+        if user_id:
+            entry['user_id'] = user_id
+        turn_id = getattr(record, 'turn_id', None)
+        if turn_id:
+            entry['turn_id'] = turn_id
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        turn_id = getattr(record, 'turn_id', None)
+        return f"{text} (turn={turn_id})" if turn_id else text
+
+
+def _parse_level(value: Union[str, int, None], default: int) -> int:
+    if isinstance(value, int):
+        return value
+    level = logging.getLevelName(str(value or '').strip().upper())
+    return level if isinstance(level, int) else default
+
+
+# ============================================================================
+# 初始化
+# ============================================================================
+
+def setup_logging():
+    """
+    替换根 logger 的处理器为 QueueHandler (main.py 导入时最先调用)
+
+    之前各模块 logging.basicConfig 添加的处理器被移除；之后的 basicConfig
+    因根 logger 已有处理器而不再生效。
+    """
+    global _listener, _default_level
+    if _listener is not None:
+        return
+
+    _default_level = _parse_level(os.getenv("LOG_LEVEL"), logging.INFO)
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if os.getenv("LOG_FORMAT", "json").lower() == "text":
+        stream_handler.setFormatter(_TextFormatter(TEXT_FORMAT))
+    else:
+        stream_handler.setFormatter(JsonFormatter())
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    _apply_root_level()
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """写完队列中剩余的日志并停止后台线程 (lifespan 关闭阶段调用)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _apply_root_level():
+    # 根 logger 取最低级别，让需要 DEBUG 的模块的记录能进入过滤器
+    levels = [_default_level] + list(_module_levels.values())
+    logging.getLogger().setLevel(min(levels))
+
+
+def apply_log_config():
+    """读取 sys_config 中的模块级别与采样率 (配置缓存预热后、配置变更时调用)"""
+    global _sample_every, _config_subscribed
+    from .config_manager import get_config  # 动态导入避免循环依赖
+
+    if not _config_subscribed:
+        from .coordination_service import register_invalidation
+        register_invalidation('config', lambda _: apply_log_config())
+        _config_subscribed = True
+
+    levels: Dict[str, int] = {}
+    for item in str(get_config('log_levels', default='') or '').split(','):
+        name, sep, level = item.partition('=')
+        if not sep or not name.strip():
+            continue
+        levels[name.strip()] = _parse_level(level, _default_level)
+
+    for name in set(_module_levels) - set(levels):
+        logging.getLogger(name).setLevel(logging.NOTSET)
+    for name, level in levels.items():
+        if name in logging.root.manager.loggerDict:
+            logging.getLogger(name).setLevel(level)
+    _module_levels.clear()
+    _module_levels.update(levels)
+    _apply_root_level()
+
+    try:
+        _sample_every = max(1, int(float(get_config('log_sample_every', default=DEFAULT_SAMPLE_EVERY))))
+    except (TypeError, ValueError):
+        _sample_every = DEFAULT_SAMPLE_EVERY
+
+
+# ============================================================================
+# 关联 ID 与采样
+# ============================================================================
+
+def bind_log_context(user_id: Optional[str] = None, turn_id: Optional[str] = None):
+    """
+    为当前任务设置关联 ID (不恢复)
+
+    asyncio 任务各自持有 context 副本，在独立任务 (如一轮访谈、一个 WebSocket 连接)
+    中调用不会影响其他任务；之后创建的子任务继承这些 ID。
+    """
+    if user_id is not None:
+        _user_id_var.set(user_id)
+    if turn_id is not None:
+        _turn_id_var.set(turn_id)
+
+
+def log_sampled(key: str, level: int, message: Union[str, Callable[[], str]], every: Optional[int] = None):
+    """
+    记录高频事件：每 every 条 (默认 log_sample_every) 输出 1 条
+
+    Args:
+        key: 采样计数键 (如 'tts_chunk')
+        message: 消息或返回消息的函数；未被采中时不调用，省去格式化开销
+    """
+    count = _sample_counts.get(key, 0) + 1
+    _sample_counts[key] = count
+    _stats['sampled_total'] += 1
+    if (count - 1) % (every or _sample_every):
+        return
+    if not logging.getLogger().isEnabledFor(level):
+        return
+    _stats['sampled_emitted'] += 1
+    text = message() if callable(message) else message
+    logging.log(level, f"{text} [采样 {key} #{count}]", stacklevel=2)
+
+
+def get_logging_stats() -> Dict[str, Any]:
+    stats = dict(_stats)
+    stats['default_level'] = logging.getLevelName(_default_level)
+    stats['module_levels'] = {name: logging.getLevelName(level) for name, level in _module_levels.items()}
+    stats['sample_every'] = _sample_every
+    stats['sample_counts'] = dict(_sample_counts)
+    return stats
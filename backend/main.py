@@ -25,11 +25,18 @@
 # ============================================================================
 # 导入模块
 # ============================================================================
+# 最先导入：启动计时起点 (见 startup_service)，之后所有日志经异步队列输出
+from .startup_service import (
+    mark_imports_done, mark_lifespan_started, mark_lifespan_ready,
+    start_warmup, stop_warmup, is_ready, get_startup_stats
+)
+from .logging_service import setup_logging, stop_logging, apply_log_config
+setup_logging()
 from typing import List, Dict, Optional, Any
 from fastapi import FastAPI, HTTPException, WebSocket, Request, UploadFile, File, Form
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
@@ -38,32 +45,30 @@ import logging
 import asyncio
 import re
 import urllib.parse
-import base64
 import uuid
+import time
 
 # 内部模块导入
-from .database import init_db, insert_record, get_records  # 数据库操作
-from .ai_service import get_doubao_summary, get_doubao_chat_reply, get_doubao_chat_reply_stream, get_doubao_response_stream  # AI服务
-from .volc_service import synthesize_speech, asr_stream  # 火山引擎服务
+# 访谈热路径在此导入；旧版接口 (/summarize, /chat, /ws/chat)、微信登录、COS 上传、
+# 音频转码等低频路径在各自端点内导入，缩短冷启动
+from .database import init_db, insert_record, get_records, close_connection_pool  # 数据库操作
+from .telemetry_service import start_telemetry, stop_telemetry  # 用量记录异步写入
+from .coordination_service import start_coordination, stop_coordination  # 多 worker 协调
+from .user_actor_service import stop_actor_runtime  # 用户级 Actor (状态常驻 + Stn/Dir 调度)
+from .partition_service import partition_maintenance_loop  # 日志表分区维护
+from .asr_gateway import asr_stream, asr_upstream_pool  # ASR 网关 (预热连接池)
 from .volc_tts_client import VolcTTSClient  # TTS客户端
-from .wechat_service import code2session, validate_wechat_config  # 微信服务
-from .user_service import get_user_by_openid, create_user, update_user_info  # 用户服务
-from .session_service import create_session, validate_session, get_session_response_id, update_session_response_id, extend_session  # Session管理
-from .interview_service import save_original_text, save_original_voice  # 访谈记录服务
-from .cos_service import upload_audio_to_cos  # COS服务
-from .audio_service import convert_pcm_to_mp3  # 音频处理服务
-from .cachepool_service import add_to_cachepool  # 缓存池服务
-from .stn_database import get_latest_hint, get_previous_dialogues # 故事板支持 (v3.2)
-from .stn_service import run_stn_agent_async  # Stn Agent 触发函数 (v3.2)
+from .user_service import get_user_by_openid, get_user_by_id, create_user, update_user_info  # 用户服务
+from .config_manager import preload_config_cache  # 配置 / 提示词缓存
+from .llm_api_service import warm_llm_clients  # Ark 客户端
 # v3.3 服务导入
-from .intv_service import process_user_input  # 访谈员 Agent v3.3
+from .interview_turn_service import run_interview_turn, wait_for_interrupt, SentenceBuffer  # 单轮访谈 (Intv + TTS)
+from .voice_session_service import VoiceSession  # 双工语音会话
 # 管理后台服务导入
 from .admin_service import router as admin_router
+from .admin_http_service import AdminHttpMiddleware, admin_static_response
 
-# ============================================================================
-# 日志配置
-# ============================================================================
-logging.basicConfig(level=logging.DEBUG)
+mark_imports_done()
 
 # 加载环境变量（从 .env 文件）
 load_dotenv()
@@ -75,6 +80,18 @@ load_dotenv()
 global_tts_client = None
 
 
+def _warm_config_cache():
+    """预热配置与提示词缓存，并应用其中的日志级别 / 采样配置"""
+    preload_config_cache()
+    apply_log_config()
+
+
+async def _connect_tts_client():
+    """初始化TTS连接池（预连接，减少首次请求延迟）"""
+    await global_tts_client.connect()
+    logging.info("全局TTS客户端连接成功")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
@@ -85,24 +102,50 @@ async def lifespan(app: FastAPI):
     """
     global global_tts_client
     logging.info("正在初始化全局资源...")
+    mark_lifespan_started()
     
-    # 1. 初始化数据库
-    init_db()
+    # 1. 初始化数据库 (后续步骤都依赖连接池)
+    await asyncio.to_thread(init_db)
     
-    # 2. 初始化TTS连接池（预连接，减少首次请求延迟）
+    # 1.5 启动用量记录后台写入线程
+    start_telemetry()
+    
+    # 1.55 启动跨 worker 协调 (缓存失效广播监听)
+    start_coordination()
+    
+    # 1.6 启动日志表分区维护（创建未来分区、归档过期分区）
+    partition_task = asyncio.create_task(partition_maintenance_loop())
+    
+    # 2. 后台并发预热，完成前 /ready 返回 503 (关键项失败时保持 503 并重试)
     global_tts_client = VolcTTSClient()
-    try:
-        await global_tts_client.connect()
-        logging.info("全局TTS客户端连接成功")
-    except Exception as e:
-        logging.error(f"TTS初始化错误: {e}")
+    start_warmup({
+        'tts': _connect_tts_client,
+        'asr_pool': asr_upstream_pool.start,
+        'ark_client': warm_llm_clients,
+        'config_cache': _warm_config_cache,
+    }, critical=('tts', 'ark_client', 'config_cache'))
+    mark_lifespan_ready()
     
     yield  # 应用运行期间
     
     # 清理资源
     logging.info("正在清理全局资源...")
+    await stop_warmup()
+    partition_task.cancel()
     if global_tts_client:
         await global_tts_client.close()
+    await asr_upstream_pool.close()
+    from .wechat_service import close_wechat_client
+    await close_wechat_client()
+    
+    # 等待进行中的 Stn/Dir 并把常驻状态落库
+    await stop_actor_runtime()
+    
+    # 写完剩余用量记录后再关闭连接池
+    await asyncio.to_thread(stop_telemetry)
+    await asyncio.to_thread(stop_coordination)
+    close_connection_pool()
+    stop_logging()
 
 
 # ============================================================================
@@ -121,6 +164,9 @@ app.add_middleware(
     allow_headers=["*"],      # 允许所有请求头
 )
 
+# 管理后台 (/admin) 响应压缩与 ETag 条件请求
+app.add_middleware(AdminHttpMiddleware)
+
 
 # ============================================================================
 # 全局中间件与异常处理
@@ -132,8 +178,9 @@ async def log_request_middleware(request: Request, call_next):
     请求日志中间件
     
     记录所有进入的HTTP请求，便于调试和监控。
+    只记录方法与路径：查询参数 (如 /tts/stream 的文本) 不写入日志。
     """
-    logging.info(f"收到请求: {request.method} {request.url}")
+    logging.info(f"收到请求: {request.method} {request.url.path}")
     try:
         response = await call_next(request)
         return response
@@ -168,13 +215,9 @@ if os.path.exists(admin_static_path):
     # 挂载静态文件（必须放在 API 路由后面，否则会拦截 API）
     # 注意：StaticFiles 无法处理前端路由回退，我们需要手动处理
     @app.get("/admin/{path:path}")
-    async def admin_spa_fallback(path: str):
-        # 如果是静态资源（assets 等），返回静态文件
-        full_path = os.path.join(admin_static_path, path)
-        if os.path.isfile(full_path):
-            return FileResponse(full_path)
-        # 否则返回 index.html 让前端路由接管
-        return FileResponse(os.path.join(admin_static_path, "index.html"))
+    async def admin_spa_fallback(path: str, request: Request):
+        # 静态资源（assets 等）返回文件 (优先预压缩版本)，否则返回 index.html 让前端路由接管
+        return admin_static_response(request, admin_static_path, path)
 
     # 同时也保留挂载，以便于处理根路径和其他静态资源
     app.mount("/admin", StaticFiles(directory=admin_static_path, html=True), name="admin_dashboard")
@@ -236,6 +279,21 @@ async def root():
     return {"status": "ok", "message": "后端服务运行中，已启用全局连接池。"}
 
 
+@app.get("/ready")
+async def ready():
+    """
+    就绪探针
+    
+    后台预热 (TTS/ASR 连接、Ark 客户端、配置缓存) 完成前返回 503，
+    关键项 (TTS、Ark 客户端、配置缓存) 失败时保持 503 (degraded，后台重试)，
+    全部成功后返回 200；data 中包含各阶段启动耗时与失败的预热项。
+    """
+    stats = get_startup_stats()
+    if not is_ready():
+        return JSONResponse(status_code=503, content={"status": stats['phase'], "data": stats})
+    return {"status": "ready", "data": stats}
+
+
 @app.post("/summarize", response_model=SummaryResponse)
 def summarize_input(request: SummaryRequest):
     """
@@ -252,6 +310,8 @@ def summarize_input(request: SummaryRequest):
     if not request.text.strip():
         raise HTTPException(status_code=400, detail="输入文本不能为空")
     
+    from .ai_service import get_doubao_summary
+    
     # 调用AI生成摘要
     summary = get_doubao_summary(request.text)
     
@@ -290,12 +350,14 @@ async def wechat_login(request: WeChatLoginRequest):
         用户信息和登录状态
     """
     try:
+        from .wechat_service import code2session, validate_wechat_config
+        
         # 1. 验证微信配置
         if not validate_wechat_config():
             raise HTTPException(status_code=500, detail="微信配置不完整")
         
-        # 2. 调用微信 API
-        wechat_result = code2session(request.code)
+        # 2. 调用微信 API (异步连接池，不阻塞事件循环)
+        wechat_result = await code2session(request.code)
         
         # 3. 检查微信 API 调用结果
         if 'errcode' in wechat_result and wechat_result['errcode'] != 0:
@@ -310,14 +372,14 @@ async def wechat_login(request: WeChatLoginRequest):
         if not openid:
             raise HTTPException(status_code=400, detail="未获取到 OpenID")
         
-        # 4. 查询用户是否存在
-        user = get_user_by_openid(openid)
+        # 4. 查询用户是否存在 (读穿透缓存)
+        user = await asyncio.to_thread(get_user_by_openid, openid)
         
         is_new_user = False
         if not user:
-            # 5. 创建新用户
-            user_id = create_user(openid, unionid)
-            user = get_user_by_openid(openid)
+            # 5. 创建新用户 (create_user 已写入缓存，不再查库)
+            user_id = await asyncio.to_thread(create_user, openid, unionid)
+            user = await asyncio.to_thread(get_user_by_id, user_id)
             is_new_user = True
             logging.info(f"新用户注册: {user_id}")
         else:
@@ -356,7 +418,8 @@ async def update_userinfo(request: UserInfoUpdateRequest):
         更新结果
     """
     try:
-        success = update_user_info(
+        success = await asyncio.to_thread(
+            update_user_info,
             user_id=request.user_id,
             nickname=request.nickname,
             avatar_url=request.avatar_url,
@@ -396,6 +459,7 @@ async def upload_avatar(file: UploadFile = File(...), user_id: str = Form(...)):
         filename = f"avatar_{user_id}_{int(time.time())}.{ext}"
         
         # 上传到 COS
+        from .cos_service import upload_file_to_cos
         avatar_url = upload_file_to_cos(file_content, filename)
         
         if not avatar_url:
@@ -420,6 +484,7 @@ async def get_latest_ai_message_endpoint(user_id: str):
     获取用户最新的 AI 回复内容
     
     用于小程序采访页初始化时展示最新 AI 消息。
+    同时在后台预热该用户的 Intv Session (见 intv_prewarm_service)。
     
     参数:
         user_id: 用户 ID (query parameter)
@@ -435,7 +500,9 @@ async def get_latest_ai_message_endpoint(user_id: str):
     """
     try:
         from .interview_service import get_latest_ai_message
+        from .intv_prewarm_service import schedule_intv_prewarm
         
+        schedule_intv_prewarm(user_id)
         ai_message = get_latest_ai_message(user_id)
         
         return {
@@ -454,25 +521,28 @@ async def get_latest_ai_message_endpoint(user_id: str):
 
 
 @app.post("/chat")
-def chat_with_doubao(request: ChatRequest):
+async def chat_with_doubao(request: ChatRequest):
     """
-    同步聊天端点（已弃用，使用 /ws/chat 替代）
+    非流式聊天端点（已弃用，使用 /ws/chat 替代）
     
-    这是一个同步的聊天端点，会阻塞等待AI回复和TTS合成完成。
+    等待AI回复和TTS合成完成后一次性返回。LLM 走共享的 Ark 异步客户端，
+    语音由全局 TTS 客户端合成（复用 HTTP 连接池），不阻塞事件循环。
     建议使用WebSocket端点 /ws/chat 以获得更好的用户体验。
     """
     if not request.messages:
         raise HTTPException(status_code=400, detail="消息列表不能为空")
     
+    from .llm_api_service import call_legacy_chat
+    
     # 系统提示词 - 定义AI的角色
     system_prompt = '你是一名邻居小妹，在和用户进行碰面闲聊。每句话开头必须加"哥哥"。输出的内容在15字左右。'
     messages = [{"role": "system", "content": system_prompt}] + request.messages
     
     # 获取AI回复
-    reply = get_doubao_chat_reply(messages)
+    reply = await call_legacy_chat(messages)
     
-    # 语音合成
-    audio_url = synthesize_speech(reply)
+    # 语音合成 (base64 MP3)
+    audio_url = await global_tts_client.synthesize_http_v3(reply)
     
     return {
         "code": 0,
@@ -522,11 +592,19 @@ async def chat_websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     logging.info("[对话] WebSocket连接已接受")
     
+    # 旧版接口依赖，仅在使用时导入
+    from .llm_api_service import call_legacy_response_stream
+    from .session_service import create_session, validate_session, get_session_response_id, update_session_response_id, extend_session
+    from .interview_service import save_original_text
+    from .cachepool_service import add_to_cachepool
+    from .stn_database import get_latest_hint, get_previous_dialogues
+    from .user_actor_service import post_agent_run
+    
     try:
         # 第一步：接收客户端消息
         logging.info("[对话] 等待客户端消息...")
         data = await websocket.receive_json()
-        logging.info(f"[对话] 收到数据: {data}")
+        logging.debug(f"[对话] 收到数据: {str(data)[:200]}")
         
         user_id = data.get("user_id")
         session_id = data.get("session_id")
@@ -541,10 +619,10 @@ async def chat_websocket_endpoint(websocket: WebSocket):
             await websocket.send_json({"type": "error", "message": "缺少 messages 参数"})
             return
         
-        # 第二步：Session 管理
+        # 第二步：Session 管理 (数据库操作放到线程中执行)
         if not session_id:
             # 创建新会话
-            session_id = create_session(user_id)
+            session_id = await asyncio.to_thread(create_session, user_id)
             logging.info(f"[对话] 创建新会话: {session_id}")
             await websocket.send_json({
                 "type": "session_id",
@@ -552,9 +630,9 @@ async def chat_websocket_endpoint(websocket: WebSocket):
             })
         else:
             # 验证会话
-            if not validate_session(session_id):
+            if not await asyncio.to_thread(validate_session, session_id):
                 # 会话无效，创建新会话
-                session_id = create_session(user_id)
+                session_id = await asyncio.to_thread(create_session, user_id)
                 logging.info(f"[对话] 会话已过期，创建新会话: {session_id}")
                 await websocket.send_json({
                     "type": "session_id",
@@ -562,7 +640,7 @@ async def chat_websocket_endpoint(websocket: WebSocket):
                 })
             else:
                 # 延长会话过期时间
-                extend_session(session_id)
+                await asyncio.to_thread(extend_session, session_id)
                 logging.info(f"[对话] 使用现有会话: {session_id}")
         
         # 第三步：获取用户输入
@@ -574,20 +652,20 @@ async def chat_websocket_endpoint(websocket: WebSocket):
         logging.info(f"[对话] 用户输入: {user_input[:50]}...")
         
         # 保存用户输入到数据库
-        save_original_text(session_id, user_id, user_input, speaker_type=0)
+        await asyncio.to_thread(save_original_text, session_id, user_id, user_input, speaker_type=0)
         
         # 添加到缓存池
-        cache_result = add_to_cachepool(session_id, user_id, 0, user_input)
+        cache_result = await asyncio.to_thread(add_to_cachepool, session_id, user_id, 0, user_input)
         logging.info(f"📝 缓存池字数: {cache_result['current_word_count']} 字")
         
         if cache_result['threshold_reached']:
             logging.info(f"🔔 缓存池已满！内容:\n{cache_result['cache_content']}")
             logging.info(f"📦 缓存池ID: {cache_result['cachepool_id']}")
-            # 触发 Stn Agent
-            await run_stn_agent_async(user_id, session_id, cache_result['cache_content'], cache_result['cachepool_id'])
+            # 触发 Stn Agent (投递到用户 actor 邮箱，不阻塞本轮)
+            await post_agent_run(user_id, 'stn')
         
         # 第四步：获取 previous_response_id
-        previous_response_id = get_session_response_id(session_id)
+        previous_response_id = await asyncio.to_thread(get_session_response_id, session_id)
         logging.info(f"[对话] previous_response_id: {previous_response_id[:50] if previous_response_id else 'None'}...")
         
         # 第五步：构建输入（严格遵循 PRD pc:; ot:; ht: 逻辑）
@@ -596,11 +674,11 @@ async def chat_websocket_endpoint(websocket: WebSocket):
         # 判断是否为新建 Session (没有 previous_response_id)
         pc_content = ""
         if not previous_response_id:
-            pc_content = get_previous_dialogues(user_id, limit=5)
+            pc_content = await asyncio.to_thread(get_previous_dialogues, user_id, limit=5)
             logging.info(f"[对话] 注入 pc (前情提要): {pc_content[:50]}...")
         
         # 5.2 处理 ht (导演提示)
-        ht_content = get_latest_hint(user_id)
+        ht_content = await asyncio.to_thread(get_latest_hint, user_id)
         if ht_content:
             logging.info(f"[对话] 注入 ht (导演建议): {ht_content[:50]}...")
 
@@ -621,123 +699,113 @@ async def chat_websocket_endpoint(websocket: WebSocket):
         
         # 第六步：调用 Response API
         logging.info("[对话] 开始调用 Response API...")
-        stream = get_doubao_response_stream(
+        stream = call_legacy_response_stream(
             input_text=full_input,
             previous_response_id=previous_response_id,
             enable_caching=False  # 暂时关闭缓存
         )
         
+        # 按句合成语音：合成在独立任务中按顺序进行，不阻塞文字流
+        sentence_queue: asyncio.Queue = asyncio.Queue()
+        
+        async def audio_sender():
+            while True:
+                sentence = await sentence_queue.get()
+                if sentence is None:
+                    return
+                sentence = sentence.strip()
+                if not sentence:
+                    continue
+                logging.info(f"[对话] 合成语音: {sentence[:30]}...")
+                audio_base64 = await global_tts_client.synthesize_http_v3(sentence)
+                if audio_base64:
+                    await websocket.send_json({
+                        "type": "audio",
+                        "data": audio_base64
+                    })
+                else:
+                    logging.error(f"[对话] TTS合成失败: {sentence[:30]}")
+        
+        audio_task = asyncio.create_task(audio_sender())
+        
         # 第六步：处理流式响应
         new_response_id = None
         ai_reply = ""
-        sentence_buffer = ""
-        sentence_endings = ["。", "!", "?", "！", "？", "\n"]
+        sentences = SentenceBuffer()
         
-        for event in stream:
-            event_type = event.get("type")
-            
-            # 6.1 获取 response_id
-            if event_type == "response_id":
-                new_response_id = event["response_id"]
-                logging.info(f"[对话] 获取 response_id: {new_response_id[:50]}...")
-                await websocket.send_json({
-                    "type": "response_id",
-                    "response_id": new_response_id
-                })
-            
-            # 6.2 处理文本内容
-            elif event_type == "text":
-                chunk = event["content"]
-                ai_reply += chunk
-                
-                # 立即发送文字给前端
-                await websocket.send_json({
-                    "type": "text",
-                    "content": chunk
-                })
-                logging.info(f"[对话] 发送文字: {chunk[:30]}...")
+        try:
+            async for event in stream:
+                event_type = event.get("type")
                 
-                # 添加到句子缓冲区
-                sentence_buffer += chunk
+                # 6.1 获取 response_id
+                if event_type == "response_id":
+                    new_response_id = event["response_id"]
+                    logging.info(f"[对话] 获取 response_id: {new_response_id[:50]}...")
+                    await websocket.send_json({
+                        "type": "response_id",
+                        "response_id": new_response_id
+                    })
                 
-                # 检测并处理完整句子
-                while True:
-                    earliest_idx = -1
-                    earliest_ending = None
-                    
-                    for ending in sentence_endings:
-                        idx = sentence_buffer.find(ending)
-                        if idx != -1:
-                            if earliest_idx == -1 or idx < earliest_idx:
-                                earliest_idx = idx
-                                earliest_ending = ending
+                # 6.2 处理文本内容
+                elif event_type == "text":
+                    chunk = event["content"]
+                    ai_reply += chunk
                     
-                    if earliest_idx == -1:
-                        break
+                    # 立即发送文字给前端
+                    await websocket.send_json({
+                        "type": "text",
+                        "content": chunk
+                    })
+                    logging.debug(f"[对话] 发送文字: {chunk[:30]}...")
                     
-                    # 提取完整句子
-                    sentence = sentence_buffer[:earliest_idx + 1].strip()
-                    
-                    # 合成语音
-                    if len(sentence) > 0:
-                        logging.info(f"[对话] 合成语音: {sentence[:30]}...")
-                        audio_base64 = await global_tts_client.synthesize_http_v3(sentence)
-                        
-                        if audio_base64:
-                            await websocket.send_json({
-                                "type": "audio",
-                                "data": audio_base64
-                            })
-                        else:
-                            logging.error(f"[对话] TTS合成失败: {sentence[:30]}")
-                    
-                    # 移除已处理的句子
-                    sentence_buffer = sentence_buffer[earliest_idx + 1:]
-            
-            # 6.3 处理错误
-            elif event_type == "error":
-                error_msg = event["message"]
-                logging.error(f"[对话] Response API 错误: {error_msg}")
-                await websocket.send_json({
-                    "type": "error",
-                    "message": error_msg
-                })
-                return
+                    # 凑满一句送去合成
+                    sentence = sentences.feed(chunk)
+                    if sentence:
+                        await sentence_queue.put(sentence)
+                
+                # 6.3 处理错误
+                elif event_type == "error":
+                    error_msg = event["message"]
+                    logging.error(f"[对话] Response API 错误: {error_msg}")
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": error_msg
+                    })
+                    return
+                
+                # 6.4 完成
+                elif event_type == "done":
+                    logging.info("[对话] Response API 完成")
             
-            # 6.4 完成
-            elif event_type == "done":
-                logging.info("[对话] Response API 完成")
-        
-        # 第七步：处理剩余文字
-        if sentence_buffer.strip():
-            logging.info(f"[对话] 合成剩余文字: {sentence_buffer[:30]}...")
-            audio_base64 = await global_tts_client.synthesize_http_v3(sentence_buffer.strip())
-            if audio_base64:
-                await websocket.send_json({
-                    "type": "audio",
-                    "data": audio_base64
-                })
+            # 第七步：处理剩余文字，等待语音全部发出
+            await sentence_queue.put(sentences.flush())
+            await sentence_queue.put(None)
+            await audio_task
+        finally:
+            await stream.aclose()
+            if not audio_task.done():
+                audio_task.cancel()
+                await asyncio.gather(audio_task, return_exceptions=True)
         
         # 第八步：保存 AI 回复到数据库
         if ai_reply:
-            save_original_text(session_id, user_id, ai_reply, speaker_type=1)
+            await asyncio.to_thread(save_original_text, session_id, user_id, ai_reply, speaker_type=1)
             logging.info(f"[对话] 保存 AI 回复: {len(ai_reply)} 字")
             
             # 添加到缓存池
-            cache_result = add_to_cachepool(session_id, user_id, 1, ai_reply)
+            cache_result = await asyncio.to_thread(add_to_cachepool, session_id, user_id, 1, ai_reply)
             logging.info(f"📝 缓存池字数: {cache_result['current_word_count']} 字")
             
             if cache_result['threshold_reached']:
                 logging.info(f"🔔 缓存池已满!内容:\n{cache_result['cache_content']}")
                 logging.info(f"📦 缓存池ID: {cache_result['cachepool_id']}")
-                # 触发 Stn Agent (使用异步包装)
-                from .stn_service import run_stn_agent
-                asyncio.create_task(run_stn_agent(user_id))
+                # 触发 Stn Agent (投递到用户 actor 邮箱，不阻塞本轮)
+                await post_agent_run(user_id, 'stn')
         
         
         # 第九步：更新 Session 的 response_id
         if new_response_id:
-            update_session_response_id(session_id, new_response_id)
+            await asyncio.to_thread(update_session_response_id, session_id, new_response_id)
             logging.info(f"[对话] 更新 session response_id")
         
         # 第十步：发送完成信号
@@ -763,37 +831,40 @@ async def upload_voice_endpoint(
 ):
     """
     上传用户语音文件接口
+
+    上传内容由框架缓存在 UploadFile.file (超过 1MB 转存临时文件)，这里不再整体
+    读入内存：直接按流送入 ffmpeg 转码，MP3 临时文件按流上传 COS (均在线程中执行)。
     """
     try:
         logging.info(f"🎤 [Upload] 收到请求: user_id={user_id}, session_id={session_id}, text_id={text_id}, filename={file.filename}")
         
-        # 读取文件内容
-        pcm_data = await file.read()
-        logging.info(f"🎤 [Upload] PCM 数据大小: {len(pcm_data)} bytes")
+        from .audio_service import encode_pcm_to_mp3, file_size
+        pcm_file = file.file
+        pcm_size = file_size(pcm_file)
+        logging.info(f"🎤 [Upload] PCM 数据大小: {pcm_size} bytes")
         
-        if len(pcm_data) == 0:
+        if pcm_size == 0:
             logging.error("❌ [Upload] 文件为空")
             return JSONResponse(status_code=400, content={"code": 400, "message": "文件为空"})
             
         # 1. 转换格式 (PCM -> MP3)
         try:
-            from .audio_service import convert_pcm_to_mp3
-            mp3_data = convert_pcm_to_mp3(pcm_data)
-            logging.info(f"🎤 [Upload] 转换成功, MP3 大小: {len(mp3_data)} bytes")
+            pcm_file.seek(0)
+            mp3_file = await asyncio.to_thread(encode_pcm_to_mp3, pcm_file)
+            logging.info(f"🎤 [Upload] 转换成功, MP3 大小: {file_size(mp3_file)} bytes")
         except Exception as e:
             logging.error(f"❌ [Upload] PCM 转换失败: {e}")
             return JSONResponse(status_code=500, content={"code": 500, "message": f"音频转换失败: {str(e)}"})
         
         # 2. 生成文件名
-        import time
-        import uuid
         timestamp = int(time.time())
         file_uuid = str(uuid.uuid4())[:8]
         filename = f"voice_{user_id}_{timestamp}_{file_uuid}.mp3"
         
         # 3. 上传到 COS
         from .cos_service import upload_audio_to_cos
-        voice_url = upload_audio_to_cos(mp3_data, filename)
+        with mp3_file:
+            voice_url = await asyncio.to_thread(upload_audio_to_cos, mp3_file, filename)
         
         if not voice_url:
             logging.error("❌ [Upload] COS 上传失败, check cos_service logs")
@@ -802,7 +873,7 @@ async def upload_voice_endpoint(
         # 4. 保存到数据库
         try:
             from .interview_service import save_original_voice
-            voice_id = save_original_voice(user_id, 0, voice_url, link_original_text_id=text_id)
+            voice_id = await asyncio.to_thread(save_original_voice, user_id, 0, voice_url, link_original_text_id=text_id)
             logging.info(f"✅ [Upload] 记录已存入数据库, ID={voice_id}, text_id={text_id}, URL={voice_url}")
         except Exception as e:
             logging.error(f"❌ [Upload] 数据库保存失败: {e}")
@@ -821,36 +892,67 @@ async def upload_voice_endpoint(
         return JSONResponse(status_code=500, content={"code": 500, "message": str(e)})
 
 
-@app.get("/tts/stream")
-async def tts_stream_endpoint(text: str):
+@app.api_route("/tts/stream", methods=["GET", "HEAD"])
+async def tts_stream_endpoint(request: Request, text: str, format: str = "mp3"):
     """
     TTS流式HTTP端点（备用方案）
     
-    使用HTTP流式响应返回音频数据。
+    使用HTTP分块响应返回音频数据，上游每到一段音频即下发。
     这是WebSocket TTS的备用方案，当WebSocket不可用时使用。
     
     参数:
         text: 需要合成的文本
+        format: 音频格式 mp3 (默认) / ogg_opus / pcm (24kHz 16bit 单声道)
     
     返回:
-        StreamingResponse: 流式音频数据（audio/mpeg）
+        未缓存: StreamingResponse 流式音频数据
+        已缓存: 文件响应，支持 HEAD / Range
     
     注意:
-        此端点使用全局连接池，支持连接复用以减少延迟。
+        此端点使用 HTTP 单向接口与共享连接池，不占用访谈的双向流连接；
+        并发受 tts_http_max_concurrent 限制，名额不足时返回 503。
     """
-    async def audio_generator():
-        global global_tts_client
-        if not global_tts_client:
-            global_tts_client = VolcTTSClient()
-        
-        try:
-            # 使用持久连接（synthesize_stream内部有锁保护）
-            async for chunk in global_tts_client.synthesize_stream(text, keep_alive=True):
-                yield chunk
-        except Exception as e:
-            logging.error(f"TTS流错误: {e}")
+    from .tts_http_service import (
+        TTS_FORMATS, TTS_HTTP_MAX_TEXT_CHARS, TTSBusyError,
+        cache_key, cached_path, acquire_slot, stream_and_cache, TTSStreamingResponse
+    )
+    
+    text = text.strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="text 不能为空")
+    if len(text) > TTS_HTTP_MAX_TEXT_CHARS:
+        raise HTTPException(status_code=400, detail=f"text 不能超过 {TTS_HTTP_MAX_TEXT_CHARS} 字")
+    if format not in TTS_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的格式: {format}")
+    
+    media_type = TTS_FORMATS[format][0]
+    key = cache_key(text, format)
+    
+    # 已缓存：FileResponse 处理 HEAD / Range / ETag
+    path = await asyncio.to_thread(cached_path, key, format)
+    if path:
+        return FileResponse(path, media_type=media_type, headers={"X-TTS-Cache": "hit"})
+    
+    # 未缓存的 HEAD 不触发合成
+    if request.method == "HEAD":
+        return Response(media_type=media_type, headers={"X-TTS-Cache": "miss"})
     
-    return StreamingResponse(audio_generator(), media_type="audio/mpeg")
+    try:
+        slot = await acquire_slot()
+    except TTSBusyError:
+        raise HTTPException(status_code=503, detail="TTS 繁忙，请稍后重试", headers={"Retry-After": "1"})
+    
+    global global_tts_client
+    if not global_tts_client:
+        global_tts_client = VolcTTSClient()
+    
+    # 名额由 TTSStreamingResponse 保证释放 (含响应体未开始即断开的情况)
+    return TTSStreamingResponse(
+        stream_and_cache(global_tts_client, slot, text, format, key),
+        slot,
+        media_type=media_type,
+        headers={"X-TTS-Cache": "miss", "Cache-Control": "no-store"}
+    )
 
 
 @app.websocket("/ws/asr")
@@ -883,6 +985,24 @@ async def asr_websocket_endpoint(websocket: WebSocket):
         logging.info("WebSocket /ws/asr 连接关闭")
 
 
+@app.websocket("/ws/voice")
+async def voice_websocket_endpoint(websocket: WebSocket):
+    """
+    双工语音 WebSocket 端点
+
+    一条连接内完成: PCM 上行 → ASR → 服务端端点检测 → Intv → TTS 下行。
+    消息格式见 voice_session_service.VoiceSession。
+    """
+    await websocket.accept()
+    logging.info("WebSocket /ws/voice 连接已接受")
+    try:
+        await VoiceSession(websocket, global_tts_client).run()
+    except Exception as e:
+        logging.error(f"[Voice] WebSocket 错误: {e}")
+    finally:
+        logging.info("WebSocket /ws/voice 连接关闭")
+
+
 # ============================================================================
 # v3.3 WebSocket 端点
 # ============================================================================
@@ -902,6 +1022,7 @@ async def chat_websocket_v33_endpoint(websocket: WebSocket):
             "text": "用户输入文本",
             "has_voice": false
         }
+        {"type": "interrupt"}  (可选，打断当前回复)
     
     发送（服务器→客户端）:
         - 开始: {"type": "start"}
@@ -909,6 +1030,7 @@ async def chat_websocket_v33_endpoint(websocket: WebSocket):
         - 音频: {"type": "audio", "data": "<base64>"}
         - 完成: {"type": "done", "full_text": "..."}
         - 错误: {"type": "error", "message": "..."}
+        - 已打断: {"type": "interrupted"}
     """
     logging.info("[v3.3] ===== 新的 WebSocket 连接请求 =====")
     await websocket.accept()
@@ -917,7 +1039,7 @@ async def chat_websocket_v33_endpoint(websocket: WebSocket):
     try:
         # 接收客户端消息
         data = await websocket.receive_json()
-        logging.info(f"[v3.3] 收到数据: {data}")
+        logging.debug(f"[v3.3] 收到数据: {str(data)[:200]}")
         
         user_id = data.get("user_id")
         user_text = data.get("text", "")
@@ -933,124 +1055,29 @@ async def chat_websocket_v33_endpoint(websocket: WebSocket):
         
         logging.info(f"[v3.3] 用户输入: {user_text[:50]}...")
         
-        # --- TTS Streaming Setup ---
-        text_queue = asyncio.Queue()
-        
-        async def text_iterator():
-            while True:
-                chunk = await text_queue.get()
-                if chunk is None:
-                    break
-                yield chunk
-
-        # Start TTS Task
-        tts_generator = global_tts_client.synthesize_stream_v3(text_iterator())
-        
-        # Audio Receiver Task: Sends audio to Frontend & Accumulates for Saving
-        full_audio_buffer = bytearray()
-        
-        async def tts_receiver_task():
-            nonlocal full_audio_buffer
-            try:
-                # We need to send "start" signal for audio? No, frontend handles it.
-                async for audio_chunk in tts_generator:
-                    if audio_chunk:
-                         full_audio_buffer.extend(audio_chunk)
-                         # Convert to base64 for websocket
-                         b64_data = base64.b64encode(audio_chunk).decode('utf-8')
-                         logging.info(f"[v3.3 DEBUG] Sending audio chunk to FE: {len(audio_chunk)} bytes (b64 len: {len(b64_data)})")
-                         await websocket.send_json({"type": "audio", "data": b64_data})
-            except Exception as e:
-                logging.error(f"[v3.3] TTS Receiver Error: {e}")
-
-        tts_task = asyncio.create_task(tts_receiver_task())
-        
-        # --- Main LLM Loop ---
-        ai_text_id = None
-        full_ai_response = ""
-        sentence_buffer = ""
-        
-        async for event in process_user_input(user_id, user_text, has_voice):
-            event_type = event.get("type")
-            
-            if event_type == "start":
-                await websocket.send_json({"type": "start"})
-
-            elif event_type == "session_id":
-                await websocket.send_json({"type": "session_id", "session_id": event.get("session_id")})
-            
-            elif event_type == "user_text_id":
-                await websocket.send_json({"type": "user_text_id", "text_id": event.get("text_id")})
-            
-            elif event_type == "text":
-                chunk = event.get("content", "")
-                full_ai_response += chunk
-                
-                # Send text to frontend
-                await websocket.send_json({"type": "text", "content": chunk})
-                
-                # Buffer sentences to avoid TTS stuttering
-                if chunk:
-                    sentence_buffer += chunk
-                    if any(p in sentence_buffer for p in "。！？；\n") or len(sentence_buffer) >= 60:
-                        await text_queue.put(sentence_buffer)
-                        sentence_buffer = ""
-            
-            elif event_type == "done":
-                ai_text_id = event.get("ai_text_id")
-                # Flush remaining buffer
-                if sentence_buffer:
-                    await text_queue.put(sentence_buffer)
-                # Signal TTS to finish
-                await text_queue.put(None) 
-                
-            elif event_type == "error":
-                await websocket.send_json({"type": "error", "message": event.get("message")})
-                await text_queue.put(None) # Ensure TTS stops
-                return
-        
-        # Wait for TTS to finish
-        await tts_task
-        
-        # --- Post-process: Save Audio to COS & DB ---
-        if full_audio_buffer and ai_text_id:
-            try:
-                from datetime import datetime
-                from io import BytesIO
-                from pydub import AudioSegment
-                from .cos_service import upload_audio_to_cos
-                from .interview_service import save_original_voice
-                
-                logging.info(f"[v3.4] PCM 转换 MP3 中... 大小: {len(full_audio_buffer)} bytes")
-                
-                # 1. 将 raw PCM 转为 AudioSegment
-                # 采样率需与 TTS 配置一致 (24000), 16bit(sample_width=2), 单声道
-                audio_segment = AudioSegment(
-                    data=bytes(full_audio_buffer),
-                    sample_width=2,
-                    frame_rate=24000,
-                    channels=1
-                )
-                
-                # 2. 导出为 MP3
-                mp3_fp = BytesIO()
-                audio_segment.export(mp3_fp, format="mp3", bitrate="128k")
-                mp3_data = mp3_fp.getvalue()
-                
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-                filename = f"tts/{user_id}/{timestamp}.mp3"
-                
-                # 3. 上传 MP3 到 COS
-                audio_url = upload_audio_to_cos(mp3_data, filename)
-                
-                if audio_url:
-                    save_original_voice(user_id, speaker_type=1, audio_url=audio_url, link_original_text_id=ai_text_id)
-                    logging.info(f"[v3.4] PCM 转档成功并保存: {audio_url} (MP3 大小: {len(mp3_data)})")
-            except Exception as e:
-                logging.error(f"[v3.4] Audio Save/Convert Error: {e}")
-        
-        await websocket.send_json({"type": "text_finish"})
-            
+        # Intv 流式输出 + TTS 流式合成 (音频在后台转存 COS)
+        # 同时监听客户端 interrupt / 断开，先到者取消本轮 (停止 LLM 与 TTS)
+        turn_task = asyncio.create_task(
+            run_interview_turn(websocket.send_json, global_tts_client, user_id, user_text, has_voice)
+        )
+        interrupt_task = asyncio.create_task(wait_for_interrupt(websocket))
+        try:
+            await asyncio.wait({turn_task, interrupt_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not turn_task.done():
+                turn_task.cancel()
+            interrupt_task.cancel()
+            await asyncio.gather(turn_task, interrupt_task, return_exceptions=True)
+
+        if turn_task.cancelled():
+            reason = "cancelled"
+            if interrupt_task.done() and not interrupt_task.cancelled() and not interrupt_task.exception():
+                reason = interrupt_task.result()
+            logging.info(f"[v3.3] 本轮已取消: {reason}")
+            if reason == "interrupt":
+                await websocket.send_json({"type": "interrupted"})
+            return
+        turn_task.result()
 
         logging.info("[v3.3] 对话完成")
         
@@ -10,14 +10,32 @@ Narration Service (讲述状态管理服务)
 - 对话缓存池 (chat_cachepool_content) 的读写
 - Session 有效性检查 (字数/时间/ID)
 
+Hint 推送:
+  Dir 写入 hint 后经消息总线 (coordination_service.publish，跨 worker 走 NOTIFY)
+  更新各进程的 hint 缓存，Intv 每轮只读内存，冷启动才查询 hintboard。
+
+常驻状态 (write-behind):
+  user_actor_service 为活跃用户调用 attach_resident_state 后，本模块对该用户
+  narration_status 的读写都在内存中完成，由 actor 定期 flush_resident_state 批量落库，
+  空闲淘汰时 detach_resident_state 最后落库一次。未常驻的用户照旧直接读写数据库。
+  常驻期间持有该用户的所有权 (跨 worker 的 advisory lock)，最后一次落库后才释放；
+  接管方取得所有权后再加载，保证读到的是前一个持有者落库后的状态。
+
 根据《服务端流程文档与数据库结构设计 v3.3》设计。
 """
 
 import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any, Tuple
 from .database import get_db_connection
 from .config_manager import get_config
+from .coordination_service import (
+    register_invalidation, subscribe_bus, publish,
+    acquire_user_ownership, release_user_ownership,
+)
 
 logging.basicConfig(level=logging.INFO)
 
@@ -33,6 +51,14 @@ def get_or_create_narration_status(user_id: str) -> Dict[str, Any]:
     如果用户没有记录则创建一条新记录
     返回完整的 narration_status 字典
     """
+    with _resident(user_id) as state:
+        if state is not None:
+            return dict(state.status)
+    return _load_narration_status(user_id)
+
+
+def _load_narration_status(user_id: str) -> Dict[str, Any]:
+    """从数据库读取 (不存在则创建) narration_status"""
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
@@ -79,7 +105,7 @@ def get_or_create_narration_status(user_id: str) -> Dict[str, Any]:
             logging.info(f"✅ 创建用户讲述状态: user_id={user_id}")
             
             # 返回新建的记录
-            return get_or_create_narration_status(user_id)
+            return _load_narration_status(user_id)
 
 
 def _row_to_dict(row) -> Dict[str, Any]:
@@ -205,49 +231,37 @@ def update_intv_session(
     Args:
         reset: 如果为 True，则重置 session 相关字段
     """
-    updates = []
-    params = []
+    sets = {}
+    increments = {}
     
     if reset:
         expire_duration = int(get_config('intv_llm_session_expire_duration', default=3600))
-        new_expire_at = datetime.now(timezone.utc) + timedelta(seconds=expire_duration)
-        
-        updates.extend([
-            "intv_llm_session_id = NULL",
-            "intv_llm_session_word_count = 0",
-            "intv_llm_session_expire_at = %s",
-            "intv_llm_session_previous_response_id = NULL"
-        ])
-        params.append(new_expire_at)
+        sets.update({
+            'intv_llm_session_id': None,
+            'intv_llm_session_word_count': 0,
+            'intv_llm_session_expire_at': datetime.now(timezone.utc) + timedelta(seconds=expire_duration),
+            'intv_llm_session_previous_response_id': None,
+        })
     else:
         if session_id is not None:
-            updates.append("intv_llm_session_id = %s")
-            params.append(session_id)
+            sets['intv_llm_session_id'] = session_id
         
         if word_count_delta is not None:
-            updates.append("intv_llm_session_word_count = intv_llm_session_word_count + %s")
-            params.append(word_count_delta)
+            increments['intv_llm_session_word_count'] = word_count_delta
         
         if expire_at is not None:
-            updates.append("intv_llm_session_expire_at = %s")
-            params.append(expire_at)
+            sets['intv_llm_session_expire_at'] = expire_at
         
         if previous_response_id is not None:
-            updates.append("intv_llm_session_previous_response_id = %s")
-            params.append(previous_response_id)
+            sets['intv_llm_session_previous_response_id'] = previous_response_id
     
     if previous_content is not None:
-        updates.append("intv_llm_previous_content = %s")
-        params.append(previous_content)
+        sets['intv_llm_previous_content'] = previous_content
     
     if hint_id is not None:
-        updates.append("intv_llm_hint_id = %s")
-        params.append(hint_id)
+        sets['intv_llm_hint_id'] = hint_id
     
-    if updates:
-        params.append(user_id)
-        _execute_update(updates, params)
-
+    _apply_update(user_id, sets, increments)
 
 def update_stn_session(
     user_id: str,
@@ -259,44 +273,34 @@ def update_stn_session(
     reset: bool = False
 ):
     """更新 Stn Session 状态"""
-    updates = []
-    params = []
+    sets = {}
+    increments = {}
     
     if reset:
         expire_duration = int(get_config('stn_llm_session_expire_duration', default=3600))
-        new_expire_at = datetime.now(timezone.utc) + timedelta(seconds=expire_duration)
-        
-        updates.extend([
-            "stn_llm_session_id = NULL",
-            "stn_llm_session_word_count = 0",
-            "stn_llm_session_expire_at = %s",
-            "stn_llm_session_previous_response_id = NULL"
-        ])
-        params.append(new_expire_at)
+        sets.update({
+            'stn_llm_session_id': None,
+            'stn_llm_session_word_count': 0,
+            'stn_llm_session_expire_at': datetime.now(timezone.utc) + timedelta(seconds=expire_duration),
+            'stn_llm_session_previous_response_id': None,
+        })
     else:
         if session_id is not None:
-            updates.append("stn_llm_session_id = %s")
-            params.append(session_id)
+            sets['stn_llm_session_id'] = session_id
         
         if word_count_delta is not None:
-            updates.append("stn_llm_session_word_count = stn_llm_session_word_count + %s")
-            params.append(word_count_delta)
+            increments['stn_llm_session_word_count'] = word_count_delta
         
         if expire_at is not None:
-            updates.append("stn_llm_session_expire_at = %s")
-            params.append(expire_at)
+            sets['stn_llm_session_expire_at'] = expire_at
         
         if previous_response_id is not None:
-            updates.append("stn_llm_session_previous_response_id = %s")
-            params.append(previous_response_id)
+            sets['stn_llm_session_previous_response_id'] = previous_response_id
     
     if unprocessed_content is not None:
-        updates.append("stn_unprocessed_content = %s")
-        params.append(unprocessed_content)
+        sets['stn_unprocessed_content'] = unprocessed_content
     
-    if updates:
-        params.append(user_id)
-        _execute_update(updates, params)
+    _apply_update(user_id, sets, increments)
 
 
 def update_dir_session(
@@ -308,40 +312,57 @@ def update_dir_session(
     reset: bool = False
 ):
     """更新 Dir Session 状态"""
-    updates = []
-    params = []
+    sets = {}
+    increments = {}
     
     if reset:
         expire_duration = int(get_config('dir_llm_session_expire_duration', default=3600))
-        new_expire_at = datetime.now(timezone.utc) + timedelta(seconds=expire_duration)
-        
-        updates.extend([
-            "dir_llm_session_id = NULL",
-            "dir_llm_session_word_count = 0",
-            "dir_llm_session_expire_at = %s",
-            "dir_llm_session_previous_response_id = NULL"
-        ])
-        params.append(new_expire_at)
+        sets.update({
+            'dir_llm_session_id': None,
+            'dir_llm_session_word_count': 0,
+            'dir_llm_session_expire_at': datetime.now(timezone.utc) + timedelta(seconds=expire_duration),
+            'dir_llm_session_previous_response_id': None,
+        })
     else:
         if session_id is not None:
-            updates.append("dir_llm_session_id = %s")
-            params.append(session_id)
+            sets['dir_llm_session_id'] = session_id
         
         if word_count_delta is not None:
-            updates.append("dir_llm_session_word_count = dir_llm_session_word_count + %s")
-            params.append(word_count_delta)
+            increments['dir_llm_session_word_count'] = word_count_delta
         
         if expire_at is not None:
-            updates.append("dir_llm_session_expire_at = %s")
-            params.append(expire_at)
+            sets['dir_llm_session_expire_at'] = expire_at
         
         if previous_response_id is not None:
-            updates.append("dir_llm_session_previous_response_id = %s")
-            params.append(previous_response_id)
+            sets['dir_llm_session_previous_response_id'] = previous_response_id
     
-    if updates:
-        params.append(user_id)
-        _execute_update(updates, params)
+    _apply_update(user_id, sets, increments)
+
+
+def _apply_update(user_id: str, sets: Dict[str, Any], increments: Dict[str, int]):
+    """
+    应用字段更新：常驻用户只改内存并标记脏字段，否则直接 UPDATE
+
+    Args:
+        sets: 列名 -> 新值 (None 写入 NULL)
+        increments: 列名 -> 增量
+    """
+    if not sets and not increments:
+        return
+    
+    with _resident(user_id) as state:
+        if state is not None:
+            state.status.update(sets)
+            for column, delta in increments.items():
+                state.status[column] = (state.status.get(column) or 0) + delta
+            state.dirty.update(sets)
+            state.dirty.update(increments)
+            return
+    
+    updates = [f"{column} = %s" for column in sets]
+    updates += [f"{column} = {column} + %s" for column in increments]
+    params = list(sets.values()) + list(increments.values()) + [user_id]
+    _execute_update(updates, params)
 
 
 def _execute_update(updates: list, params: list):
@@ -370,6 +391,14 @@ def append_cachepool(user_id: str, speaker: str, text: str) -> int:
     """
     formatted = f"{speaker}:{text} "
     
+    with _resident(user_id) as state:
+        if state is not None:
+            content = (state.status.get('chat_cachepool_content') or '') + formatted
+            state.status['chat_cachepool_content'] = content
+            state.dirty.add('chat_cachepool_content')
+            logging.info(f"📝 缓存池追加: {speaker}:{text[:20]}... (总字数: {len(content)})")
+            return len(content)
+    
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
@@ -398,6 +427,15 @@ def take_cachepool_snapshot(user_id: str) -> Optional[str]:
     Returns:
         缓存池快照内容，如果为空返回 None
     """
+    with _resident(user_id) as state:
+        if state is not None:
+            content = state.status.get('chat_cachepool_content') or None
+            if content:
+                state.status['chat_cachepool_content'] = None
+                state.dirty.add('chat_cachepool_content')
+                logging.info(f"📸 缓存池快照: {len(content)} 字符")
+            return content
+    
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
@@ -433,10 +471,13 @@ def take_cachepool_snapshot(user_id: str) -> Optional[str]:
             return content
 
 
-def check_cachepool_threshold(user_id: str) -> Tuple[bool, int]:
+def check_cachepool_threshold(user_id: str, threshold: Optional[int] = None) -> Tuple[bool, int]:
     """
     检测缓存池是否达到触发阈值
     
+    Args:
+        threshold: 生效阈值 (stn_batching_service 按负载计算)，默认取 cache_pool_limit
+    
     Returns:
         (是否触发, 当前字数)
     """
@@ -444,7 +485,8 @@ def check_cachepool_threshold(user_id: str) -> Tuple[bool, int]:
     content = status.get('chat_cachepool_content') or ''
     current_len = len(content)
     
-    threshold = int(get_config('cache_pool_limit', default=200))
+    if threshold is None:
+        threshold = int(get_config('cache_pool_limit', default=200))
     should_trigger = current_len >= threshold
     
     if should_trigger:
@@ -500,9 +542,24 @@ def get_latest_hint(user_id: str) -> Tuple[Optional[int], Optional[str]]:
     """
     获取用户最新的 hint
     
+    读内存缓存：Dir 写入新 hint 时经消息总线推送 (含其他 worker)，
+    只有冷启动 (缓存中没有该用户) 才查询 hintboard。
+    
     Returns:
         (hint_id, hint_content)
     """
+    with _hint_cache_lock:
+        hint = _hint_cache.get(user_id)
+        if hint is not None:
+            _hint_cache.move_to_end(user_id)
+            _hint_stats['hits'] += 1
+            return hint
+        _hint_stats['loads'] += 1
+    
+    return _store_hint(user_id, _load_latest_hint(user_id))
+
+
+def _load_latest_hint(user_id: str) -> Tuple[Optional[int], Optional[str]]:
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
@@ -560,6 +617,225 @@ def insert_hint(user_id: str, hint_content: str) -> int:
             
             hint_id = cursor.fetchone()[0]
             conn.commit()
-            
-            logging.info(f"💡 插入 Hint: hint_id={hint_id}")
-            return hint_id
+    
+    logging.info(f"💡 插入 Hint: hint_id={hint_id}")
+    
+    # 推送给本进程与其他 worker 的 Intv；NOTIFY 放不下 (按序列化后的信封计算) 或
+    # 发送失败时只推送 id，接收方丢弃旧缓存后回源读取
+    _store_hint(user_id, (hint_id, hint_content))
+    publish(
+        HINT_CHANNEL,
+        {'u': user_id, 'id': hint_id, 'c': hint_content},
+        fallback={'u': user_id, 'id': hint_id, 'c': None}
+    )
+    return hint_id
+
+
+# ============================================================================
+# Hint 缓存 (推送更新)
+# ============================================================================
+
+HINT_CHANNEL = "hint_updated"
+HINT_CACHE_MAX_USERS = 10000
+
+_hint_cache: "OrderedDict[str, Tuple[Optional[int], Optional[str]]]" = OrderedDict()
+_hint_cache_lock = threading.Lock()
+_hint_stats = {'hits': 0, 'loads': 0, 'pushed': 0}   # 与缓存同在 _hint_cache_lock 下更新
+
+
+def _is_older(hint_id: Optional[int], than_id: Optional[int]) -> bool:
+    return than_id is not None and (hint_id is None or hint_id < than_id)
+
+
+def _store_hint(user_id: str, hint: Tuple[Optional[int], Optional[str]]) -> Tuple[Optional[int], Optional[str]]:
+    """写入缓存 (不会用旧 hint 覆盖新 hint)，返回缓存中的最终值"""
+    with _hint_cache_lock:
+        cached = _hint_cache.get(user_id)
+        if cached is not None and _is_older(hint[0], cached[0]):
+            return cached
+        _hint_cache[user_id] = hint
+        _hint_cache.move_to_end(user_id)
+        while len(_hint_cache) > HINT_CACHE_MAX_USERS:
+            _hint_cache.popitem(last=False)
+        return hint
+
+
+def _on_hint_published(message: Dict[str, Any]):
+    user_id, hint_id = message.get('u'), message.get('id')
+    if not user_id or hint_id is None:
+        return
+    with _hint_cache_lock:
+        _hint_stats['pushed'] += 1
+    if message.get('c') is not None:
+        _store_hint(user_id, (hint_id, message['c']))
+        return
+    with _hint_cache_lock:
+        cached = _hint_cache.get(user_id)
+        if cached is not None and _is_older(cached[0], hint_id):
+            del _hint_cache[user_id]
+
+
+def _forget_hints(user_id: Optional[str]):
+    with _hint_cache_lock:
+        if user_id:
+            _hint_cache.pop(user_id, None)
+        else:
+            _hint_cache.clear()
+
+
+def get_hint_cache_stats() -> Dict[str, Any]:
+    with _hint_cache_lock:
+        stats = dict(_hint_stats)
+        stats['cached_users'] = len(_hint_cache)
+    return stats
+
+
+subscribe_bus(HINT_CHANNEL, _on_hint_published)
+
+
+# ============================================================================
+# 常驻状态 (write-behind)
+# ============================================================================
+
+class _ResidentState:
+    """单个用户的内存状态；status / dirty 只在持有 lock 时读写"""
+
+    def __init__(self, status: Dict[str, Any]):
+        self.status = status
+        self.dirty: set = set()
+        self.detached = False
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()   # 串行化落库，避免旧快照覆盖新值
+
+
+RESIDENT_CLAIM_TIMEOUT_SEC = 5.0    # 等待前一个持有者落库并交出所有权的上限
+
+_resident_states: Dict[str, _ResidentState] = {}
+_resident_states_lock = threading.Lock()
+
+
+@contextmanager
+def _resident(user_id: str):
+    """持有常驻状态的锁；用户未常驻 (或已卸载) 时给出 None"""
+    state = _resident_states.get(user_id)
+    if state is None:
+        yield None
+        return
+    with state.lock:
+        yield None if state.detached else state
+
+
+def is_resident(user_id: str) -> bool:
+    return user_id in _resident_states
+
+
+def attach_resident_state(user_id: str, timeout: float = RESIDENT_CLAIM_TIMEOUT_SEC) -> bool:
+    """
+    取得用户所有权后从数据库加载状态并常驻内存 (已常驻则忽略)
+
+    前一个持有者 (其他 worker) 在 detach_resident_state 最后落库后才释放所有权，
+    因此这里加载到的一定是其落库后的状态。
+
+    Returns:
+        是否常驻；timeout 秒内未取得所有权时返回 False，该用户照旧直接读写数据库
+    """
+    if user_id in _resident_states:
+        return True
+    if not acquire_user_ownership(user_id, timeout):
+        logging.warning(f"⚠️ 等待用户所有权超时，直接读写数据库: user={user_id[:8]}...")
+        return False
+    try:
+        status = _load_narration_status(user_id)
+    except Exception:
+        release_user_ownership(user_id)
+        raise
+    with _resident_states_lock:
+        raced = user_id in _resident_states
+        if not raced:
+            _resident_states[user_id] = _ResidentState(status)
+    if raced:
+        # 同进程并发加载：所有权按次数叠加，归还多取的一次
+        release_user_ownership(user_id)
+    return True
+
+
+def _write_columns(user_id: str, values: Dict[str, Any]):
+    updates = [f"{column} = %s" for column in values]
+    _execute_update(updates, list(values.values()) + [user_id])
+
+
+def flush_resident_state(user_id: str) -> int:
+    """
+    把脏字段批量写回数据库 (一条 UPDATE)
+
+    Returns:
+        写入的列数
+    """
+    state = _resident_states.get(user_id)
+    if state is None:
+        return 0
+    with state.flush_lock:
+        with state.lock:
+            if state.detached or not state.dirty:
+                return 0
+            values = {column: state.status.get(column) for column in state.dirty}
+            state.dirty = set()
+        try:
+            _write_columns(user_id, values)
+        except Exception:
+            # 写入失败：重新标记，下次 flush 以最新值重试
+            with state.lock:
+                state.dirty.update(values)
+            raise
+    return len(values)
+
+
+def detach_resident_state(user_id: str) -> int:
+    """
+    最后一次落库并卸载常驻状态，然后释放所有权；之后该用户的读写回到数据库
+
+    落库期间持有状态锁，避免卸载后直接写库的更新被旧值覆盖。
+
+    Returns:
+        写入的列数
+    """
+    state = _resident_states.get(user_id)
+    if state is None:
+        return 0
+    with state.flush_lock, state.lock:
+        if state.detached:
+            return 0
+        state.detached = True
+        with _resident_states_lock:
+            if _resident_states.get(user_id) is state:
+                del _resident_states[user_id]
+        values = {column: state.status.get(column) for column in state.dirty}
+        state.dirty = set()
+        written = 0
+        if values:
+            try:
+                _write_columns(user_id, values)
+                written = len(values)
+            except Exception as e:
+                logging.error(f"❌ 常驻状态落库失败，丢弃 {len(values)} 个字段: {e}")
+    # 落库之后才交出所有权，接管方此时加载到的是最新状态
+    release_user_ownership(user_id)
+    return written
+
+
+def get_resident_count() -> int:
+    return len(_resident_states)
+
+
+def _on_narration_invalidated(user_id: str):
+    """
+    其他 worker 接管了该用户 (或删除了其数据)：落库并卸载本进程的常驻状态
+
+    payload 为空 (监听断线重连) 时卸载全部，并清空 hint 缓存 (断线期间的推送可能丢失)。
+    """
+    for uid in ([user_id] if user_id else list(_resident_states)):
+        detach_resident_state(uid)
+    _forget_hints(user_id or None)
+
+
+register_invalidation('narration', _on_narration_invalidated)
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Partition Service (日志表按月分区 / 归档 / 恢复)
+============================================================================
+
+llm_processed / asr_processed / tts_processed / interview_original_text
+按 created_time 做 RANGE 分区，每月一个分区 ({table}_pYYYYMM)，另有
+{table}_default 兜底。维护任务负责：
+
+1. 提前创建未来 PARTITION_MONTHS_AHEAD 个月的分区
+2. 超过保留期的冷分区导出为 NDJSON (zstd 压缩，未安装时 gzip) 后 DETACH + DROP
+3. 按需把归档文件恢复为分区 (恢复的分区打上标记，不会被再次自动归档)
+
+归档后分区被删除，归档文件是唯一副本，因此第 2 步需显式开启：
+- 环境变量 PARTITION_ARCHIVE_DIR 指向已存在的目录
+- 该目录须是持久存储 (与程序所在文件系统不同，即挂载的数据卷)；
+  裸机部署可设置 PARTITION_ARCHIVE_PERSISTENT=1 声明其持久
+未满足时只创建分区，不删除任何数据。interview_original_text 为用户原文，不自动归档。
+
+已有表的转换见根目录 migrate_partition_log_tables.py。
+"""
+
+import io
+import os
+import re
+import gzip
+import asyncio
+import logging
+from datetime import date
+from typing import Dict, Any, List, Optional, Tuple
+from .database import get_db_connection
+
+try:
+    import zstandard as _zstd  # 可选依赖，未安装时退回 gzip
+except ImportError:
+    _zstd = None
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量
+# ============================================================================
+
+ARCHIVE_DIR = os.getenv("PARTITION_ARCHIVE_DIR") or None   # 未设置时不自动归档
+ARCHIVE_DIR_PERSISTENT = os.getenv("PARTITION_ARCHIVE_PERSISTENT", "").lower() in ("1", "true", "yes")
+PARTITION_MONTHS_AHEAD = 2                  # 提前创建的分区月数
+MAINTENANCE_INTERVAL_SEC = 6 * 3600         # 后台维护间隔
+MAINTENANCE_LOCK_KEY = 0x5041525449544e     # pg_advisory_lock key，多 worker 只跑一份
+RESTORED_MARK = "restored-from-archive"     # 恢复分区的表注释，维护任务跳过
+EXPORT_FETCH_SIZE = 2000
+RESTORE_BATCH_SIZE = 1000
+
+# 表名 -> 主键列 / 保留月数 (None 表示不自动归档) / 父表索引
+PARTITIONED_TABLES: Dict[str, Dict[str, Any]] = {
+    'llm_processed': {
+        'pk': 'model_processed_id',
+        'retention_months': 3,
+        'indexes': {
+            'idx_llm_processed_user_time': '(user_id, created_time DESC)',
+            'idx_llm_processed_user_agent_time': '(user_id, agent, created_time DESC)',
+            'idx_llm_processed_related_text': '(related_original_text_id)',
+        },
+    },
+    'asr_processed': {
+        'pk': 'processed_id',
+        'retention_months': 3,
+        'indexes': {
+            'idx_asr_processed_text': '(original_text_id)',
+        },
+    },
+    'tts_processed': {
+        'pk': 'processed_id',
+        'retention_months': 3,
+        'indexes': {
+            'idx_tts_processed_text': '(link_original_text_id)',
+        },
+    },
+    'interview_original_text': {
+        'pk': 'interview_original_text_id',
+        'retention_months': None,               # 用户原文，只分区不自动归档
+        'indexes': {
+            'idx_interview_text_user_time': '(user_id, created_time DESC)',
+        },
+    },
+}
+
+_PARTITION_RE = re.compile(r'^(?P<table>[a-z_]+)_p(?P<month>\d{6})$')
+
+
+# ============================================================================
+# 工具函数
+# ============================================================================
+
+def _month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def _add_months(d: date, n: int) -> date:
+    years, month_index = divmod(d.month - 1 + n, 12)
+    return date(d.year + years, month_index + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def parse_month(value: str) -> date:
+    """'202601' / '2026-01' -> date(2026, 1, 1)"""
+    digits = value.replace('-', '')
+    if not re.fullmatch(r'\d{6}', digits):
+        raise ValueError(f"月份格式错误: {value}")
+    return date(int(digits[:4]), int(digits[4:]), 1)
+
+
+def _check_table(table: str):
+    if table not in PARTITIONED_TABLES:
+        raise ValueError(f"不支持分区的表: {table}")
+
+
+def archive_unavailable_reason() -> Optional[str]:
+    """归档目录不可用于归档 + 删除分区的原因；可用时返回 None"""
+    if not ARCHIVE_DIR:
+        return "未设置 PARTITION_ARCHIVE_DIR"
+    if not os.path.isdir(ARCHIVE_DIR):
+        return f"归档目录不存在: {ARCHIVE_DIR}"
+    if not os.access(ARCHIVE_DIR, os.W_OK):
+        return f"归档目录不可写: {ARCHIVE_DIR}"
+    # 与程序同一文件系统 (容器内即镜像层)，重建容器后归档文件随之丢失
+    if not ARCHIVE_DIR_PERSISTENT and os.stat(ARCHIVE_DIR).st_dev == os.stat(os.path.dirname(__file__)).st_dev:
+        return f"归档目录与程序在同一文件系统，可能不是持久存储: {ARCHIVE_DIR} (确认持久可设置 PARTITION_ARCHIVE_PERSISTENT=1)"
+    return None
+
+
+def _archive_path(table: str, month: date) -> str:
+    ext = "ndjson.zst" if _zstd else "ndjson.gz"
+    return os.path.join(ARCHIVE_DIR, table, f"{partition_name(table, month)}.{ext}")
+
+
+def _find_archive(table: str, month: date) -> Optional[str]:
+    if not ARCHIVE_DIR:
+        return None
+    base = os.path.join(ARCHIVE_DIR, table, partition_name(table, month))
+    for ext in ("ndjson.zst", "ndjson.gz"):
+        if os.path.exists(f"{base}.{ext}"):
+            return f"{base}.{ext}"
+    return None
+
+
+def _open_archive(path: str, mode: str):
+    """按扩展名打开压缩文件 (文本模式)"""
+    if path.endswith(".zst"):
+        if not _zstd:
+            raise RuntimeError("归档文件为 zstd 格式，但未安装 zstandard")
+        raw = open(path, mode + 'b')
+        if mode == 'w':
+            stream = _zstd.ZstdCompressor(level=10).stream_writer(raw)
+        else:
+            stream = _zstd.ZstdDecompressor().stream_reader(raw)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return gzip.open(path, mode + 't', encoding='utf-8')
+
+
+def is_partitioned(cursor, table: str) -> bool:
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def list_partitions(cursor, table: str) -> List[Dict[str, Any]]:
+    """列出某表的所有月分区 (不含 default)"""
+    cursor.execute("""
+        SELECT c.relname, c.reltuples::BIGINT, obj_description(c.oid, 'pg_class')
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY c.relname
+    """, (table,))
+    partitions = []
+    for name, est_rows, comment in cursor.fetchall():
+        match = _PARTITION_RE.match(name)
+        if not match or match.group('table') != table:
+            continue
+        partitions.append({
+            'name': name,
+            'month': parse_month(match.group('month')),
+            'estimated_rows': max(est_rows, 0),
+            'restored': comment == RESTORED_MARK,
+        })
+    return partitions
+
+
+# ============================================================================
+# 分区创建 / 索引
+# ============================================================================
+
+def ensure_partitions(cursor, table: str, start: Optional[date] = None,
+                      months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """创建 [start, 当前月 + months_ahead] 范围内缺失的月分区及 default 分区"""
+    current = _month_start(date.today())
+    month = _month_start(start) if start else current
+    last = _add_months(current, months_ahead)
+    created = []
+
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT")
+    while month <= last:
+        name = partition_name(table, month)
+        cursor.execute("SELECT to_regclass(%s)", (name,))
+        if cursor.fetchone()[0] is None:
+            cursor.execute(
+                f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                (month, _add_months(month, 1))
+            )
+            created.append(name)
+        month = _add_months(month, 1)
+    return created
+
+
+def ensure_indexes(cursor, table: str):
+    """在父表上创建索引 (分区表会自动下发到所有分区)"""
+    for index_name, columns in PARTITIONED_TABLES[table]['indexes'].items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} {columns}")
+
+
+# ============================================================================
+# 归档 / 恢复
+# ============================================================================
+
+def archive_partition(table: str, month: date) -> Dict[str, Any]:
+    """
+    导出分区到压缩 NDJSON 后 DETACH + DROP
+
+    先完整写出文件并 fsync 后再删除分区；写文件失败时分区保持不变。
+
+    Raises:
+        RuntimeError: 归档目录未配置或不是持久存储 (见 archive_unavailable_reason)
+    """
+    _check_table(table)
+    reason = archive_unavailable_reason()
+    if reason:
+        raise RuntimeError(f"拒绝归档 {partition_name(table, month)}: {reason}")
+    name = partition_name(table, month)
+    path = _archive_path(table, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 临时文件保持相同扩展名，_open_archive 按扩展名选择压缩方式
+    tmp_path = os.path.join(os.path.dirname(path), ".tmp-" + os.path.basename(path))
+
+    rows = 0
+    with get_db_connection() as conn:
+        try:
+            with conn.cursor(name=f"export_{name}") as export_cursor:
+                export_cursor.itersize = EXPORT_FETCH_SIZE
+                export_cursor.execute(f"SELECT row_to_json(t)::TEXT FROM {name} t")
+                with _open_archive(tmp_path, 'w') as f:
+                    for (line,) in export_cursor:
+                        f.write(line)
+                        f.write("\n")
+                        rows += 1
+            # 落盘后才删除分区，掉电不会只剩一个空文件
+            with open(tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+            with conn.cursor() as cursor:
+                cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                cursor.execute(f"DROP TABLE {name}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    logging.info(f"📦 分区已归档: {name} -> {path} ({rows} 行)")
+    return {'partition': name, 'path': path, 'rows': rows}
+
+
+def restore_partition(table: str, month: date) -> Dict[str, Any]:
+    """把归档文件恢复为分区（标记为已恢复，维护任务不会自动再归档）"""
+    _check_table(table)
+    name = partition_name(table, month)
+    path = _find_archive(table, month)
+    if not path:
+        raise FileNotFoundError(f"未找到归档文件: {name}")
+
+    rows = 0
+    with get_db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT to_regclass(%s)", (name,))
+                if cursor.fetchone()[0] is not None:
+                    raise ValueError(f"分区 {name} 已存在")
+                cursor.execute(
+                    f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                    (month, _add_months(month, 1))
+                )
+
+                batch: List[str] = []
+
+                def _flush():
+                    cursor.execute(
+                        f"INSERT INTO {name} SELECT * FROM json_populate_recordset(NULL::{table}, %s::JSON)",
+                        ("[" + ",".join(batch) + "]",)
+                    )
+                    batch.clear()
+
+                with _open_archive(path, 'r') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        batch.append(line)
+                        rows += 1
+                        if len(batch) >= RESTORE_BATCH_SIZE:
+                            _flush()
+                if batch:
+                    _flush()
+
+                cursor.execute(f"COMMENT ON TABLE {name} IS %s", (RESTORED_MARK,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    logging.info(f"📂 分区已恢复: {path} -> {name} ({rows} 行)")
+    return {'partition': name, 'path': path, 'rows': rows}
+
+
+def list_archives(table: str) -> List[Dict[str, Any]]:
+    """列出某表的归档文件"""
+    if not ARCHIVE_DIR:
+        return []
+    folder = os.path.join(ARCHIVE_DIR, table)
+    if not os.path.isdir(folder):
+        return []
+    archives = []
+    for filename in sorted(os.listdir(folder)):
+        match = _PARTITION_RE.match(filename.split('.')[0])
+        if not match:
+            continue
+        archives.append({
+            'file': filename,
+            'month': parse_month(match.group('month')).strftime('%Y-%m'),
+            'size_bytes': os.path.getsize(os.path.join(folder, filename)),
+        })
+    return archives
+
+
+# ============================================================================
+# 维护任务
+# ============================================================================
+
+def run_partition_maintenance() -> Dict[str, Any]:
+    """
+    创建未来分区 + 归档超过保留期的分区
+
+    通过 pg_try_advisory_lock 保证多个 worker 同时只有一个在执行。
+    归档目录不可用时 (见 archive_unavailable_reason) 只创建分区。
+    """
+    summary: Dict[str, Any] = {
+        'created': [], 'archived': [], 'skipped_tables': [],
+        'archive_disabled': archive_unavailable_reason(),
+    }
+
+    with get_db_connection() as lock_conn:
+        with lock_conn.cursor() as lock_cursor:
+            lock_cursor.execute("SELECT pg_try_advisory_lock(%s)", (MAINTENANCE_LOCK_KEY,))
+            if not lock_cursor.fetchone()[0]:
+                logging.info("⏭️ 分区维护正在其它进程执行，跳过")
+                return summary
+        lock_conn.commit()
+
+        try:
+            current = _month_start(date.today())
+            to_archive: List[Tuple[str, date]] = []
+
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    for table, spec in PARTITIONED_TABLES.items():
+                        if not is_partitioned(cursor, table):
+                            summary['skipped_tables'].append(table)
+                            continue
+                        summary['created'].extend(ensure_partitions(cursor, table))
+                        ensure_indexes(cursor, table)
+
+                        if summary['archive_disabled'] or spec['retention_months'] is None:
+                            continue
+                        cutoff = _add_months(current, -spec['retention_months'])
+                        for part in list_partitions(cursor, table):
+                            if part['month'] < cutoff and not part['restored']:
+                                to_archive.append((table, part['month']))
+                conn.commit()
+
+            for table, month in to_archive:
+                try:
+                    summary['archived'].append(archive_partition(table, month))
+                except Exception as e:
+                    logging.error(f"❌ 归档分区失败 {partition_name(table, month)}: {e}")
+        finally:
+            with lock_conn.cursor() as lock_cursor:
+                lock_cursor.execute("SELECT pg_advisory_unlock(%s)", (MAINTENANCE_LOCK_KEY,))
+            lock_conn.commit()
+
+    if summary['archive_disabled']:
+        logging.info(f"⏭️ 未开启自动归档: {summary['archive_disabled']}")
+    if summary['skipped_tables']:
+        logging.info(f"⏭️ 以下表尚未分区，跳过维护: {summary['skipped_tables']}")
+    logging.info(f"✅ 分区维护完成: 新建 {len(summary['created'])} 个, 归档 {len(summary['archived'])} 个")
+    return summary
+
+
+async def partition_maintenance_loop():
+    """后台循环执行分区维护 (在 lifespan 中启动)"""
+    while True:
+        try:
+            await asyncio.to_thread(run_partition_maintenance)
+        except Exception as e:
+            logging.error(f"❌ 分区维护失败: {e}", exc_info=True)
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SEC)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Startup Service (启动预热与就绪状态)
+============================================================================
+
+冷启动分两段：
+
+1. lifespan 启动阶段只做必需且依赖数据库的工作 (init_db、后台线程)，
+   之后立即开始接受请求
+2. 其余预热 (TTS / ASR 连接池、Ark 客户端、配置 / 提示词 / 模型缓存)
+   在后台并发执行，互不等待；单项失败只记录，不影响其他项
+
+/ready 在全部预热结束前返回 503，供滚动发布 / 自动扩容判断何时接入流量；
+/ 健康检查不受影响。关键预热项 (critical) 失败时进入 degraded 阶段，/ready
+继续返回 503，并每隔 WARMUP_RETRY_SEC 秒重试失败的关键项，全部成功后转为 ready。启动耗时 (模块导入、lifespan、各预热项、总就绪时间)
+记录在 get_startup_stats()，同时输出到日志，便于对比优化前后的启动时间。
+"""
+
+import time
+import asyncio
+import logging
+from typing import Dict, Any, Callable, Optional, Iterable
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 启动状态
+# ============================================================================
+
+# 本模块由 main.py 最先导入，近似为进程开始加载应用的时间
+PROCESS_STARTED_AT = time.perf_counter()
+WARMUP_RETRY_SEC = 10
+
+_state: Dict[str, Any] = {
+    'phase': 'importing',       # importing / starting / warming / degraded / ready / stopping
+    'import_ms': None,
+    'lifespan_ms': None,
+    'ready_ms': None,           # 从开始加载到全部预热结束
+    'warmup': {},               # name -> {'ok', 'duration_ms', 'error'}
+}
+_lifespan_started_at: Optional[float] = None
+_warmup_task: Optional[asyncio.Task] = None
+
+
+def _elapsed_ms(since: float) -> int:
+    return int((time.perf_counter() - since) * 1000)
+
+
+def mark_imports_done():
+    """main.py 导入完成后调用"""
+    _state['import_ms'] = _elapsed_ms(PROCESS_STARTED_AT)
+    logging.info(f"🚀 模块导入完成: {_state['import_ms']}ms")
+
+
+def mark_lifespan_started():
+    global _lifespan_started_at
+    _lifespan_started_at = time.perf_counter()
+    _state['phase'] = 'starting'
+
+
+def mark_lifespan_ready():
+    """lifespan 必需步骤完成，开始接受请求"""
+    _state['lifespan_ms'] = _elapsed_ms(_lifespan_started_at or PROCESS_STARTED_AT)
+    logging.info(f"🚀 lifespan 启动完成: {_state['lifespan_ms']}ms，后台预热中")
+
+
+# ============================================================================
+# 并发预热
+# ============================================================================
+
+async def _run_step(name: str, step: Callable):
+    """执行单个预热项；同步函数放到线程中执行"""
+    started_at = time.perf_counter()
+    result = {'ok': True, 'duration_ms': None, 'error': None}
+    try:
+        if asyncio.iscoroutinefunction(step):
+            await step()
+        else:
+            await asyncio.to_thread(step)
+    except Exception as e:
+        result['ok'] = False
+        result['error'] = str(e)
+        logging.error(f"❌ 预热失败 ({name}): {e}")
+    result['duration_ms'] = _elapsed_ms(started_at)
+    _state['warmup'][name] = result
+
+
+def _failed_critical(critical: Iterable[str]) -> list:
+    return [name for name in critical if not _state['warmup'].get(name, {}).get('ok')]
+
+
+async def _run_warmup(steps: Dict[str, Callable], critical: Iterable[str]):
+    critical = [name for name in critical if name in steps]
+    await asyncio.gather(*(_run_step(name, step) for name, step in steps.items()))
+
+    failed = [name for name, r in _state['warmup'].items() if not r['ok']]
+    logging.info(
+        f"🚀 预热完成: 耗时 {_elapsed_ms(PROCESS_STARTED_AT)}ms "
+        f"(导入 {_state['import_ms']}ms, lifespan {_state['lifespan_ms']}ms)"
+        f"{'，失败项: ' + ', '.join(failed) if failed else ''}"
+    )
+
+    # 关键项失败：保持未就绪 (degraded) 并重试，直到全部成功
+    while _state['phase'] in ('warming', 'degraded'):
+        pending = _failed_critical(critical)
+        if not pending:
+            _state['ready_ms'] = _elapsed_ms(PROCESS_STARTED_AT)
+            _state['phase'] = 'ready'
+            logging.info(f"🚀 服务就绪: {_state['ready_ms']}ms")
+            return
+        if _state['phase'] != 'degraded':
+            _state['phase'] = 'degraded'
+            logging.error(f"❌ 关键预热项失败，/ready 保持 503: {', '.join(pending)}")
+        await asyncio.sleep(WARMUP_RETRY_SEC)
+        await asyncio.gather(*(_run_step(name, steps[name]) for name in pending))
+
+
+def start_warmup(steps: Dict[str, Callable], critical: Iterable[str] = ()):
+    """
+    在后台并发执行预热项 (lifespan yield 之前调用，不等待)
+
+    Args:
+        steps: 预热项名称 -> 无参函数 (同步或 async)
+        critical: 失败后服务不可用的预热项；其中任一失败时不进入 ready
+    """
+    global _warmup_task
+    _state['phase'] = 'warming'
+    _warmup_task = asyncio.create_task(_run_warmup(steps, critical))
+
+
+async def stop_warmup():
+    """关闭时取消尚未完成的预热"""
+    _state['phase'] = 'stopping'
+    if _warmup_task is not None and not _warmup_task.done():
+        _warmup_task.cancel()
+        await asyncio.gather(_warmup_task, return_exceptions=True)
+
+
+def is_ready() -> bool:
+    return _state['phase'] == 'ready'
+
+
+def get_startup_stats() -> Dict[str, Any]:
+    stats = dict(_state)
+    stats['warmup'] = {name: dict(r) for name, r in _state['warmup'].items()}
+    if _state['ready_ms'] is None:
+        stats['elapsed_ms'] = _elapsed_ms(PROCESS_STARTED_AT)
+    return stats
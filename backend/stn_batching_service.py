@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Stn Batching Service (自适应缓存池阈值)
+============================================================================
+
+缓存池达到阈值才触发 Stn。固定阈值 (cache_pool_limit) 在系统空闲和繁忙时
+粒度相同；这里根据负载动态调整实际生效的阈值：
+
+- 负载信号
+  - Stn 积压：本进程等待/执行中的 Stn 数 (user_actor_service)
+  - Ark 延迟：Stn LLM 耗时的指数滑动平均，相对 stn_latency_target_ms
+- 负载 load ∈ [0, 1] 取两者较大值
+  - 空闲 (无积压且延迟不高)：取下限 cache_pool_limit_min，故事板更新更及时
+  - 有负载：在 cache_pool_limit 与上限 cache_pool_limit_max 之间按 load 插值，
+    批次更大、调用更少，同一前缀的缓存复用也更好
+
+每次 Stn 运行记录触发时的阈值与实际批次大小 (stn_batch_log，经 telemetry 写入)，
+用于按数据权衡吞吐与新鲜度。
+"""
+
+import logging
+from typing import Dict, Any, Optional
+
+from .config_manager import get_config
+from .telemetry_service import record_usage
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量与状态
+# ============================================================================
+
+STN_BACKLOG_FULL = 8           # 积压达到此数视为满载
+LATENCY_EWMA_ALPHA = 0.2       # 滑动平均权重
+
+_latency_ewma_ms: Optional[float] = None
+_trigger_decisions: Dict[str, Dict[str, Any]] = {}   # user_id -> 触发本次 Stn 的决策
+
+_stats = {
+    'decisions': 0,
+    'runs': 0,
+    'batch_chars_total': 0,
+    'threshold_total': 0,
+}
+
+
+def _config_int(key: str, default: int) -> int:
+    try:
+        return int(float(get_config(key, default=default)))
+    except (TypeError, ValueError):
+        return default
+
+
+# ============================================================================
+# 阈值决策
+# ============================================================================
+
+def decide_cachepool_threshold() -> Dict[str, Any]:
+    """
+    计算当前生效的缓存池阈值
+
+    Returns:
+        {'threshold', 'base_threshold', 'load_factor', 'stn_backlog', 'latency_ewma_ms'}
+    """
+    from .user_actor_service import get_agent_backlog  # 动态导入避免循环依赖
+
+    base = _config_int('cache_pool_limit', 200)
+    lower = min(base, _config_int('cache_pool_limit_min', base))
+    upper = max(base, _config_int('cache_pool_limit_max', base))
+    latency_target = max(1, _config_int('stn_latency_target_ms', 8000))
+
+    backlog = get_agent_backlog('stn')
+    queue_load = min(1.0, backlog / STN_BACKLOG_FULL)
+    latency_load = 0.0
+    if _latency_ewma_ms is not None and _latency_ewma_ms > latency_target:
+        # 超过目标一倍视为满载
+        latency_load = min(1.0, _latency_ewma_ms / latency_target - 1)
+    load = max(queue_load, latency_load)
+
+    if backlog == 0 and latency_load == 0:
+        threshold = lower
+    else:
+        threshold = int(base + (upper - base) * load)
+
+    _stats['decisions'] += 1
+    return {
+        'threshold': threshold,
+        'base_threshold': base,
+        'load_factor': round(load, 3),
+        'stn_backlog': backlog,
+        'latency_ewma_ms': int(_latency_ewma_ms) if _latency_ewma_ms is not None else None,
+    }
+
+
+def note_stn_trigger(user_id: str, decision: Dict[str, Any]):
+    """记住触发该用户 Stn 的决策；防抖合并时保留第一次触发的决策"""
+    _trigger_decisions.setdefault(user_id, decision)
+
+
+def forget_stn_trigger(user_id: str):
+    """Stn 未实际调用 LLM (缓存池已空) 时丢弃决策"""
+    _trigger_decisions.pop(user_id, None)
+
+
+# ============================================================================
+# 运行记录
+# ============================================================================
+
+def record_stn_batch(user_id: str, batch_chars: int, llm_duration_ms: int, success: bool):
+    """Stn LLM 调用结束后调用：更新延迟滑动平均，并记录本次批次"""
+    global _latency_ewma_ms
+    if success:
+        if _latency_ewma_ms is None:
+            _latency_ewma_ms = float(llm_duration_ms)
+        else:
+            _latency_ewma_ms += LATENCY_EWMA_ALPHA * (llm_duration_ms - _latency_ewma_ms)
+
+    decision = _trigger_decisions.pop(user_id, None)
+    if decision is None:
+        # 非缓存池触发 (如兼容入口)，按当前负载补一个决策
+        decision = decide_cachepool_threshold()
+
+    _stats['runs'] += 1
+    _stats['batch_chars_total'] += batch_chars
+    _stats['threshold_total'] += decision['threshold']
+
+    record_usage('stn_batch_log', {
+        'user_id': user_id,
+        'threshold': decision['threshold'],
+        'base_threshold': decision['base_threshold'],
+        'load_factor': decision['load_factor'],
+        'stn_backlog': decision['stn_backlog'],
+        'latency_ewma_ms': decision['latency_ewma_ms'],
+        'batch_chars': batch_chars,
+        'llm_duration_ms': llm_duration_ms,
+        'success': success,
+    })
+    logging.info(
+        f"📦 Stn 批次: {batch_chars} 字 (阈值 {decision['threshold']}, load={decision['load_factor']}), "
+        f"{llm_duration_ms}ms"
+    )
+
+
+def get_stn_batching_stats() -> Dict[str, Any]:
+    stats = dict(_stats)
+    runs = stats['runs']
+    stats['avg_batch_chars'] = int(stats['batch_chars_total'] / runs) if runs else None
+    stats['avg_threshold'] = int(stats['threshold_total'] / runs) if runs else None
+    stats['latency_ewma_ms'] = int(_latency_ewma_ms) if _latency_ewma_ms is not None else None
+    stats['pending_decisions'] = len(_trigger_decisions)
+    return stats
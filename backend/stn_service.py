@@ -14,7 +14,7 @@ Stn Service (速记员 Agent 服务) v3.3
 6. 实体入库与关系建立
 7. 写入 Storyboard
 8. 更新处理状态
-9. 触发 Dir Agent
+9. 按故事板变更调度 Dir Agent (dir_scheduler_service)
 
 根据《服务端流程文档与数据库结构设计 v3.3》实现。
 """
@@ -22,6 +22,7 @@ Stn Service (速记员 Agent 服务) v3.3
 import asyncio
 import json
 import re
+import time
 import logging
 from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, timezone
@@ -49,24 +50,13 @@ from .stn_database import (
     find_character_by_name,
 )
 from .config_manager import get_config, get_active_prompt
+from .coordination_service import user_agent_lock
+from .dir_scheduler_service import schedule_dir_after_stn
+from .stn_batching_service import record_stn_batch, forget_stn_trigger
 
 logging.basicConfig(level=logging.INFO)
 
 
-# ============================================================================
-# 用户级并发控制（FIFO 队列）
-# ============================================================================
-
-_user_locks: Dict[str, asyncio.Lock] = {}
-
-
-def _get_user_lock(user_id: str) -> asyncio.Lock:
-    """获取用户级别的锁"""
-    if user_id not in _user_locks:
-        _user_locks[user_id] = asyncio.Lock()
-    return _user_locks[user_id]
-
-
 # ============================================================================
 # Stn Agent 主入口
 # ============================================================================
@@ -75,21 +65,21 @@ async def run_stn_agent(user_id: str) -> bool:
     """
     运行 Stn Agent
     
-    这是一个异步函数，可以被 Intv Agent 在后台调用。
-    使用用户级锁保证同一用户的任务按 FIFO 顺序执行。
+    由 Intv Agent 投递到用户 actor 的邮箱 (user_actor_service) 后执行。
+    跨 worker 仍以用户级锁保证同一用户的任务互斥。
     
     Returns:
         bool: 是否成功
     """
-    lock = _get_user_lock(user_id)
-    
-    async with lock:
+    # 用户级锁：进程内 FIFO + 跨 worker advisory lock
+    async with user_agent_lock('stn', user_id):
         logging.info(f"📝 Stn Agent 开始工作 (User: {user_id[:8]}...)")
         
         try:
             # Step 1: 获取缓存池快照
             cachepool_content = take_cachepool_snapshot(user_id)
             if not cachepool_content:
+                forget_stn_trigger(user_id)
                 logging.info("📝 Stn Agent: 缓存池为空，跳过")
                 return True
             
@@ -123,7 +113,14 @@ async def run_stn_agent(user_id: str) -> bool:
             llm_input_str = json.dumps(llm_input, ensure_ascii=False)
             
             # Step 6: 调用 Stn LLM (Async)
+            llm_start = time.monotonic()
             result = await call_stn_llm(user_id, llm_input, llm_input_str=llm_input_str)
+            record_stn_batch(
+                user_id,
+                batch_chars=len(cachepool_content),
+                llm_duration_ms=int((time.monotonic() - llm_start) * 1000),
+                success=bool(result.get('success'))
+            )
             
             if not result.get('success'):
                 logging.error(f"❌ Stn LLM 调用失败: {result.get('error')}")
@@ -150,8 +147,8 @@ async def run_stn_agent(user_id: str) -> bool:
             
             update_stn_session(user_id, unprocessed_content=None)
             
-            # Step 10: 触发 Dir Agent
-            asyncio.create_task(_trigger_dir_agent(user_id))
+            # Step 10: 按故事板变更决定是否触发 Dir Agent (投递到用户 actor 邮箱)
+            await schedule_dir_after_stn(user_id, parsed_data)
             
             logging.info(f"✅ Stn Agent 完成 (User: {user_id[:8]}...)")
             return True
@@ -162,7 +159,7 @@ async def run_stn_agent(user_id: str) -> bool:
 
 
 # ============================================================================
-# 向后兼容函数（供旧版 cachepool_service 调用）
+# 向后兼容函数（旧版调用方式；服务内改由 post_agent_run 投递到用户 actor）
 # ============================================================================
 
 def run_stn_agent_async(user_id: str, session_id: str, cache_content: str, cachepool_id: int):
@@ -611,16 +608,3 @@ def _create_storyboard_entry(user_id: str, entity_type: str, entity_id: int, ent
     
     return insert_storyboard(user_id, story_type, entity_id, content)
 
-
-# ============================================================================
-# 触发 Dir Agent
-# ============================================================================
-
-async def _trigger_dir_agent(user_id: str):
-    """异步触发 Dir Agent"""
-    try:
-        # 动态导入避免循环依赖
-        from .dir_service import run_dir_agent
-        await run_dir_agent(user_id)
-    except Exception as e:
-        logging.error(f"❌ 触发 Dir Agent 失败: {e}")
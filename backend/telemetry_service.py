@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Telemetry Service (用量记录异步批量写入)
+============================================================================
+
+LLM / ASR / TTS 的用量记录不再在请求路径上同步 INSERT + COMMIT，
+而是写入内存队列，由后台线程按「条数或时间」批量落库：
+
+- 队列有条数与字节两个上限 (LLM 事件携带完整 input/output)，超出时丢弃并计数 (不阻塞用户请求)
+- 每 FLUSH_INTERVAL_SEC 秒或积累 BATCH_SIZE 条时 flush 一次
+- 多行 INSERT (execute_values)，每批一个事务
+- llm_processed 的 input/output 编码 (llm_content_service) 也在后台线程完成
+- 同一事务内累加 usage_rollup 小时/天聚合 (usage_rollup_service)
+- stn_batch_log (Stn 批次记录) 在 SAVEPOINT 中写入，表未建时不影响用量记录
+- 应用关闭时由 lifespan 调用 stop_telemetry() 写完剩余数据
+
+统计信息通过 get_telemetry_stats() 获取。
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, List
+from psycopg2.extras import execute_values
+from .database import get_db_connection
+from .llm_content_service import (
+    encode_llm_io, remember_llm_io, remember_prompt_blobs, forget_llm_sessions, save_prompt_blobs
+)
+from .usage_rollup_service import apply_rollups, compute_llm_cost
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量
+# ============================================================================
+
+MAX_QUEUE_SIZE = 10000        # 内存中最多缓存的事件数，超出后丢弃
+MAX_QUEUE_BYTES = 64 * 1024 * 1024   # 内存中事件字符串字段的总长度上限，超出后丢弃
+BATCH_SIZE = 200              # 单批最多写入的事件数
+FLUSH_INTERVAL_SEC = 1.0      # 最长 flush 间隔
+SHUTDOWN_TIMEOUT_SEC = 10.0   # 关闭时等待 flush 完成的最长时间
+
+
+# ============================================================================
+# Sink
+# ============================================================================
+
+class TelemetrySink:
+    """内存队列 + 后台 flush 线程"""
+
+    def __init__(self, max_queue_size: int = MAX_QUEUE_SIZE, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL_SEC, max_queue_bytes: int = MAX_QUEUE_BYTES):
+        self.max_queue_size = max_queue_size
+        self.max_queue_bytes = max_queue_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue: deque = deque()
+        self._queue_bytes = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped_queue_full': 0,
+            'dropped_queue_bytes': 0,
+            'dropped_write_failed': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'max_event_latency_ms': 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    # 生命周期
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """启动后台 flush 线程（重复调用无副作用）"""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="telemetry-flusher", daemon=True)
+            self._thread.start()
+        logging.info("✅ Telemetry 后台写入线程已启动")
+
+    def stop(self, timeout: float = SHUTDOWN_TIMEOUT_SEC):
+        """停止线程并写完队列中剩余的事件"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        # 线程未启动或超时退出时，在当前线程兜底写一次
+        self.flush()
+        logging.info(f"✅ Telemetry 已停止: {self.stats()}")
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def enqueue(self, table: str, event: Dict[str, Any]) -> bool:
+        """
+        加入队列，不触发任何 DB 操作
+
+        Returns:
+            是否入队成功（队列条数或字节数超限时返回 False 并计数）
+        """
+        size = _event_size(event)
+        with self._cond:
+            if len(self._queue) >= self.max_queue_size:
+                self._stats['dropped_queue_full'] += 1
+                return False
+            if self._queue_bytes + size > self.max_queue_bytes:
+                self._stats['dropped_queue_bytes'] += 1
+                return False
+            self._queue.append((time.monotonic(), table, event, size))
+            self._queue_bytes += size
+            self._stats['enqueued'] += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def flush(self):
+        """把队列中的事件全部写入数据库"""
+        while True:
+            with self._cond:
+                if not self._queue:
+                    return
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._queue_bytes -= sum(item[3] for item in batch)
+            self._write_batch(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {**self._stats, 'queue_size': len(self._queue), 'queue_bytes': self._queue_bytes}
+
+    # ------------------------------------------------------------------
+    # 内部实现
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def _write_batch(self, batch: List[tuple]):
+        """单个事务写入一批事件，失败时整批丢弃并计数"""
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for _, table, event, _ in batch:
+            groups.setdefault(table, []).append(event)
+
+        start = time.monotonic()
+        llm_users = set()
+        llm_blobs: set = set()
+        with self._flush_lock:
+            try:
+                with get_db_connection() as conn:
+                    try:
+                        with conn.cursor() as cursor:
+                            rollups: List[Dict[str, Any]] = []
+                            if 'llm_processed' in groups:
+                                llm_users = {e['user_id'] for e in groups['llm_processed']}
+                                rollups += _insert_llm_rows(cursor, groups['llm_processed'], llm_blobs)
+                            if 'asr_processed' in groups:
+                                rollups += _insert_asr_rows(cursor, groups['asr_processed'])
+                            if 'tts_processed' in groups:
+                                rollups += _insert_tts_rows(cursor, groups['tts_processed'])
+                            if 'stn_batch_log' in groups:
+                                _insert_stn_batch_rows(cursor, groups['stn_batch_log'])
+                            apply_rollups(cursor, rollups)
+                        conn.commit()
+                        # 提交后才标记 blob 已存在；回滚时这些 blob 行不存在，下次需重新写入
+                        remember_prompt_blobs(llm_blobs)
+                    except Exception:
+                        conn.rollback()
+                        raise
+            except Exception as e:
+                # 差分基准可能指向未写入的行，丢弃相关会话状态
+                for user_id in llm_users:
+                    forget_llm_sessions(user_id)
+                with self._cond:
+                    self._stats['failed_batches'] += 1
+                    self._stats['dropped_write_failed'] += len(batch)
+                logging.error(f"❌ Telemetry 批量写入失败，丢弃 {len(batch)} 条: {e}")
+                return
+
+        now = time.monotonic()
+        flush_ms = (now - start) * 1000
+        with self._cond:
+            self._stats['written'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['last_flush_ms'] = round(flush_ms, 2)
+            self._stats['max_flush_ms'] = round(max(self._stats['max_flush_ms'], flush_ms), 2)
+            oldest_ms = (now - batch[0][0]) * 1000
+            self._stats['max_event_latency_ms'] = round(
+                max(self._stats['max_event_latency_ms'], oldest_ms), 2)
+
+
+def _event_size(event: Dict[str, Any]) -> int:
+    """事件的近似内存占用：字符串 / bytes 字段的长度之和"""
+    return sum(len(v) for v in event.values() if isinstance(v, (str, bytes)))
+
+
+def _insert_llm_rows(cursor, events: List[Dict[str, Any]], new_blobs: set) -> List[Dict[str, Any]]:
+    """
+    llm_processed：预分配 ID 后编码 input/output，支持批内差分；返回聚合条目
+
+    本批写入的 prompt blob 哈希收集到 new_blobs，由调用方在提交后记录。
+    """
+    cursor.execute("""
+        SELECT nextval(pg_get_serial_sequence('llm_processed', 'model_processed_id'))
+        FROM generate_series(1, %s)
+    """, (len(events),))
+    ids = [row[0] for row in cursor.fetchall()]
+
+    rows = []
+    rollups = []
+    for row_id, e in zip(ids, events):
+        encoded = encode_llm_io(e['user_id'], e['agent'], e['llm_input'], e['llm_output'])
+        save_prompt_blobs(cursor, encoded['new_blobs'])
+        new_blobs.update(encoded['new_blobs'])
+        remember_llm_io(e['user_id'], e['agent'], row_id, encoded)
+        usage = e['usage']
+        pricing = compute_llm_cost(e['model_id'], usage)
+        rows.append((
+            row_id,
+            e['user_id'],
+            e['agent'],
+            e['model_id'],
+            e['model_name_cn'],
+            e['duration_ms'],
+            pricing['cost'],
+            usage.get('total_tokens', 0),
+            usage.get('prompt_tokens', 0),
+            usage.get('completion_tokens', 0),
+            usage.get('cached_tokens', 0),
+            encoded['io_format'],
+            encoded['input_base_id'],
+            encoded['input_packed'],
+            encoded['output_packed'],
+            e['related_original_text_id'],
+        ))
+        rollups.append({
+            'user_id': e['user_id'],
+            'service': 'LLM',
+            'agent': e['agent'],
+            'model_id': e['model_id'],
+            'total_tokens': usage.get('total_tokens', 0),
+            'prompt_tokens': usage.get('prompt_tokens', 0),
+            'completion_tokens': usage.get('completion_tokens', 0),
+            'cached_tokens': usage.get('cached_tokens', 0),
+            'duration_ms': e['duration_ms'],
+            'cost': pricing['cost'],
+            'cache_saving': pricing['cache_saving'],
+        })
+
+    execute_values(cursor, """
+        INSERT INTO llm_processed
+        (model_processed_id, user_id, agent, model_id, model_name_cn, process_duration, processed_cost,
+         total_tokens, prompt_tokens, completion_tokens, cached_tokens,
+         io_format, input_base_id, input_packed, output_packed,
+         related_original_text_id)
+        VALUES %s
+    """, rows)
+    return rollups
+
+
+def _insert_asr_rows(cursor, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    execute_values(cursor, """
+        INSERT INTO asr_processed
+        (original_text_id, model_id, duration, processed_cost)
+        VALUES %s
+    """, [(e['original_text_id'], e['model_id'], e['duration_ms'], e['cost']) for e in events])
+    return [{
+        'user_id': e.get('user_id'),
+        'service': 'ASR',
+        'model_id': e['model_id'],
+        'usage_units': e.get('audio_seconds', 0),
+        'duration_ms': e['duration_ms'],
+        'cost': e['cost'],
+    } for e in events]
+
+
+def _insert_tts_rows(cursor, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    execute_values(cursor, """
+        INSERT INTO tts_processed
+        (link_original_text_id, link_original_voice_id, model_id, duration, processed_cost)
+        VALUES %s
+    """, [(e['link_original_text_id'], e['link_original_voice_id'], e['model_id'],
+           e['duration_ms'], e['cost']) for e in events])
+    return [{
+        'user_id': e.get('user_id'),
+        'service': 'TTS',
+        'model_id': e['model_id'],
+        'usage_units': e.get('char_count', 0),
+        'duration_ms': e['duration_ms'],
+        'cost': e['cost'],
+    } for e in events]
+
+
+def _insert_stn_batch_rows(cursor, events: List[Dict[str, Any]]):
+    """stn_batch_log：诊断数据，失败时只回滚到保存点并丢弃这部分"""
+    cursor.execute("SAVEPOINT stn_batch_log")
+    try:
+        execute_values(cursor, """
+            INSERT INTO stn_batch_log
+            (user_id, threshold, base_threshold, load_factor, stn_backlog, latency_ewma_ms,
+             batch_chars, llm_duration_ms, success)
+            VALUES %s
+        """, [(e['user_id'], e['threshold'], e['base_threshold'], e['load_factor'], e['stn_backlog'],
+               e['latency_ewma_ms'], e['batch_chars'], e['llm_duration_ms'], e['success']) for e in events])
+        cursor.execute("RELEASE SAVEPOINT stn_batch_log")
+    except Exception as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT stn_batch_log")
+        logging.warning(f"⚠️ stn_batch_log 写入失败，丢弃 {len(events)} 条: {e}")
+
+
+# ============================================================================
+# 全局实例与便捷函数
+# ============================================================================
+
+telemetry_sink = TelemetrySink()
+
+
+def start_telemetry():
+    """启动后台写入（在 lifespan 启动阶段调用）"""
+    telemetry_sink.start()
+
+
+def stop_telemetry():
+    """写完剩余数据并停止（在 lifespan 关闭阶段、关闭连接池之前调用）"""
+    telemetry_sink.stop()
+
+
+def flush_telemetry():
+    """立即写完当前队列（删除用户数据前调用）"""
+    telemetry_sink.flush()
+
+
+def record_usage(table: str, event: Dict[str, Any]) -> bool:
+    """将一条用量记录加入写入队列"""
+    return telemetry_sink.enqueue(table, event)
+
+
+def get_telemetry_stats() -> Dict[str, Any]:
+    """获取写入统计（入队/写入/丢弃数、flush 耗时、事件最大延迟）"""
+    return telemetry_sink.stats()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+TTS HTTP Service (HTTP 分块流式 TTS，WebSocket 不可用时的备用方案)
+============================================================================
+
+GET /tts/stream?text=...&format=mp3|ogg_opus|pcm
+
+1. 未缓存：经 V3 HTTP 单向流式接口 (共享 httpx 连接池) 合成，上游每到一段
+   音频即以 chunked 方式下发，首字节延迟约等于上游首包延迟。双向流连接
+   由访谈独占 (单连接串行会话)，这里不使用，避免与进行中的访谈争抢
+2. 同时写入磁盘缓存 (TTS_HTTP_CACHE_DIR)，完整合成后原子改名生效；
+   客户端中途断开时丢弃半成品
+3. 已缓存：按文件返回，支持 HEAD 与 Range (拖动 / 断点续传)，带 ETag
+4. 并发上限 tts_http_max_concurrent (每 worker)：名额等待超过
+   TTS_HTTP_QUEUE_TIMEOUT 秒返回 503 + Retry-After；命中缓存不占名额。
+   名额由 TTSStreamingResponse 在响应结束时释放 (响应体未开始迭代、
+   客户端提前断开时同样释放)
+5. 缓存总量超过 tts_http_cache_max_mb 时按最近使用时间淘汰 (多 worker 共用目录)
+6. 缓存文件读写与清理在线程中执行，不阻塞事件循环
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Dict, Any, Optional, AsyncIterator
+
+from fastapi.responses import StreamingResponse
+
+from .config_manager import get_config
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量与统计
+# ============================================================================
+
+TTS_HTTP_CACHE_DIR = os.getenv("TTS_HTTP_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tts_http_cache"))
+TTS_HTTP_MAX_TEXT_CHARS = 500
+TTS_HTTP_QUEUE_TIMEOUT = 2.0
+TTS_SAMPLE_RATE = 24000
+DEFAULT_VOICE = "zh_female_vv_uranus_bigtts"
+
+# 上游格式 -> (Content-Type, 缓存文件扩展名)
+TTS_FORMATS = {
+    "mp3": ("audio/mpeg", "mp3"),
+    "ogg_opus": ("audio/ogg", "ogg"),
+    "pcm": (f"audio/L16; rate={TTS_SAMPLE_RATE}; channels=1", "pcm"),
+}
+
+_semaphore: Optional[asyncio.Semaphore] = None
+_semaphore_size = 0
+_inflight = 0
+
+_stats = {
+    'cache_hits': 0,
+    'cache_misses': 0,
+    'cache_stored': 0,
+    'cache_evicted': 0,
+    'rejected_busy': 0,
+    'upstream_errors': 0,
+    'aborted': 0,
+    'first_byte_ms_total': 0,
+    'first_byte_count': 0,
+}
+_stats_lock = threading.Lock()   # 计数在事件循环与工作线程中都会更新
+
+
+def _count(key: str, n: int = 1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+class TTSBusyError(Exception):
+    """并发名额已满"""
+
+
+class TTSSlot:
+    """一个合成名额；release() 可重复调用，只释放一次"""
+
+    def __init__(self, semaphore: asyncio.Semaphore):
+        self._semaphore = semaphore
+        self._released = False
+
+    def release(self):
+        global _inflight
+        if self._released:
+            return
+        self._released = True
+        self._semaphore.release()
+        _inflight -= 1
+
+
+# ============================================================================
+# 缓存
+# ============================================================================
+
+def cache_key(text: str, audio_format: str, voice: str = DEFAULT_VOICE) -> str:
+    return hashlib.sha256(f"{voice}\n{audio_format}\n{text}".encode("utf-8")).hexdigest()[:32]
+
+
+def cached_path(key: str, audio_format: str) -> Optional[str]:
+    """返回已缓存文件路径 (并刷新其最近使用时间)，未缓存返回 None"""
+    path = os.path.join(TTS_HTTP_CACHE_DIR, f"{key}.{TTS_FORMATS[audio_format][1]}")
+    try:
+        os.utime(path)
+    except OSError:
+        _count('cache_misses')
+        return None
+    _count('cache_hits')
+    return path
+
+
+def _cache_limit_bytes() -> int:
+    try:
+        return int(float(get_config('tts_http_cache_max_mb', default=200)) * 1024 * 1024)
+    except (TypeError, ValueError):
+        return 200 * 1024 * 1024
+
+
+def _evict_cache():
+    """缓存总量超限时删除最久未使用的文件"""
+    entries = []
+    total = 0
+    for entry in os.scandir(TTS_HTTP_CACHE_DIR):
+        if not entry.is_file() or entry.name.endswith(".part"):
+            continue
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+
+    limit = _cache_limit_bytes()
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            _count('cache_evicted')
+        except OSError:
+            pass
+
+
+# ============================================================================
+# 流式合成
+# ============================================================================
+
+def _get_semaphore() -> asyncio.Semaphore:
+    """按当前配置创建信号量；配置变更后在空闲时重建"""
+    global _semaphore, _semaphore_size
+    size = max(1, int(float(get_config('tts_http_max_concurrent', default=4))))
+    if _semaphore is None or (size != _semaphore_size and _inflight == 0):
+        _semaphore = asyncio.Semaphore(size)
+        _semaphore_size = size
+    return _semaphore
+
+
+async def acquire_slot() -> TTSSlot:
+    """
+    取得一个合成名额 (在开始响应前调用，以便名额不足时返回 503)
+
+    名额需交给 TTSStreamingResponse，由其保证释放。
+
+    Raises:
+        TTSBusyError: 等待超过 TTS_HTTP_QUEUE_TIMEOUT
+    """
+    global _inflight
+    semaphore = _get_semaphore()
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout=TTS_HTTP_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        _count('rejected_busy')
+        raise TTSBusyError()
+    _inflight += 1
+    return TTSSlot(semaphore)
+
+
+class TTSStreamingResponse(StreamingResponse):
+    """
+    响应结束时释放合成名额
+
+    响应体生成器的 finally 只有在开始迭代后才会执行；客户端在响应开始前断开、
+    或发送响应头失败时生成器从未启动，需要在这里兜底释放。
+    """
+
+    def __init__(self, content, slot: TTSSlot, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.slot.release()
+
+
+def _open_part_file(part_path: str):
+    os.makedirs(TTS_HTTP_CACHE_DIR, exist_ok=True)
+    return open(part_path, "wb")
+
+
+def _finish_part_file(part_file, part_path: str, final_path: str, completed: bool):
+    """关闭半成品；完整合成则改名生效并清理超限缓存，否则删除 (在线程中执行)"""
+    part_file.close()
+    if not completed:
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        return
+    os.replace(part_path, final_path)
+    _count('cache_stored')
+    try:
+        _evict_cache()
+    except OSError as e:
+        logging.warning(f"⚠️ TTS 缓存清理失败: {e}")
+
+
+async def stream_and_cache(
+    tts_client,
+    slot: TTSSlot,
+    text: str,
+    audio_format: str,
+    key: str
+) -> AsyncIterator[bytes]:
+    """
+    转发上游音频并写入缓存；结束 (含客户端断开) 时释放 acquire_slot 取得的名额
+
+    上游在发送部分音频后出错时，已发送的内容无法撤回，直接结束响应且不缓存。
+    """
+    final_path = os.path.join(TTS_HTTP_CACHE_DIR, f"{key}.{TTS_FORMATS[audio_format][1]}")
+    part_path = f"{final_path}.{uuid.uuid4().hex[:8]}.part"
+    start_time = time.time()
+    first_byte = True
+    completed = False
+    part_file = None
+    try:
+        part_file = await asyncio.to_thread(_open_part_file, part_path)
+        async for chunk in tts_client.stream_http_v3(text, audio_format=audio_format, voice_name=DEFAULT_VOICE, sample_rate=TTS_SAMPLE_RATE):
+            if first_byte:
+                first_byte = False
+                _count('first_byte_ms_total', int((time.time() - start_time) * 1000))
+                _count('first_byte_count')
+            await asyncio.to_thread(part_file.write, chunk)
+            yield chunk
+        completed = not first_byte
+    except (GeneratorExit, asyncio.CancelledError):
+        _count('aborted')
+        raise
+    except Exception as e:
+        _count('upstream_errors')
+        logging.error(f"❌ TTS HTTP 流式合成失败: {e}")
+    finally:
+        slot.release()
+        if part_file is not None:
+            # 取消 / 生成器关闭时不能再 await，同步收尾只涉及关闭与删除半成品
+            if completed:
+                await asyncio.to_thread(_finish_part_file, part_file, part_path, final_path, True)
+            else:
+                _finish_part_file(part_file, part_path, final_path, False)
+
+
+def get_tts_http_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['inflight'] = _inflight
+    stats['max_concurrent'] = _semaphore_size or None
+    count = stats['first_byte_count']
+    stats['avg_first_byte_ms'] = int(stats['first_byte_ms_total'] / count) if count else None
+    stats['cache_dir'] = TTS_HTTP_CACHE_DIR
+    return stats
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Usage Rollup Service (用量与成本汇总)
+============================================================================
+
+按「小时 / 天 × 用户 × 服务(LLM/ASR/TTS) × Agent × 模型」维护预聚合表
+usage_rollup，报表查询只扫描聚合桶而不是原始记录。
+
+- 增量维护：telemetry_service 每批写入原始记录时，在同一事务内调用
+  apply_rollups() 累加聚合值；桶时间取事务的 now()，与原始行 created_time 一致
+- 成本按 base_models 价格计算：
+    LLM: ¥/百万 Token，缓存命中部分按 input_price × cache_discount 计费
+    ASR: ¥/小时音频
+    TTS: ¥/万字符
+- rebuild_rollups() 可按原始表重新计算指定时间范围（历史数据回填 / 校正）
+
+表结构见 sql/create_usage_rollup.sql。
+"""
+
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Iterable
+from psycopg2.extras import execute_values
+from .database import get_db_connection
+from .coordination_service import register_invalidation
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量
+# ============================================================================
+
+GRANULARITIES = {'hour': 'h', 'day': 'd'}
+GROUP_BY_COLUMNS = ('user_id', 'service', 'agent', 'model_id')
+
+LLM_PRICE_UNIT = 1_000_000   # LLM 价格单位: 百万 Token
+ASR_PRICE_UNIT = 3600        # ASR 价格单位: 小时 (秒)
+TTS_PRICE_UNIT = 10_000      # TTS 价格单位: 万字符
+
+
+# ============================================================================
+# 模型价格缓存
+# ============================================================================
+
+_model_cache: Dict[int, Dict[str, Any]] = {}
+_model_cache_lock = threading.Lock()
+
+
+def _load_models():
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT model_id, model_type, input_price, output_price, cache_discount
+                FROM base_models
+                ORDER BY model_id
+            """)
+            rows = cursor.fetchall()
+
+    models = {
+        row[0]: {
+            'model_id': row[0],
+            'model_type': row[1],
+            'input_price': float(row[2]) if row[2] else 0.0,
+            'output_price': float(row[3]) if row[3] else 0.0,
+            'cache_discount': float(row[4]) if row[4] is not None else 0.5,
+        }
+        for row in rows
+    }
+    with _model_cache_lock:
+        _model_cache.clear()
+        _model_cache.update(models)
+
+
+def get_model_pricing(model_id: Optional[int]) -> Optional[Dict[str, Any]]:
+    """获取模型价格信息 (进程内缓存，未命中时整表重新加载一次)"""
+    if model_id is None:
+        return None
+    if model_id not in _model_cache:
+        try:
+            _load_models()
+        except Exception as e:
+            logging.error(f"❌ 加载模型价格失败: {e}")
+            return None
+    return _model_cache.get(model_id)
+
+
+def get_default_model_id(model_type: str) -> Optional[int]:
+    """按类型 (LLM/ASR/TTS) 获取第一个模型 ID"""
+    if not _model_cache:
+        try:
+            _load_models()
+        except Exception as e:
+            logging.error(f"❌ 加载模型价格失败: {e}")
+            return None
+    for model_id, model in sorted(_model_cache.items()):
+        if model['model_type'] == model_type:
+            return model_id
+    return None
+
+
+def clear_pricing_cache():
+    """清空模型价格缓存 (base_models 变更后调用)"""
+    with _model_cache_lock:
+        _model_cache.clear()
+
+
+register_invalidation('models', lambda _: clear_pricing_cache())
+
+
+# ============================================================================
+# 成本计算
+# ============================================================================
+
+def compute_llm_cost(model_id: Optional[int], usage: Dict[str, int]) -> Dict[str, float]:
+    """
+    计算 LLM 调用成本
+
+    Returns:
+        {'cost': 实际成本, 'cache_saving': 缓存命中节省的成本}
+    """
+    model = get_model_pricing(model_id)
+    if not model:
+        return {'cost': 0.0, 'cache_saving': 0.0}
+
+    prompt = usage.get('prompt_tokens', 0) or 0
+    cached = min(usage.get('cached_tokens', 0) or 0, prompt)
+    completion = usage.get('completion_tokens', 0) or 0
+    input_price = model['input_price']
+
+    cost = (
+        (prompt - cached) * input_price
+        + cached * input_price * model['cache_discount']
+        + completion * model['output_price']
+    ) / LLM_PRICE_UNIT
+    saving = cached * input_price * (1 - model['cache_discount']) / LLM_PRICE_UNIT
+    return {'cost': round(cost, 6), 'cache_saving': round(saving, 6)}
+
+
+def compute_asr_cost(model_id: Optional[int], audio_seconds: float) -> float:
+    """按音频时长计算 ASR 成本"""
+    model = get_model_pricing(model_id)
+    if not model:
+        return 0.0
+    return round(audio_seconds / ASR_PRICE_UNIT * model['input_price'], 6)
+
+
+def compute_tts_cost(model_id: Optional[int], char_count: int) -> float:
+    """按字符数计算 TTS 成本"""
+    model = get_model_pricing(model_id)
+    if not model:
+        return 0.0
+    return round(char_count / TTS_PRICE_UNIT * model['input_price'], 6)
+
+
+# ============================================================================
+# 增量维护
+# ============================================================================
+
+def apply_rollups(cursor, entries: Iterable[Dict[str, Any]]):
+    """
+    将一批调用记录累加到小时/天聚合桶 (需与原始记录在同一事务中调用)
+
+    entry 字段: user_id, service, agent, model_id, total_tokens, prompt_tokens,
+    completion_tokens, cached_tokens, usage_units, duration_ms, cost, cache_saving
+    """
+    merged: Dict[tuple, List[float]] = {}
+    for e in entries:
+        if not e.get('user_id'):
+            continue
+        key = (str(e['user_id']), e['service'], e.get('agent') or '', e.get('model_id') or 0)
+        values = (
+            1,
+            e.get('total_tokens', 0) or 0,
+            e.get('prompt_tokens', 0) or 0,
+            e.get('completion_tokens', 0) or 0,
+            e.get('cached_tokens', 0) or 0,
+            e.get('usage_units', 0) or 0,
+            e.get('duration_ms', 0) or 0,
+            e.get('cost', 0) or 0,
+            e.get('cache_saving', 0) or 0,
+        )
+        acc = merged.setdefault(key, [0] * len(values))
+        for i, v in enumerate(values):
+            acc[i] += v
+
+    if not merged:
+        return
+
+    for granularity, unit in (('h', 'hour'), ('d', 'day')):
+        rows = [(granularity, unit) + key + tuple(acc) for key, acc in merged.items()]
+        execute_values(cursor, """
+            INSERT INTO usage_rollup
+            (granularity, bucket_start, user_id, service, agent, model_id,
+             calls, total_tokens, prompt_tokens, completion_tokens, cached_tokens,
+             usage_units, duration_ms, cost, cache_saving)
+            SELECT v.g, date_trunc(v.unit, now()), v.user_id::UUID, v.service, v.agent, v.model_id,
+                   v.calls, v.total_tokens, v.prompt_tokens, v.completion_tokens, v.cached_tokens,
+                   v.usage_units, v.duration_ms, v.cost, v.cache_saving
+            FROM (VALUES %s) AS v(g, unit, user_id, service, agent, model_id,
+                                  calls, total_tokens, prompt_tokens, completion_tokens, cached_tokens,
+                                  usage_units, duration_ms, cost, cache_saving)
+            ON CONFLICT (granularity, bucket_start, user_id, service, agent, model_id) DO UPDATE SET
+                calls = usage_rollup.calls + EXCLUDED.calls,
+                total_tokens = usage_rollup.total_tokens + EXCLUDED.total_tokens,
+                prompt_tokens = usage_rollup.prompt_tokens + EXCLUDED.prompt_tokens,
+                completion_tokens = usage_rollup.completion_tokens + EXCLUDED.completion_tokens,
+                cached_tokens = usage_rollup.cached_tokens + EXCLUDED.cached_tokens,
+                usage_units = usage_rollup.usage_units + EXCLUDED.usage_units,
+                duration_ms = usage_rollup.duration_ms + EXCLUDED.duration_ms,
+                cost = usage_rollup.cost + EXCLUDED.cost,
+                cache_saving = usage_rollup.cache_saving + EXCLUDED.cache_saving,
+                updated_time = CURRENT_TIMESTAMP
+        """, rows)
+
+
+# ============================================================================
+# 全量重算
+# ============================================================================
+
+_REBUILD_SOURCES = {
+    # LLM: 历史记录没有 processed_cost 时按当前价格补算
+    'LLM': """
+        SELECT p.user_id, 'LLM', COALESCE(p.agent, ''), COALESCE(p.model_id, 0), p.created_time,
+               COALESCE(p.total_tokens, 0), COALESCE(p.prompt_tokens, 0),
+               COALESCE(p.completion_tokens, 0), COALESCE(p.cached_tokens, 0),
+               0, COALESCE(p.process_duration, 0),
+               COALESCE(p.processed_cost,
+                   ((COALESCE(p.prompt_tokens, 0) - COALESCE(p.cached_tokens, 0)) * COALESCE(m.input_price, 0)
+                    + COALESCE(p.cached_tokens, 0) * COALESCE(m.input_price, 0) * COALESCE(m.cache_discount, 0.5)
+                    + COALESCE(p.completion_tokens, 0) * COALESCE(m.output_price, 0)) / 1000000.0),
+               COALESCE(p.cached_tokens, 0) * COALESCE(m.input_price, 0)
+                   * (1 - COALESCE(m.cache_discount, 0.5)) / 1000000.0
+        FROM llm_processed p
+        LEFT JOIN base_models m ON m.model_id = p.model_id
+        WHERE p.user_id IS NOT NULL AND p.created_time >= %(start)s AND p.created_time < %(end)s
+    """,
+    'ASR': """
+        SELECT t.user_id, 'ASR', '', COALESCE(a.model_id, 0), a.created_time,
+               0, 0, 0, 0, 0, COALESCE(a.duration, 0), COALESCE(a.processed_cost, 0), 0
+        FROM asr_processed a
+        JOIN interview_original_text t ON t.interview_original_text_id = a.original_text_id
+        WHERE a.created_time >= %(start)s AND a.created_time < %(end)s
+    """,
+    'TTS': """
+        SELECT t.user_id, 'TTS', '', COALESCE(p.model_id, 0), p.created_time,
+               0, 0, 0, 0, 0, COALESCE(p.duration, 0), COALESCE(p.processed_cost, 0), 0
+        FROM tts_processed p
+        JOIN interview_original_text t ON t.interview_original_text_id = p.link_original_text_id
+        WHERE p.created_time >= %(start)s AND p.created_time < %(end)s
+    """,
+}
+
+
+def rebuild_rollups(start: datetime, end: datetime) -> Dict[str, int]:
+    """
+    按原始表重新计算 [start, end) 范围内的聚合 (范围会扩展到整天)
+
+    重算期间锁定 usage_rollup，阻塞 telemetry 的增量写入，避免重复累加。
+    ASR/TTS 历史记录没有音频时长/字符数，usage_units 记为 0。
+    """
+    with get_db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("LOCK TABLE usage_rollup IN SHARE ROW EXCLUSIVE MODE")
+                cursor.execute("SELECT date_trunc('day', %s::TIMESTAMPTZ), date_trunc('day', %s::TIMESTAMPTZ) + INTERVAL '1 day'",
+                               (start, end))
+                start, end = cursor.fetchone()
+
+                cursor.execute("""
+                    DELETE FROM usage_rollup
+                    WHERE bucket_start >= %s AND bucket_start < %s
+                """, (start, end))
+                deleted = cursor.rowcount
+
+                source = " UNION ALL ".join(f"({sql})" for sql in _REBUILD_SOURCES.values())
+                inserted = 0
+                for granularity, unit in (('h', 'hour'), ('d', 'day')):
+                    cursor.execute(f"""
+                        INSERT INTO usage_rollup
+                        (granularity, bucket_start, user_id, service, agent, model_id,
+                         calls, total_tokens, prompt_tokens, completion_tokens, cached_tokens,
+                         usage_units, duration_ms, cost, cache_saving)
+                        SELECT %(g)s, date_trunc(%(unit)s, src.created_time), src.user_id, src.service,
+                               src.agent, src.model_id, COUNT(*),
+                               SUM(src.total_tokens), SUM(src.prompt_tokens), SUM(src.completion_tokens),
+                               SUM(src.cached_tokens), SUM(src.usage_units), SUM(src.duration_ms),
+                               SUM(src.cost), SUM(src.cache_saving)
+                        FROM ({source}) AS src(user_id, service, agent, model_id, created_time,
+                                               total_tokens, prompt_tokens, completion_tokens, cached_tokens,
+                                               usage_units, duration_ms, cost, cache_saving)
+                        GROUP BY 1, 2, 3, 4, 5, 6
+                    """, {'g': granularity, 'unit': unit, 'start': start, 'end': end})
+                    inserted += cursor.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    logging.info(f"✅ 用量汇总重算完成: {start} ~ {end}, 删除 {deleted} 桶, 生成 {inserted} 桶")
+    return {'deleted_buckets': deleted, 'inserted_buckets': inserted}
+
+
+# ============================================================================
+# 查询
+# ============================================================================
+
+def get_usage_rollup(
+    granularity: str = 'day',
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    user_id: Optional[str] = None,
+    service: Optional[str] = None,
+    group_by: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    查询聚合用量
+
+    Args:
+        granularity: hour / day
+        group_by: 除时间桶外的分组维度，取值 user_id/service/agent/model_id，默认全部
+
+    Returns:
+        每个桶一行，含 cached_ratio (缓存命中 Token / 输入 Token)
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"不支持的粒度: {granularity}")
+    group_by = group_by if group_by is not None else list(GROUP_BY_COLUMNS)
+    invalid = [c for c in group_by if c not in GROUP_BY_COLUMNS]
+    if invalid:
+        raise ValueError(f"不支持的分组维度: {invalid}")
+
+    conditions = ["r.granularity = %s"]
+    params: List[Any] = [GRANULARITIES[granularity]]
+    if start_time:
+        conditions.append("r.bucket_start >= %s")
+        params.append(start_time)
+    if end_time:
+        conditions.append("r.bucket_start <= %s")
+        params.append(end_time)
+    if user_id:
+        conditions.append("r.user_id = %s")
+        params.append(user_id)
+    if service:
+        conditions.append("r.service = %s")
+        params.append(service.upper())
+
+    dims = ["r.bucket_start"] + [f"r.{c}" for c in group_by]
+    select_dims = ", ".join(dims)
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT {select_dims},
+                       SUM(r.calls), SUM(r.total_tokens), SUM(r.prompt_tokens),
+                       SUM(r.completion_tokens), SUM(r.cached_tokens), SUM(r.usage_units),
+                       SUM(r.duration_ms), SUM(r.cost), SUM(r.cache_saving)
+                FROM usage_rollup r
+                WHERE {' AND '.join(conditions)}
+                GROUP BY {select_dims}
+                ORDER BY r.bucket_start DESC
+            """, params)
+            rows = cursor.fetchall()
+
+    results = []
+    for row in rows:
+        item: Dict[str, Any] = {'bucket_start': row[0].isoformat()}
+        for i, column in enumerate(group_by, start=1):
+            item[column] = str(row[i]) if column == 'user_id' else row[i]
+        (calls, total, prompt, completion, cached, units,
+         duration, cost, saving) = row[len(group_by) + 1:]
+        item.update({
+            'calls': int(calls or 0),
+            'total_tokens': int(total or 0),
+            'prompt_tokens': int(prompt or 0),
+            'completion_tokens': int(completion or 0),
+            'cached_tokens': int(cached or 0),
+            'cached_ratio': round(float(cached) / float(prompt), 4) if prompt else 0.0,
+            'usage_units': float(units or 0),
+            'duration_ms': int(duration or 0),
+            'cost': float(cost or 0),
+            'cache_saving': float(saving or 0),
+        })
+        results.append(item)
+    return results
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+User Actor Service (用户级 Actor 运行时)
+============================================================================
+
+每个活跃用户一个轻量 actor，取代各处的 asyncio.create_task 触发与
+narration_status 轮询：
+
+1. 状态常驻：启动时 narration_service.attach_resident_state 把该用户的
+   Session / 缓存池载入内存 (最新 Hint 由推送更新的 hint 缓存提供)，
+   热路径上的读写不再访问数据库
+2. 串行调度：
+   - Intv 轮次通过 actor.turn() 依次执行
+   - Stn / Dir 通过邮箱 (post_agent_run) 排队，由 actor 的 agent 循环按 FIFO 执行，
+     Stn 完成后投递的 Dir 一定排在其后
+   - 合并：每种 agent 最多一个待执行请求，重复投递直接并入；Stn 出队后再等待
+     stn_trigger_debounce_ms 防抖窗口，期间追加的对话一并进入本次快照
+   Intv 与 Stn/Dir 分属两条通道，Stn 的长耗时 LLM 调用不阻塞访谈
+3. 批量落库：每 ACTOR_FLUSH_INTERVAL_SEC 秒把脏字段合并成一条 UPDATE
+4. 空闲淘汰：无轮次、无排队任务且超过 ACTOR_IDLE_EVICT_SEC 秒未活动时
+   最后落库一次并退出
+
+多 worker: actor 启动时广播 invalidate_cache('narration', user_id)，
+之前持有该用户的 worker 收到后落库、卸载常驻状态并释放所有权 (advisory lock)；
+本 actor 取得所有权后才加载状态，不会读到落库前的旧值。
+ACTOR_CLAIM_TIMEOUT_SEC 内未取得所有权时本 actor 直接读写数据库，
+ACTOR_CLAIM_RETRY_SEC 后再尝试接管。
+进程崩溃最多丢失一个落库周期内的状态更新 (原文表照常实时写入)。
+"""
+
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+
+from .narration_service import (
+    attach_resident_state,
+    detach_resident_state,
+    flush_resident_state,
+    is_resident,
+    get_resident_count,
+    get_hint_cache_stats,
+)
+from .coordination_service import invalidate_cache
+from .config_manager import get_config
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量与统计
+# ============================================================================
+
+ACTOR_FLUSH_INTERVAL_SEC = 2.0      # 批量落库周期
+ACTOR_IDLE_EVICT_SEC = 600          # 空闲淘汰时间
+ACTOR_STOP_TIMEOUT_SEC = 10.0       # 关闭时等待进行中的 Stn/Dir 的上限
+ACTOR_CLAIM_TIMEOUT_SEC = 5.0       # 等待前一个 worker 落库并交出所有权的上限
+ACTOR_CLAIM_RETRY_SEC = 30.0        # 接管失败后的重试间隔 (期间直接读写数据库)
+
+AGENT_KINDS = ('stn', 'dir')
+DEFAULT_STN_DEBOUNCE_MS = 2000
+
+_stats = {
+    'spawned': 0,
+    'claim_failures': 0,
+    'evicted': 0,
+    'turns': 0,
+    'agent_runs': {'stn': 0, 'dir': 0},
+    'coalesced': {'stn': 0, 'dir': 0},   # 已有待执行请求而被合并的投递
+    'agent_failures': 0,
+    'flushes': 0,
+    'flushed_columns': 0,
+    'flush_errors': 0,
+}
+
+
+# ============================================================================
+# Actor
+# ============================================================================
+
+class UserActor:
+    """单个用户的 actor：常驻状态 + Intv 轮次锁 + Stn/Dir 邮箱"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.mailbox: asyncio.Queue = asyncio.Queue()
+        self.started = asyncio.Event()
+        self.last_active = time.monotonic()
+        self._turn_lock = asyncio.Lock()
+        self._active_turns = 0
+        self._agent_busy = False
+        self._pending: set = set()          # 已投递、尚未开始执行的 agent
+        self._running: Optional[str] = None
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._claim_lock = asyncio.Lock()
+        self._claim_retry_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._agent_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    # ------------------------------------------------------------------
+    # 消息
+    # ------------------------------------------------------------------
+
+    def post(self, kind: str):
+        """投递 Stn / Dir 运行请求；已有同类请求等待时合并"""
+        if kind not in AGENT_KINDS:
+            raise ValueError(f"未知的 agent: {kind}")
+        self.touch()
+        if kind in self._pending:
+            _stats['coalesced'][kind] += 1
+            return
+        self._pending.add(kind)
+        self.mailbox.put_nowait(kind)
+
+    @asynccontextmanager
+    async def turn(self):
+        """一轮 Intv 访谈；同一用户的轮次依次执行"""
+        self._active_turns += 1
+        self.touch()
+        try:
+            async with self._turn_lock:
+                await self._ensure_resident()
+                _stats['turns'] += 1
+                yield
+        finally:
+            self._active_turns -= 1
+            self.touch()
+
+    # ------------------------------------------------------------------
+    # 主循环
+    # ------------------------------------------------------------------
+
+    async def _run(self):
+        try:
+            await self._ensure_resident()
+        finally:
+            self.started.set()
+
+        self._agent_task = asyncio.create_task(self._agent_loop())
+        try:
+            while not self._stopping:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=ACTOR_FLUSH_INTERVAL_SEC)
+                except asyncio.TimeoutError:
+                    pass
+                await self._flush()
+                if self._is_idle():
+                    break
+        finally:
+            await self._shutdown()
+
+    async def _agent_loop(self):
+        while True:
+            kind = await self.mailbox.get()
+            self._agent_busy = True
+            try:
+                if kind == 'stn':
+                    # 防抖：窗口内的重复触发仍被合并，追加内容留给本次快照
+                    await asyncio.sleep(_get_stn_debounce_sec())
+                self._pending.discard(kind)
+                self._running = kind
+                await self._ensure_resident()
+                await _run_agent(self.user_id, kind)
+            finally:
+                self._running = None
+                self._agent_busy = False
+                self.touch()
+                self.mailbox.task_done()
+
+    def _is_idle(self) -> bool:
+        return (
+            not self._active_turns
+            and not self._agent_busy
+            and self.mailbox.empty()
+            and time.monotonic() - self.last_active >= ACTOR_IDLE_EVICT_SEC
+        )
+
+    async def _ensure_resident(self):
+        """首次加载，或常驻状态被其他 worker 接管 / 监听重连清空后重新加载"""
+        # 轮次与 Stn/Dir 可能同时发现未常驻，串行化避免重复接管
+        async with self._claim_lock:
+            if is_resident(self.user_id) or time.monotonic() < self._claim_retry_at:
+                return
+            try:
+                claimed = await asyncio.to_thread(_claim_user, self.user_id)
+            except Exception as e:
+                logging.error(f"❌ Actor 加载状态失败，直接读写数据库: {e}")
+                claimed = False
+            if not claimed:
+                _stats['claim_failures'] += 1
+                self._claim_retry_at = time.monotonic() + ACTOR_CLAIM_RETRY_SEC
+
+    async def _flush(self):
+        try:
+            columns = await asyncio.to_thread(flush_resident_state, self.user_id)
+        except Exception as e:
+            _stats['flush_errors'] += 1
+            logging.error(f"❌ Actor 状态落库失败 (下次重试): {e}")
+            return
+        if columns:
+            _stats['flushes'] += 1
+            _stats['flushed_columns'] += columns
+
+    async def _shutdown(self):
+        # 先从注册表移除：之后的请求会新建 actor，并等待本次落库完成后再加载
+        if _actors.get(self.user_id) is self:
+            del _actors[self.user_id]
+        _evicting[self.user_id] = asyncio.current_task()
+        try:
+            if self._agent_task is not None:
+                if self._agent_busy:
+                    await asyncio.wait([self._agent_task], timeout=ACTOR_STOP_TIMEOUT_SEC)
+                self._agent_task.cancel()
+                await asyncio.gather(self._agent_task, return_exceptions=True)
+            if not self.mailbox.empty():
+                logging.warning(f"⚠️ Actor 退出时丢弃 {self.mailbox.qsize()} 个待执行任务")
+
+            columns = await asyncio.to_thread(detach_resident_state, self.user_id)
+            _stats['flushed_columns'] += columns
+            _stats['evicted'] += 1
+            logging.info(f"💤 Actor 已退出: user={self.user_id[:8]}...")
+        finally:
+            if _evicting.get(self.user_id) is asyncio.current_task():
+                del _evicting[self.user_id]
+
+
+def _get_stn_debounce_sec() -> float:
+    try:
+        return max(0.0, float(get_config('stn_trigger_debounce_ms', default=DEFAULT_STN_DEBOUNCE_MS)) / 1000)
+    except (TypeError, ValueError):
+        return DEFAULT_STN_DEBOUNCE_MS / 1000
+
+
+def _claim_user(user_id: str) -> bool:
+    """
+    通知其他 worker 交出该用户，等其最后落库并释放所有权后再把状态载入本进程 (在线程中执行)
+
+    Returns:
+        是否已常驻
+    """
+    invalidate_cache('narration', user_id)
+    return attach_resident_state(user_id, ACTOR_CLAIM_TIMEOUT_SEC)
+
+
+async def _run_agent(user_id: str, kind: str):
+    # 动态导入避免循环依赖
+    try:
+        if kind == 'stn':
+            from .stn_service import run_stn_agent
+            ok = await run_stn_agent(user_id)
+        else:
+            from .dir_service import run_dir_agent
+            ok = await run_dir_agent(user_id)
+        _stats['agent_runs'][kind] += 1
+        if not ok:
+            _stats['agent_failures'] += 1
+    except Exception as e:
+        _stats['agent_failures'] += 1
+        logging.error(f"❌ Actor 执行 {kind} 失败: {e}")
+
+
+# ============================================================================
+# 注册表
+# ============================================================================
+
+_actors: Dict[str, UserActor] = {}
+_evicting: Dict[str, asyncio.Task] = {}
+
+
+async def get_actor(user_id: str) -> UserActor:
+    """获取 (必要时启动) 用户的 actor"""
+    evicting = _evicting.get(user_id)
+    if evicting is not None:
+        await asyncio.gather(asyncio.shield(evicting), return_exceptions=True)
+
+    actor = _actors.get(user_id)
+    if actor is None:
+        actor = UserActor(user_id)
+        _actors[user_id] = actor
+        _stats['spawned'] += 1
+        actor.start()
+    await actor.started.wait()
+    return actor
+
+
+async def post_agent_run(user_id: str, kind: str):
+    """投递 Stn / Dir 运行请求到用户 actor 的邮箱"""
+    actor = await get_actor(user_id)
+    actor.post(kind)
+
+
+async def stop_actor_runtime():
+    """关闭全部 actor 并落库 (lifespan 调用)"""
+    tasks = [actor._task for actor in list(_actors.values()) if actor._task]
+    for actor in list(_actors.values()):
+        actor.stop()
+    tasks += list(_evicting.values())
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logging.info(f"✅ 已关闭 {len(tasks)} 个用户 Actor")
+
+
+def get_agent_backlog(kind: str) -> int:
+    """本进程中等待或正在执行该 agent 的用户数"""
+    return sum(
+        1 for actor in _actors.values()
+        if kind in actor._pending or actor._running == kind
+    )
+
+
+def get_actor_stats() -> Dict[str, Any]:
+    stats = dict(_stats)
+    stats['agent_runs'] = dict(_stats['agent_runs'])
+    stats['coalesced'] = dict(_stats['coalesced'])
+    stats['active_actors'] = len(_actors)
+    stats['resident_states'] = get_resident_count()
+    stats['hint_cache'] = get_hint_cache_stats()
+    stats['queued_agent_runs'] = sum(actor.mailbox.qsize() for actor in _actors.values())
+    stats['active_turns'] = sum(actor._active_turns for actor in _actors.values())
+    return stats
@@ -2,14 +2,116 @@
 """
 用户服务模块
 提供用户数据库操作相关功能
+
+get_user_by_openid / get_user_by_id 为读穿透缓存 (按 user_id 存储，openid 建索引)：
+- update_user_info 提交后经 invalidate_cache('users', user_id) 清除各 worker 的缓存
+- 条目最多保留 USER_CACHE_TTL 秒，兜底其他路径直接修改 users 表的情况
+- 不缓存"用户不存在"，新用户注册后立即可查到
 """
 
-from typing import Optional, Dict, Any
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
 from .database import get_db_connection
+from .coordination_service import register_invalidation, invalidate_cache
 import logging
 import uuid
 
 
+USER_COLUMNS = """
+    user_id, wechat_openid, wechat_unionid, wechat_nickname,
+    wechat_avatar_url, wechat_phone_number, user_profile,
+    birth_year, birth_month, gender, user_type, created_time
+"""
+
+
+def _row_to_user(result) -> Dict[str, Any]:
+    return {
+        'user_id': str(result[0]),
+        'wechat_openid': result[1],
+        'wechat_unionid': result[2],
+        'wechat_nickname': result[3],
+        'wechat_avatar_url': result[4],
+        'wechat_phone_number': result[5],
+        'user_profile': result[6],
+        'birth_year': result[7],
+        'birth_month': result[8],
+        'gender': result[9],
+        'user_type': result[10],
+        'created_time': result[11].isoformat() if result[11] else None
+    }
+
+
+# ============================================================================
+# 用户缓存
+# ============================================================================
+
+USER_CACHE_MAX_USERS = 10000
+USER_CACHE_TTL = 300
+
+_user_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_openid_index: Dict[str, str] = {}
+_user_cache_lock = threading.Lock()
+_user_cache_stats = {'hits': 0, 'loads': 0, 'invalidated': 0}
+
+
+def _cache_get(user_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not user_id:
+        return None
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            _drop_locked(user_id)
+            return None
+        _user_cache.move_to_end(user_id)
+        _user_cache_stats['hits'] += 1
+        return dict(entry[1])
+
+
+def _cache_put(user: Dict[str, Any]):
+    with _user_cache_lock:
+        _user_cache_stats['loads'] += 1
+        _user_cache[user['user_id']] = (time.monotonic() + USER_CACHE_TTL, dict(user))
+        _user_cache.move_to_end(user['user_id'])
+        if user.get('wechat_openid'):
+            _openid_index[user['wechat_openid']] = user['user_id']
+        while len(_user_cache) > USER_CACHE_MAX_USERS:
+            oldest_id, _ = next(iter(_user_cache.items()))
+            _drop_locked(oldest_id)
+
+
+def _drop_locked(user_id: str):
+    entry = _user_cache.pop(user_id, None)
+    if entry is not None:
+        _openid_index.pop(entry[1].get('wechat_openid'), None)
+
+
+def _forget_user(user_id: Optional[str]):
+    with _user_cache_lock:
+        _user_cache_stats['invalidated'] += 1
+        if user_id:
+            _drop_locked(user_id)
+        else:
+            _user_cache.clear()
+            _openid_index.clear()
+
+
+def get_user_cache_stats() -> Dict[str, Any]:
+    stats = dict(_user_cache_stats)
+    stats['cached_users'] = len(_user_cache)
+    return stats
+
+
+register_invalidation('users', _forget_user)
+
+
+# ============================================================================
+# 用户查询与更新
+# ============================================================================
+
 def get_user_by_openid(openid: str) -> Optional[Dict[str, Any]]:
     """
     根据微信 OpenID 查询用户
@@ -20,12 +122,14 @@ def get_user_by_openid(openid: str) -> Optional[Dict[str, Any]]:
     Returns:
         用户信息字典，如果不存在返回 None
     """
+    cached = _cache_get(_openid_index.get(openid))
+    if cached is not None and cached['wechat_openid'] == openid:
+        return cached
+    
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT user_id, wechat_openid, wechat_unionid, wechat_nickname, 
-                       wechat_avatar_url, wechat_phone_number, user_profile,
-                       birth_year, birth_month, gender, user_type, created_time
+            cursor.execute(f"""
+                SELECT {USER_COLUMNS}
                 FROM users 
                 WHERE wechat_openid = %s
             """, (openid,))
@@ -34,20 +138,9 @@ def get_user_by_openid(openid: str) -> Optional[Dict[str, Any]]:
             if not result:
                 return None
             
-            return {
-                'user_id': str(result[0]),
-                'wechat_openid': result[1],
-                'wechat_unionid': result[2],
-                'wechat_nickname': result[3],
-                'wechat_avatar_url': result[4],
-                'wechat_phone_number': result[5],
-                'user_profile': result[6],
-                'birth_year': result[7],
-                'birth_month': result[8],
-                'gender': result[9],
-                'user_type': result[10],
-                'created_time': result[11].isoformat() if result[11] else None
-            }
+            user = _row_to_user(result)
+            _cache_put(user)
+            return user
 
 
 def create_user(openid: str, unionid: Optional[str] = None) -> str:
@@ -59,23 +152,25 @@ def create_user(openid: str, unionid: Optional[str] = None) -> str:
         unionid: 微信 UnionID（可选）
     
     Returns:
-        新用户的 user_id (UUID 字符串)
+        新用户的 user_id (UUID 字符串)；新用户信息同时写入缓存，
+        随后的 get_user_by_id / get_user_by_openid 不再查库
     """
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
             # 生成默认用户名（使用 openid 前8位）
             default_user_name = f"用户_{openid[:8]}"
             
-            cursor.execute("""
+            cursor.execute(f"""
                 INSERT INTO users (wechat_openid, wechat_unionid, user_name)
                 VALUES (%s, %s, %s)
-                RETURNING user_id
+                RETURNING {USER_COLUMNS}
             """, (openid, unionid, default_user_name))
-            user_id = cursor.fetchone()[0]
+            user = _row_to_user(cursor.fetchone())
             conn.commit()
+            _cache_put(user)
             
-            logging.info(f"创建新用户成功，user_id: {user_id}, openid: {openid}, user_name: {default_user_name}")
-            return str(user_id)
+            logging.info(f"创建新用户成功，user_id: {user['user_id']}, openid: {openid}, user_name: {default_user_name}")
+            return user['user_id']
 
 
 def update_user_info(
@@ -151,9 +246,10 @@ def update_user_info(
             """
             cursor.execute(sql, params)
             conn.commit()
-            
-            logging.info(f"更新用户信息成功，user_id: {user_id}")
-            return True
+    
+    invalidate_cache('users', user_id)
+    logging.info(f"更新用户信息成功，user_id: {user_id}")
+    return True
 
 
 def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
@@ -166,12 +262,14 @@ def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
     Returns:
         用户信息字典，如果不存在返回 None
     """
+    cached = _cache_get(user_id)
+    if cached is not None:
+        return cached
+    
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT user_id, wechat_openid, wechat_unionid, wechat_nickname, 
-                       wechat_avatar_url, wechat_phone_number, user_profile,
-                       birth_year, birth_month, gender, user_type, created_time
+            cursor.execute(f"""
+                SELECT {USER_COLUMNS}
                 FROM users 
                 WHERE user_id = %s
             """, (user_id,))
@@ -180,17 +278,6 @@ def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
             if not result:
                 return None
             
-            return {
-                'user_id': str(result[0]),
-                'wechat_openid': result[1],
-                'wechat_unionid': result[2],
-                'wechat_nickname': result[3],
-                'wechat_avatar_url': result[4],
-                'wechat_phone_number': result[5],
-                'user_profile': result[6],
-                'birth_year': result[7],
-                'birth_month': result[8],
-                'gender': result[9],
-                'user_type': result[10],
-                'created_time': result[11].isoformat() if result[11] else None
-            }
+            user = _row_to_user(result)
+            _cache_put(user)
+            return user
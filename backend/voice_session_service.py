@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Voice Session Service (双工语音会话 /ws/voice)
+============================================================================
+
+原流程需要客户端维护三条链路：/ws/asr 识别 → 客户端拼接文本 → /ws/interview
+发起对话 → /api/upload_voice 上传录音。双工会话把它们合并到一条 WebSocket：
+
+1. 客户端持续发送 PCM 音频帧，服务端转发给 ASR (asr_gateway.AsrSession)
+2. 服务端判定一句话结束 (端点检测)，直接把识别文本交给 Intv Agent
+3. Intv 文本与 TTS 音频在同一连接回传；用户录音在服务端缓存 (SpooledAudioBuffer，
+   超过阈值转存临时文件)，拿到 user_text_id 后后台转 MP3 上传 COS
+
+端点检测:
+    - 所有分句均为 definite 且静默 ENDPOINT_SILENCE_SEC 内无新结果
+    - 或客户端发送 {"type": "end_of_speech"} (松开录音键)
+    - 或 ASR 上游结束 / 单句录音超过 MAX_UTTERANCE_SEC
+
+多轮对话按顺序串行处理 (同一用户的 Intv 调用不会并发)。
+
+打断: 客户端发送 {"type": "interrupt"}，或 AI 回复过程中识别到用户新的语音 (voice_barge_in_on_speech)，
+立即取消当前轮次 (停止 LLM / TTS，记录部分回复)；连接断开时同样取消。
+
+推测执行: 没有进行中的轮次时，识别文本稳定 intv_speculation_stable_ms 后
+提前启动 Intv (intv_speculation_service)，提交时最终文本一致即直接复用。
+"""
+
+import json
+import asyncio
+import logging
+from typing import Dict, Any, Optional, Tuple, NamedTuple
+
+from fastapi import WebSocket
+
+from .asr_gateway import AsrSession
+from .config_manager import get_config
+from .audio_service import SpooledAudioBuffer
+from .interview_turn_service import run_interview_turn, save_user_voice, spawn_background
+from .intv_speculation_service import IntvSpeculation, get_speculation_stable_sec
+from .logging_service import bind_log_context
+
+logging.basicConfig(level=logging.INFO)
+
+
+# ============================================================================
+# 常量
+# ============================================================================
+
+ENDPOINT_SILENCE_SEC = 0.8        # 分句全部确定后的静默时长，超过即提交
+FINAL_DRAIN_TIMEOUT_SEC = 3.0     # end_of_speech 后等待 ASR 最终结果的上限
+MAX_UTTERANCE_SEC = 60            # 单句录音上限 (与小程序 59s 录音上限对齐)
+PCM_BYTES_PER_SEC = 16000 * 2     # 16kHz / 16bit / 单声道
+
+
+def is_barge_in_enabled() -> bool:
+    """AI 回复中识别到用户说话即打断 (依赖客户端回声消除，无 AEC 的客户端需关闭)"""
+    return str(get_config('voice_barge_in_on_speech', default='true')).lower() == 'true'
+
+
+class _Turn(NamedTuple):
+    text: str
+    has_voice: bool
+    pcm: SpooledAudioBuffer
+    reason: str
+    speculation: Optional[IntvSpeculation] = None
+
+
+class _Utterance:
+    """一句话：一个 ASR 会话 + 识别结果 + 录音缓存"""
+
+    def __init__(self, asr: AsrSession):
+        self.asr = asr
+        self.results: Dict[int, Tuple[str, bool]] = {}
+        self.pcm = SpooledAudioBuffer()
+        self.reader: Optional[asyncio.Task] = None
+        self.speculation: Optional[IntvSpeculation] = None
+        self.committed = False
+
+    def transcript(self) -> str:
+        return "".join(text for _, (text, _) in sorted(self.results.items()))
+
+    def all_final(self) -> bool:
+        return bool(self.results) and all(final for _, final in self.results.values())
+
+
+# ============================================================================
+# 双工会话
+# ============================================================================
+
+class VoiceSession:
+    """
+    /ws/voice 会话
+
+    接收（客户端→服务器）:
+        - {"type": "start", "user_id": "..."}      首条消息
+        - 二进制 PCM 帧 (16kHz, 16bit, 单声道)
+        - {"type": "end_of_speech"}                 客户端结束录音
+        - {"type": "text", "text": "..."}           文字输入
+        - {"type": "interrupt"}                     打断当前回复
+
+    发送（服务器→客户端）:
+        - {"type": "ready"}
+        - {"type": "asr", "text", "is_final", "index"}    识别中间/最终结果
+        - {"type": "user_text", "text", "reason"}         本轮提交给 Intv 的文本
+        - start / session_id / user_text_id / text / error / text_finish (同 /ws/interview)
+        - {"type": "interrupted", "reason"}               当前回复已被打断
+        - 二进制帧: TTS PCM (24kHz, 16bit, 单声道)
+    """
+
+    def __init__(self, websocket: WebSocket, tts_client):
+        self._ws = websocket
+        self._tts_client = tts_client
+        self._send_lock = asyncio.Lock()
+        self._turn_queue: asyncio.Queue = asyncio.Queue()
+        self._turn_worker: Optional[asyncio.Task] = None
+        self._turn_task: Optional[asyncio.Task] = None
+        self._current: Optional[_Utterance] = None
+        self._endpoint_timer: Optional[asyncio.Task] = None
+        self._speculation_timer: Optional[asyncio.Task] = None
+        self._speculation_window = 0.0
+        self._turn_busy = False
+        self._interrupt_reason: Optional[str] = None
+        self._closed = False
+        self.user_id: Optional[str] = None
+
+    # ------------------------------------------------------------------
+    # 发送 (ASR 结果、Intv 文本、TTS 音频来自不同任务，需串行化)
+    # ------------------------------------------------------------------
+
+    async def send_json(self, data: Dict[str, Any]):
+        async with self._send_lock:
+            await self._ws.send_json(data)
+
+    async def send_audio(self, chunk: bytes):
+        async with self._send_lock:
+            await self._ws.send_bytes(chunk)
+
+    # ------------------------------------------------------------------
+    # 主循环
+    # ------------------------------------------------------------------
+
+    async def run(self):
+        start = await self._ws.receive_json()
+        self.user_id = start.get("user_id")
+        if not self.user_id:
+            await self.send_json({"type": "error", "message": "缺少 user_id 参数"})
+            return
+
+        bind_log_context(user_id=self.user_id)
+        self._speculation_window = await asyncio.to_thread(get_speculation_stable_sec)
+        self._turn_worker = asyncio.create_task(self._turn_loop())
+        await self.send_json({"type": "ready"})
+        logging.info(f"[Voice] 会话开始: user_id={self.user_id}")
+
+        try:
+            while True:
+                message = await self._ws.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    await self._on_audio(message["bytes"])
+                elif message.get("text") is not None:
+                    try:
+                        control = json.loads(message["text"])
+                    except ValueError:
+                        continue
+                    await self._on_control(control)
+        finally:
+            await self.close()
+
+    async def _on_control(self, control: Dict[str, Any]):
+        msg_type = control.get("type")
+        if msg_type == "end_of_speech":
+            if self._current:
+                utterance = self._detach()
+                spawn_background(self._end_utterance(utterance, "end_of_speech", drain=True))
+        elif msg_type == "interrupt":
+            self.interrupt("interrupt")
+        elif msg_type == "text":
+            text = (control.get("text") or "").strip()
+            if text:
+                self._turn_queue.put_nowait(_Turn(text, False, SpooledAudioBuffer(), "text"))
+
+    # ------------------------------------------------------------------
+    # ASR 与端点检测
+    # ------------------------------------------------------------------
+
+    async def _on_audio(self, pcm: bytes):
+        if not pcm:
+            return
+        utterance = self._current
+        if utterance is None:
+            try:
+                utterance = _Utterance(await AsrSession.open())
+            except Exception as e:
+                logging.error(f"[Voice] ASR 上游连接失败: {e}")
+                await self.send_json({"type": "error", "message": "语音识别服务连接异常"})
+                return
+            utterance.reader = asyncio.create_task(self._read_asr(utterance))
+            self._current = utterance
+
+        utterance.pcm.extend(pcm)
+        await utterance.asr.send_audio(pcm)
+
+        if len(utterance.pcm) >= MAX_UTTERANCE_SEC * PCM_BYTES_PER_SEC:
+            self._detach()
+            spawn_background(self._end_utterance(utterance, "max_duration", drain=True))
+
+    async def _read_asr(self, utterance: _Utterance):
+        try:
+            async for item in utterance.asr.results():
+                utterance.results[item["index"]] = (item["text"], item["is_final"])
+                if item["text"] and utterance is self._current and is_barge_in_enabled():
+                    self.interrupt("barge_in")
+                await self.send_json({"type": "asr", **item})
+                if utterance is self._current:
+                    self._schedule_endpoint(utterance)
+                    self._schedule_speculation(utterance)
+        except Exception as e:
+            logging.debug(f"[Voice] ASR 结果转发结束: {e}")
+        finally:
+            # 上游结束 (end_of_speech 后的最终结果或上游断开)
+            self._commit(utterance, "asr_end")
+
+    def _schedule_endpoint(self, utterance: _Utterance):
+        self._cancel_timers()
+        if utterance.all_final():
+            self._endpoint_timer = asyncio.create_task(self._endpoint_after_silence(utterance))
+
+    def _cancel_timers(self):
+        timer = self._endpoint_timer
+        self._endpoint_timer = None
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+        timer = self._speculation_timer
+        self._speculation_timer = None
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+
+    def _schedule_speculation(self, utterance: _Utterance):
+        """识别文本变化：丢弃过期的推测，文本稳定一个窗口后重新推测"""
+        if utterance.speculation and not utterance.speculation.matches(utterance.transcript()):
+            utterance.speculation.discard("transcript_changed")
+            utterance.speculation = None
+        if self._speculation_timer:
+            self._speculation_timer.cancel()
+            self._speculation_timer = None
+        if self._speculation_window > 0 and utterance.speculation is None:
+            self._speculation_timer = asyncio.create_task(self._speculate_after_stable(utterance))
+
+    async def _speculate_after_stable(self, utterance: _Utterance):
+        await asyncio.sleep(self._speculation_window)
+        self._speculation_timer = None
+        # 有进行中或排队的轮次时，本轮上下文尚未落定，不做推测
+        if utterance is not self._current or self._turn_busy or not self._turn_queue.empty():
+            return
+        text = utterance.transcript().strip()
+        if text:
+            utterance.speculation = IntvSpeculation(self.user_id, text).start()
+
+    async def _endpoint_after_silence(self, utterance: _Utterance):
+        await asyncio.sleep(ENDPOINT_SILENCE_SEC)
+        self._endpoint_timer = None
+        await self._end_utterance(utterance, "silence", drain=False)
+
+    def _detach(self) -> Optional[_Utterance]:
+        """当前句子脱离会话，后续音频开启新的 ASR 会话"""
+        utterance, self._current = self._current, None
+        self._cancel_timers()
+        return utterance
+
+    async def _end_utterance(self, utterance: _Utterance, reason: str, drain: bool):
+        """结束一句话：提交识别结果并关闭上游"""
+        if self._current is utterance:
+            self._detach()
+
+        if drain and not utterance.committed:
+            await utterance.asr.finish()
+            try:
+                await asyncio.wait_for(asyncio.shield(utterance.reader), FINAL_DRAIN_TIMEOUT_SEC)
+            except asyncio.TimeoutError:
+                logging.warning("[Voice] 等待 ASR 最终结果超时，使用当前识别结果")
+
+        self._commit(utterance, reason)
+        await utterance.asr.close()
+
+    def _commit(self, utterance: _Utterance, reason: str):
+        if utterance.committed:
+            return
+        utterance.committed = True
+        if self._current is utterance:
+            self._detach()
+
+        text = utterance.transcript().strip()
+        speculation, utterance.speculation = utterance.speculation, None
+        if speculation and self._closed:
+            speculation.cancel()
+            utterance.pcm.close()
+            return
+        if speculation and not (text and speculation.matches(text)):
+            speculation.discard("final_mismatch")
+            speculation = None
+        if not text:
+            utterance.pcm.close()
+            return
+        logging.info(f"[Voice] 提交 ({reason}): {text[:50]}")
+        self._turn_queue.put_nowait(_Turn(text, True, utterance.pcm, reason, speculation))
+
+    # ------------------------------------------------------------------
+    # 对话轮次
+    # ------------------------------------------------------------------
+
+    def interrupt(self, reason: str):
+        """取消进行中的轮次 (LLM 流、TTS 会话随之关闭)"""
+        task = self._turn_task
+        if task and not task.done():
+            logging.info(f"[Voice] 打断当前轮次: {reason}")
+            self._interrupt_reason = reason
+            task.cancel()
+
+    async def _turn_loop(self):
+        while True:
+            turn = await self._turn_queue.get()
+            self._turn_busy = True
+            self._interrupt_reason = None
+            result: Dict[str, Any] = {}
+            try:
+                await self.send_json({"type": "user_text", "text": turn.text, "reason": turn.reason})
+                task = asyncio.create_task(run_interview_turn(
+                    self.send_json, self._tts_client, self.user_id,
+                    turn.text, turn.has_voice, send_audio=self.send_audio,
+                    speculation=turn.speculation, result=result,
+                    audio_seconds=len(turn.pcm) / PCM_BYTES_PER_SEC if turn.has_voice else None
+                ))
+                self._turn_task = task
+                try:
+                    await asyncio.wait({task})
+                except asyncio.CancelledError:
+                    # 会话关闭：等待本轮清理完成 (释放 TTS 连接锁)
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    raise
+                if task.cancelled():
+                    await self.send_json({"type": "interrupted", "reason": self._interrupt_reason})
+                else:
+                    task.result()
+            except asyncio.CancelledError:
+                if turn.speculation:
+                    turn.speculation.cancel()
+                turn.pcm.close()
+                raise
+            except Exception as e:
+                logging.error(f"[Voice] 对话轮次失败: {e}")
+                if turn.speculation:
+                    turn.speculation.cancel()
+                turn.pcm.close()
+                continue
+            finally:
+                self._turn_task = None
+                self._turn_busy = False
+
+            # 用户录音转存 (关联本轮 user_text_id)，save_user_voice 负责关闭缓存
+            if turn.pcm and result.get('user_text_id'):
+                spawn_background(asyncio.to_thread(
+                    save_user_voice, self.user_id, turn.pcm, result['user_text_id']
+                ))
+            else:
+                turn.pcm.close()
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._cancel_timers()
+        if self._current:
+            utterance, self._current = self._current, None
+            utterance.committed = True
+            if utterance.speculation:
+                utterance.speculation.cancel()
+            utterance.pcm.close()
+            await utterance.asr.close()
+        while not self._turn_queue.empty():
+            turn = self._turn_queue.get_nowait()
+            if turn.speculation:
+                turn.speculation.cancel()
+            turn.pcm.close()
+        if self._turn_worker:
+            self._turn_worker.cancel()
+            await asyncio.gather(self._turn_worker, return_exceptions=True)
+        logging.info(f"[Voice] 会话结束: user_id={self.user_id}")
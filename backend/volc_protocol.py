@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+============================================================================
+Volcengine Binary Protocol Codec (火山引擎二进制协议编解码)
+============================================================================
+
+ASR (asr_gateway) 与 TTS 双向流 (volc_tts_client) 共用。
+
+ASR V3 (bigmodel_async) 帧格式:
+    header(4) [+ sequence(4) | error_code(4)] + payload_size(4) + payload
+
+TTS V3 双向流 (带 event 标志) 帧格式:
+    header(4) [+ sequence(4)] + event(4) [+ id_size(4) + id] + payload_size(4) + payload
+    - id 为 session_id (会话类事件) 或 connection_id (服务端连接事件)；
+      客户端 StartConnection / FinishConnection 不带 id
+    - 错误帧: header(4) + error_code(4) + payload_size(4) + payload
+
+- 预编译 struct.Struct：头部与定长字段一次 pack，再与 payload 拼接
+  (payload 只复制一次，不经过中间 body 拼接)
+- 解析按 header_size 跳过扩展头，payload 以 memoryview 切片返回，不复制；
+  帧不完整 / 长度字段越界时返回 None，不抛异常
+- PCM 音频帧不压缩 (COMPRESSION_NONE)
+- 内容固定的帧 / JSON payload 预先序列化
+
+帧只有几 KB 时每帧开销主要是解释器调用而非内存复制，热路径 (音频帧打包、
+服务端音频帧解析) 尽量减少函数调用与对象创建；基准见 benchmark_volc_protocol.py。
+"""
+
+import gzip
+import json
+import zlib
+import struct
+from typing import Any, Dict, NamedTuple, Optional, Union
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+# ============================================================================
+# 协议常量
+# ============================================================================
+
+PROTOCOL_VERSION = 0b0001
+HEADER_SIZE = 0b0001
+
+MSG_TYPE_FULL_CLIENT_REQUEST = 0b0001
+MSG_TYPE_AUDIO_ONLY_REQUEST = 0b0010
+MSG_TYPE_FULL_SERVER_RESPONSE = 0b1001
+MSG_TYPE_PARTIAL_SERVER_RESPONSE = 0b1010
+MSG_TYPE_AUDIO_ONLY_RESPONSE = 0b1011
+MSG_TYPE_ERROR = 0b1111
+
+ASR_FLAGS_NONE = 0b0000
+ASR_FLAGS_HAS_SEQUENCE = 0b0001
+ASR_FLAGS_IS_LAST = 0b0010
+FLAGS_WITH_EVENT = 0b0100
+
+SERIALIZATION_NONE = 0b0000
+SERIALIZATION_JSON = 0b0001
+
+COMPRESSION_NONE = 0b0000
+COMPRESSION_GZIP = 0b0001
+
+# TTS V3 事件
+EVENT_START_CONNECTION = 1
+EVENT_FINISH_CONNECTION = 2
+EVENT_CONNECTION_STARTED = 50
+EVENT_CONNECTION_FAILED = 51
+EVENT_CONNECTION_FINISHED = 52
+
+EVENT_START_SESSION = 100
+EVENT_CANCEL_SESSION = 101
+EVENT_FINISH_SESSION = 102
+EVENT_SESSION_STARTED = 150
+EVENT_SESSION_CANCELED = 151
+EVENT_SESSION_FINISHED = 152
+EVENT_SESSION_FAILED = 153
+
+EVENT_TASK_REQUEST = 200
+EVENT_TTS_SENTENCE_START = 350
+EVENT_TTS_SENTENCE_END = 351
+EVENT_TTS_RESPONSE = 352
+
+_EVENTS_WITHOUT_ID = frozenset({EVENT_START_CONNECTION, EVENT_FINISH_CONNECTION})
+
+_BYTE_0 = (PROTOCOL_VERSION << 4) | HEADER_SIZE
+_EVENT_REQUEST_BYTE_1 = (MSG_TYPE_FULL_CLIENT_REQUEST << 4) | FLAGS_WITH_EVENT
+_JSON_BYTE_2 = (SERIALIZATION_JSON << 4) | COMPRESSION_NONE
+
+# header(4) + payload_size(4) / header(4) + event(4)
+_HEADER_WITH_U32 = struct.Struct('!BBBBI')
+# header(4) + event(4) + id_size(4)
+_HEADER_WITH_EVENT_ID = struct.Struct('!BBBBII')
+_HEADER = struct.Struct('!BBBB')
+_U32 = struct.Struct('!I')
+_I32 = struct.Struct('!i')
+
+
+# ============================================================================
+# 打包
+# ============================================================================
+
+def pack_asr_packet(
+    msg_type: int,
+    payload: BytesLike = b"",
+    serialization: int = SERIALIZATION_NONE,
+    compression: int = COMPRESSION_NONE,
+    is_last: bool = False
+) -> bytes:
+    """打包 ASR 客户端请求帧 (payload 只复制一次)"""
+    if compression == COMPRESSION_GZIP:
+        payload = gzip.compress(payload)
+
+    flags = ASR_FLAGS_IS_LAST if is_last else ASR_FLAGS_NONE
+    return _HEADER_WITH_U32.pack(
+        _BYTE_0,
+        (msg_type << 4) | flags,
+        (serialization << 4) | compression,
+        0x00,
+        len(payload)
+    ) + payload
+
+
+_AUDIO_BYTE_1 = MSG_TYPE_AUDIO_ONLY_REQUEST << 4
+_AUDIO_LAST_BYTE_1 = _AUDIO_BYTE_1 | ASR_FLAGS_IS_LAST
+
+
+def pack_audio_packet(pcm: BytesLike, is_last: bool = False) -> bytes:
+    """打包音频帧 (PCM 不压缩；每 100ms 一帧的热路径，不经过 pack_asr_packet)"""
+    return _HEADER_WITH_U32.pack(
+        _BYTE_0, _AUDIO_LAST_BYTE_1 if is_last else _AUDIO_BYTE_1, 0x00, 0x00, len(pcm)
+    ) + pcm
+
+
+# 结束帧内容固定，预先生成
+LAST_AUDIO_PACKET = pack_audio_packet(b"", is_last=True)
+
+
+def pack_event_packet(
+    event: int,
+    payload: Union[BytesLike, Dict[str, Any]] = b"{}",
+    session_id: Optional[str] = None
+) -> bytes:
+    """
+    打包 TTS 双向流客户端事件帧 (JSON 序列化，不压缩)
+
+    Args:
+        payload: dict 时序列化为 JSON；固定内容可传预先序列化的 bytes
+        session_id: 会话类事件 (StartSession / TaskRequest / FinishSession ...) 必填
+    """
+    if isinstance(payload, dict):
+        payload = json.dumps(payload).encode('utf-8')
+
+    if session_id:
+        sid = session_id.encode('utf-8')
+        return b"".join((
+            _HEADER_WITH_EVENT_ID.pack(_BYTE_0, _EVENT_REQUEST_BYTE_1, _JSON_BYTE_2, 0x00, event, len(sid)),
+            sid,
+            _U32.pack(len(payload)),
+            payload,
+        ))
+    return b"".join((
+        _HEADER_WITH_U32.pack(_BYTE_0, _EVENT_REQUEST_BYTE_1, _JSON_BYTE_2, 0x00, event),
+        _U32.pack(len(payload)),
+        payload,
+    ))
+
+
+# 内容固定的事件帧 / payload 预先序列化
+START_CONNECTION_PACKET = pack_event_packet(EVENT_START_CONNECTION, b"{}")
+FINISH_CONNECTION_PACKET = pack_event_packet(EVENT_FINISH_CONNECTION, json.dumps({"event": EVENT_FINISH_CONNECTION}).encode('utf-8'))
+CANCEL_SESSION_PAYLOAD = json.dumps({"event": EVENT_CANCEL_SESSION}).encode('utf-8')
+FINISH_SESSION_PAYLOAD = json.dumps({"event": EVENT_FINISH_SESSION}).encode('utf-8')
+
+
+# ============================================================================
+# 解析
+# ============================================================================
+
+def _decompress(payload: memoryview, compression: int) -> bytes:
+    if compression == COMPRESSION_GZIP:
+        return gzip.decompress(payload)
+    return payload.tobytes()
+
+
+class AsrPacket(NamedTuple):
+    msg_type: int
+    flags: int
+    serialization: int
+    compression: int
+    sequence: Optional[int]
+    error_code: Optional[int]
+    payload: memoryview
+
+    def payload_bytes(self) -> bytes:
+        """返回解压后的 payload"""
+        return _decompress(self.payload, self.compression)
+
+
+def parse_asr_packet(data: BytesLike) -> Optional[AsrPacket]:
+    """
+    解析 ASR 服务端响应帧
+
+    Returns:
+        AsrPacket (payload 为 memoryview，不复制)；帧不完整时返回 None
+    """
+    length = len(data)
+    if length < 8:
+        return None
+
+    b0, b1, b2, _ = _HEADER.unpack_from(data, 0)
+    msg_type = b1 >> 4
+    flags = b1 & 0x0F
+    offset = max((b0 & 0x0F) * 4, 4)
+    sequence = None
+    error_code = None
+
+    # Error: header(4) + error_code(4) + size(4) + payload
+    if msg_type == MSG_TYPE_ERROR:
+        if length < offset + 4:
+            return None
+        error_code = _U32.unpack_from(data, offset)[0]
+        offset += 4
+    # 带序号: header(4) + sequence(4) + size(4) + payload
+    elif flags & ASR_FLAGS_HAS_SEQUENCE:
+        if length < offset + 4:
+            return None
+        sequence = _I32.unpack_from(data, offset)[0]
+        offset += 4
+
+    if length < offset + 4:
+        return None
+    size = _U32.unpack_from(data, offset)[0]
+    offset += 4
+    if length < offset + size:
+        return None
+
+    return AsrPacket._make((
+        msg_type, flags, b2 >> 4, b2 & 0x0F, sequence, error_code,
+        memoryview(data)[offset:offset + size],
+    ))
+
+
+class EventPacket(NamedTuple):
+    msg_type: int
+    flags: int
+    serialization: int
+    compression: int
+    sequence: Optional[int]
+    event: Optional[int]
+    session_id: Optional[str]     # 会话 ID 或连接 ID
+    error_code: Optional[int]
+    payload: memoryview
+
+    def payload_bytes(self) -> bytes:
+        """返回解压后的 payload"""
+        return _decompress(self.payload, self.compression)
+
+    def audio(self) -> BytesLike:
+        """音频 payload：未压缩时直接返回 memoryview (不复制)"""
+        if self.compression == COMPRESSION_NONE:
+            return self.payload
+        return self.payload_bytes()
+
+    def text(self) -> str:
+        """payload 文本 (错误信息 / JSON)，无法解压时返回空串"""
+        try:
+            return self.payload_bytes().decode('utf-8', errors='ignore')
+        except (OSError, EOFError, zlib.error):
+            return ""
+
+
+def parse_event_packet(data: BytesLike) -> Optional[EventPacket]:
+    """
+    解析 TTS 双向流服务端帧 (音频 / 事件 / 错误)
+
+    Returns:
+        EventPacket (payload 为 memoryview，不复制)；帧不完整时返回 None
+    """
+    length = len(data)
+    if length < 8:
+        return None
+
+    b0, b1, b2, _ = _HEADER.unpack_from(data, 0)
+    msg_type = b1 >> 4
+    flags = b1 & 0x0F
+    offset = max((b0 & 0x0F) * 4, 4)
+    sequence = None
+    event = None
+    session_id = None
+    error_code = None
+
+    if msg_type == MSG_TYPE_ERROR:
+        if length < offset + 4:
+            return None
+        error_code = _U32.unpack_from(data, offset)[0]
+        offset += 4
+    else:
+        if flags & ASR_FLAGS_HAS_SEQUENCE:
+            if length < offset + 4:
+                return None
+            sequence = _I32.unpack_from(data, offset)[0]
+            offset += 4
+        if flags & FLAGS_WITH_EVENT:
+            if length < offset + 4:
+                return None
+            event = _U32.unpack_from(data, offset)[0]
+            offset += 4
+            if event not in _EVENTS_WITHOUT_ID:
+                if length < offset + 4:
+                    return None
+                id_size = _U32.unpack_from(data, offset)[0]
+                offset += 4
+                if length < offset + id_size:
+                    return None
+                session_id = str(data[offset:offset + id_size], 'utf-8', 'ignore')
+                offset += id_size
+
+    if length < offset + 4:
+        return None
+    size = _U32.unpack_from(data, offset)[0]
+    offset += 4
+    if length < offset + size:
+        return None
+
+    return EventPacket._make((
+        msg_type, flags, b2 >> 4, b2 & 0x0F, sequence, event, session_id, error_code,
+        memoryview(data)[offset:offset + size],
+    ))
+
+
+# 服务端音频帧: header(4) + event(4) + id_size(4) 一次解出
+_AUDIO_RESPONSE_PREFIX = struct.Struct('!HBxII')
+_AUDIO_RESPONSE_B01 = (_BYTE_0 << 8) | (MSG_TYPE_AUDIO_ONLY_RESPONSE << 4) | FLAGS_WITH_EVENT
+
+
+def parse_audio_payload(data: BytesLike) -> Optional[memoryview]:
+    """
+    TTS 音频帧快速路径 (标准头 + event + session_id，不压缩)
+
+    Returns:
+        音频 payload 的 memoryview (不复制)；不是该形式的帧返回 None，
+        调用方再交给 parse_event_packet 处理
+    """
+    length = len(data)
+    if length < 16:
+        return None
+    b01, b2, _, id_size = _AUDIO_RESPONSE_PREFIX.unpack_from(data, 0)
+    if b01 != _AUDIO_RESPONSE_B01 or b2 & 0x0F:
+        return None
+    offset = 16 + id_size
+    if length < offset:
+        return None
+    size = _U32.unpack_from(data, offset - 4)[0]
+    if length < offset + size:
+        return None
+    return memoryview(data)[offset:offset + size]
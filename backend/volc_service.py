@@ -1,12 +1,12 @@
 import os
 import json
 import uuid
-import gzip
 import time
 import requests
 import websockets
 import asyncio
 import struct
+import logging
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -23,232 +23,7 @@ TTS_CLUSTER = os.getenv("VOLC_TTS_CLUSTER")
 MOCK_MODE = False
 # --------------------------------
 
-# --- Volcengine ASR Protocol V2/V3 Constants ---
-PROTOCOL_VERSION = 0b0001
-HEADER_SIZE = 0b0001
-MSG_TYPE_FULL_CLIENT_REQUEST = 0b0001
-MSG_TYPE_AUDIO_ONLY_REQUEST = 0b0010
-MSG_TYPE_FULL_SERVER_RESPONSE = 0b1001
-MSG_TYPE_PARTIAL_SERVER_RESPONSE = 0b1010
-MSG_TYPE_ERROR = 0b1111
-
-ASR_FLAGS_NONE = 0b0000
-ASR_FLAGS_HAS_SEQUENCE = 0b0001
-ASR_FLAGS_IS_LAST = 0b0010
-
-SERIALIZATION_JSON = 0b0001
-SERIALIZATION_NONE = 0b0000
-COMPRESSION_GZIP = 0b0001
-COMPRESSION_NONE = 0b0000
-
-def construct_protocol_packet(msg_type, payload_bytes, serialization_method=SERIALIZATION_NONE, compression_method=COMPRESSION_NONE, is_last_packet=False, sequence=None):
-    flags = ASR_FLAGS_NONE
-    if is_last_packet:
-        flags |= ASR_FLAGS_IS_LAST
-    
-    # Note: In V3 Client example, flags is b0000 and NO separate sequence field is shown.
-    # We will follow this strictly to avoid malformed packets.
-    
-    if compression_method == COMPRESSION_GZIP:
-        payload_bytes = gzip.compress(payload_bytes)
-        
-    byte_0 = (PROTOCOL_VERSION << 4) | HEADER_SIZE
-    byte_1 = (msg_type << 4) | flags
-    byte_2 = (serialization_method << 4) | compression_method
-    byte_3 = 0x00
-    header = struct.pack('!BBBB', byte_0, byte_1, byte_2, byte_3)
-    payload_size = struct.pack('!I', len(payload_bytes))
-    return header + payload_size + payload_bytes
-
-def parse_protocol_packet(packet_data):
-    if len(packet_data) < 8:
-        return None, None, False, None
-    header = packet_data[:4]
-    b0, b1, b2, b3 = struct.unpack('!BBBB', header)
-    msg_type = b1 >> 4
-    flags = b1 & 0x0F
-    compression_method = b2 & 0b00001111
-    is_gzip = (compression_method == COMPRESSION_GZIP)
-    
-    offset = 4
-    error_code = None
-    
-    # V3 Error Packet: Header(4) + ErrorCode(4) + Size(4) + Payload
-    if msg_type == MSG_TYPE_ERROR:
-        if len(packet_data) < 12: return msg_type, None, is_gzip, None
-        error_code = struct.unpack('!I', packet_data[offset:offset+4])[0]
-        offset += 4
-    # V3 Response with Sequence: Header(4) + Sequence(4) + Size(4) + Payload
-    elif flags & ASR_FLAGS_HAS_SEQUENCE:
-        if len(packet_data) < 12: return msg_type, None, is_gzip, None
-        # sequence = struct.unpack('!I', packet_data[offset:offset+4])[0]
-        offset += 4
-        
-    if len(packet_data) < offset + 4:
-        return msg_type, None, is_gzip, error_code
-        
-    payload_len = struct.unpack('!I', packet_data[offset:offset+4])[0]
-    payload = packet_data[offset+4 : offset+4+payload_len]
-    return msg_type, payload, is_gzip, error_code
-
-from fastapi import WebSocket
-
-async def asr_stream(client_ws: WebSocket):
-    ak = os.getenv("VOLC_ACCESS_KEY") 
-    appid = os.getenv("VOLC_APPID")
-    
-    if not all([ak, appid]):
-        print(f"Error: Missing Volcengine Config.")
-        await client_ws.close()
-        return
-
-    # --- V3 BIGMODEL CONFIGURATION ---
-    host = "openspeech.bytedance.com"
-    path = "/api/v3/sauc/bigmodel_async" 
-    url = f"wss://{host}{path}"
-    
-    query = {
-        "appid": appid,
-        "resource_id": "volc.seedasr.sauc.duration"
-    }
-    
-    req_id = str(uuid.uuid4())
-    # ALIGN WITH V3 PARAMETER TABLE
-    init_payload = {
-        "type": "application/json",
-        "app": {"appid": appid, "token": ak},
-        "user": {"uid": "user_1"},
-        "audio": {
-            "format": "pcm", 
-            "rate": 16000, 
-            "bits": 16, 
-            "channel": 1, 
-            "codec": "raw"
-        },
-        "request": {
-            "model_name": "bigmodel", # REQUIRED BY TABLE
-            "reqid": req_id, 
-            "result_type": "single", # DEFAULT IN CODE
-            "show_utterances": True, 
-            "enable_intermediate_result": True,
-            "enable_itn": True,
-            "enable_punc": True
-        }
-    }
-
-    ws_headers = {
-        "X-Api-Resource-Id": "volc.seedasr.sauc.duration",
-        "X-Api-App-Key": appid,
-        "X-Api-Access-Key": ak,
-        "X-Api-Connect-Id": str(uuid.uuid4())
-    }
-
-    import urllib.parse
-    full_url = url + "?" + urllib.parse.urlencode(query)
-
-    print(f"Connecting with Token Auth: appid={appid}")
-
-    try:
-        import ssl
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        
-        async with websockets.connect(full_url, additional_headers=ws_headers, ssl=ssl_context) as volc_ws:
-            print("Connected to Volcengine ASR (Handshake Success)")
-            
-            try:
-                resp = getattr(volc_ws, 'response', None)
-                headers = getattr(resp, 'headers', {}) if resp else {}
-                logid = headers.get("X-Tt-Logid")
-                if logid:
-                    print(f"\n[ASR_LOG] OFFICIAL LOGID DETECTED: {logid}\n")
-            except: pass
-
-            # SEND INIT PACKET (GZIP REQUIRED BY V3 EXAMPLE)
-            init_json_bytes = json.dumps(init_payload).encode('utf-8')
-            init_packet = construct_protocol_packet(MSG_TYPE_FULL_CLIENT_REQUEST, init_json_bytes, SERIALIZATION_JSON, COMPRESSION_GZIP)
-            await volc_ws.send(init_packet)
-
-            async def send_audio_loop():
-                seq = 1
-                try:
-                    async for message in client_ws.iter_bytes():
-                        if not message: continue
-                        if isinstance(message, str): message = message.encode('utf-8')
-                        # V3 Audio Request: Usually Gzipped as per example flow
-                        audio_packet = construct_protocol_packet(MSG_TYPE_AUDIO_ONLY_REQUEST, message, SERIALIZATION_NONE, COMPRESSION_GZIP)
-                        await volc_ws.send(audio_packet)
-                        print(f"[ASR_TRACE] Chunk {seq} Sent to Volc (Size: {len(message)})")
-                        seq += 1
-                except Exception as e:
-                    print(f"Send Error: {e}")
-                finally:
-                    if seq > 1:
-                        # Final Packet
-                        last_packet = construct_protocol_packet(MSG_TYPE_AUDIO_ONLY_REQUEST, b"", SERIALIZATION_NONE, COMPRESSION_GZIP, is_last_packet=True)
-                        await volc_ws.send(last_packet)
-                    print("Send Loop Ended")
-
-            async def receive_text_loop():
-                try:
-                    async for message in volc_ws:
-                        if isinstance(message, str):
-                            try:
-                                data = json.loads(message)
-                                print(f"[ASR_DEBUG] Raw Response: {data}")
-                                result = data.get('result')
-                                if result:
-                                    # Compatibility: result can be list or dict
-                                    text = result['text'] if isinstance(result, dict) else result[0]['text']
-                                    await client_ws.send_json({"text": text})
-                            except: continue
-                            continue
-                            
-                        msg_type, payload, is_gzip, error_code = parse_protocol_packet(message)
-                        
-                        if msg_type == MSG_TYPE_ERROR:
-                            if is_gzip: payload = gzip.decompress(payload)
-                            error_text = payload.decode('utf-8', errors='ignore')
-                            print(f"[VOLC ERROR] Code={error_code} Msg={error_text}")
-                            continue 
-                            
-                        if msg_type in [MSG_TYPE_FULL_SERVER_RESPONSE, MSG_TYPE_PARTIAL_SERVER_RESPONSE]:
-                            if is_gzip: payload = gzip.decompress(payload)
-                            try:
-                                json_str = payload.decode('utf-8', errors='replace')
-                                print(f"[ASR_DEBUG] Raw Binary JSON: {json_str}")
-                                data = json.loads(json_str)
-                                result = data.get('result')
-                                if result:
-                                    # Send each utterance separately with correct is_final flag
-                                    utterances = result.get('utterances', [])
-                                    if utterances:
-                                        for i, utterance in enumerate(utterances):
-                                            text = utterance.get('text', '')
-                                            is_final = utterance.get('definite', False)
-                                            if text:
-                                                await client_ws.send_json({
-                                                    "text": text, 
-                                                    "is_final": is_final,
-                                                    "index": i
-                                                })
-                                                print(f"[ASR] Sent: idx={i}, is_final={is_final}, text={text[:30]}...")
-                                    else:
-                                        # Fallback for old format
-                                        text = result['text'] if isinstance(result, dict) else result[0]['text']
-                                        await client_ws.send_json({"text": text, "is_final": False})
-                            except: pass
-                except Exception as e:
-                    print(f"Receive Error: {e}")
-                finally: print("Receive Loop Ended")
-
-            await asyncio.gather(send_audio_loop(), receive_text_loop())
-
-    except Exception as e:
-        print(f"Connection Error: {e}")
-        await client_ws.send_json({"text": "(服务连接异常)"})
-    print("ASR Stream Ended")
+# ASR 流式识别已迁移至 asr_gateway.py (协议编解码见 volc_protocol.py)
 
 # --- TTS V3 WebSocket Implementation ---
 async def synthesize_speech_v3_async(text):
@@ -323,7 +98,7 @@ async def synthesize_speech_v3_async(text):
         
         full_packet = header + event_type + session_id_len + session_id_bytes + payload_len + payload_bytes
         await ws.send(full_packet)
-        print("[TTS_V3] Sent StartSession")
+        logging.debug("[TTS_V3] Sent StartSession")
 
         # 2. Receive Loop
         audio_buffer = bytearray()
@@ -407,7 +182,7 @@ async def synthesize_speech_v3_async(text):
                  msg_type = b1 >> 4
                  flags = b1 & 0x0F
                  if msg_type == 0b1011 and (flags == 0b0010 or flags == 0b0011):
-                     print("[TTS_V3] Received Last Audio Packet")
+                     logging.debug("[TTS_V3] Received Last Audio Packet")
                      break
                      
     import base64
@@ -427,7 +202,6 @@ def synthesize_speech(text, user_id=None, text_id=None, voice_id=None, output_di
     Returns:
         base64 编码的音频数据
     """
-    import time
     start_time = time.time()
     
     # Wrapper to run async V3 code synchronously
@@ -440,30 +214,22 @@ def synthesize_speech(text, user_id=None, text_id=None, voice_id=None, output_di
         # 记录到数据库
         if user_id and text_id and audio_base64:
             try:
-                from db_logger import log_tts_call, get_model_id_by_name
+                from .db_logger import log_tts_call, get_model_id_by_name
+                from .usage_rollup_service import get_default_model_id, compute_tts_cost
                 
-                # 获取 TTS 模型ID (Vivi 2.0)
-                model_id = get_model_id_by_name("Vivi 2.0")
-                if not model_id:
-                    # 如果找不到,使用默认值或查询第一个 TTS 模型
-                    from database import get_db_connection
-                    with get_db_connection() as conn:
-                        with conn.cursor() as cursor:
-                            cursor.execute("SELECT model_id FROM base_models WHERE model_type = 'TTS' LIMIT 1")
-                            row = cursor.fetchone()
-                            model_id = row[0] if row else 1
+                # 获取 TTS 模型ID (Vivi 2.0)，找不到时使用第一个 TTS 模型
+                model_id = get_model_id_by_name("Vivi 2.0") or get_default_model_id('TTS')
                 
-                # 估算成本 (这里需要根据实际情况计算,暂时使用固定值)
-                # 实际应该根据字符数和模型定价计算
-                cost = len(text) * 0.0001  # 示例:每字符 0.0001 元
+                # 按 base_models 价格 (¥/万字符) 计算成本
+                cost = compute_tts_cost(model_id, len(text))
                 
-                log_tts_call(user_id, text_id, voice_id, model_id, duration_ms, cost)
+                log_tts_call(user_id, text_id, voice_id, model_id, duration_ms, cost, char_count=len(text))
             except Exception as e:
                 import logging
                 logging.error(f"记录 TTS 调用失败: {e}")
         
         return audio_base64
     except Exception as e:
-        print(f"[TTS_V3 ERROR] {e}")
+        logging.error(f"[TTS_V3 ERROR] {e}")
         return None
 
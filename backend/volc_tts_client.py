@@ -5,59 +5,30 @@ import json
 import os
 import uuid
 import logging
-import struct
 import base64
-import gzip
 import ssl
 import httpx
 from dotenv import load_dotenv
 
+from .logging_service import log_sampled
+from .volc_protocol import (
+    MSG_TYPE_FULL_SERVER_RESPONSE, MSG_TYPE_AUDIO_ONLY_RESPONSE, MSG_TYPE_ERROR,
+    EVENT_CONNECTION_STARTED, EVENT_START_SESSION, EVENT_CANCEL_SESSION, EVENT_FINISH_SESSION,
+    EVENT_SESSION_STARTED, EVENT_SESSION_CANCELED, EVENT_SESSION_FINISHED, EVENT_SESSION_FAILED,
+    EVENT_TASK_REQUEST, EVENT_TTS_RESPONSE,
+    START_CONNECTION_PACKET, FINISH_CONNECTION_PACKET, CANCEL_SESSION_PAYLOAD, FINISH_SESSION_PAYLOAD,
+    pack_event_packet, parse_event_packet, parse_audio_payload,
+)
+
 load_dotenv()
 
 APPID = os.getenv("VOLC_APPID")
 ACCESS_TOKEN = os.getenv("VOLC_ACCESS_KEY")
 CLUSTER = os.getenv("VOLC_TTS_CLUSTER", "volc_tts")
 TTS_ENDPOINT = "wss://openspeech.bytedance.com/api/v3/tts/bidirection"
+TTS_CANCEL_TIMEOUT_SEC = 2.0  # CancelSession 等待确认的上限
 
-# --- V3 Protocol Constants (Updated per mix.md) ---
-PROTOCOL_VERSION = 1
-
-# Message Types
-MSG_FULL_CLIENT_REQUEST = 1
-MSG_FULL_SERVER_RESPONSE = 9
-MSG_AUDIO_ONLY_RESPONSE = 11
-MSG_ERROR_RESPONSE = 15
-
-# Message Flags
-FLAG_WITH_EVENT = 4 
-
-# Serialization
-SER_RAW = 0 
-SER_JSON = 1
-
-# Compression
-COMP_NONE = 0
-COMP_GZIP = 1
-
-# Event Codes (2.3)
-EVENT_START_CONNECTION = 1
-EVENT_FINISH_CONNECTION = 2
-EVENT_CONNECTION_STARTED = 50
-EVENT_CONNECTION_FAILED = 51
-EVENT_CONNECTION_FINISHED = 52
-
-EVENT_START_SESSION = 100
-EVENT_CANCEL_SESSION = 101
-EVENT_FINISH_SESSION = 102
-EVENT_SESSION_STARTED = 150
-EVENT_SESSION_CANCELED = 151
-EVENT_SESSION_FINISHED = 152
-EVENT_SESSION_FAILED = 153
-
-EVENT_TASK_REQUEST = 200
-EVENT_TTS_SENTENCE_START = 350
-EVENT_TTS_SENTENCE_END = 351
-EVENT_TTS_RESPONSE = 352
+# V3 双向流帧编解码见 volc_protocol.py (与 ASR 共用)
 
 class VolcTTSClient:
     def __init__(self):
@@ -68,14 +39,13 @@ class VolcTTSClient:
         self.lock = asyncio.Lock()
         self.http_client = httpx.AsyncClient(timeout=30.0)
         
-    async def synthesize_http_v3(self, text: str, user_id: str = None, text_id: int = None, voice_id: int = None) -> str:
+    async def stream_http_v3(self, text: str, audio_format: str = "mp3", voice_name: str = "zh_female_vv_uranus_bigtts", sample_rate: int = 24000):
         """
-        [Legacy/Fallback] Synthesize speech using V3 HTTP API (Unidirectional)
-        Reserved for non-streaming scenarios or fallback.
+        V3 HTTP API (Unidirectional) 流式合成：每收到一行响应即解码并产出音频字节
+
+        使用共享的 httpx 连接池，不占用双向流连接锁。
+        上游返回错误时抛出异常 (调用方决定如何处理已发送的部分)。
         """
-        import time
-        start_time = time.time()
-        
         url = "https://openspeech.bytedance.com/api/v3/tts/unidirectional"
         headers = {
             "X-Api-App-Key": APPID, # Use App-Key for V3
@@ -89,93 +59,48 @@ class VolcTTSClient:
         payload = {
             "req_params": {
                 "text": text,
-                "speaker": "zh_female_vv_uranus_bigtts",
+                "speaker": voice_name,
                 "audio_params": {
-                    "format": "mp3",
-                    "sample_rate": 24000
+                    "format": audio_format,
+                    "sample_rate": sample_rate
                 }
             }
         }
         
+        async with self.http_client.stream('POST', url, headers=headers, json=payload) as response:
+            if response.status_code != 200:
+                error_text = await response.aread()
+                raise Exception(f"TTS HTTP Error {response.status_code}: {error_text.decode('utf-8', 'ignore')}")
+            
+            async for line in response.aiter_lines():
+                if not line.strip(): continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    continue
+                if data.get("code") == 0 and data.get("data"):
+                    chunk = base64.b64decode(data["data"])
+                    log_sampled('tts_http_chunk', logging.DEBUG, lambda: f"[TTS HTTP] Audio Chunk: {len(chunk)} bytes")
+                    yield chunk
+                elif data.get("code") not in (0, 20000000):
+                    raise Exception(f"TTS HTTP Error {data.get('code')}: {data.get('message')}")
+
+    async def synthesize_http_v3(self, text: str, user_id: str = None, text_id: int = None, voice_id: int = None) -> str:
+        """
+        [Legacy/Fallback] Synthesize speech using V3 HTTP API (Unidirectional)
+        Reserved for non-streaming scenarios or fallback.
+
+        Returns: base64 编码的完整 MP3，失败时返回 None
+        """
         try:
-            # Stream response
-            async with self.http_client.stream('POST', url, headers=headers, json=payload) as response:
-                if response.status_code != 200:
-                    error_text = await response.aread()
-                    logging.error(f"[TTS HTTP] Error {response.status_code}: {error_text.decode()}")
-                    return None
-                
-                # Concatenate all base64 audio chunks
-                audio_chunks = []
-                async for line in response.aiter_lines():
-                    if not line.strip(): continue
-                    try:
-                        data = json.loads(line)
-                        if data.get("code") == 0 and "data" in data:
-                            audio_chunks.append(data["data"])
-                    except: continue
-                
-                if audio_chunks:
-                    # Filter out None values and concatenate
-                    valid_chunks = [chunk for chunk in audio_chunks if chunk is not None]
-                    if valid_chunks:
-                        full_audio = "".join(valid_chunks)
-                        return full_audio
-                return None
-                    
+            audio = bytearray()
+            async for chunk in self.stream_http_v3(text, audio_format="mp3"):
+                audio.extend(chunk)
+            return base64.b64encode(audio).decode('utf-8') if audio else None
         except Exception as e:
             logging.error(f"[TTS HTTP] Exception: {e}")
             return None
 
-    def _pack_header(self, msg_type, msg_flags, serialization, compression):
-        b0 = 0x11 # Version 1, Header Size 1 (which means 4 bytes)
-        b1 = (msg_type << 4) | msg_flags
-        b2 = (serialization << 4) | compression
-        b3 = 0x00
-        return struct.pack('!BBBB', b0, b1, b2, b3)
-
-    def _parse_header(self, data):
-        if len(data) < 4: return 0, 0, b""
-        b0, b1, b2, b3 = struct.unpack('!BBBB', data[:4])
-        header_size = (b0 & 0x0F) * 4
-        msg_type = b1 >> 4
-        flags = b1 & 0x0F
-        comp = b2 & 0x0F
-        
-        body = data[header_size:]
-        if comp == COMP_GZIP:
-             try: body = gzip.decompress(body)
-             except: pass
-        return msg_type, flags, body
-
-    async def _pack_v3_packet(self, event_code, payload_json, session_id=None):
-        """
-        Definitive V3 Binary Packet Builder per Official Support
-        - Byte 0 is always 0x11 (Header Size = 4 bytes)
-        - Session/Data Class (Event 100, 102, 200) MUST include 16-byte SID prefix
-        - Connection Class (Event 1, 2) uses 8-byte prefix (Header + Event)
-        """
-        # Header: Version 1, Header Size 1 (4 bytes)
-        byte_0 = 0x11
-        byte_1 = (MSG_FULL_CLIENT_REQUEST << 4) | FLAG_WITH_EVENT # 0x14
-        byte_2 = (SER_JSON << 4) | COMP_NONE # 0x10
-        byte_3 = 0x00
-        
-        header = struct.pack('!BBBB', byte_0, byte_1, byte_2, byte_3)
-        body = struct.pack('!I', event_code)
-        
-        if session_id:
-            # Session/Data Class: Fixed 16-byte SID prefix
-            sid_str = session_id[:12].ljust(12, '0')
-            sid_bytes = sid_str.encode('utf-8')
-            body += struct.pack('!I', 12) + sid_bytes # SIDLen(4) + SID(12)
-            
-        json_bytes = json.dumps(payload_json).encode('utf-8')
-        # PayloadLen(4) + JSON
-        body += struct.pack('!I', len(json_bytes)) + json_bytes
-        
-        return header + body
-
     async def connect(self):
         """Connect to WebSocket Bidirectional Endpoint and Perform Handshake"""
         if self.connected and self.websocket and self.websocket.state == State.OPEN and self.handshake_done:
@@ -192,26 +117,30 @@ class VolcTTSClient:
             self.connected = False
             self.handshake_done = False
             
+            # 旧连接 (如 CancelSession 未确认) 先关闭，避免残留
+            if self.websocket:
+                try: await self.websocket.close()
+                except Exception: pass
+                self.websocket = None
+            
             logging.info(f"Connecting to TTS V3 via {TTS_ENDPOINT}...")
             ssl_context = ssl._create_unverified_context()
             self.websocket = await websockets.connect(TTS_ENDPOINT, additional_headers=headers, ssl=ssl_context)
             self.connected = True
             
             # --- Perform StartConnection Handshake (Event 1) ---
-            conn_packet = await self._pack_v3_packet(EVENT_START_CONNECTION, {})
-            await self.websocket.send(conn_packet)
+            await self.websocket.send(START_CONNECTION_PACKET)
             
             msg = await asyncio.wait_for(self.websocket.recv(), timeout=5.0)
-            m_type, flags, body = self._parse_header(msg)
-            if m_type == MSG_FULL_SERVER_RESPONSE:
-                event = struct.unpack('!I', body[:4])[0]
-                if event == EVENT_CONNECTION_STARTED:
+            packet = parse_event_packet(msg)
+            if packet and packet.msg_type == MSG_TYPE_FULL_SERVER_RESPONSE:
+                if packet.event == EVENT_CONNECTION_STARTED:
                     logging.info("TTS V3 WebSocket Connection & Handshake Success")
                     self.handshake_done = True
                 else:
-                    raise Exception(f"Connection Handshake Failed: Event {event}")
+                    raise Exception(f"Connection Handshake Failed: Event {packet.event}")
             else:
-                 raise Exception(f"Connection Handshake Failed: MsgType {m_type}")
+                 raise Exception(f"Connection Handshake Failed: MsgType {packet.msg_type if packet else None}")
                  
         except Exception as e:
             logging.error(f"TTS Connection/Handshake Failed: {e}")
@@ -224,18 +153,48 @@ class VolcTTSClient:
         if self.websocket:
             # Send FinishConnection before closing
             try:
-                c_payload = {"event": EVENT_FINISH_CONNECTION}
-                final_packet = await self._pack_v3_packet(EVENT_FINISH_CONNECTION, c_payload)
-                await self.websocket.send(final_packet)
+                await self.websocket.send(FINISH_CONNECTION_PACKET)
             except: pass
             await self.websocket.close()
             self.websocket = None
             self.connected = False
             self.handshake_done = False
 
+    async def _cancel_session(self, session_id, sender_task, receiver_task):
+        """
+        CancelSession (Event 101)，丢弃剩余音频直到 SessionCanceled / SessionFinished，
+        保证下一次会话从干净的连接开始；未确认时标记重连
+        """
+        sender_task.cancel()
+        receiver_task.cancel()
+        await asyncio.gather(sender_task, receiver_task, return_exceptions=True)
+
+        async def drain():
+            while True:
+                packet = parse_event_packet(await self.websocket.recv())
+                if packet is None:
+                    continue
+                if packet.msg_type == MSG_TYPE_FULL_SERVER_RESPONSE:
+                    if packet.event in (EVENT_SESSION_CANCELED, EVENT_SESSION_FINISHED, EVENT_SESSION_FAILED):
+                        return
+                elif packet.msg_type == MSG_TYPE_ERROR:
+                    return
+
+        try:
+            await self.websocket.send(pack_event_packet(EVENT_CANCEL_SESSION, CANCEL_SESSION_PAYLOAD, session_id=session_id))
+            await asyncio.wait_for(drain(), timeout=TTS_CANCEL_TIMEOUT_SEC)
+            logging.info(f"[TTS V3] Session Canceled (SID={session_id[:8]})")
+        except BaseException as e:
+            logging.warning(f"[TTS V3] CancelSession 未确认，下次使用时重连: {e!r}")
+            self.handshake_done = False
+            if isinstance(e, asyncio.CancelledError):
+                raise
+
     async def synthesize_stream_v3(self, text_iterator, voice_name="zh_female_vv_uranus_bigtts", user_id=None):
         """
         True Bidirectional Streaming (Persistence-Enabled)
+
+        调用方提前结束时需 await gen.aclose()：会发送 CancelSession 并释放连接锁。
         """
         await self.lock.acquire()
         try:
@@ -244,7 +203,8 @@ class VolcTTSClient:
                 logging.error("TTS Connection not ready for session")
                 return
 
-            session_id = str(uuid.uuid4())
+            # Session/Data Class 帧带 12 字节 SID
+            session_id = uuid.uuid4().hex[:12]
             
             # --- 1. Phase 1: StartSession (Event 100) ---
             start_payload = {
@@ -261,27 +221,24 @@ class VolcTTSClient:
                     }
                 }
             }
-            session_packet = await self._pack_v3_packet(EVENT_START_SESSION, start_payload, session_id=session_id)
-            await self.websocket.send(session_packet)
+            await self.websocket.send(pack_event_packet(EVENT_START_SESSION, start_payload, session_id=session_id))
             logging.info(f"[TTS V3] StartSession Sent (SID={session_id[:8]})")
             
             session_ready = False
             while not session_ready:
                 try:
-                    msg = await asyncio.wait_for(self.websocket.recv(), timeout=10.0)
-                    m_type, flags, body = self._parse_header(msg)
-                    if m_type == MSG_FULL_SERVER_RESPONSE:
-                        event = struct.unpack('!I', body[:4])[0]
-                        if event == EVENT_SESSION_STARTED:
+                    packet = parse_event_packet(await asyncio.wait_for(self.websocket.recv(), timeout=10.0))
+                    if packet is None:
+                        continue
+                    if packet.msg_type == MSG_TYPE_FULL_SERVER_RESPONSE:
+                        if packet.event == EVENT_SESSION_STARTED:
                             logging.info("[TTS V3] SessionStarted Received")
                             session_ready = True
-                        elif event == EVENT_SESSION_FAILED:
-                            # Try to decode error detail if present
-                            err_msg = body[8:].decode('utf-8', 'ignore') if len(body) > 8 else "Unknown Session Error"
-                            logging.error(f"[TTS V3] SessionFailed: {err_msg}")
+                        elif packet.event == EVENT_SESSION_FAILED:
+                            logging.error(f"[TTS V3] SessionFailed: {packet.text() or 'Unknown Session Error'}")
                             return
-                    elif m_type == MSG_ERROR_RESPONSE:
-                         logging.error(f"[TTS V3] Session Error: {body[4:].decode('utf-8', 'ignore')}")
+                    elif packet.msg_type == MSG_TYPE_ERROR:
+                         logging.error(f"[TTS V3] Session Error ({packet.error_code}): {packet.text()}")
                          return
                 except Exception as e:
                     logging.error(f"[TTS V3] Session Handshake Error: {e}")
@@ -299,14 +256,11 @@ class VolcTTSClient:
                             "req_params": {"text": chunk}
                         }
                         # OFFICIAL: TaskRequest (200) MUST also carry SID prefix in Session-Class
-                        t_packet = await self._pack_v3_packet(EVENT_TASK_REQUEST, t_payload, session_id=session_id)
-                        await self.websocket.send(t_packet)
-                        logging.debug(f"[TTS V3] Sent TaskRequest: {chunk[:10]}...")
+                        await self.websocket.send(pack_event_packet(EVENT_TASK_REQUEST, t_payload, session_id=session_id))
+                        log_sampled('tts_task_request', logging.DEBUG, lambda: f"[TTS V3] Sent TaskRequest: {chunk[:10]}...")
                     
                     # FinishSession (Event 102) - Also needs SID prefix
-                    f_payload = {"event": EVENT_FINISH_SESSION}
-                    f_packet = await self._pack_v3_packet(EVENT_FINISH_SESSION, f_payload, session_id=session_id)
-                    await self.websocket.send(f_packet)
+                    await self.websocket.send(pack_event_packet(EVENT_FINISH_SESSION, FINISH_SESSION_PAYLOAD, session_id=session_id))
                     logging.info("[TTS V3] Sent FinishSession")
                 except Exception as e:
                     logging.error(f"[TTS V3] Sender Error: {e}")
@@ -315,36 +269,37 @@ class VolcTTSClient:
                 try:
                     while True:
                         msg = await self.websocket.recv()
-                        m_type, flags, body = self._parse_header(msg)
                         
-                        # Use fixed parsing offset (20 bytes into body if Session packet)
-                        # Offset 20 in body = Index 24 in Packet (Byte 25)
-                        # Offset 24 in body = Index 28 in Packet (Byte 29)
-                        if m_type == MSG_AUDIO_ONLY_RESPONSE:
-                            if len(body) < 24: continue
-                            p_len = struct.unpack('!I', body[20:24])[0]
-                            chunk = body[24:24+p_len]
-                            if chunk:
-                                if len(chunk) > 4:
-                                    logging.debug(f"[TTS V3 DEBUG] Audio Chunk (Offset 28): {chunk[:4].hex()}... Length: {len(chunk)}")
+                        # 音频 payload 为接收帧上的 memoryview，不复制
+                        chunk = parse_audio_payload(msg)
+                        if chunk is not None:
+                            if len(chunk):
+                                log_sampled('tts_audio_chunk', logging.DEBUG, lambda: f"[TTS V3] Audio Chunk: Length: {len(chunk)}")
+                                await audio_queue.put(chunk)
+                            continue
+                        
+                        packet = parse_event_packet(msg)
+                        if packet is None:
+                            continue
+                        
+                        if packet.msg_type == MSG_TYPE_AUDIO_ONLY_RESPONSE:
+                            chunk = packet.audio()
+                            if len(chunk):
+                                log_sampled('tts_audio_chunk', logging.DEBUG, lambda: f"[TTS V3] Audio Chunk: Length: {len(chunk)}")
                                 await audio_queue.put(chunk)
                             
-                        elif m_type == MSG_FULL_SERVER_RESPONSE:
-                            if len(body) < 24: continue
-                            event = struct.unpack('!I', body[:4])[0]
-                            if event == EVENT_SESSION_FINISHED:
+                        elif packet.msg_type == MSG_TYPE_FULL_SERVER_RESPONSE:
+                            if packet.event == EVENT_SESSION_FINISHED:
                                 logging.info("[TTS V3] SessionFinished Received")
                                 break
-                            elif event == EVENT_TTS_RESPONSE:
-                                p_len = struct.unpack('!I', body[20:24])[0]
-                                chunk = body[24:24+p_len]
-                                if p_len > 0: 
-                                    if len(chunk) > 4:
-                                         logging.debug(f"[TTS V3 DEBUG] Audio Full Response Chunk: {chunk[:4].hex()}")
+                            elif packet.event == EVENT_TTS_RESPONSE:
+                                chunk = packet.audio()
+                                if len(chunk):
+                                    log_sampled('tts_audio_chunk', logging.DEBUG, lambda: f"[TTS V3] Audio Full Response Chunk: Length: {len(chunk)}")
                                     await audio_queue.put(chunk)
                                 
-                        elif m_type == MSG_ERROR_RESPONSE:
-                            logging.error(f"[TTS V3] Error Response: {body[4:].decode('utf-8', 'ignore')}")
+                        elif packet.msg_type == MSG_TYPE_ERROR:
+                            logging.error(f"[TTS V3] Error Response ({packet.error_code}): {packet.text()}")
                             break
                 except Exception as e:
                     if self.connected: 
@@ -356,10 +311,16 @@ class VolcTTSClient:
             sender_task = asyncio.create_task(sender())
             receiver_task = asyncio.create_task(receiver())
 
-            while True:
-                chunk = await audio_queue.get()
-                if chunk is None: break
-                yield chunk
+            try:
+                while True:
+                    chunk = await audio_queue.get()
+                    if chunk is None: break
+                    yield chunk
+            finally:
+                # 消费方提前退出 (用户打断 / 断开)：取消会话，避免继续合成无人收听的音频
+                if not receiver_task.done():
+                    await self._cancel_session(session_id, sender_task, receiver_task)
+                sender_task.cancel()
 
             # session cleaned up, connection remains open.
 
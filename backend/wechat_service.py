@@ -2,11 +2,17 @@
 """
 微信 API 服务模块
 提供微信小程序登录相关的 API 调用
+
+code2session 使用进程内共享的 httpx.AsyncClient (连接复用、并发连接数上限)，
+不阻塞事件循环；小程序发版后的登录高峰不会拖慢同一进程内进行中的访谈。
 """
 
 import os
-import requests
+import asyncio
 import logging
+from typing import Optional
+
+import httpx
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,8 +24,33 @@ WECHAT_SECRET = os.getenv("WECHAT_SECRET")
 # 微信 API 地址
 WECHAT_CODE2SESSION_URL = "https://api.weixin.qq.com/sns/jscode2session"
 
+# 微信 API 连接池
+WECHAT_TIMEOUT = httpx.Timeout(5.0, connect=3.0)
+WECHAT_POOL_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+
+_http_client: Optional[httpx.AsyncClient] = None
+_http_client_lock = asyncio.Lock()
+
+
+async def _get_http_client() -> httpx.AsyncClient:
+    """首次调用时创建共享客户端"""
+    global _http_client
+    if _http_client is None:
+        async with _http_client_lock:
+            if _http_client is None:
+                _http_client = httpx.AsyncClient(timeout=WECHAT_TIMEOUT, limits=WECHAT_POOL_LIMITS)
+    return _http_client
+
+
+async def close_wechat_client():
+    """关闭共享客户端 (lifespan 关闭阶段调用)"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 
-def code2session(code: str) -> dict:
+async def code2session(code: str) -> dict:
     """
     调用微信 code2Session 接口
     
@@ -43,7 +74,8 @@ def code2session(code: str) -> dict:
             'grant_type': 'authorization_code'
         }
         
-        response = requests.get(WECHAT_CODE2SESSION_URL, params=params, timeout=10)
+        client = await _get_http_client()
+        response = await client.get(WECHAT_CODE2SESSION_URL, params=params)
         result = response.json()
         
         # 检查是否有错误
@@ -0,0 +1,62 @@
+"""
+启动耗时基准
+
+1. 多次在新进程中导入 backend.main，统计模块导入耗时
+2. 启动一次 uvicorn，轮询 / 与 /ready，统计开始接受请求与预热完成的时间，
+   并打印 /ready 返回的各阶段耗时
+
+用法: python benchmark_startup.py [导入次数] [端口]
+"""
+import subprocess
+import sys
+import time
+import json
+import requests
+
+
+def benchmark_import(runs):
+    durations = []
+    for _ in range(runs):
+        start_time = time.time()
+        subprocess.run([sys.executable, "-c", "import backend.main"], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        durations.append(time.time() - start_time)
+    durations.sort()
+    print(f"导入 backend.main ({runs} 次): "
+          f"最快 {durations[0]:.3f}s, 中位数 {durations[len(durations) // 2]:.3f}s, 最慢 {durations[-1]:.3f}s")
+
+
+def benchmark_boot(port):
+    base = f"http://127.0.0.1:{port}"
+    start_time = time.time()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    listening_time = None
+    try:
+        while time.time() - start_time < 60:
+            try:
+                if listening_time is None:
+                    requests.get(f"{base}/", timeout=1)
+                    listening_time = time.time() - start_time
+                    print(f"开始接受请求: {listening_time:.3f}s")
+                r = requests.get(f"{base}/ready", timeout=1)
+                if r.status_code == 200:
+                    print(f"预热完成 (/ready 200): {time.time() - start_time:.3f}s")
+                    print(json.dumps(r.json().get("data"), ensure_ascii=False, indent=2))
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.05)
+        print("Error: 60s 内未就绪")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8011
+    benchmark_import(runs)
+    benchmark_boot(port)
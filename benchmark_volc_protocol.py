@@ -0,0 +1,145 @@
+"""
+火山引擎二进制协议编解码基准与模糊测试 (backend/volc_protocol.py)
+
+1. 模糊测试：随机字节与对合法帧逐字节截断 / 随机改写后解析，
+   解析函数不得抛异常；合法帧解析结果与打包参数一致
+2. 吞吐：对比旧实现 (bytes 拼接 + 切片复制) 与 volc_protocol 在
+   ASR 上行音频帧、TTS 下行音频帧上的单帧耗时
+
+用法: python benchmark_volc_protocol.py [模糊测试次数] [吞吐测试帧数]
+"""
+import sys
+import json
+import time
+import uuid
+import random
+import struct
+
+from backend.volc_protocol import (
+    MSG_TYPE_AUDIO_ONLY_REQUEST, MSG_TYPE_AUDIO_ONLY_RESPONSE, MSG_TYPE_FULL_CLIENT_REQUEST,
+    FLAGS_WITH_EVENT, EVENT_TASK_REQUEST, EVENT_TTS_RESPONSE,
+    pack_audio_packet, pack_event_packet, parse_asr_packet, parse_event_packet, parse_audio_payload,
+)
+
+ASR_FRAME_BYTES = 3200     # 100ms 16kHz 16bit 单声道
+TTS_FRAME_BYTES = 4800     # 100ms 24kHz 16bit 单声道
+
+
+# ============================================================================
+# 旧实现 (对照)
+# ============================================================================
+
+def legacy_pack_audio(pcm, is_last=False):
+    header = struct.pack('!BBBB', 0x11, (MSG_TYPE_AUDIO_ONLY_REQUEST << 4) | (0b0010 if is_last else 0), 0x00, 0x00)
+    return header + struct.pack('!I', len(pcm)) + pcm
+
+
+def legacy_parse_tts_audio(data):
+    body = data[4:]
+    p_len = struct.unpack('!I', body[20:24])[0]
+    return body[24:24 + p_len]
+
+
+def legacy_pack_event(event_code, payload_json, session_id=None):
+    header = struct.pack('!BBBB', 0x11, (MSG_TYPE_FULL_CLIENT_REQUEST << 4) | FLAGS_WITH_EVENT, 0x10, 0x00)
+    body = struct.pack('!I', event_code)
+    if session_id:
+        sid_bytes = session_id[:12].ljust(12, '0').encode('utf-8')
+        body += struct.pack('!I', 12) + sid_bytes
+    json_bytes = json.dumps(payload_json).encode('utf-8')
+    body += struct.pack('!I', len(json_bytes)) + json_bytes
+    return header + body
+
+
+def server_audio_frame(session_id, pcm):
+    """构造服务端 TTS 音频帧 (带 event 与 session_id)"""
+    sid = session_id.encode('utf-8')
+    header = struct.pack('!BBBB', 0x11, (MSG_TYPE_AUDIO_ONLY_RESPONSE << 4) | FLAGS_WITH_EVENT, 0x00, 0x00)
+    return (header + struct.pack('!I', EVENT_TTS_RESPONSE) + struct.pack('!I', len(sid)) + sid
+            + struct.pack('!I', len(pcm)) + pcm)
+
+
+# ============================================================================
+# 模糊测试
+# ============================================================================
+
+def fuzz(runs):
+    rng = random.Random(20240601)
+    session_id = uuid.uuid4().hex[:12]
+    samples = [
+        bytes(pack_audio_packet(rng.randbytes(64))),
+        bytes(pack_event_packet(EVENT_TASK_REQUEST, {"req_params": {"text": "你好"}}, session_id=session_id)),
+        server_audio_frame(session_id, rng.randbytes(64)),
+    ]
+
+    # 合法帧往返
+    packet = parse_event_packet(samples[1])
+    assert packet.event == EVENT_TASK_REQUEST and packet.session_id == session_id
+    assert json.loads(packet.payload_bytes())["req_params"]["text"] == "你好"
+    packet = parse_event_packet(samples[2])
+    assert packet.event == EVENT_TTS_RESPONSE and len(packet.audio()) == 64
+    assert parse_audio_payload(samples[2]).tobytes() == packet.audio().tobytes()
+    assert parse_asr_packet(samples[0]).payload.nbytes == 64
+
+    parsed = 0
+    for i in range(runs):
+        choice = i % 3
+        if choice == 0:
+            data = rng.randbytes(rng.randint(0, 64))
+        elif choice == 1:
+            base = rng.choice(samples)
+            data = base[:rng.randint(0, len(base))]
+        else:
+            data = bytearray(rng.choice(samples))
+            for _ in range(rng.randint(1, 4)):
+                data[rng.randrange(len(data))] = rng.randrange(256)
+        for parse in (parse_asr_packet, parse_event_packet):
+            result = parse(data)
+            if result is not None:
+                parsed += 1
+                assert result.payload.nbytes <= len(data)
+        view = parse_audio_payload(data)
+        if view is not None:
+            assert view.nbytes <= len(data)
+    print(f"模糊测试: {runs} 组输入无异常 (可解析 {parsed} 次)")
+
+
+# ============================================================================
+# 吞吐
+# ============================================================================
+
+def _time_per_frame(fn, frames):
+    start = time.perf_counter()
+    for frame in frames:
+        fn(frame)
+    return (time.perf_counter() - start) / len(frames) * 1e6
+
+
+def throughput(count):
+    session_id = uuid.uuid4().hex[:12]
+    asr_frames = [bytes(ASR_FRAME_BYTES) for _ in range(count)]
+    tts_frames = [server_audio_frame(session_id, bytes(TTS_FRAME_BYTES)) for _ in range(count)]
+    tts_large_frames = [server_audio_frame(session_id, bytes(TTS_FRAME_BYTES * 8)) for _ in range(count // 8)]
+    texts = ["今天天气不错，我们聊聊小时候的事情吧。"] * count
+
+    rows = [
+        ("ASR 上行打包", legacy_pack_audio, pack_audio_packet, asr_frames),
+        (f"TTS 下行解析 ({TTS_FRAME_BYTES}B)", legacy_parse_tts_audio, parse_audio_payload, tts_frames),
+        (f"TTS 下行解析 ({TTS_FRAME_BYTES * 8}B)", legacy_parse_tts_audio, parse_audio_payload, tts_large_frames),
+        ("TTS 下行解析 (通用 parse_event_packet)", legacy_parse_tts_audio, lambda f: parse_event_packet(f).audio(), tts_frames),
+        ("TTS TaskRequest 打包",
+         lambda t: legacy_pack_event(EVENT_TASK_REQUEST, {"event": EVENT_TASK_REQUEST, "req_params": {"text": t}}, session_id),
+         lambda t: pack_event_packet(EVENT_TASK_REQUEST, {"event": EVENT_TASK_REQUEST, "req_params": {"text": t}}, session_id),
+         texts),
+    ]
+    for name, legacy, codec, frames in rows:
+        legacy_us = _time_per_frame(legacy, frames)
+        codec_us = _time_per_frame(codec, frames)
+        print(f"{name}: 旧实现 {legacy_us:.2f}us/帧, volc_protocol {codec_us:.2f}us/帧 ({legacy_us / codec_us:.2f}x)")
+
+
+if __name__ == "__main__":
+    fuzz_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    frame_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    fuzz(fuzz_runs)
+    throughput(frame_count)
@@ -26,5 +26,14 @@ echo "📁 复制文件到后端..."
 mkdir -p ../backend/static/admin
 cp -r dist/* ../backend/static/admin/
 
+# 预压缩文本资源（后端按 Accept-Encoding 直接返回 .br / .gz）
+echo "🗜️ 预压缩静态资源..."
+find ../backend/static/admin -type f \( -name "*.js" -o -name "*.css" -o -name "*.html" -o -name "*.svg" -o -name "*.json" \) | while read -r f; do
+  gzip -k -9 -f "$f"
+  if command -v brotli > /dev/null; then
+    brotli -k -f -q 11 "$f"
+  fi
+done
+
 echo "✅ 管理后台构建完成！"
 echo "📍 访问地址: http://你的局域网IP:8000/admin"
@@ -32,6 +32,27 @@ def init_sys_config():
             'config_type': 'number',
             'remark': '对话缓存池字数达到此阈值时触发 Stn Agent'
         },
+        {
+            'config_key': 'cache_pool_limit_min',
+            'config_name': '缓存池触发字数下限',
+            'config_value': '100',
+            'config_type': 'number',
+            'remark': '系统空闲时采用的阈值，Stn 更频繁、故事板更新更及时'
+        },
+        {
+            'config_key': 'cache_pool_limit_max',
+            'config_name': '缓存池触发字数上限',
+            'config_value': '800',
+            'config_type': 'number',
+            'remark': 'Stn 排队或 Ark 延迟高时阈值逐步升至此值，批次更大、调用更少'
+        },
+        {
+            'config_key': 'stn_latency_target_ms',
+            'config_name': '速记员 LLM 目标耗时',
+            'config_value': '8000',
+            'config_type': 'number',
+            'remark': '单位：毫秒，Stn LLM 耗时滑动平均超过此值视为 Ark 负载高'
+        },
         
         # ============================================================
         # Intv Agent 配置
@@ -71,6 +92,41 @@ def init_sys_config():
             'config_type': 'number',
             'remark': '单位：秒，距过期少于此时间需重建'
         },
+        {
+            'config_key': 'intv_speculation_stable_ms',
+            'config_name': '访谈员推测执行稳定窗口',
+            'config_value': '600',
+            'config_type': 'number',
+            'remark': '单位：毫秒，/ws/voice 识别文本稳定此时长后提前调用 Intv；0 表示关闭'
+        },
+        {
+            'config_key': 'voice_barge_in_on_speech',
+            'config_name': '语音会话说话即打断',
+            'config_value': 'true',
+            'config_type': 'string',
+            'remark': 'true/false，/ws/voice 在 AI 回复中识别到用户说话即打断；依赖客户端回声消除，无 AEC 的客户端需关闭'
+        },
+        {
+            'config_key': 'intv_history_token_budget',
+            'config_name': '访谈员对话历史 token 预算',
+            'config_value': '1200',
+            'config_type': 'number',
+            'remark': '滚动历史 (摘要 + 最近轮次) 的估算 token 上限，Session 重建时作为前情提要'
+        },
+        {
+            'config_key': 'intv_history_recent_turns',
+            'config_name': '访谈员对话历史保留轮数',
+            'config_value': '6',
+            'config_type': 'number',
+            'remark': '保留原文的最近轮数，更早的轮次压缩为摘要'
+        },
+        {
+            'config_key': 'intv_prewarm_prime_ark',
+            'config_name': '访谈员预热时创建前缀缓存',
+            'config_value': 'false',
+            'config_type': 'string',
+            'remark': 'true/false，采访页打开时用 system prompt + 前情提要预先创建 Ark 前缀缓存；需同时开启 enable_llm_caching'
+        },
         
         # ============================================================
         # Stn Agent 配置
@@ -110,6 +166,13 @@ def init_sys_config():
             'config_type': 'number',
             'remark': '单位：秒'
         },
+        {
+            'config_key': 'stn_trigger_debounce_ms',
+            'config_name': '速记员触发防抖窗口',
+            'config_value': '2000',
+            'config_type': 'number',
+            'remark': '单位：毫秒，缓存池达到阈值后等待此时长再运行 Stn，期间的追加内容与重复触发合并到同一次运行；0 表示立即运行'
+        },
         
         # ============================================================
         # Dir Agent 配置
@@ -149,6 +212,45 @@ def init_sys_config():
             'config_type': 'number',
             'remark': '单位：秒'
         },
+        {
+            'config_key': 'dir_trigger_min_score',
+            'config_name': '导演触发变更分',
+            'config_value': '4',
+            'config_type': 'number',
+            'remark': 'Stn 产生的故事板变更累计达到此分数才运行 Dir (新阶段4/新话题3/新镜头2/人物变更2/其他更新1)；0 表示每次 Stn 后都运行'
+        },
+        {
+            'config_key': 'dir_max_defer_sec',
+            'config_name': '导演最长延后时间',
+            'config_value': '300',
+            'config_type': 'number',
+            'remark': '单位：秒，变更分不足时最多延后这么久，到期仍有未处理变更则运行 Dir'
+        },
+        
+        # ============================================================
+        # LLM 准入控制
+        # ============================================================
+        {
+            'config_key': 'llm_max_inflight',
+            'config_name': 'LLM 并发上限',
+            'config_value': '16',
+            'config_type': 'number',
+            'remark': '每个 worker 同时进行的 Ark 调用上限 (Intv 流式调用持续占用直到输出结束)'
+        },
+        {
+            'config_key': 'llm_intv_reserved_slots',
+            'config_name': 'Intv 预留并发',
+            'config_value': '4',
+            'config_type': 'number',
+            'remark': 'Stn/Dir 后台调用最多使用 (并发上限 - 预留数)，剩余名额只给 Intv'
+        },
+        {
+            'config_key': 'llm_model_rpm',
+            'config_name': '单模型每分钟请求数',
+            'config_value': '600',
+            'config_type': 'number',
+            'remark': '每个模型的令牌桶速率 (全部 worker 合计，按 WEB_CONCURRENCY 均分)；0 表示不限'
+        },
         
         # ============================================================
         # Storyboard 配置
@@ -178,6 +280,38 @@ def init_sys_config():
             'config_type': 'select',
             'remark': '关联 base_models 表的 model_id'
         },
+        {
+            'config_key': 'tts_http_max_concurrent',
+            'config_name': 'HTTP TTS 并发上限',
+            'config_value': '4',
+            'config_type': 'number',
+            'remark': '/tts/stream 每个 worker 同时合成的请求数，等待超过 2 秒返回 503'
+        },
+        {
+            'config_key': 'tts_http_cache_max_mb',
+            'config_name': 'HTTP TTS 缓存上限 (MB)',
+            'config_value': '200',
+            'config_type': 'number',
+            'remark': '/tts/stream 合成结果的磁盘缓存总量，超出后按最近使用时间淘汰'
+        },
+        
+        # ============================================================
+        # 日志配置
+        # ============================================================
+        {
+            'config_key': 'log_levels',
+            'config_name': '模块日志级别',
+            'config_value': '',
+            'config_type': 'string',
+            'remark': '按模块覆盖默认级别 (LOG_LEVEL)，如 volc_tts_client=DEBUG,asr_gateway=WARNING'
+        },
+        {
+            'config_key': 'log_sample_every',
+            'config_name': '高频日志采样间隔',
+            'config_value': '100',
+            'config_type': 'number',
+            'remark': '音频分片、ASR 中间结果等高频事件每 N 条输出 1 条'
+        },
     ]
     
     with get_db_connection() as conn:
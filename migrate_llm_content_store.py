@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+数据库迁移脚本：llm_processed input/output 去重压缩存储
+1. 执行 sql/create_llm_content_store.sql
+2. 将历史明文记录重新打包为关键帧并清空 input/output TEXT 列
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from database import get_db_connection
+from llm_content_service import encode_llm_io, save_prompt_blobs, forget_llm_sessions
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BATCH_SIZE = 500
+
+
+def apply_schema():
+    """执行建表 / 加列 SQL"""
+    sql_path = os.path.join(os.path.dirname(__file__), 'sql', 'create_llm_content_store.sql')
+    with open(sql_path, 'r', encoding='utf-8') as f:
+        sql = f.read()
+    
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+            conn.commit()
+    logging.info("✅ llm_content_blob / llm_processed 新列已就绪")
+
+
+def repack_legacy_rows():
+    """分批将 io_format=0 的历史记录转为压缩格式（全部写关键帧）"""
+    total = 0
+    while True:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT model_processed_id, user_id, agent, input, output
+                    FROM llm_processed
+                    WHERE io_format = 0
+                    ORDER BY model_processed_id
+                    LIMIT %s
+                """, (BATCH_SIZE,))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                
+                for row_id, user_id, agent, llm_input, llm_output in rows:
+                    # 不建立差分链，每行独立为关键帧
+                    forget_llm_sessions()
+                    encoded = encode_llm_io(str(user_id), agent, llm_input, llm_output)
+                    save_prompt_blobs(cursor, encoded['new_blobs'])
+                    cursor.execute("""
+                        UPDATE llm_processed
+                        SET io_format = %s, input_base_id = NULL,
+                            input_packed = %s, output_packed = %s,
+                            input = NULL, output = NULL
+                        WHERE model_processed_id = %s
+                    """, (encoded['io_format'], encoded['input_packed'],
+                          encoded['output_packed'], row_id))
+                conn.commit()
+                total += len(rows)
+                logging.info(f"📝 已转换 {total} 条记录...")
+    
+    logging.info(f"✅ 历史记录转换完成，共 {total} 条")
+
+
+if __name__ == "__main__":
+    try:
+        apply_schema()
+        repack_legacy_rows()
+        print("\n🎉 数据库迁移成功完成！建议随后执行 VACUUM FULL llm_processed 回收空间")
+    except Exception as e:
+        logging.error(f"迁移失败: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+数据库迁移脚本：将日志类大表转换为按月 RANGE 分区表
+涉及表：llm_processed / asr_processed / tts_processed / interview_original_text
+
+步骤（每张表一个事务）：
+1. 原表改名为 {table}_legacy
+2. 新建同结构的分区父表，主键改为 (id, created_time)
+3. 按历史数据最早月份创建月分区 + default 分区
+4. 复制数据，序列归属转移到新表
+5. 删除旧表（指向 interview_original_text 的外键随之删除，分区表无法被外键引用）
+6. 创建索引
+
+迁移期间会锁表，请在低峰期执行。
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+
+from backend.database import get_db_connection
+from backend.partition_service import (
+    PARTITIONED_TABLES, is_partitioned, ensure_partitions, ensure_indexes
+)
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def convert_table(table: str, pk: str):
+    """将单张表转换为分区表"""
+    legacy = f"{table}_legacy"
+    
+    with get_db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                if is_partitioned(cursor, table):
+                    logging.info(f"⏭️  {table} 已是分区表，跳过")
+                    return
+                
+                logging.info(f"📝 转换 {table} ...")
+                cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+                cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+                
+                # 主键约束改名，避免与新表主键索引重名
+                cursor.execute("""
+                    SELECT conname FROM pg_constraint
+                    WHERE conrelid = %s::regclass AND contype = 'p'
+                """, (legacy,))
+                row = cursor.fetchone()
+                if row:
+                    cursor.execute(f"ALTER TABLE {legacy} RENAME CONSTRAINT {row[0]} TO {legacy}_pkey")
+                
+                cursor.execute(f"""
+                    CREATE TABLE {table} (
+                        LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING COMMENTS,
+                        PRIMARY KEY ({pk}, created_time)
+                    ) PARTITION BY RANGE (created_time)
+                """)
+                
+                cursor.execute(f"SELECT MIN(created_time) FROM {legacy}")
+                earliest = cursor.fetchone()[0]
+                created = ensure_partitions(cursor, table, start=earliest.date() if earliest else None)
+                logging.info(f"  ✓ 创建 {len(created)} 个月分区")
+                
+                cursor.execute(f"INSERT INTO {table} SELECT * FROM {legacy}")
+                logging.info(f"  ✓ 复制 {cursor.rowcount} 行")
+                
+                cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", (legacy, pk))
+                sequence = cursor.fetchone()[0]
+                if sequence:
+                    cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.{pk}")
+                
+                cursor.execute(f"DROP TABLE {legacy} CASCADE")
+                ensure_indexes(cursor, table)
+            conn.commit()
+            logging.info(f"  ✓ {table} 转换完成")
+        except Exception:
+            conn.rollback()
+            raise
+
+
+if __name__ == "__main__":
+    try:
+        for table, spec in PARTITIONED_TABLES.items():
+            convert_table(table, spec['pk'])
+        print("\n🎉 数据库迁移成功完成！")
+    except Exception as e:
+        logging.error(f"迁移失败: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
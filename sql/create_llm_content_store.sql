@@ -0,0 +1,24 @@
+-- ============================================================================
+-- LLM 调用 input/output 去重压缩存储
+-- 配合 backend/llm_content_service.py 使用
+-- ============================================================================
+
+-- System Prompt 等大段重复内容，按 sha256 只存一份
+CREATE TABLE IF NOT EXISTS llm_content_blob (
+    blob_hash CHAR(64) PRIMARY KEY,
+    content BYTEA NOT NULL,  -- 首字节为编码方式：0=原文, 1=zlib, 2=zstd
+    created_time TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- llm_processed 新增压缩列（旧的 input/output TEXT 列保留，用于兼容历史数据）
+ALTER TABLE llm_processed ADD COLUMN IF NOT EXISTS io_format SMALLINT NOT NULL DEFAULT 0;
+ALTER TABLE llm_processed ADD COLUMN IF NOT EXISTS input_base_id BIGINT;
+ALTER TABLE llm_processed ADD COLUMN IF NOT EXISTS input_packed BYTEA;
+ALTER TABLE llm_processed ADD COLUMN IF NOT EXISTS output_packed BYTEA;
+
+-- 添加注释
+COMMENT ON TABLE llm_content_blob IS 'LLM 调用中重复出现的大段内容（System Prompt），按 sha256 去重';
+COMMENT ON COLUMN llm_processed.io_format IS 'input/output 存储格式：0=明文 TEXT 列, 1=input_packed/output_packed';
+COMMENT ON COLUMN llm_processed.input_base_id IS '差分基准记录 ID，NULL 表示完整关键帧';
+COMMENT ON COLUMN llm_processed.input_packed IS '压缩后的 input（关键帧或相对 input_base_id 的差分）';
+COMMENT ON COLUMN llm_processed.output_packed IS '压缩后的 output';
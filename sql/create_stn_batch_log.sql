@@ -0,0 +1,22 @@
+-- ============================================================================
+-- Stn 批次记录（自适应缓存池阈值）
+-- 配合 backend/stn_batching_service.py 使用，由 telemetry 后台批量写入
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS stn_batch_log (
+    stn_batch_id BIGSERIAL PRIMARY KEY,
+    user_id UUID NOT NULL,
+    threshold INTEGER NOT NULL,            -- 触发本次运行时生效的缓存池阈值 (字)
+    base_threshold INTEGER NOT NULL,       -- cache_pool_limit 配置值
+    load_factor NUMERIC(5,3) NOT NULL,     -- 0=空闲 (取下限), 1=满载 (取上限)
+    stn_backlog INTEGER NOT NULL,          -- 决策时等待/执行中的 Stn 数
+    latency_ewma_ms INTEGER,               -- 决策时 Stn LLM 耗时滑动平均
+    batch_chars INTEGER NOT NULL,          -- 实际送入 Stn 的缓存池字数
+    llm_duration_ms INTEGER NOT NULL,
+    success BOOLEAN NOT NULL,
+    created_time TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_stn_batch_log_time ON stn_batch_log(created_time);
+
+COMMENT ON TABLE stn_batch_log IS '每次 Stn 运行的批次大小与当时的自适应阈值，用于权衡吞吐与新鲜度';
@@ -0,0 +1,36 @@
+-- ============================================================================
+-- 用量与成本汇总表（小时 / 天）
+-- 配合 backend/usage_rollup_service.py 使用，由 telemetry 写入时增量维护
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS usage_rollup (
+    granularity CHAR(1) NOT NULL,          -- h:小时, d:天
+    bucket_start TIMESTAMPTZ NOT NULL,     -- 桶起始时间 (date_trunc)
+    user_id UUID NOT NULL,
+    service VARCHAR(8) NOT NULL,           -- LLM / ASR / TTS
+    agent VARCHAR(16) NOT NULL DEFAULT '', -- Intv / Stn / Dir，ASR/TTS 为空
+    model_id BIGINT NOT NULL DEFAULT 0,
+    calls BIGINT NOT NULL DEFAULT 0,
+    total_tokens BIGINT NOT NULL DEFAULT 0,
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    cached_tokens BIGINT NOT NULL DEFAULT 0,
+    usage_units NUMERIC(18,3) NOT NULL DEFAULT 0,  -- ASR:音频秒数, TTS:字符数
+    duration_ms BIGINT NOT NULL DEFAULT 0,
+    cost NUMERIC(16,6) NOT NULL DEFAULT 0,
+    cache_saving NUMERIC(16,6) NOT NULL DEFAULT 0,
+    updated_time TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (granularity, bucket_start, user_id, service, agent, model_id)
+);
+
+-- 按时间范围查询全体用户
+CREATE INDEX IF NOT EXISTS idx_usage_rollup_bucket ON usage_rollup(granularity, bucket_start);
+-- 按用户查询
+CREATE INDEX IF NOT EXISTS idx_usage_rollup_user ON usage_rollup(user_id, granularity, bucket_start);
+
+-- llm_processed 单次调用成本通常不足 ¥0.0001，原 DECIMAL(10,4) 精度不够
+ALTER TABLE llm_processed ALTER COLUMN processed_cost TYPE DECIMAL(12,6);
+
+-- 添加注释
+COMMENT ON TABLE usage_rollup IS '用量与成本按小时/天预聚合，报表查询只扫描聚合桶';
+COMMENT ON COLUMN usage_rollup.cache_saving IS '缓存命中 Token 相对原价节省的成本';
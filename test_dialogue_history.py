@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Intv 滚动对话历史测试脚本 (backend/dialogue_history_service.py)
+
+纯逻辑测试，不连接数据库：get_config 直接返回默认值
+"""
+
+import sys
+import os
+import json
+import logging
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend import dialogue_history_service as dh
+from backend.dialogue_history_service import (
+    DialogueHistory, append_dialogue_turn, render_dialogue_history,
+    estimate_tokens, ELLIPSIS, SUMMARY_BUDGET_RATIO,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 使用默认预算 (1200) 与默认保留轮数 (6)
+dh.get_config = lambda key, default=None: default
+
+
+def test_empty_history():
+    """空历史的读取、渲染与首轮追加"""
+    print("\n[测试 1] 空历史")
+    for stored in (None, ""):
+        history = DialogueHistory.load(stored)
+        assert history.is_empty(), "空存储应解析为空历史"
+        assert history.render() == "", "空历史渲染应为空串"
+        assert render_dialogue_history(stored) == ""
+
+    stored = append_dialogue_turn(None, "你好", "您好，今天想聊什么？")
+    data = json.loads(stored)
+    assert data == {'v': 1, 's': [], 't': [["你好", "您好，今天想聊什么？"]]}, f"首轮存储格式不正确: {data}"
+    assert render_dialogue_history(stored) == "U:你好 I:您好，今天想聊什么？"
+
+    # 空文本也是合法的一轮
+    stored = append_dialogue_turn(None, "", None)
+    assert json.loads(stored)['t'] == [["", ""]]
+    print("✅ 通过")
+
+
+def test_round_trip():
+    """dump / load 往返保持摘要与轮次不变"""
+    print("\n[测试 2] 存取往返")
+    history = DialogueHistory(summary=["U:早年 I:插队"], turns=[("小时候住哪？", "住在胡同里。"), ("后来呢", "搬去了南方")])
+    restored = DialogueHistory.load(history.dump())
+    assert list(restored.summary) == list(history.summary)
+    assert list(restored.turns) == list(history.turns)
+    assert restored.render() == "U:早年 I:插队 U:小时候住哪？ I:住在胡同里。 U:后来呢 I:搬去了南方"
+
+    # 逐轮经存储表示追加，与内存中直接追加结果一致
+    stored = None
+    direct = DialogueHistory()
+    for i in range(20):
+        stored = append_dialogue_turn(stored, f"问题{i}" * 5, f"回答{i}" * 8)
+        direct.append(f"问题{i}" * 5, f"回答{i}" * 8)
+    assert stored == direct.dump(), "经存储追加与直接追加结果不一致"
+    print("✅ 通过")
+
+
+def test_recent_turns_ring():
+    """超出保留轮数的最早轮次压缩为摘要"""
+    print("\n[测试 3] 最近轮次环形缓冲")
+    history = DialogueHistory(token_budget=100000, recent_turns=3)
+    for i in range(5):
+        history.append(f"用户第{i}轮" + "很长的内容" * 10, f"回复第{i}轮")
+    assert len(history.turns) == 3, f"应保留 3 轮，实际 {len(history.turns)}"
+    assert history.turns[0][0].startswith("用户第2轮")
+    assert len(history.summary) == 2
+    assert history.summary[0].startswith("U:用户第0轮") and ELLIPSIS in history.summary[0], \
+        f"摘要应截取开头并带省略号: {history.summary[0]}"
+    assert history.summary[0].endswith("I:回复第0轮")
+    print("✅ 通过")
+
+
+def test_over_budget_single_turn():
+    """单轮就超出预算时按预算截断，仍保留这一轮"""
+    print("\n[测试 4] 单轮超预算")
+    budget = 100
+    history = DialogueHistory(token_budget=budget, recent_turns=6)
+    history.append("我" * 500, "好" * 500)
+    assert len(history.turns) == 1, "超预算的单轮不应被整体丢弃"
+    user_text, ai_text = history.turns[0]
+    assert user_text.endswith(ELLIPSIS) and ai_text.endswith(ELLIPSIS), "截断后应带省略号"
+    assert history.token_count() <= budget + 2, f"截断后超出预算: {history.token_count()}"
+
+    # 再追加一轮：旧轮次被压缩进摘要，摘要不超过预算的 1/4
+    history.append("再" * 500, "说" * 500)
+    assert len(history.turns) == 1
+    assert sum(estimate_tokens(s) for s in history.summary) <= int(budget * SUMMARY_BUDGET_RATIO)
+
+    # 英文按 4 字符 1 token 估算
+    history = DialogueHistory(token_budget=40, recent_turns=6)
+    history.append("word " * 200, "")
+    assert estimate_tokens(history.turns[0][0]) <= 20 + 1
+    print("✅ 通过")
+
+
+def test_summary_budget():
+    """长对话的摘要与总量始终受预算约束"""
+    print("\n[测试 5] 摘要预算")
+    budget = 300
+    history = DialogueHistory(token_budget=budget, recent_turns=6)
+    for i in range(200):
+        history.append(f"第{i}个问题：" + "细节" * 20, f"第{i}个回答：" + "故事" * 30)
+        assert history.token_count() <= budget + 2, f"第 {i} 轮后超出预算: {history.token_count()}"
+        assert sum(estimate_tokens(s) for s in history.summary) <= int(budget * SUMMARY_BUDGET_RATIO)
+    assert history.turns[-1][0].startswith("第199个问题"), "最近一轮必须保留原文"
+    print("✅ 通过")
+
+
+def test_legacy_and_malformed():
+    """旧版纯文本与损坏的 JSON"""
+    print("\n[测试 6] 旧格式兼容")
+    legacy = "U:很久以前的问题 I:很久以前的回答 " * 200 + "U:最近的问题 I:最近的回答"
+    history = DialogueHistory.load(legacy)
+    assert len(history.summary) == 1 and not history.turns, "旧版内容应视为一条摘要"
+    assert history.summary[0].endswith("I:最近的回答"), "旧版内容应保留结尾 (最近) 部分"
+    assert len(history.summary[0]) < len(legacy), "旧版内容应按摘要预算截取"
+
+    history = DialogueHistory.load("U:短 I:短")
+    assert list(history.summary) == ["U:短 I:短"]
+
+    # 版本不符或轮次结构损坏：忽略坏条目，不抛异常
+    history = DialogueHistory.load(json.dumps({'v': 1, 's': ["ok", 3], 't': [["a", "b"], ["c"], "x"]}))
+    assert list(history.summary) == ["ok"] and list(history.turns) == [("a", "b")]
+    history = DialogueHistory.load(json.dumps({'v': 99, 't': [["a", "b"]]}))
+    assert not history.turns, "未知版本按旧版文本处理"
+    print("✅ 通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Intv 滚动对话历史测试")
+    print("=" * 60)
+    try:
+        test_empty_history()
+        test_round_trip()
+        test_recent_turns_ring()
+        test_over_budget_single_turn()
+        test_summary_budget()
+        test_legacy_and_malformed()
+
+        print("\n" + "=" * 60)
+        print("🎉 所有测试通过！")
+        print("=" * 60)
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM 准入控制测试脚本 (backend/llm_api_service.py 的 _LLMAdmission / _TokenBucket)
+
+纯逻辑测试，不调用 LLM：get_config 返回下方 CONFIG，单 worker 连接预算
+"""
+
+import sys
+import os
+import time
+import asyncio
+import logging
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend import llm_api_service as las
+from backend.llm_api_service import (
+    _LLMAdmission, _TokenBucket, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CONFIG = {'llm_max_inflight': 2, 'llm_intv_reserved_slots': 1, 'llm_model_rpm': 0}
+las.get_config = lambda key, default=None: CONFIG.get(key, default)
+las.get_pool_budget = lambda: {'workers': 1}
+
+MODEL_ID = 1
+
+
+def _configure(**values):
+    CONFIG.update({'llm_max_inflight': 2, 'llm_intv_reserved_slots': 1, 'llm_model_rpm': 0})
+    CONFIG.update(values)
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class Caller:
+    """在独立任务中取得名额并持有，直到 release()"""
+
+    def __init__(self, admission: _LLMAdmission, priority: int, order: list, name: str):
+        self.admission = admission
+        self.priority = priority
+        self.order = order
+        self.name = name
+        self.admitted = asyncio.Event()
+        self._done = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        async with self.admission.slot(self.priority, MODEL_ID):
+            self.order.append(self.name)
+            self.admitted.set()
+            await self._done.wait()
+
+    async def release(self):
+        self._done.set()
+        await self.task
+
+
+def test_token_bucket():
+    """令牌桶：不限速、突发容量、按速率恢复"""
+    print("\n[测试 1] 令牌桶")
+    bucket = _TokenBucket()
+    bucket.configure(0, 1)
+    assert all(bucket.take() == 0 for _ in range(100)), "rate <= 0 时不限速"
+
+    bucket = _TokenBucket()
+    bucket.configure(10, 3)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0], "初始应装满突发容量"
+    delay = bucket.take()
+    assert 0.05 < delay <= 0.1, f"令牌耗尽后应等待约 1/rate 秒: {delay}"
+    bucket.updated -= 0.2                  # 过去 0.2 秒，按 10/s 恢复 2 个
+    assert bucket.take() == 0 and bucket.take() == 0
+
+    bucket.configure(10, 1)                # 缩小容量时令牌随之截断
+    assert bucket.tokens <= 1
+    print("✅ 通过")
+
+
+def test_background_yields_to_interactive():
+    """有 Intv 排队时 Stn/Dir 不放行，即使它先排队；名额归还后先给 Intv"""
+    print("\n[测试 2] 后台让位于交互")
+    _configure(llm_max_inflight=2, llm_intv_reserved_slots=1)
+
+    async def scenario():
+        admission = _LLMAdmission()
+        order = []
+        first = Caller(admission, PRIORITY_INTERACTIVE, order, "intv-1")
+        second = Caller(admission, PRIORITY_INTERACTIVE, order, "intv-2")
+        await _settle()
+        assert order == ["intv-1", "intv-2"]
+
+        background = Caller(admission, PRIORITY_BACKGROUND, order, "stn")
+        await _settle()
+        queued = Caller(admission, PRIORITY_INTERACTIVE, order, "intv-3")
+        await _settle()
+        stats = admission.get_stats()
+        assert stats['background']['queue_depth'] == 1 and stats['interactive']['queue_depth'] == 1
+
+        await first.release()
+        await _settle()
+        assert order[-1] == "intv-3", f"空出的名额应先给 Intv: {order}"
+
+        # 在途 2 个 Intv；后台上限为 max_inflight - reserved = 1
+        await second.release()
+        await _settle()
+        assert "stn" not in order, "在途数未低于后台上限时不应放行 Stn"
+        await queued.release()
+        await _settle()
+        assert order[-1] == "stn"
+        await background.release()
+        assert admission.get_stats()['inflight'] == 0
+        assert admission.get_stats()['background']['deferred'] == 1
+
+    asyncio.run(scenario())
+    print("✅ 通过")
+
+
+def test_rate_limit_deferral():
+    """令牌耗尽时请求排队，按令牌桶给出的延迟由定时器放行"""
+    print("\n[测试 3] 限速延后")
+    _configure(llm_max_inflight=4, llm_model_rpm=600)   # 10 次/秒
+
+    async def scenario():
+        admission = _LLMAdmission()
+        bucket = admission._bucket(MODEL_ID)
+        bucket.tokens = 0
+        bucket.updated = time.monotonic()
+
+        order = []
+        start = time.monotonic()
+        caller = Caller(admission, PRIORITY_INTERACTIVE, order, "intv")
+        await _settle()
+        assert not order, "无令牌时不应立即放行"
+        assert admission.get_stats()['rate_limited'] == 1
+        await asyncio.wait_for(caller.admitted.wait(), 1)
+        waited = time.monotonic() - start
+        assert 0.05 < waited < 0.5, f"应在约 0.1 秒后放行: {waited:.3f}"
+        await caller.release()
+        assert admission.get_stats()['interactive']['deferred'] == 1
+
+    asyncio.run(scenario())
+    print("✅ 通过")
+
+
+def test_cancel_after_grant_releases_slot():
+    """已被放行、但在恢复执行前被取消的调用归还名额"""
+    print("\n[测试 4] 放行后取消")
+    _configure(llm_max_inflight=1, llm_intv_reserved_slots=0)
+
+    async def scenario():
+        admission = _LLMAdmission()
+        order = []
+        holder = Caller(admission, PRIORITY_INTERACTIVE, order, "holder")
+        await _settle()
+        waiter = Caller(admission, PRIORITY_INTERACTIVE, order, "waiter")
+        await _settle()
+
+        # 归还名额会同步放行 waiter (future 已完成)，在它恢复执行前取消
+        admission._release()
+        waiter.task.cancel()
+        await asyncio.gather(waiter.task, return_exceptions=True)
+        assert waiter.task.cancelled()
+        assert "waiter" not in order
+        assert admission.get_stats()['inflight'] == 0, "被取消的调用应归还名额"
+        admission._inflight += 1           # 抵消上面代 holder 的归还
+        await holder.release()
+        assert admission.get_stats()['inflight'] == 0
+
+        after = Caller(admission, PRIORITY_INTERACTIVE, order, "after")
+        await asyncio.wait_for(after.admitted.wait(), 1)
+        await after.release()
+
+    asyncio.run(scenario())
+    print("✅ 通过")
+
+
+def test_cancelled_waiter_removed():
+    """排队中被取消的请求移出队列，不占用后续名额"""
+    print("\n[测试 5] 排队中取消")
+    _configure(llm_max_inflight=1, llm_intv_reserved_slots=0)
+
+    async def scenario():
+        admission = _LLMAdmission()
+        order = []
+        holder = Caller(admission, PRIORITY_INTERACTIVE, order, "holder")
+        await _settle()
+        cancelled = Caller(admission, PRIORITY_BACKGROUND, order, "cancelled")
+        kept = Caller(admission, PRIORITY_BACKGROUND, order, "kept")
+        await _settle()
+        assert admission.get_stats()['background']['queue_depth'] == 2
+
+        cancelled.task.cancel()
+        await asyncio.gather(cancelled.task, return_exceptions=True)
+        assert admission.get_stats()['background']['queue_depth'] == 1, "取消的请求应移出队列"
+
+        await holder.release()
+        await asyncio.wait_for(kept.admitted.wait(), 1)
+        assert order == ["holder", "kept"]
+        await kept.release()
+        assert admission.get_stats()['inflight'] == 0
+
+    asyncio.run(scenario())
+    print("✅ 通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("LLM 准入控制测试")
+    print("=" * 60)
+    try:
+        test_token_bucket()
+        test_background_yields_to_interactive()
+        test_rate_limit_deferral()
+        test_cancel_after_grant_releases_slot()
+        test_cancelled_waiter_removed()
+
+        print("\n" + "=" * 60)
+        print("🎉 所有测试通过！")
+        print("=" * 60)
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
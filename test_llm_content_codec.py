@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM 调用输入/输出去重压缩存储测试脚本 (backend/llm_content_service.py)
+
+纯逻辑测试，不连接数据库：用内存中的 llm_processed / llm_content_blob
+模拟写入与 load_llm_io 读取
+"""
+
+import sys
+import os
+import json
+import random
+import logging
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend import llm_content_service as lcs
+from backend.llm_content_service import (
+    IO_FORMAT_PLAIN, KEYFRAME_INTERVAL, DELTA_BLOCK,
+    diff_ops, apply_ops, encode_llm_io, remember_llm_io, remember_prompt_blobs,
+    forget_llm_sessions, load_llm_io,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SYSTEM_PROMPT = "你是一位温和耐心的人生故事访谈员，" * 10
+
+
+# ============================================================================
+# 内存数据库
+# ============================================================================
+
+class FakeStore:
+    """只支持 load_llm_io / _load_blobs 用到的两条查询"""
+
+    def __init__(self):
+        self.rows = {}      # id -> (io_format, input_base_id, input, output, input_packed, output_packed)
+        self.blobs = {}
+        self.next_id = 1
+
+    def cursor(self):
+        return _FakeCursor(self)
+
+    def write(self, user_id, agent, llm_input, llm_output, commit=True):
+        """模拟 telemetry 的一行写入；commit=False 模拟事务回滚"""
+        row_id = self.next_id
+        self.next_id += 1
+        encoded = encode_llm_io(user_id, agent, llm_input, llm_output)
+        remember_llm_io(user_id, agent, row_id, encoded)
+        if not commit:
+            forget_llm_sessions(user_id)
+            return row_id, encoded
+        self.blobs.update(encoded['new_blobs'])
+        self.rows[row_id] = (
+            encoded['io_format'], encoded['input_base_id'], None, None,
+            encoded['input_packed'], encoded['output_packed'],
+        )
+        remember_prompt_blobs(encoded['new_blobs'])
+        return row_id, encoded
+
+
+class _FakeCursor:
+    def __init__(self, store):
+        self.store = store
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params):
+        keys = params[0]
+        if "FROM llm_processed" in sql:
+            self.result = [(k,) + self.store.rows[k] for k in keys if k in self.store.rows]
+        elif "FROM llm_content_blob" in sql:
+            self.result = [(k, self.store.blobs[k]) for k in keys if k in self.store.blobs]
+        else:
+            raise AssertionError(f"未预期的查询: {sql}")
+
+    def fetchall(self):
+        return self.result
+
+
+def _messages(context: str) -> str:
+    return json.dumps([
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": context},
+    ], ensure_ascii=False)
+
+
+def _reset():
+    forget_llm_sessions()
+    lcs._known_blobs.clear()
+
+
+# ============================================================================
+# 测试
+# ============================================================================
+
+def test_diff_round_trip():
+    """diff_ops / apply_ops 往返，含空串与短于块大小的边界"""
+    print("\n[测试 1] 差分往返")
+    rng = random.Random(20240601)
+    words = ["童年", "胡同", "插队", "工厂", "结婚", "孩子", "退休", "。", "，", "\n"]
+    base = "".join(rng.choice(words) for _ in range(2000))
+    cases = [
+        ("", ""), ("", "新内容"), ("旧内容", ""), ("短", "短"),
+        ("a" * (DELTA_BLOCK - 1), "a" * (DELTA_BLOCK - 1) + "b"),
+        (base, base),
+        (base, base + "新的一轮对话"),                      # 故事板追加
+        (base, base[300:] + "最新的前情提要"),              # 滑动窗口
+        (base, base[:500] + "中间插入" + base[500:]),
+        (base, "".join(rng.choice(words) for _ in range(2000))),
+    ]
+    for old, new in cases:
+        ops = diff_ops(old, new)
+        assert apply_ops(old, ops) == new, f"差分还原不一致: base={old[:20]!r} new={new[:20]!r}"
+
+    # 追加场景应退化为一次复制 + 一段字面量
+    ops = diff_ops(base, base + "新的一轮对话")
+    assert ops[0] == [0, len(base)] and ops[-1] == "新的一轮对话", f"追加差分不够紧凑: {ops[:3]}"
+    print("✅ 通过")
+
+
+def test_pack_round_trip():
+    """压缩编解码：短文本不压缩，长文本压缩，兼容 memoryview"""
+    print("\n[测试 2] 压缩往返")
+    for text in ("", "短", "重复内容" * 1000):
+        packed = lcs._pack_text(text)
+        assert lcs._unpack_text(packed) == text
+        assert lcs._unpack_text(memoryview(packed)) == text
+    assert lcs._pack_text("短")[0] == lcs.CODEC_RAW
+    assert len(lcs._pack_text("重复内容" * 1000)) < len(("重复内容" * 1000).encode('utf-8')) // 10
+    print("✅ 通过")
+
+
+def test_store_round_trip():
+    """关键帧 + 差分链写入后经 load_llm_io 还原，system prompt 只存一份"""
+    print("\n[测试 3] 写入 / 还原往返")
+    _reset()
+    store = FakeStore()
+    written = {}
+    context = "前情提要：" + "我小时候住在胡同里，" * 40
+    for i in range(KEYFRAME_INTERVAL * 2 + 3):
+        context = context[20:] + f"第{i}轮：后来搬去了南方。"
+        llm_input = _messages(context)
+        row_id, _ = store.write("u1", "intv", llm_input, f"回复{i}")
+        written[row_id] = (llm_input, f"回复{i}")
+
+    # 非消息数组的 input 与 None
+    row_id, _ = store.write("u1", "stn", "纯文本输入", None)
+    written[row_id] = ("纯文本输入", None)
+    row_id, _ = store.write("u1", "dir", None, "只有输出")
+    written[row_id] = (None, "只有输出")
+
+    # 旧格式明文行
+    store.rows[999] = (IO_FORMAT_PLAIN, None, "旧输入", "旧输出", None, None)
+    written[999] = ("旧输入", "旧输出")
+
+    decoded = load_llm_io(store, list(written) + [None, 12345])
+    assert decoded == written, "还原结果与写入不一致"
+    assert len(store.blobs) == 1, f"system prompt 应只存一份，实际 {len(store.blobs)}"
+
+    depths = [store.rows[k][1] is None for k in sorted(store.rows) if k != 999]
+    assert depths.count(True) >= 3, "超过 KEYFRAME_INTERVAL 后应写入新的关键帧"
+    assert depths.count(False) > depths.count(True), "大部分行应为差分"
+    print("✅ 通过")
+
+
+def test_delta_against_evicted_base():
+    """差分基准失效：会话被淘汰、基准行被删除、事务回滚"""
+    print("\n[测试 4] 基准失效")
+    _reset()
+    store = FakeStore()
+    context = "前情提要：" + "在工厂上班的日子，" * 40
+
+    # 1. 基准行被删除 / 归档：读取返回占位文本，不抛异常
+    base_id, _ = store.write("u2", "intv", _messages(context), "a")
+    delta_id, encoded = store.write("u2", "intv", _messages(context + "新一轮"), "b")
+    assert encoded['input_base_id'] == base_id, "第二行应为差分"
+    del store.rows[base_id]
+    decoded = load_llm_io(store, [delta_id])
+    assert decoded[delta_id][1] == "b"
+    assert "无法还原" in decoded[delta_id][0], f"缺失基准应返回占位文本: {decoded[delta_id][0]}"
+
+    # 2. 内存中的会话被淘汰 (超过 MAX_TRACKED_SESSIONS)：下一次写关键帧
+    old_max = lcs.MAX_TRACKED_SESSIONS
+    lcs.MAX_TRACKED_SESSIONS = 2
+    try:
+        store.write("u3", "intv", _messages(context), "a")
+        store.write("u4", "intv", _messages(context), "a")
+        store.write("u5", "intv", _messages(context), "a")
+        row_id, encoded = store.write("u3", "intv", _messages(context + "新一轮"), "b")
+        assert encoded['input_base_id'] is None, "被淘汰会话的下一行应为关键帧"
+        assert load_llm_io(store, [row_id])[row_id] == (_messages(context + "新一轮"), "b")
+    finally:
+        lcs.MAX_TRACKED_SESSIONS = old_max
+
+    # 3. 事务回滚：不以回滚的行为基准，回滚批次的 prompt 需重新写入
+    _reset()
+    store = FakeStore()
+    rolled_id, encoded = store.write("u6", "intv", _messages(context), "a", commit=False)
+    assert encoded['new_blobs'], "首次出现的 prompt 应为新 blob"
+    row_id, encoded = store.write("u6", "intv", _messages(context + "新一轮"), "b")
+    assert encoded['input_base_id'] is None, "回滚后不能以回滚的行为基准"
+    assert encoded['new_blobs'], "回滚批次的 prompt 未落库，应再次写入"
+    assert load_llm_io(store, [row_id])[row_id] == (_messages(context + "新一轮"), "b")
+    assert rolled_id not in store.rows
+    print("✅ 通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("LLM 输入/输出存储编解码测试")
+    print("=" * 60)
+    try:
+        test_diff_round_trip()
+        test_pack_round_trip()
+        test_store_round_trip()
+        test_delta_against_evicted_base()
+
+        print("\n" + "=" * 60)
+        print("🎉 所有测试通过！")
+        print("=" * 60)
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
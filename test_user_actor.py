@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+用户 Actor 与常驻状态接管测试脚本 (backend/user_actor_service.py, backend/narration_service.py)
+
+纯逻辑测试，不连接数据库：narration_status 用内存字典模拟，
+跨 worker 的所有权 (advisory lock) 用 FakeOwnership 模拟，"A" 为本进程，"B" 为另一个 worker
+"""
+
+import sys
+import os
+import time
+import asyncio
+import threading
+import logging
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend import narration_service as ns
+from backend import user_actor_service as uas
+from backend.narration_service import (
+    attach_resident_state, detach_resident_state, flush_resident_state,
+    append_cachepool, is_resident,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+# ============================================================================
+# 内存数据库与所有权
+# ============================================================================
+
+class FakeOwnership:
+    """按用户的互斥所有权，记录获取 / 释放顺序"""
+
+    def __init__(self, events):
+        self.owners = {}
+        self.events = events
+        self.cond = threading.Condition()
+
+    def acquire(self, worker: str, user_id: str, timeout: float) -> bool:
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.owners.get(user_id) in (None, worker), timeout):
+                return False
+            self.owners[user_id] = worker
+            self.events.append(('acquire', worker))
+            return True
+
+    def release(self, worker: str, user_id: str):
+        with self.cond:
+            assert self.owners.get(user_id) == worker, f"{worker} 释放了未持有的所有权"
+            del self.owners[user_id]
+            self.events.append(('release', worker))
+            self.cond.notify_all()
+
+
+def _install_fakes():
+    """替换数据库读写与所有权；返回 (db, events, ownership)"""
+    db = {}
+    events = []
+    ownership = FakeOwnership(events)
+
+    def load(user_id):
+        events.append(('load', dict(db.setdefault(user_id, {}))))
+        return dict(db[user_id])
+
+    def write_columns(user_id, values):
+        events.append(('write', dict(values)))
+        db.setdefault(user_id, {}).update(values)
+
+    ns._load_narration_status = load
+    ns._write_columns = write_columns
+    ns.acquire_user_ownership = lambda user_id, timeout: ownership.acquire("A", user_id, timeout)
+    ns.release_user_ownership = lambda user_id: ownership.release("A", user_id)
+    ns._resident_states.clear()
+    return db, events, ownership
+
+
+# ============================================================================
+# 常驻状态接管
+# ============================================================================
+
+def test_claim_waits_for_final_flush():
+    """接管方在前一个持有者最后落库并释放所有权后才加载"""
+    print("\n[测试 1] 接管等待最后落库")
+    db, events, ownership = _install_fakes()
+    db["u1"] = {'chat_cachepool_content': "U:旧 "}
+
+    assert attach_resident_state("u1", timeout=1)
+    append_cachepool("u1", "U", "新内容")
+    assert db["u1"]['chat_cachepool_content'] == "U:旧 ", "常驻期间不应直接写库"
+
+    # 另一个 worker 开始接管：先被所有权挡住
+    loaded = {}
+
+    def worker_b():
+        assert ownership.acquire("B", "u1", timeout=2)
+        loaded.update(db["u1"])
+        ownership.release("B", "u1")
+
+    claimer = threading.Thread(target=worker_b)
+    claimer.start()
+    time.sleep(0.1)
+    assert not loaded, "前一个持有者落库前不应加载"
+
+    # 本进程收到 NOTIFY：落库、卸载、释放
+    ns._on_narration_invalidated("u1")
+    claimer.join(2)
+    assert not is_resident("u1")
+    assert loaded['chat_cachepool_content'] == "U:旧 U:新内容 ", f"接管方读到旧值: {loaded}"
+    order = [e[0] for e in events if e[0] in ('write', 'release')]
+    assert order[:2] == ['write', 'release'], f"应先落库再释放所有权: {events}"
+    print("✅ 通过")
+
+
+def test_attach_waits_for_owner():
+    """所有权被占用：超时返回 False 且不常驻；释放后加载到最新状态"""
+    print("\n[测试 2] 加载前等待所有权")
+    db, events, ownership = _install_fakes()
+    db["u2"] = {'intv_llm_session_previous_response_id': "resp-1"}
+    assert ownership.acquire("B", "u2", timeout=0)
+
+    assert not attach_resident_state("u2", timeout=0.1), "所有权被占用时应超时"
+    assert not is_resident("u2")
+    assert not any(e[0] == 'load' for e in events), "未取得所有权不应加载"
+
+    def worker_b_finish():
+        time.sleep(0.1)
+        db["u2"]['intv_llm_session_previous_response_id'] = "resp-2"
+        ownership.release("B", "u2")
+
+    threading.Thread(target=worker_b_finish).start()
+    assert attach_resident_state("u2", timeout=2)
+    assert ns.get_or_create_narration_status("u2")['intv_llm_session_previous_response_id'] == "resp-2"
+    assert ownership.owners["u2"] == "A"
+
+    # 重复加载不再获取；卸载释放一次，重复卸载不重复释放
+    assert attach_resident_state("u2", timeout=0)
+    assert detach_resident_state("u2") == 0
+    assert detach_resident_state("u2") == 0
+    assert "u2" not in ownership.owners
+    assert [e[0] for e in events].count('release') == 2
+    print("✅ 通过")
+
+
+def test_detach_releases_after_failed_write():
+    """最后落库失败也释放所有权，load 失败时归还所有权"""
+    print("\n[测试 3] 失败路径释放所有权")
+    db, events, ownership = _install_fakes()
+    assert attach_resident_state("u3", timeout=1)
+    append_cachepool("u3", "I", "回复")
+
+    def broken_write(user_id, values):
+        raise RuntimeError("db down")
+
+    ns._write_columns = broken_write
+    assert detach_resident_state("u3") == 0
+    assert "u3" not in ownership.owners, "落库失败也应释放所有权"
+
+    def broken_load(user_id):
+        raise RuntimeError("db down")
+
+    ns._load_narration_status = broken_load
+    try:
+        attach_resident_state("u3", timeout=1)
+        raise AssertionError("加载失败应抛出异常")
+    except RuntimeError:
+        pass
+    assert "u3" not in ownership.owners, "加载失败应归还所有权"
+    assert flush_resident_state("u3") == 0
+    print("✅ 通过")
+
+
+# ============================================================================
+# Actor
+# ============================================================================
+
+class FakeRuntime:
+    """替换 actor 依赖的接管 / 落库 / agent 执行，记录调用"""
+
+    def __init__(self, claim_ok: bool = True, claim_delay: float = 0.0, agent_delay: float = 0.0):
+        self.events = []
+        self.resident = set()
+        self.claim_ok = claim_ok
+        self.claim_delay = claim_delay
+        self.agent_delay = agent_delay
+        uas._claim_user = self.claim
+        uas.is_resident = lambda user_id: user_id in self.resident
+        uas.flush_resident_state = lambda user_id: 0
+        uas.detach_resident_state = self.detach
+        uas._run_agent = self.run_agent
+        uas._get_stn_debounce_sec = lambda: 0.05
+        uas._actors.clear()
+        uas._evicting.clear()
+
+    def claim(self, user_id):
+        self.events.append(('claim', user_id))
+        time.sleep(self.claim_delay)
+        if self.claim_ok:
+            self.resident.add(user_id)
+        return self.claim_ok
+
+    def detach(self, user_id):
+        time.sleep(0.05)
+        self.resident.discard(user_id)
+        self.events.append(('detach', user_id))
+        return 0
+
+    async def run_agent(self, user_id, kind):
+        self.events.append(('run', kind))
+        await asyncio.sleep(self.agent_delay)
+
+
+def test_mailbox_coalescing():
+    """同类请求合并，Stn 之后投递的 Dir 排在其后"""
+    print("\n[测试 4] 邮箱合并与顺序")
+    runtime = FakeRuntime()
+
+    async def scenario():
+        actor = await uas.get_actor("u4")
+        for _ in range(3):
+            actor.post('stn')
+        actor.post('dir')
+        actor.post('dir')
+        await asyncio.wait_for(actor.mailbox.join(), 2)
+        actor.stop()
+        await asyncio.wait_for(actor._task, 2)
+
+    before = dict(uas._stats['coalesced'])
+    asyncio.run(scenario())
+    runs = [e[1] for e in runtime.events if e[0] == 'run']
+    assert runs == ['stn', 'dir'], f"合并或顺序不正确: {runs}"
+    assert uas._stats['coalesced']['stn'] - before['stn'] == 2
+    assert uas._stats['coalesced']['dir'] - before['dir'] == 1
+    print("✅ 通过")
+
+
+def test_concurrent_claim_once():
+    """轮次与 agent 同时发现未常驻时只接管一次"""
+    print("\n[测试 5] 并发接管只执行一次")
+    runtime = FakeRuntime(claim_delay=0.1)
+
+    async def scenario():
+        actor = await uas.get_actor("u5")
+        runtime.resident.clear()        # 模拟被其他 worker 接管
+
+        async def one_turn():
+            async with actor.turn():
+                pass
+
+        actor.post('stn')
+        await asyncio.gather(one_turn(), one_turn())
+        await asyncio.wait_for(actor.mailbox.join(), 2)
+        actor.stop()
+        await asyncio.wait_for(actor._task, 2)
+
+    asyncio.run(scenario())
+    claims = [e for e in runtime.events if e[0] == 'claim']
+    assert len(claims) == 2, f"启动一次 + 重新接管一次，实际 {len(claims)}"
+    print("✅ 通过")
+
+
+def test_claim_failure_backoff():
+    """接管超时：actor 照常启动并直接读写数据库，重试间隔内不再等待"""
+    print("\n[测试 6] 接管失败退避")
+    runtime = FakeRuntime(claim_ok=False)
+    failures = uas._stats['claim_failures']
+
+    async def scenario():
+        actor = await uas.get_actor("u6")
+        start = time.monotonic()
+        for _ in range(3):
+            async with actor.turn():
+                pass
+        elapsed = time.monotonic() - start
+        actor.stop()
+        await asyncio.wait_for(actor._task, 2)
+        return elapsed
+
+    elapsed = asyncio.run(scenario())
+    assert len([e for e in runtime.events if e[0] == 'claim']) == 1, "重试间隔内不应再次接管"
+    assert uas._stats['claim_failures'] - failures == 1
+    assert elapsed < 0.5
+    print("✅ 通过")
+
+
+def test_respawn_waits_for_eviction():
+    """淘汰中的 actor 落库卸载完成后，新 actor 才接管"""
+    print("\n[测试 7] 淘汰与重新接管顺序")
+    runtime = FakeRuntime()
+
+    async def scenario():
+        actor = await uas.get_actor("u7")
+        actor.stop()
+        await asyncio.sleep(0)          # 让旧 actor 进入 _shutdown
+        while "u7" not in uas._evicting:
+            await asyncio.sleep(0.005)
+        new_actor = await uas.get_actor("u7")
+        assert new_actor is not actor
+        new_actor.stop()
+        await asyncio.wait_for(new_actor._task, 2)
+
+    asyncio.run(scenario())
+    kinds = [e[0] for e in runtime.events]
+    assert kinds == ['claim', 'detach', 'claim', 'detach'], f"接管 / 卸载顺序不正确: {runtime.events}"
+    print("✅ 通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("用户 Actor 与常驻状态接管测试")
+    print("=" * 60)
+    try:
+        test_claim_waits_for_final_flush()
+        test_attach_waits_for_owner()
+        test_detach_releases_after_failed_write()
+        test_mailbox_coalescing()
+        test_concurrent_claim_once()
+        test_claim_failure_backoff()
+        test_respawn_waits_for_eviction()
+
+        print("\n" + "=" * 60)
+        print("🎉 所有测试通过！")
+        print("=" * 60)
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+双工语音会话测试脚本 (backend/voice_session_service.py)
+
+不连接 ASR / LLM / TTS：run_interview_turn 替换为桩函数，只验证会话的轮次调度
+"""
+
+import sys
+import os
+import asyncio
+import logging
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend import voice_session_service as vs
+from backend.voice_session_service import VoiceSession, _Turn, PCM_BYTES_PER_SEC
+from backend.audio_service import SpooledAudioBuffer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+vs.get_speculation_stable_sec = lambda: 0.0
+
+
+class FakeWebSocket:
+    """按顺序返回预置消息；消息用完后等待 disconnect() 调用"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        self.sent = []
+
+    async def receive_json(self):
+        return {"type": "start", "user_id": self.user_id}
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+    async def send_bytes(self, data):
+        self.sent.append(bytes(data))
+
+    def send_text_turn(self, text: str):
+        self.incoming.put_nowait({"type": "websocket.receive", "text": f'{{"type": "text", "text": "{text}"}}'})
+
+    def disconnect(self):
+        self.incoming.put_nowait({"type": "websocket.disconnect"})
+
+
+audio_seconds = []
+
+
+def _install_turn_stub(delay: float = 0.0):
+    calls = []
+    audio_seconds.clear()
+
+    async def fake_run_interview_turn(send_json, tts_client, user_id, user_text, has_voice, **kwargs):
+        calls.append((user_text, has_voice))
+        audio_seconds.append(kwargs.get('audio_seconds'))
+        await asyncio.sleep(delay)
+        await send_json({"type": "text_finish", "text": user_text})
+        return kwargs.get('result') or {}
+
+    vs.run_interview_turn = fake_run_interview_turn
+    return calls
+
+
+async def _wait_for(predicate, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "等待超时"
+        await asyncio.sleep(0.01)
+
+
+def test_two_text_turns():
+    """连续两轮文字输入都得到回复，轮次任务不因文字轮次退出"""
+    print("\n[测试 1] 连续两轮文字输入")
+    calls = _install_turn_stub()
+
+    async def scenario():
+        ws = FakeWebSocket("u-text")
+        session = VoiceSession(ws, tts_client=None)
+        runner = asyncio.create_task(session.run())
+        ws.send_text_turn("第一句")
+        await _wait_for(lambda: len(calls) == 1)
+        ws.send_text_turn("第二句")
+        await _wait_for(lambda: sum(1 for m in ws.sent if isinstance(m, dict) and m.get("type") == "text_finish") == 2)
+        assert not session._turn_worker.done(), "文字轮次后轮次任务不应退出"
+        ws.disconnect()
+        await asyncio.wait_for(runner, 2)
+        return ws
+
+    ws = asyncio.run(scenario())
+    assert calls == [("第一句", False), ("第二句", False)], f"轮次调用不正确: {calls}"
+    user_texts = [m["text"] for m in ws.sent if isinstance(m, dict) and m.get("type") == "user_text"]
+    assert user_texts == ["第一句", "第二句"]
+    assert audio_seconds == [None, None], "文字轮次没有音频时长"
+    print("✅ 通过")
+
+
+def test_close_with_queued_text_turns():
+    """进行中的轮次未完成时断开：排队的文字轮次被清理，close() 不抛异常"""
+    print("\n[测试 2] 断开时清理排队的文字轮次")
+    calls = _install_turn_stub(delay=10)
+
+    async def scenario():
+        ws = FakeWebSocket("u-close")
+        session = VoiceSession(ws, tts_client=None)
+        runner = asyncio.create_task(session.run())
+        for text in ("一", "二", "三"):
+            ws.send_text_turn(text)
+        await _wait_for(lambda: len(calls) == 1)
+        ws.disconnect()
+        await asyncio.wait_for(runner, 2)
+        assert session._turn_queue.empty()
+        assert session._turn_worker.done()
+
+    asyncio.run(scenario())
+    assert calls == [("一", False)]
+    print("✅ 通过")
+
+
+def test_voice_turn_audio_seconds():
+    """语音轮次把录音的实际时长传给 run_interview_turn (ASR 按时长计费)"""
+    print("\n[测试 3] 语音轮次的音频时长")
+    calls = _install_turn_stub()
+    vs.save_user_voice = lambda user_id, pcm, text_id: pcm.close()
+
+    async def scenario():
+        ws = FakeWebSocket("u-voice")
+        session = VoiceSession(ws, tts_client=None)
+        runner = asyncio.create_task(session.run())
+        pcm = SpooledAudioBuffer()
+        pcm.extend(b"\x00" * (PCM_BYTES_PER_SEC * 3 // 2))
+        await _wait_for(lambda: session._turn_worker is not None)
+        session._turn_queue.put_nowait(_Turn("一段语音", True, pcm, "vad"))
+        await _wait_for(lambda: len(calls) == 1)
+        ws.disconnect()
+        await asyncio.wait_for(runner, 2)
+
+    asyncio.run(scenario())
+    assert calls == [("一段语音", True)]
+    assert audio_seconds == [1.5], f"音频时长不正确: {audio_seconds}"
+    print("✅ 通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("双工语音会话测试")
+    print("=" * 60)
+    try:
+        test_two_text_turns()
+        test_close_with_queued_text_turns()
+        test_voice_turn_audio_seconds()
+
+        print("\n" + "=" * 60)
+        print("🎉 所有测试通过！")
+        print("=" * 60)
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)